@@ -19,14 +19,17 @@ Typical usage example:
     
     python __main__.py
 """
+import os
 import sys
 
-from typing import Optional
+from typing import List, Optional
 from typing_extensions import Annotated
 import argparse
 import subprocess
 from src.archivist import __app_name__, __version__, DEBUG
-from src.archivist.crawler.crawler import Crawler
+from src.archivist.crawler.crawler import Crawler, CLONE_FILTERS
+from src.archivist.crawler.mirror import MirrorCache
+from src.archivist.crawler.scheduler import MAX_CONCURRENT_CRAWLS
 
 parser = argparse.ArgumentParser(prog='Archivist', description="Archivist is a tool for understanding codebases.")
 parser.add_argument("--version", "-v", action="store_true",
@@ -49,6 +52,38 @@ parser.add_argument("--config", "-c", type=str,
                     help="Path to a configuration file.")
 parser.add_argument("--embeddings_path", "-e", type=str,
                     help="The output path for vector embeddings.")
+parser.add_argument("--depth", "-d", type=int,
+                    help="Create a shallow clone truncated to this many commits.")
+parser.add_argument("--single_branch", "-s", action="store_true",
+                    help="Only clone the history of --branch, or of the remote HEAD.", default=False)
+parser.add_argument("--clone_filter", "-f", type=str, choices=CLONE_FILTERS,
+                    help="Create a partial clone that omits blobs (blob:none) or trees (tree:0).")
+parser.add_argument("--mirror_cache", "-m", type=str,
+                    help="Directory of cached bare mirrors; repeat crawls only fetch new objects.")
+parser.add_argument("--incremental", "-i", action="store_true",
+                    help="Update an existing clone at --output_path instead of cloning.", default=False)
+parser.add_argument("--manifest_path", type=str,
+                    help="With --incremental, write a JSON manifest of the changed files to this path.")
+parser.add_argument("--no_checkout", action="store_true",
+                    help="Clone bare and read files from the object database instead of a working tree.",
+                    default=False)
+parser.add_argument("--include", type=str, action="append",
+                    help="Only check out paths matching this glob. May be repeated.")
+parser.add_argument("--exclude", type=str, action="append",
+                    help="Never check out paths matching this glob. May be repeated.")
+parser.add_argument("--max_file_size", type=int,
+                    help="Never download or check out files larger than this many bytes.")
+parser.add_argument("--retries", type=int,
+                    help="Retry transient clone and fetch failures this many times. Default 3.")
+parser.add_argument("--archive", action="store_true",
+                    help="Download a snapshot archive over HTTP instead of cloning with git.",
+                    default=False)
+parser.add_argument("--batch", type=str,
+                    help="Run every crawl job in a JSONL manifest instead of a single --github_url.")
+parser.add_argument("--results", type=str,
+                    help="Where batch mode writes one JSONL result per job. Defaults to <batch>.results.jsonl.")
+parser.add_argument("--max_concurrent", type=int, default=MAX_CONCURRENT_CRAWLS,
+                    help="The maximum number of repositories to crawl at once in batch mode.")
 
 
 class Config:
@@ -59,7 +94,14 @@ class Config:
                  output_path: Optional[str], branch: Optional[str],
                  verbose: Optional[bool], quiet: Optional[bool],
                  token: Optional[str], config_file: Optional[str],
-                 embeddings_path: Optional[str]):
+                 embeddings_path: Optional[str], depth: Optional[int] = None,
+                 single_branch: Optional[bool] = None, clone_filter: Optional[str] = None,
+                 mirror_cache: Optional[str] = None, incremental: Optional[bool] = None,
+                 manifest_path: Optional[str] = None, no_checkout: Optional[bool] = None,
+                 batch: Optional[str] = None, results: Optional[str] = None,
+                 max_concurrent: Optional[int] = None, include: Optional[List[str]] = None,
+                 exclude: Optional[List[str]] = None, max_file_size: Optional[int] = None,
+                 retries: Optional[int] = None, archive: Optional[bool] = None):
         self.github_url = github_url
         self.output_path = output_path
         self.branch = branch
@@ -68,6 +110,37 @@ class Config:
         self.token = token
         self.config_file = config_file
         self.embeddings_path = embeddings_path
+        self.depth = depth
+        self.single_branch = single_branch
+        self.clone_filter = clone_filter
+        self.mirror_cache = mirror_cache
+        self.incremental = incremental
+        self.manifest_path = manifest_path
+        self.no_checkout = no_checkout
+        self.batch = batch
+        self.results = results
+        self.max_concurrent = max_concurrent
+        self.include = include
+        self.exclude = exclude
+        self.max_file_size = max_file_size
+        self.retries = retries
+        self.archive = archive
+
+
+def _open_mirror_cache(config: Config) -> Optional[MirrorCache]:
+    """
+    Validate --mirror_cache and open the cache it names.
+
+    Args:
+        config (Config): The configuration object.
+
+    Returns:
+        Optional[MirrorCache]: The mirror cache, or None if --mirror_cache was not given.
+    """
+    from src.archivist.cli.cli import handle_mirror_cache
+
+    handle_mirror_cache(config)
+    return MirrorCache(config.mirror_cache) if config.mirror_cache else None
 
 
 def main() -> None:
@@ -85,6 +158,21 @@ def main() -> None:
         config: Path to a configuration file.
         update: Update the Archivist tool to the latest version.
         embeddings_path: The output path for vector embeddings.
+        depth: Create a shallow clone truncated to this many commits.
+        single_branch: Only clone the history of a single branch.
+        clone_filter: Create a partial clone with the given object filter.
+        mirror_cache: Directory of cached bare mirrors to clone through.
+        incremental: Update an existing clone instead of cloning.
+        manifest_path: Where to write the manifest of changed files.
+        no_checkout: Clone bare instead of materializing a working tree.
+        batch: Path to a JSONL manifest of crawl jobs to run.
+        results: Path of the JSONL results file for batch mode.
+        max_concurrent: The maximum number of concurrent crawls in batch mode.
+        include: Only check out paths matching these globs.
+        exclude: Never check out paths matching these globs.
+        max_file_size: Never download or check out files larger than this.
+        retries: The number of retries of transient clone and fetch failures.
+        archive: Download a snapshot archive instead of cloning.
 
     Returns:
         None
@@ -106,7 +194,34 @@ def main() -> None:
 
     config = Config(github_url=args.github_url, output_path=args.output_path, branch=args.branch,
                     verbose=args.verbose, quiet=args.quiet, token=args.token, config_file=args.config,
-                    embeddings_path=args.embeddings_path)
-
-    crawler = Crawler(config.github_url, config.output_path)
+                    embeddings_path=args.embeddings_path, depth=args.depth,
+                    single_branch=args.single_branch, clone_filter=args.clone_filter,
+                    mirror_cache=args.mirror_cache, incremental=args.incremental,
+                    manifest_path=args.manifest_path, no_checkout=args.no_checkout, batch=args.batch,
+                    results=args.results, max_concurrent=args.max_concurrent, include=args.include,
+                    exclude=args.exclude, max_file_size=args.max_file_size, retries=args.retries,
+                    archive=args.archive)
+
+    if config.batch:
+        from src.archivist.cli.batch import run_batch
+        from src.archivist.cli.cli import handle_max_concurrent
+
+        handle_max_concurrent(config)
+        mirror_cache = _open_mirror_cache(config)
+        results = config.results or f"{os.path.splitext(config.batch)[0]}.results.jsonl"
+        counts = run_batch(config.batch, results, max_concurrent=config.max_concurrent, mirror_cache=mirror_cache)
+        if not config.quiet:
+            print(", ".join(f"{count} {status}" for status, count in counts.items()) + f"; results in {results}")
+        sys.exit(0 if set(counts) <= {"succeeded"} else 1)
+
+    mirror_cache = _open_mirror_cache(config)
+    crawler = Crawler(config.github_url, config.output_path, branch=config.branch, depth=config.depth,
+                      single_branch=config.single_branch, clone_filter=config.clone_filter,
+                      mirror_cache=mirror_cache, incremental=config.incremental,
+                      checkout=not config.no_checkout, include=config.include, exclude=config.exclude,
+                      max_file_size=config.max_file_size, retries=config.retries, archive=config.archive)
     crawler.execute()
+    if config.manifest_path and crawler.manifest:
+        crawler.manifest.write(config.manifest_path)
+    if config.verbose and crawler.clone_stats:
+        print(f"Cloned {config.github_url}: {crawler.clone_stats}")
@@ -0,0 +1,193 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+batch.py
+
+Batch mode: runs every crawl job in a JSONL manifest through one shared
+scheduler and writes one JSONL result per job as it finishes. The manifest is
+read and validated one line at a time, so it never has to fit in memory.
+
+Each manifest line is an object such as:
+
+    {"url": "https://github.com/org/repo", "output_path": "repos/repo", "branch": "main",
+     "options": {"depth": 1, "clone_filter": "blob:none"}}
+"""
+import json
+from typing import Callable, Dict, Iterator, Optional
+
+from src.archivist.__main__ import Config
+from src.archivist.cli.cli import handle_github_url, handle_output_path, handle_branch, handle_depth, \
+    handle_clone_filter, handle_max_file_size, handle_retries
+from src.archivist.crawler.crawler import Crawler, check_crawl_options
+from src.archivist.crawler.filters import PathFilter
+from src.archivist.crawler.mirror import MirrorCache
+from src.archivist.crawler.scheduler import CrawlScheduler, CrawlJob, MAX_CONCURRENT_CRAWLS, JOB_STATUSES
+from src.archivist.errors.errors import INVALID_BATCH_LINE, UNSUPPORTED_BATCH_OPTION, INVALID_BATCH_OPTION, \
+    INVALID_BATCH_FIELD
+
+INVALID = "invalid"
+
+# The crawler options a job may set, and the JSON type of each: list means a list of strings.
+BATCH_JOB_OPTIONS = {"depth": int, "single_branch": bool, "clone_filter": str, "incremental": bool,
+                     "checkout": bool, "include": list, "exclude": list, "max_file_size": int, "retries": int,
+                     "archive": bool}
+# The options `check_crawl_options` checks in combination.
+CLONE_MODE_OPTIONS = ("depth", "single_branch", "clone_filter", "incremental", "checkout", "max_file_size", "archive")
+
+
+class BatchJob(CrawlJob):
+    """
+    A crawl job read from line `line_number` of a batch manifest.
+    """
+
+    def __init__(self, line_number: int, repo_url: str, output_path: str, **crawler_options):
+        super().__init__(repo_url, output_path, **crawler_options)
+        self.line_number = line_number
+
+    def as_dict(self) -> dict:
+        return {"line": self.line_number, **super().as_dict()}
+
+
+def parse_job_line(line: str, line_number: int) -> BatchJob:
+    """
+    Parses and validates one manifest line with the same checks as the CLI.
+
+    Args:
+        line (str): The JSON text of the line.
+        line_number (int): The 1-based line number, reported in the results.
+
+    Returns:
+        BatchJob: The job described by the line.
+
+    Raises:
+        ValueError: If the line is not a JSON object or fails validation.
+    """
+    try:
+        entry = json.loads(line)
+    except json.JSONDecodeError:
+        raise ValueError(INVALID_BATCH_LINE)
+    if not isinstance(entry, dict):
+        raise ValueError(INVALID_BATCH_LINE)
+
+    url = entry.get("url") or entry.get("github_url")
+    # Missing fields are reported by the CLI checks below; other types would crash them.
+    if any(value is not None and not isinstance(value, str)
+           for value in (url, entry.get("output_path"), entry.get("branch"))):
+        raise ValueError(INVALID_BATCH_FIELD)
+
+    options = entry.get("options") or {}
+    if not isinstance(options, dict):
+        raise ValueError(INVALID_BATCH_LINE)
+    unsupported = sorted(set(options) - set(BATCH_JOB_OPTIONS))
+    if unsupported:
+        raise ValueError(f"{UNSUPPORTED_BATCH_OPTION} {', '.join(unsupported)}")
+    mistyped = [name for name, value in options.items() if not _has_option_type(value, BATCH_JOB_OPTIONS[name])]
+    if mistyped:
+        raise ValueError(f"{INVALID_BATCH_OPTION} {', '.join(sorted(mistyped))}")
+
+    config = Config(github_url=url, output_path=entry.get("output_path"),
+                    branch=entry.get("branch"), verbose=None, quiet=None, token=None, config_file=None,
+                    embeddings_path=None, depth=options.get("depth"), single_branch=options.get("single_branch"),
+                    clone_filter=options.get("clone_filter"), max_file_size=options.get("max_file_size"),
+                    retries=options.get("retries"))
+    handle_github_url(config)
+    handle_output_path(config)
+    handle_branch(config)
+    handle_depth(config)
+    handle_clone_filter(config)
+    handle_max_file_size(config)
+    handle_retries(config)
+    # Combinations the crawler would reject are reported now, as invalid, instead of as failed crawls.
+    check_crawl_options(**{name: value for name, value in options.items()
+                           if name in CLONE_MODE_OPTIONS and value is not None})
+    PathFilter(options.get("include"), options.get("exclude"), options.get("max_file_size"))
+
+    return BatchJob(line_number, config.github_url, config.output_path, branch=config.branch, **options)
+
+
+def _has_option_type(value, expected: type) -> bool:
+    if value is None:
+        return True
+    if expected is list:
+        return isinstance(value, list) and all(isinstance(item, str) for item in value)
+    # JSON true and false are ints to Python, but never a valid depth, size or count.
+    return isinstance(value, expected) and (expected is bool or not isinstance(value, bool))
+
+
+def iter_batch_jobs(batch_path: str, on_invalid: Callable[[dict], None]) -> Iterator[BatchJob]:
+    """
+    Reads a manifest lazily, yielding valid jobs. Blank lines are skipped and
+    invalid lines are reported to `on_invalid` instead of stopping the batch.
+
+    Args:
+        batch_path (str): The path to the JSONL manifest.
+        on_invalid (Callable[[dict], None]): Receives the result record of each invalid line.
+
+    Yields:
+        BatchJob: Each valid job, in manifest order.
+    """
+    with open(batch_path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield parse_job_line(line, line_number)
+            except ValueError as e:
+                on_invalid({"line": line_number, "status": INVALID, "error": str(e)})
+
+
+def run_batch(batch_path: str, results_path: str, max_concurrent: int = MAX_CONCURRENT_CRAWLS,
+              mirror_cache: Optional[MirrorCache] = None,
+              crawler_factory: Callable[..., Crawler] = Crawler) -> Dict[str, int]:
+    """
+    Runs every job in a manifest and writes a JSONL result line per job as it
+    finishes, in completion order.
+
+    Args:
+        batch_path (str): The path to the JSONL manifest.
+        results_path (str): The path of the JSONL results file. Overwritten if it exists.
+        max_concurrent (int): The maximum number of crawls to run at once.
+        mirror_cache (Optional[MirrorCache]): A mirror cache shared by every job.
+        crawler_factory (Callable[..., Crawler]): Builds the crawler for each job.
+
+    Returns:
+        Dict[str, int]: The number of jobs per final status, including invalid lines.
+
+    Raises:
+        ValueError: If `max_concurrent` is not a positive integer.
+    """
+    counts = {status: 0 for status in JOB_STATUSES + (INVALID,)}
+
+    # Built first, so an invalid max_concurrent fails before the results file is overwritten.
+    with CrawlScheduler(max_concurrent=max_concurrent, crawler_factory=crawler_factory) as scheduler, \
+            open(results_path, "w") as results:
+        def write(record: dict) -> None:
+            counts[record["status"]] += 1
+            results.write(json.dumps(record) + "\n")
+            results.flush()
+
+        jobs = iter_batch_jobs(batch_path, on_invalid=write)
+        if mirror_cache is not None:
+            jobs = _with_mirror_cache(jobs, mirror_cache)
+        for job in scheduler.imap(jobs):
+            write(job.as_dict())
+
+    return {status: count for status, count in counts.items() if count}
+
+
+def _with_mirror_cache(jobs: Iterator[BatchJob], mirror_cache: MirrorCache) -> Iterator[BatchJob]:
+    for job in jobs:
+        job.crawler_options["mirror_cache"] = mirror_cache
+        yield job
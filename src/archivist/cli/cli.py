@@ -23,8 +23,10 @@ from urllib.parse import urlparse
 import os
 
 from src.archivist.__main__ import Config
+from src.archivist.crawler.crawler import CLONE_FILTERS
 from src.archivist.errors.errors import UNSUPPORTED_CONFIG, NO_CONFIG, UNSUPPORTED_URL, NO_EMPTY_PATH, \
-    UNSUPPORTED_PATH, NON_EXISTENT_PATH, UNSUPPORTED_CONFIG_PATH
+    UNSUPPORTED_PATH, NON_EXISTENT_PATH, UNSUPPORTED_CONFIG_PATH, INVALID_DEPTH, UNSUPPORTED_CLONE_FILTER, \
+    INVALID_CONCURRENCY, INVALID_MAX_FILE_SIZE, INVALID_RETRIES
 
 
 def handle_config(config: Config) -> Config:
@@ -62,6 +64,13 @@ def handle_config(config: Config) -> Config:
     handle_token(config_copy)
     handle_config_file(config_copy)
     handle_embeddings_path(config_copy)
+    handle_depth(config_copy)
+    handle_clone_filter(config_copy)
+    handle_mirror_cache(config_copy)
+    handle_manifest_path(config_copy)
+    handle_max_concurrent(config_copy)
+    handle_max_file_size(config_copy)
+    handle_retries(config_copy)
     return config_copy
 
 
@@ -199,3 +208,142 @@ def handle_embeddings_path(config: Config) -> None:
 
     if not all(c.isalnum() or c in '-_./\\' for c in embeddings_path):
         raise ValueError(UNSUPPORTED_PATH)
+
+
+def handle_depth(config: Config) -> None:
+    """
+    Handle the --depth option.
+
+    Args:
+        config (Config): The configuration object.
+
+    Returns:
+        None
+    """
+    depth = config.depth
+
+    if depth is None:
+        return
+
+    if not isinstance(depth, int) or depth < 1:
+        raise ValueError(INVALID_DEPTH)
+
+
+def handle_clone_filter(config: Config) -> None:
+    """
+    Handle the --clone-filter option.
+
+    Args:
+        config (Config): The configuration object.
+
+    Returns:
+        None
+    """
+    clone_filter = config.clone_filter
+
+    if clone_filter is None:
+        return
+
+    if clone_filter not in CLONE_FILTERS:
+        raise ValueError(UNSUPPORTED_CLONE_FILTER)
+
+
+def handle_mirror_cache(config: Config) -> None:
+    """
+    Handle the --mirror-cache option.
+
+    Args:
+        config (Config): The configuration object.
+
+    Returns:
+        None
+    """
+    mirror_cache = config.mirror_cache
+
+    if mirror_cache is None:
+        return
+
+    if mirror_cache.strip() == "":
+        raise ValueError(NO_EMPTY_PATH)
+
+    if not all(c.isalnum() or c in '-_./\\' for c in mirror_cache):
+        raise ValueError(UNSUPPORTED_PATH)
+
+
+def handle_manifest_path(config: Config) -> None:
+    """
+    Handle the --manifest-path option.
+
+    Args:
+        config (Config): The configuration object.
+
+    Returns:
+        None
+    """
+    manifest_path = config.manifest_path
+
+    if manifest_path is None:
+        return
+
+    if manifest_path.strip() == "":
+        raise ValueError(NO_EMPTY_PATH)
+
+    if not all(c.isalnum() or c in '-_./\\' for c in manifest_path):
+        raise ValueError(UNSUPPORTED_PATH)
+
+
+def handle_max_concurrent(config: Config) -> None:
+    """
+    Handle the --max-concurrent option.
+
+    Args:
+        config (Config): The configuration object.
+
+    Returns:
+        None
+    """
+    max_concurrent = config.max_concurrent
+
+    if max_concurrent is None:
+        return
+
+    if not isinstance(max_concurrent, int) or max_concurrent < 1:
+        raise ValueError(INVALID_CONCURRENCY)
+
+
+def handle_max_file_size(config: Config) -> None:
+    """
+    Handle the --max-file-size option.
+
+    Args:
+        config (Config): The configuration object.
+
+    Returns:
+        None
+    """
+    max_file_size = config.max_file_size
+
+    if max_file_size is None:
+        return
+
+    if not isinstance(max_file_size, int) or max_file_size < 1:
+        raise ValueError(INVALID_MAX_FILE_SIZE)
+
+
+def handle_retries(config: Config) -> None:
+    """
+    Handle the --retries option.
+
+    Args:
+        config (Config): The configuration object.
+
+    Returns:
+        None
+    """
+    retries = config.retries
+
+    if retries is None:
+        return
+
+    if not isinstance(retries, int) or isinstance(retries, bool) or retries < 0:
+        raise ValueError(INVALID_RETRIES)
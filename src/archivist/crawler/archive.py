@@ -0,0 +1,192 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+archive.py
+
+Downloads repository snapshots as tar or zip archives over HTTP, for
+read-only crawls that need the files at one revision but not git history.
+Tar archives are decompressed as they stream in, so the archive is never
+held in memory or on disk.
+
+Typical usage example:
+
+    reader = ArchiveReader(archive_url("https://github.com/org/repo", "main"))
+    for record in reader:
+        index(record.path, record.data)
+"""
+import os
+import posixpath
+import shutil
+import stat
+import tarfile
+import tempfile
+import zipfile
+from typing import IO, Callable, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+from src.archivist.crawler.blobs import BlobRecord, blob_sha
+from src.archivist.crawler.filters import PathFilter
+from src.archivist.errors.errors import UNSUPPORTED_ARCHIVE_URL, UNSAFE_ARCHIVE_PATH
+
+ARCHIVE_SUFFIXES = (".tar.gz", ".tgz", ".tar.bz2", ".tar.xz", ".tar", ".zip")
+DEFAULT_TIMEOUT = 60.0
+CHUNK_SIZE = 1 << 16
+
+
+def archive_url(repo_url: str, ref: Optional[str] = None) -> str:
+    """
+    Resolves the snapshot archive URL of a repository. URLs that already
+    point at an archive are returned unchanged.
+
+    Args:
+        repo_url (str): A GitHub repository URL, or a direct archive URL.
+        ref (Optional[str]): The branch, tag or commit. Defaults to the default branch.
+
+    Returns:
+        str: The URL of a gzipped tarball of the repository at `ref`.
+
+    Raises:
+        ValueError: If the URL is neither a GitHub repository nor an archive.
+    """
+    parsed = urlparse(repo_url)
+    if parsed.path.lower().endswith(ARCHIVE_SUFFIXES):
+        return repo_url
+    parts = [part for part in parsed.path.split("/") if part]
+    if (parsed.hostname or "").lower() not in ("github.com", "www.github.com") or len(parts) != 2:
+        raise ValueError(UNSUPPORTED_ARCHIVE_URL)
+    owner, name = parts[0], parts[1][:-len(".git")] if parts[1].endswith(".git") else parts[1]
+    return f"https://github.com/{owner}/{name}/archive/{ref or 'HEAD'}.tar.gz"
+
+
+class _CountingReader:
+    """
+    Wraps a response and counts the bytes read from it.
+    """
+
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class ArchiveReader:
+    """
+    Streams the regular files of a snapshot archive as `BlobRecord`s. Tar
+    archives (optionally gzip, bzip2 or xz compressed) are read in stream mode
+    as they download. Zip archives keep their index at the end, so they are
+    spooled to a temporary file first. Symlinks and other special entries are
+    skipped, as in `iter_tree`.
+    """
+
+    def __init__(self, url: str, strip_components: int = 1, path_filter: Optional[PathFilter] = None,
+                 timeout: float = DEFAULT_TIMEOUT, headers: Optional[Dict[str, str]] = None):
+        """
+        Initialize the ArchiveReader object.
+
+        Args:
+            url (str): The URL of the archive.
+            strip_components (int): Leading path components to drop, e.g. the
+                `repo-<sha>/` directory that forges put at the top of archives.
+            path_filter (Optional[PathFilter]): Skip files the filter rejects.
+            timeout (float): Socket timeout in seconds.
+            headers (Optional[Dict[str, str]]): Extra request headers, e.g. Authorization.
+        """
+        self.url = url
+        self.strip_components = strip_components
+        self.path_filter = path_filter
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.bytes_received = 0
+        self.files_read = 0
+        self.commit: Optional[str] = None
+
+    def __iter__(self) -> Iterator[BlobRecord]:
+        for record, _ in self._entries():
+            yield record
+
+    def extract(self, output_path: str) -> int:
+        """
+        Writes every file to `output_path`, keeping executable bits.
+
+        Args:
+            output_path (str): The directory to write to.
+
+        Returns:
+            int: The number of files written.
+
+        Raises:
+            ValueError: If an entry would be written outside `output_path`.
+        """
+        written = 0
+        for record, executable in self._entries():
+            full_path = os.path.join(output_path, record.path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "wb") as f:
+                f.write(record.data)
+            os.chmod(full_path, 0o755 if executable else 0o644)
+            written += 1
+        return written
+
+    def _entries(self) -> Iterator[Tuple[BlobRecord, bool]]:
+        self.bytes_received = 0
+        self.files_read = 0
+        request = Request(self.url, headers=self.headers)
+        with urlopen(request, timeout=self.timeout) as response:
+            stream = _CountingReader(response)
+            is_zip = (urlparse(response.geturl()).path.lower().endswith(".zip")
+                      or response.headers.get_content_type() == "application/zip")
+            entries = self._zip_entries(stream) if is_zip else self._tar_entries(stream)
+            for path, mode, size, read in entries:
+                self.bytes_received = stream.bytes_read
+                path = self._relative_path(path)
+                if path is None or (self.path_filter is not None and not self.path_filter.matches(path, size)):
+                    continue
+                data = read()
+                self.files_read += 1
+                yield BlobRecord(path, blob_sha(data), len(data), data), bool(mode & 0o111)
+            self.bytes_received = stream.bytes_read
+
+    def _tar_entries(self, stream: _CountingReader) -> Iterator[Tuple[str, int, int, Callable[[], bytes]]]:
+        with tarfile.open(fileobj=stream, mode="r|*") as tar:
+            for member in tar:
+                # GitHub stores the commit SHA in the global pax header.
+                self.commit = self.commit or tar.pax_headers.get("comment")
+                if member.isfile():
+                    yield member.name, member.mode, member.size, lambda: tar.extractfile(member).read()
+
+    def _zip_entries(self, stream: _CountingReader) -> Iterator[Tuple[str, int, int, Callable[[], bytes]]]:
+        with tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(stream, spool, CHUNK_SIZE)
+            with zipfile.ZipFile(spool) as archive:
+                self.commit = archive.comment.decode("ascii", "replace") or None
+                for info in archive.infolist():
+                    mode = info.external_attr >> 16
+                    if info.is_dir() or (mode and not stat.S_ISREG(mode)):
+                        continue
+                    yield info.filename, mode, info.file_size, lambda: archive.read(info)
+
+    def _relative_path(self, name: str) -> Optional[str]:
+        parts = [part for part in name.split("/") if part not in ("", ".")]
+        if len(parts) <= self.strip_components:
+            return None
+        path = posixpath.join(*parts[self.strip_components:])
+        if name.startswith("/") or ".." in parts:
+            raise ValueError(f"{UNSAFE_ARCHIVE_PATH} {name}")
+        return path
@@ -0,0 +1,244 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+async_crawler.py
+
+Crawler that drives git through asyncio subprocesses, so one event loop can
+run many clones alongside other work without a thread per clone.
+
+Typical usage example:
+
+    crawler = AsyncCrawler(url, path, depth=1, timeout=600, on_progress=print)
+    path = await crawler.aexecute()
+"""
+import asyncio
+import itertools
+import os
+import re
+import shutil
+import time
+from typing import Callable, Iterable, List, Optional, Union
+
+from git import GitCommandError
+
+from src.archivist.crawler.crawler import Crawler
+from src.archivist.crawler.progress import CloneProgress
+from src.archivist.crawler.retry import is_transient
+from src.archivist.crawler.scheduler import MAX_CONCURRENT_CRAWLS
+from src.archivist.errors.errors import UNSUPPORTED_ASYNC_OPTION, INVALID_CONCURRENCY
+
+_PROGRESS_SEPARATOR = re.compile(rb"[\r\n]")
+
+
+def git_options(options: dict) -> List[str]:
+    """
+    Converts `Crawler.clone_options()` keyword arguments to git command line options.
+
+    Args:
+        options (dict): Options keyed by name, e.g. {"depth": 1, "single_branch": True}.
+
+    Returns:
+        List[str]: The command line options, e.g. ["--depth=1", "--single-branch"].
+    """
+    args = []
+    for key, value in options.items():
+        flag = "--" + key.replace("_", "-")
+        if value is True:
+            args.append(flag)
+        elif value not in (None, False):
+            args.append(f"{flag}={value}")
+    return args
+
+
+class AsyncCrawler(Crawler):
+    """
+    Crawler with coroutine counterparts of `clone_repo` and `execute`,
+    `aclone_repo` and `aexecute`. Git runs through
+    `asyncio.create_subprocess_exec`; progress lines are parsed as they arrive
+    and passed to `on_progress`. Cancelling the task, or exceeding `timeout`,
+    kills the git process and removes the partial clone, so the next run
+    starts over in an empty output path.
+
+    The inherited synchronous methods keep working, so an AsyncCrawler can
+    still be passed anywhere a `Crawler` is expected, e.g. to a
+    `CrawlScheduler`.
+    """
+
+    git_executable = "git"
+
+    def __init__(self, repo_url: str, output_path: str, timeout: Optional[float] = None,
+                 on_progress: Optional[Callable[[str], None]] = None, **crawler_options):
+        """
+        Initialize the AsyncCrawler object.
+
+        Args:
+            repo_url (str): The URL of the Git repository to clone.
+            output_path (str): The directory where the repository will be cloned.
+            timeout (Optional[float]): Kill the clone if it takes longer than this many seconds.
+            on_progress (Optional[Callable[[str], None]]): Called with each git progress line.
+            **crawler_options: Clone mode options accepted by `Crawler`.
+
+        Raises:
+            ValueError: If an option needs GitPython or HTTP, i.e. `mirror_cache`,
+                `incremental` or `archive`.
+        """
+        if (crawler_options.get("mirror_cache") is not None or crawler_options.get("incremental")
+                or crawler_options.get("archive")):
+            raise ValueError(UNSUPPORTED_ASYNC_OPTION)
+        super().__init__(repo_url, output_path, **crawler_options)
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self.last_progress: Optional[str] = None
+
+    def clone_command(self) -> List[str]:
+        return [self.git_executable, "clone", "--progress", *git_options(self.clone_options()),
+                "--", self.repo_url, self.output_path]
+
+    async def aclone_repo(self) -> str:
+        """
+        Clones the Git repository to the specified output path without blocking
+        the event loop. Transient git failures are retried with backoff; each
+        attempt gets the full `timeout`. Transfer statistics are stored on
+        `clone_stats`.
+
+        Returns:
+            str: The path to the root of the cloned repository.
+
+        Raises:
+            GitCommandError: If the git clone operation fails.
+            asyncio.TimeoutError: If the clone takes longer than `timeout`.
+            asyncio.CancelledError: If the task is cancelled.
+        """
+        progress = CloneProgress()
+        started = time.monotonic()
+        for retry in itertools.count(1):
+            self.attempts += 1
+            try:
+                await asyncio.wait_for(self._clone(progress), self.timeout)
+                break
+            except GitCommandError as e:
+                if retry > self.retry_policy.retries or not is_transient(e):
+                    raise
+                await asyncio.sleep(self.retry_policy.delay(retry))
+        self.clone_stats = progress.stats(self.output_path, time.monotonic() - started)
+        self.repo_path = self.output_path
+        return self.output_path
+
+    async def aexecute(self) -> str:
+        """
+        Orchestrates the whole cloning operation without blocking the event loop.
+
+        Returns:
+            str: The path to the root of the cloned repository.
+
+        Raises:
+            Exception: If any step in the operation fails.
+            asyncio.CancelledError: If the task is cancelled.
+        """
+        try:
+            self.validate_repo_url()
+            self.prepare_output_path()
+            return await self.aclone_repo()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            raise Exception(f"Cloning operation failed: timed out after {self.timeout}s")
+        except Exception as e:
+            raise Exception(f"Cloning operation failed: {str(e)}")
+
+    async def _clone(self, progress: CloneProgress) -> None:
+        # Git refuses to clone into a directory that is not empty, so whatever
+        # is left in an initially empty output path came from this clone.
+        fresh = not os.path.isdir(self.output_path) or not os.listdir(self.output_path)
+        try:
+            await self._run_git(self.clone_command(), progress)
+            if self.checkout and self.path_filter.active:
+                git_dir = [self.git_executable, "-C", self.output_path]
+                # Listing oversized files runs git synchronously; keep it off the event loop.
+                patterns = await asyncio.to_thread(self.sparse_patterns)
+                await self._run_git([*git_dir, "sparse-checkout", "set", "--no-cone", *patterns], progress)
+                await self._run_git([*git_dir, "checkout", "--progress"], progress)
+        except asyncio.CancelledError:
+            if fresh:
+                await asyncio.to_thread(self._discard_partial_clone)
+            raise
+
+    def _discard_partial_clone(self) -> None:
+        shutil.rmtree(self.output_path, ignore_errors=True)
+        os.makedirs(self.output_path, exist_ok=True)
+
+    async def _run_git(self, command: List[str], progress: CloneProgress) -> None:
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.DEVNULL,
+                                                       stderr=asyncio.subprocess.PIPE)
+        handle_line = progress.new_message_handler()
+        tail: List[str] = []
+        try:
+            buffer = b""
+            while True:
+                chunk = await process.stderr.read(4096)
+                if not chunk:
+                    break
+                *lines, buffer = _PROGRESS_SEPARATOR.split(buffer + chunk)
+                for line in lines:
+                    self._handle_progress(line, handle_line, tail)
+            if buffer:
+                self._handle_progress(buffer, handle_line, tail)
+            status = await process.wait()
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+        if status != 0:
+            raise GitCommandError(command, status, "\n".join(tail))
+
+    def _handle_progress(self, raw: bytes, handle_line: Callable[[str], None], tail: List[str]) -> None:
+        line = raw.decode("utf-8", "replace").strip()
+        if not line:
+            return
+        handle_line(line)
+        self.last_progress = line
+        tail.append(line)
+        del tail[:-20]
+        if self.on_progress is not None:
+            self.on_progress(line)
+
+
+async def crawl_all(crawlers: Iterable[AsyncCrawler],
+                    max_concurrent: int = MAX_CONCURRENT_CRAWLS) -> List[Union[str, BaseException]]:
+    """
+    Runs many crawls on the current event loop with at most `max_concurrent`
+    clones in flight.
+
+    Args:
+        crawlers (Iterable[AsyncCrawler]): The crawls to run.
+        max_concurrent (int): The maximum number of clones to run at once.
+
+    Returns:
+        List[Union[str, BaseException]]: The cloned path, or the exception raised, per crawler.
+
+    Raises:
+        ValueError: If `max_concurrent` is not a positive integer.
+    """
+    if not isinstance(max_concurrent, int) or max_concurrent < 1:
+        raise ValueError(INVALID_CONCURRENCY)
+
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def run(crawler: AsyncCrawler) -> str:
+        async with semaphore:
+            return await crawler.aexecute()
+
+    return await asyncio.gather(*(run(crawler) for crawler in crawlers), return_exceptions=True)
@@ -0,0 +1,288 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+blobs.py
+
+Reads file contents straight from a repository's object database, so bare
+clones and mirrors can be indexed without materializing a working tree.
+
+Typical usage example:
+
+    for record in iter_blobs("/path/to/repo.git", "main"):
+        index(record.path, record.data)
+"""
+import hashlib
+import mmap
+import subprocess
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+from src.archivist.crawler.filters import PathFilter
+from src.archivist.errors.errors import MISSING_OBJECT, GIT_PROCESS_FAILED
+
+BLOB_MODES = (b"100644", b"100755")
+PIPELINE_DEPTH = 64
+
+
+class BlobRecord(NamedTuple):
+    """
+    One file at a revision: its path, blob SHA, size in bytes and contents.
+    """
+    path: str
+    blob_sha: str
+    size: int
+    data: bytes
+
+
+class TreeEntry(NamedTuple):
+    """
+    One regular file listed by `git ls-tree`. `size` is None when sizes
+    were not requested.
+    """
+    path: str
+    blob_sha: str
+    size: Optional[int]
+
+
+def blob_sha(data: Union[bytes, mmap.mmap]) -> str:
+    """
+    Computes the git blob SHA of file contents, as `git hash-object` would.
+
+    Args:
+        data (Union[bytes, mmap.mmap]): The file contents.
+
+    Returns:
+        str: The hex SHA-1 of the blob.
+    """
+    digest = hashlib.sha1(b"blob %d\0" % len(data))
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def _read_records(stream: IO[bytes], separator: bytes = b"\0", chunk_size: int = 65536) -> Iterator[bytes]:
+    buffer = b""
+    while True:
+        chunk = stream.read1(chunk_size) if hasattr(stream, "read1") else stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        *records, buffer = buffer.split(separator)
+        yield from records
+    if buffer:
+        yield buffer
+
+
+def iter_tree(repo_path: str, revision: str = "HEAD", sizes: bool = True) -> Iterator[TreeEntry]:
+    """
+    Streams the regular files of a revision from `git ls-tree`, without
+    holding the whole listing in memory. Symlinks and submodules are skipped.
+
+    Reading sizes needs every blob, so in a partial clone it downloads the
+    missing ones one at a time; pass `sizes=False` to avoid that.
+
+    Args:
+        repo_path (str): The path to a bare repository or a working copy.
+        revision (str): The commit, branch or tag to list.
+        sizes (bool): Read the size of each file.
+
+    Yields:
+        TreeEntry: The path, blob SHA and size of each file.
+
+    Raises:
+        RuntimeError: If git fails, e.g. because the revision does not exist.
+    """
+    command = ["git", "ls-tree", "-r", "-z", "--full-tree", revision]
+    if sizes:
+        command.insert(3, "-l")
+    process = subprocess.Popen(command, cwd=repo_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for record in _read_records(process.stdout):
+            meta, _, path = record.partition(b"\t")
+            mode, object_type, sha, *size = meta.split()
+            if object_type != b"blob" or mode not in BLOB_MODES:
+                continue
+            yield TreeEntry(path.decode("utf-8", "surrogateescape"), sha.decode("ascii"),
+                            int(size[0]) if size else None)
+        stderr = process.stderr.read()
+        if process.wait() != 0:
+            raise RuntimeError(f"{GIT_PROCESS_FAILED} {stderr.decode('utf-8', 'replace').strip()}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def missing_blobs(repo_path: str, revision: str = "HEAD") -> Set[str]:
+    """
+    Lists the blobs of a revision that a partial clone filtered out, without
+    downloading them.
+
+    Args:
+        repo_path (str): The path to a bare repository or a working copy.
+        revision (str): The commit, branch or tag to check.
+
+    Returns:
+        Set[str]: The SHAs of the missing blobs. Empty for a full clone.
+
+    Raises:
+        RuntimeError: If git fails, e.g. because the revision does not exist.
+    """
+    result = subprocess.run(["git", "rev-list", "--objects", "--no-walk", "--missing=print", revision],
+                            cwd=repo_path, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{GIT_PROCESS_FAILED} {result.stderr.decode('utf-8', 'replace').strip()}")
+    return {line[1:].decode("ascii") for line in result.stdout.split() if line.startswith(b"?")}
+
+
+class CatFileBatch:
+    """
+    A persistent `git cat-file --batch` process. Object requests are written
+    ahead of the responses being read, up to `pipeline_depth` at a time, so the
+    process never waits on a round trip between objects.
+    """
+
+    def __init__(self, repo_path: str, pipeline_depth: int = PIPELINE_DEPTH):
+        """
+        Initialize the CatFileBatch object.
+
+        Args:
+            repo_path (str): The path to a bare repository or a working copy.
+            pipeline_depth (int): The number of requests to keep in flight.
+        """
+        self.repo_path = repo_path
+        self.pipeline_depth = pipeline_depth
+        self._process = subprocess.Popen(["git", "cat-file", "--batch"], cwd=repo_path,
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL)
+
+    def __enter__(self) -> "CatFileBatch":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def read(self, sha: str) -> Tuple[str, str, bytes]:
+        """
+        Reads a single object.
+
+        Args:
+            sha (str): The object name.
+
+        Returns:
+            Tuple[str, str, bytes]: The object SHA, type and contents.
+
+        Raises:
+            KeyError: If the object does not exist.
+        """
+        self._request([sha])
+        return self._response()
+
+    def read_many(self, shas: Iterable[str]) -> Iterator[Tuple[str, str, bytes]]:
+        """
+        Reads objects in request order with pipelined requests.
+
+        Args:
+            shas (Iterable[str]): The object names.
+
+        Yields:
+            Tuple[str, str, bytes]: The object SHA, type and contents, in request order.
+
+        Raises:
+            KeyError: If an object does not exist.
+        """
+        pending: List[str] = []
+        for sha in shas:
+            pending.append(sha)
+            if len(pending) == self.pipeline_depth:
+                yield from self._round(pending)
+                pending = []
+        if pending:
+            yield from self._round(pending)
+
+    def close(self) -> None:
+        self._process.stdin.close()
+        self._process.stdout.close()
+        self._process.wait()
+
+    def _round(self, shas: List[str]) -> Iterator[Tuple[str, str, bytes]]:
+        self._request(shas)
+        for _ in shas:
+            yield self._response()
+
+    def _request(self, shas: List[str]) -> None:
+        self._process.stdin.write("".join(f"{sha}\n" for sha in shas).encode("ascii"))
+        self._process.stdin.flush()
+
+    def _response(self) -> Tuple[str, str, bytes]:
+        header = self._process.stdout.readline()
+        if not header:
+            raise RuntimeError(GIT_PROCESS_FAILED)
+        fields = header.split()
+        if len(fields) == 2 and fields[1] == b"missing":
+            raise KeyError(f"{MISSING_OBJECT} {fields[0].decode('ascii')}")
+        sha, object_type, size = fields
+        data = self._process.stdout.read(int(size))
+        self._process.stdout.read(1)
+        return sha.decode("ascii"), object_type.decode("ascii"), data
+
+
+def iter_blobs(repo_path: str, revision: str = "HEAD", max_size: Optional[int] = None,
+               path_filter: Optional[PathFilter] = None, skip_missing: bool = False) -> Iterator[BlobRecord]:
+    """
+    Streams every file of a revision straight from the object database. Only
+    one file's contents are held in memory at a time.
+
+    Args:
+        repo_path (str): The path to a bare repository or a working copy.
+        revision (str): The commit, branch or tag to read.
+        max_size (Optional[int]): Skip files larger than this many bytes.
+        path_filter (Optional[PathFilter]): Skip files the filter rejects.
+        skip_missing (bool): Skip blobs a partial clone filtered out instead of
+            downloading them.
+
+    Yields:
+        BlobRecord: The path, blob SHA, size and contents of each file.
+    """
+    missing = missing_blobs(repo_path, revision) if skip_missing else set()
+    if missing:
+        # Sizes are only known once the remaining blobs are read.
+        entries = (entry for entry in iter_tree(repo_path, revision, sizes=False)
+                   if entry.blob_sha not in missing and (path_filter is None or path_filter.matches(entry.path)))
+    else:
+        entries = (entry for entry in iter_tree(repo_path, revision)
+                   if (max_size is None or entry.size <= max_size)
+                   and (path_filter is None or path_filter.matches(entry.path, entry.size)))
+    with CatFileBatch(repo_path) as cat_file:
+        window: List[TreeEntry] = []
+        for entry in entries:
+            window.append(entry)
+            if len(window) == cat_file.pipeline_depth:
+                yield from _read_window(cat_file, window, max_size, path_filter)
+                window = []
+        if window:
+            yield from _read_window(cat_file, window, max_size, path_filter)
+
+
+def _read_window(cat_file: CatFileBatch, window: List[TreeEntry], max_size: Optional[int],
+                 path_filter: Optional[PathFilter]) -> Iterator[BlobRecord]:
+    objects = cat_file.read_many(entry.blob_sha for entry in window)
+    for entry, (_, _, data) in zip(window, objects):
+        if entry.size is None:
+            if max_size is not None and len(data) > max_size:
+                continue
+            if path_filter is not None and not path_filter.matches(entry.path, len(data)):
+                continue
+        yield BlobRecord(entry.path, entry.blob_sha, len(data), data)
@@ -15,13 +15,64 @@ limitations under the License.
 
 crawler.py
 """
+import glob
 import os
 import subprocess
+import time
+from typing import Callable, Iterator, List, Optional, Set, TypeVar
 
 from validators import url as check_url
-from git import Repo, GitCommandError
+from git import Repo, GitCommandError, InvalidGitRepositoryError, NoSuchPathError
 
-from src.archivist.errors.errors import UNSUPPORTED_URL
+from src.archivist.crawler.archive import ArchiveReader, archive_url
+from src.archivist.crawler.blobs import BlobRecord, iter_blobs, iter_tree, missing_blobs
+from src.archivist.crawler.filters import PathFilter
+from src.archivist.crawler.manifest import ChangeManifest, FileChange, diff_changes
+from src.archivist.crawler.mirror import MirrorCache
+from src.archivist.crawler.progress import CloneProgress, CloneStats, pack_bytes
+from src.archivist.crawler.retry import DEFAULT_RETRIES, RetryPolicy
+from src.archivist.errors.errors import UNSUPPORTED_URL, UNSUPPORTED_CLONE_FILTER, INVALID_DEPTH, \
+    NOT_CLONED, CONFLICTING_CLONE_FILTER, NO_REMOTE_HEAD, UNSUPPORTED_ARCHIVE_OPTION, \
+    INCREMENTAL_NEEDS_CHECKOUT
+
+T = TypeVar("T")
+
+CLONE_FILTERS = ("blob:none", "tree:0")
+
+
+def check_crawl_options(depth: Optional[int] = None, single_branch: bool = False, clone_filter: Optional[str] = None,
+                        mirror_cache: Optional[MirrorCache] = None, incremental: bool = False, checkout: bool = True,
+                        max_file_size: Optional[int] = None, archive: bool = False) -> None:
+    """
+    Checks the clone-mode options of a `Crawler`, alone and in combination,
+    without building one, e.g. to reject a batch job before it is scheduled.
+
+    Args:
+        See `Crawler.__init__`.
+
+    Returns:
+        None
+
+    Raises:
+        ValueError: If `depth` is not a positive integer.
+        ValueError: If `clone_filter` is not supported, or is combined with `max_file_size`.
+        ValueError: If `archive` is combined with an option that needs git.
+        ValueError: If `incremental` is set without `checkout`.
+    """
+    if depth is not None and (not isinstance(depth, int) or depth < 1):
+        raise ValueError(INVALID_DEPTH)
+
+    if clone_filter is not None and clone_filter not in CLONE_FILTERS:
+        raise ValueError(UNSUPPORTED_CLONE_FILTER)
+
+    if clone_filter is not None and max_file_size is not None:
+        raise ValueError(CONFLICTING_CLONE_FILTER)
+
+    if archive and (mirror_cache is not None or incremental or depth or single_branch or clone_filter):
+        raise ValueError(UNSUPPORTED_ARCHIVE_OPTION)
+
+    if incremental and not checkout:
+        raise ValueError(INCREMENTAL_NEEDS_CHECKOUT)
 
 
 class Crawler:
@@ -29,21 +80,69 @@ class Crawler:
     Crawler class responsible for cloning Git repositories.
     """
 
-    def __init__(self, repo_url: str, output_path: str):
+    def __init__(self, repo_url: str, output_path: str, branch: Optional[str] = None,
+                 depth: Optional[int] = None, single_branch: bool = False,
+                 clone_filter: Optional[str] = None, mirror_cache: Optional[MirrorCache] = None,
+                 incremental: bool = False, checkout: bool = True, include: Optional[List[str]] = None,
+                 exclude: Optional[List[str]] = None, max_file_size: Optional[int] = None,
+                 retries: Optional[int] = None, archive: bool = False):
         """
         Initialize the Crawler object.
 
         Args:
             repo_url (str): The URL of the Git repository to clone.
             output_path (str): The directory where the repository will be cloned.
+            branch (Optional[str]): The branch to check out. Defaults to the remote HEAD.
+            depth (Optional[int]): Truncate history to this many commits.
+            single_branch (bool): Only fetch the history of `branch`.
+            clone_filter (Optional[str]): Partial clone filter, one of `CLONE_FILTERS`.
+            mirror_cache (Optional[MirrorCache]): Fetch into a cached local mirror and clone
+                from it instead of cloning from `repo_url` directly.
+            incremental (bool): Update an existing checkout at `output_path` instead of
+                cloning, and record the changed files on `manifest`.
+            checkout (bool): Materialize a working tree. Without one the repository is
+                cloned bare, or read straight from the mirror cache, and files are read
+                with `blobs`.
+            include (Optional[List[str]]): Only check out or read paths matching these globs.
+            exclude (Optional[List[str]]): Never check out or read paths matching these globs.
+            max_file_size (Optional[int]): Never check out or read files larger than this.
+            retries (Optional[int]): Retries of transient clone and fetch failures.
+                Defaults to `DEFAULT_RETRIES`.
+            archive (bool): Download a snapshot archive over HTTP instead of cloning.
+                Files are extracted to `output_path`, or without a checkout streamed
+                from the archive by `blobs`.
 
         Raises:
             ValueError: If `repo_url` is invalid.
             ValueError: If `output_path` is invalid.
+            ValueError: If `depth` is not a positive integer.
+            ValueError: If `clone_filter` is not supported, or is combined with `max_file_size`.
+            ValueError: If a path pattern is empty or `max_file_size` is not positive.
+            ValueError: If `retries` is not a non-negative integer.
+            ValueError: If `archive` is combined with an option that needs git.
+            ValueError: If `incremental` is set without `checkout`.
         """
         # TODO: Switch to a common url validator.
         self.repo_url = repo_url
         self.output_path = output_path
+        self.branch = branch
+        self.depth = depth
+        self.single_branch = single_branch
+        self.clone_filter = clone_filter
+        self.mirror_cache = mirror_cache
+        self.incremental = incremental
+        self.checkout = checkout
+        self.path_filter = PathFilter(include, exclude, max_file_size)
+        self.retry_policy = RetryPolicy(DEFAULT_RETRIES if retries is None else retries)
+        self.archive = archive
+        self.attempts = 0
+        self.repo_path: Optional[str] = None
+        self.clone_stats: Optional[CloneStats] = None
+        self.manifest: Optional[ChangeManifest] = None
+
+        check_crawl_options(depth=depth, single_branch=single_branch, clone_filter=clone_filter,
+                            mirror_cache=mirror_cache, incremental=incremental, checkout=checkout,
+                            max_file_size=max_file_size, archive=archive)
 
     def validate_repo_url(self) -> bool:
         """
@@ -87,26 +186,375 @@ class Crawler:
 
         return True
 
+    def clone_options(self) -> dict:
+        """
+        Builds the git clone options for the configured clone mode.
+
+        With path or size filtering, a working copy is cloned without blobs and
+        without a checkout; `apply_sparse_checkout` then checks out only the
+        kept files, fetching just their blobs. With a size limit, blobs over
+        the limit are filtered out by the server instead, since their sizes
+        cannot be known locally without downloading them.
+
+        Returns:
+            dict: Keyword arguments for `Repo.clone_from`.
+        """
+        options = {}
+        if self.branch:
+            options["branch"] = self.branch
+        if self.depth:
+            options["depth"] = self.depth
+        if self.single_branch:
+            options["single_branch"] = True
+        if self.clone_filter:
+            options["filter"] = self.clone_filter
+        elif self.path_filter.max_file_size:
+            options["filter"] = f"blob:limit={self.path_filter.max_file_size}"
+        elif self.path_filter.active and self.checkout:
+            options["filter"] = "blob:none"
+        if not self.checkout:
+            options["bare"] = True
+        elif self.path_filter.active:
+            options["no_checkout"] = True
+        return options
+
+    def sparse_patterns(self, revision: str = "HEAD") -> List[str]:
+        """
+        Builds the sparse-checkout patterns for a revision. Files over the size
+        limit are excluded by exact path.
+
+        Args:
+            revision (str): The revision whose oversized files to exclude.
+
+        Returns:
+            List[str]: Non-cone sparse-checkout patterns.
+        """
+        return self.path_filter.sparse_patterns(sorted(self.oversized_paths(revision)))
+
+    def oversized_paths(self, revision: str = "HEAD") -> Set[str]:
+        """
+        Lists the files of a revision larger than the size limit. In a clone
+        filtered by `blob:limit` these are exactly the missing blobs, which
+        are found without downloading them.
+
+        Args:
+            revision (str): The revision to list.
+
+        Returns:
+            Set[str]: The oversized paths, empty if there is no size limit.
+        """
+        max_file_size = self.path_filter.max_file_size
+        if not max_file_size:
+            return set()
+        missing = missing_blobs(self.output_path, revision)
+        if missing:
+            return {entry.path for entry in iter_tree(self.output_path, revision, sizes=False)
+                    if entry.blob_sha in missing}
+        return {entry.path for entry in iter_tree(self.output_path, revision) if entry.size > max_file_size}
+
+    def apply_sparse_checkout(self, repo: Repo, revision: str = "HEAD", checkout: bool = True) -> None:
+        """
+        Restricts the working copy to the files kept by the path filter.
+
+        Args:
+            repo (Repo): The working copy.
+            revision (str): The revision whose oversized files to exclude.
+            checkout (bool): Populate the working tree afterwards, as needed after a
+                clone without a checkout.
+
+        Returns:
+            None
+
+        Raises:
+            GitCommandError: If git fails.
+        """
+        repo.git.sparse_checkout("set", "--no-cone", *self.sparse_patterns(revision))
+        if checkout:
+            repo.git.checkout()
+
     def clone_repo(self) -> str:
         """
-        Clones the Git repository to the specified output path.
+        Clones the Git repository to the specified output path. Transient
+        failures are retried with backoff, and a clone interrupted by an
+        earlier attempt or run is resumed rather than started over. Transfer
+        statistics for the clone are stored on `clone_stats`. With a mirror
+        cache, only the fetch into the mirror touches the network.
 
         Returns:
-            str: The path to the root of the cloned repository.
+            str: The path to the root of the cloned repository. Without a checkout
+            this is the bare repository, which is the mirror itself when a mirror
+            cache is used.
 
         Raises:
             GitCommandError: If the git clone operation fails.
         """
+        if self.archive:
+            return self.download_archive()
+        if self.mirror_cache is not None:
+            return self._with_retries(self.clone_from_mirror)
+
+        progress = CloneProgress()
+        started = time.monotonic()
+
+        def attempt() -> Repo:
+            if self.is_partial_clone():
+                return self.resume_clone(progress)
+            repo = Repo.clone_from(self.repo_url, self.output_path, progress=progress, **self.clone_options())
+            if self.checkout and self.path_filter.active:
+                self.apply_sparse_checkout(repo)
+            return repo
+
         try:
-            Repo.clone_from(self.repo_url, self.output_path)
+            self._with_retries(attempt)
         except GitCommandError as e:
             raise GitCommandError(f"Git clone operation failed: {str(e)}")
 
+        self.clone_stats = progress.stats(self.output_path, time.monotonic() - started)
+        self.repo_path = self.output_path
+        return self.output_path
+
+    def archive_reader(self, revision: Optional[str] = None, max_size: Optional[int] = None) -> ArchiveReader:
+        """
+        Builds a reader for the snapshot archive of a revision.
+
+        Args:
+            revision (Optional[str]): The revision to download. Defaults to `branch`,
+                then the default branch.
+            max_size (Optional[int]): Skip files larger than this many bytes.
+
+        Returns:
+            ArchiveReader: The reader, which downloads when iterated.
+        """
+        limits = [limit for limit in (self.path_filter.max_file_size, max_size) if limit]
+        path_filter = PathFilter(self.path_filter.include, self.path_filter.exclude,
+                                 min(limits) if limits else None)
+        return ArchiveReader(archive_url(self.repo_url, revision or self.branch),
+                             path_filter=path_filter if path_filter.active else None)
+
+    def download_archive(self) -> str:
+        """
+        Downloads the snapshot archive and extracts it to the output path,
+        retrying transient failures. Without a checkout nothing is downloaded
+        until `blobs` is iterated.
+
+        Returns:
+            str: The output path.
+
+        Raises:
+            URLError: If the download fails.
+            ValueError: If the URL has no archive, or the archive is unsafe.
+        """
+        self.repo_path = self.output_path
+        if not self.checkout:
+            return self.output_path
+
+        reader = self.archive_reader()
+        started = time.monotonic()
+        self._with_retries(lambda: reader.extract(self.output_path))
+        self.clone_stats = CloneStats(objects_received=reader.files_read, bytes_received=reader.bytes_received,
+                                      elapsed=time.monotonic() - started)
         return self.output_path
 
+    def is_partial_clone(self) -> bool:
+        """
+        Checks whether the output path holds a clone of `repo_url` that was
+        interrupted before any branch was written, e.g. because git was killed
+        mid-transfer. Git removes its own failed clones, so this is left behind
+        by crashes and kills rather than by network errors.
+
+        Returns:
+            bool: True if the clone can be resumed with `resume_clone`.
+        """
+        git_dir = os.path.join(self.output_path, ".git") if self.checkout else self.output_path
+        if not os.path.isfile(os.path.join(git_dir, "HEAD")):
+            return False
+        try:
+            repo = Repo(self.output_path)
+        except (InvalidGitRepositoryError, NoSuchPathError):
+            return False
+        return (not repo.head.is_valid() and "origin" in repo.remotes
+                and repo.remotes.origin.url == self.repo_url)
+
+    def resume_clone(self, progress: Optional[CloneProgress] = None) -> Repo:
+        """
+        Finishes an interrupted clone by fetching into it, then checks out the
+        branch the clone would have. Temporary packs and lock files left by the
+        killed git process are removed first, so nothing else may be writing to
+        the output path.
+
+        Args:
+            progress (Optional[CloneProgress]): Receives fetch progress.
+
+        Returns:
+            Repo: The completed clone.
+
+        Raises:
+            GitCommandError: If the fetch or the checkout fails.
+        """
+        repo = Repo(self.output_path)
+        stale = glob.glob(os.path.join(repo.git_dir, "objects", "pack", "tmp_*"))
+        stale += glob.glob(os.path.join(repo.git_dir, "*.lock"))
+        for path in stale:
+            os.remove(path)
+
+        branch = self.branch or remote_head_branch(repo)
+        options = self.clone_options()
+        fetch_options = {key: options[key] for key in ("depth", "filter") if key in options}
+        refspec = None
+        if not self.checkout:
+            heads = branch if self.single_branch else "*"
+            refspec = f"+refs/heads/{heads}:refs/heads/{heads}"
+        repo.remotes.origin.fetch(refspec, progress=progress, **fetch_options)
+
+        repo.git.symbolic_ref("HEAD", f"refs/heads/{branch}")
+        if self.checkout:
+            upstream = f"origin/{branch}"
+            if self.path_filter.active:
+                self.apply_sparse_checkout(repo, upstream, checkout=False)
+            repo.git.reset("--hard", upstream)
+            repo.git.branch("--set-upstream-to", upstream)
+        return repo
+
+    def clone_from_mirror(self) -> str:
+        """
+        Updates the cached mirror of the repository and clones the working copy
+        from it with a local, hardlinked clone.
+
+        Returns:
+            str: The path to the root of the cloned repository.
+
+        Raises:
+            GitCommandError: If the fetch or the local clone fails.
+        """
+        progress = CloneProgress()
+        started = time.monotonic()
+        mirror_path = self.mirror_cache.mirror_path(self.repo_url)
+        bytes_before = pack_bytes(mirror_path)
+        if self.checkout:
+            repo = self.mirror_cache.clone(self.repo_url, self.output_path, progress=progress,
+                                           **self.clone_options())
+            if self.path_filter.active:
+                self.apply_sparse_checkout(repo)
+            self.repo_path = self.output_path
+        else:
+            self.repo_path = self.mirror_cache.fetch(self.repo_url, progress=progress)
+
+        self.clone_stats = CloneStats(objects_received=progress.objects_received,
+                                      bytes_received=max(pack_bytes(mirror_path) - bytes_before, 0),
+                                      elapsed=time.monotonic() - started)
+        return self.repo_path
+
+    def blobs(self, revision: Optional[str] = None, max_size: Optional[int] = None) -> Iterator[BlobRecord]:
+        """
+        Streams the files of a revision from the cloned repository's object
+        database through a persistent `git cat-file --batch` process. No
+        working tree is needed. Partial clones fetch missing blobs on demand.
+        Files rejected by the include, exclude or size rules are never read.
+        In archive mode the files are streamed from a snapshot archive instead.
+
+        Args:
+            revision (Optional[str]): The revision to read. Defaults to `branch`, then HEAD.
+            max_size (Optional[int]): Skip files larger than this many bytes.
+
+        Returns:
+            Iterator[BlobRecord]: (path, blob_sha, size, data) for each file.
+
+        Raises:
+            ValueError: If the repository has not been cloned yet.
+        """
+        if self.repo_path is None:
+            raise ValueError(NOT_CLONED)
+        if self.archive:
+            return iter(self.archive_reader(revision, max_size))
+        path_filter = self.path_filter if self.path_filter.active else None
+        return iter_blobs(self.repo_path, revision or self.branch or "HEAD", max_size=max_size,
+                          path_filter=path_filter, skip_missing=bool(self.path_filter.max_file_size))
+
+    def has_checkout(self) -> bool:
+        """
+        Checks whether the output path already holds a git working copy. An
+        interrupted clone does not count; it is resumed instead.
+
+        Returns:
+            bool: True if `output_path` is the root of a working copy.
+        """
+        return os.path.isdir(os.path.join(self.output_path, ".git")) and not self.is_partial_clone()
+
+    def update_repo(self) -> ChangeManifest:
+        """
+        Fetches new commits into the existing checkout at the output path and
+        fast-forwards it. If upstream history was rewritten, the checkout is
+        reset to the upstream branch instead. The manifest of files changed
+        between the previous and new HEAD is stored on `manifest`.
+
+        Returns:
+            ChangeManifest: The files changed by the update.
+
+        Raises:
+            GitCommandError: If the fetch or the fast-forward fails.
+        """
+        repo = Repo(self.output_path)
+        previous_head = repo.head.commit.hexsha
+        progress = CloneProgress()
+        started = time.monotonic()
+        fetch_options = {"depth": self.depth} if self.depth else {}
+        try:
+            with repo.config_writer() as config:
+                # Keep every fetch as a pack so transfer sizes stay measurable.
+                config.set_value("fetch", "unpackLimit", "1")
+            if self.mirror_cache is not None:
+                stats_path = self.mirror_cache.mirror_path(self.repo_url)
+                bytes_before = pack_bytes(stats_path)
+                mirror_path = self._with_retries(lambda: self.mirror_cache.fetch(self.repo_url, progress=progress))
+                repo.git.fetch(mirror_path, "+refs/heads/*:refs/remotes/origin/*", prune=True, **fetch_options)
+            else:
+                stats_path = self.output_path
+                bytes_before = pack_bytes(stats_path)
+                self._with_retries(lambda: repo.remotes.origin.fetch(progress=progress, **fetch_options))
+
+            branch = self.branch or repo.active_branch.name
+            if repo.active_branch.name != branch:
+                repo.git.checkout(branch)
+            upstream = f"origin/{branch}"
+            if self.path_filter.active:
+                self.apply_sparse_checkout(repo, upstream, checkout=False)
+            forced = not repo.is_ancestor(previous_head, upstream)
+            if forced:
+                repo.git.reset("--hard", upstream)
+            else:
+                repo.git.merge("--ff-only", upstream)
+        except GitCommandError as e:
+            raise GitCommandError(f"Git update operation failed: {str(e)}")
+
+        new_head = repo.head.commit.hexsha
+        self.repo_path = self.output_path
+        self.clone_stats = CloneStats(objects_received=progress.objects_received,
+                                      bytes_received=max(pack_bytes(stats_path) - bytes_before, 0),
+                                      elapsed=time.monotonic() - started)
+        self.manifest = ChangeManifest(self.repo_url, self.output_path, previous_head, new_head,
+                                       self.filter_changes(diff_changes(repo, previous_head, new_head), new_head),
+                                       forced=forced)
+        return self.manifest
+
+    def filter_changes(self, changes: List[FileChange], revision: str = "HEAD") -> List[FileChange]:
+        """
+        Drops changes to files excluded by the path filter, including files at
+        `revision` over the size limit. A rename is kept if either side is included.
+        """
+        if not self.path_filter.active:
+            return changes
+        oversized = self.oversized_paths(revision)
+
+        def kept(path: Optional[str]) -> bool:
+            return path is not None and path not in oversized and self.path_filter.matches(path)
+
+        return [change for change in changes if kept(change.path) or kept(change.old_path)]
+
     def execute(self) -> str:
         """
-        Orchestrates the whole cloning operation.
+        Orchestrates the whole cloning operation. In incremental mode an
+        existing checkout is updated instead, and a fresh clone records every
+        file as added, so `manifest` is set after every incremental run.
 
         Returns:
             str: The path to the root of the cloned repository.
@@ -116,7 +564,44 @@ class Crawler:
         """
         try:
             self.validate_repo_url()
+            if self.incremental and self.has_checkout():
+                self.update_repo()
+                return self.output_path
             self.prepare_output_path()
-            return self.clone_repo()
+            path = self.clone_repo()
+            if self.incremental:
+                repo = Repo(path)
+                new_head = repo.head.commit.hexsha
+                self.manifest = ChangeManifest(self.repo_url, path, None, new_head,
+                                               self.filter_changes(diff_changes(repo, None, new_head), new_head))
+            return path
         except Exception as e:
-            raise Exception(f"Cloning operation failed: {str(e)}")
+            raise Exception(f"Cloning operation failed: {str(e)}") from e
+
+    def _with_retries(self, operation: Callable[[], T]) -> T:
+        def attempt() -> T:
+            self.attempts += 1
+            return operation()
+
+        return self.retry_policy.run(attempt)
+
+
+def remote_head_branch(repo: Repo, remote: str = "origin") -> str:
+    """
+    Asks a remote for its default branch.
+
+    Args:
+        repo (Repo): A repository with the remote configured.
+        remote (str): The name of the remote.
+
+    Returns:
+        str: The branch the remote's HEAD points to, e.g. "main".
+
+    Raises:
+        GitCommandError: If the remote cannot be reached.
+        ValueError: If the remote has no default branch.
+    """
+    for line in repo.git.ls_remote("--symref", remote, "HEAD").splitlines():
+        if line.startswith("ref: refs/heads/") and line.endswith("\tHEAD"):
+            return line[len("ref: refs/heads/"):-len("\tHEAD")]
+    raise ValueError(NO_REMOTE_HEAD)
@@ -0,0 +1,125 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+filters.py
+
+Crawl-time path and size filtering. The same rules drive git sparse-checkout
+patterns for working copies and in-process matching for checkout-free crawls.
+"""
+import re
+from typing import Iterable, List, Optional
+
+from pathspec import PathSpec
+
+from src.archivist.errors.errors import INVALID_MAX_FILE_SIZE, NO_EMPTY_PATTERN
+
+_GLOB_SPECIAL = re.compile(r"([\\*?\[\]!#])")
+
+
+def escape_pattern(path: str) -> str:
+    """
+    Escapes a literal path for use as an anchored gitignore-style pattern.
+
+    Args:
+        path (str): A repository-relative path.
+
+    Returns:
+        str: A pattern matching exactly that path.
+    """
+    escaped = _GLOB_SPECIAL.sub(r"\\\1", path)
+    if escaped.endswith(" "):
+        escaped = escaped[:-1] + "\\ "
+    return "/" + escaped
+
+
+def _contents_pattern(pattern: str) -> str:
+    # Sparse checkout applies a negated directory pattern to the directory
+    # only, so files inside it matched by an include rule would still be
+    # checked out. This pattern excludes them explicitly.
+    directory = pattern.rstrip("/")
+    if "/" not in directory:
+        directory = "**/" + directory
+    return directory + "/**"
+
+
+class PathFilter:
+    """
+    Include/exclude glob rules and a maximum file size. Globs use gitignore
+    syntax, e.g. `*.py`, `docs/`, `/src/**/*.ts`. With no include rules
+    every path is included; exclude rules win over include rules.
+    """
+
+    def __init__(self, include: Optional[Iterable[str]] = None, exclude: Optional[Iterable[str]] = None,
+                 max_file_size: Optional[int] = None):
+        """
+        Initialize the PathFilter object.
+
+        Args:
+            include (Optional[Iterable[str]]): Only keep paths matching one of these globs.
+            exclude (Optional[Iterable[str]]): Drop paths matching any of these globs.
+            max_file_size (Optional[int]): Drop files larger than this many bytes.
+
+        Raises:
+            ValueError: If a pattern is empty or `max_file_size` is not a positive integer.
+        """
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.max_file_size = max_file_size
+
+        if any(not pattern.strip() for pattern in self.include + self.exclude):
+            raise ValueError(NO_EMPTY_PATTERN)
+        if max_file_size is not None and (not isinstance(max_file_size, int) or max_file_size < 1):
+            raise ValueError(INVALID_MAX_FILE_SIZE)
+
+        self._include_spec = PathSpec.from_lines("gitwildmatch", self.include)
+        self._exclude_spec = PathSpec.from_lines("gitwildmatch", self.exclude)
+
+    @property
+    def active(self) -> bool:
+        return bool(self.include or self.exclude or self.max_file_size)
+
+    def matches(self, path: str, size: Optional[int] = None) -> bool:
+        """
+        Checks whether a file passes the filter.
+
+        Args:
+            path (str): A repository-relative path.
+            size (Optional[int]): The file size in bytes, if known.
+
+        Returns:
+            bool: True if the file should be kept.
+        """
+        if self.max_file_size is not None and size is not None and size > self.max_file_size:
+            return False
+        if self.include and not self._include_spec.match_file(path):
+            return False
+        return not self._exclude_spec.match_file(path)
+
+    def sparse_patterns(self, oversized_paths: Iterable[str] = ()) -> List[str]:
+        """
+        Builds non-cone sparse-checkout patterns for the filter. Each exclude
+        rule also excludes everything below a directory it matches.
+
+        Args:
+            oversized_paths (Iterable[str]): Paths larger than `max_file_size`, excluded literally.
+
+        Returns:
+            List[str]: The sparse-checkout patterns, in order.
+        """
+        patterns = list(self.include) if self.include else ["/*"]
+        for pattern in self.exclude:
+            patterns += [f"!{pattern}", f"!{_contents_pattern(pattern)}"]
+        patterns += [f"!{escape_pattern(path)}" for path in oversized_paths]
+        return patterns
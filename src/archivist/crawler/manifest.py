@@ -0,0 +1,160 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+manifest.py
+
+Changed-file manifests between two commits of a crawled repository, so later
+stages can process only the delta.
+"""
+import json
+from typing import List, Optional
+
+from git import Repo
+
+ADDED = "added"
+MODIFIED = "modified"
+DELETED = "deleted"
+RENAMED = "renamed"
+
+_DIFF_STATUSES = {"A": ADDED, "C": ADDED, "M": MODIFIED, "T": MODIFIED, "D": DELETED, "R": RENAMED}
+
+
+class FileChange:
+    """
+    One changed path. `old_path` is only set for renames.
+    """
+
+    def __init__(self, status: str, path: str, old_path: Optional[str] = None):
+        self.status = status
+        self.path = path
+        self.old_path = old_path
+
+    def as_dict(self) -> dict:
+        change = {"status": self.status, "path": self.path}
+        if self.old_path is not None:
+            change["old_path"] = self.old_path
+        return change
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FileChange) and self.as_dict() == other.as_dict()
+
+    def __repr__(self) -> str:
+        return f"FileChange({self.status!r}, {self.path!r}, {self.old_path!r})"
+
+
+class ChangeManifest:
+    """
+    The files that changed in a working copy between `previous_head` and
+    `new_head`. A first crawl has no previous head and lists every file as added.
+    """
+
+    def __init__(self, repo_url: str, output_path: str, previous_head: Optional[str], new_head: str,
+                 changes: List[FileChange], forced: bool = False):
+        """
+        Initialize the ChangeManifest object.
+
+        Args:
+            repo_url (str): The URL of the crawled repository.
+            output_path (str): The path to the working copy.
+            previous_head (Optional[str]): The commit checked out before the crawl, if any.
+            new_head (str): The commit checked out after the crawl.
+            changes (List[FileChange]): The changed paths.
+            forced (bool): True if upstream history was rewritten and the working copy was reset.
+        """
+        self.repo_url = repo_url
+        self.output_path = output_path
+        self.previous_head = previous_head
+        self.new_head = new_head
+        self.changes = changes
+        self.forced = forced
+
+    def paths(self, status: str) -> List[str]:
+        return [change.path for change in self.changes if change.status == status]
+
+    @property
+    def added(self) -> List[str]:
+        return self.paths(ADDED)
+
+    @property
+    def modified(self) -> List[str]:
+        return self.paths(MODIFIED)
+
+    @property
+    def deleted(self) -> List[str]:
+        return self.paths(DELETED)
+
+    @property
+    def renamed(self) -> List[FileChange]:
+        return [change for change in self.changes if change.status == RENAMED]
+
+    @property
+    def unchanged(self) -> bool:
+        return self.previous_head == self.new_head
+
+    def as_dict(self) -> dict:
+        return {
+            "repo_url": self.repo_url,
+            "output_path": self.output_path,
+            "previous_head": self.previous_head,
+            "new_head": self.new_head,
+            "forced": self.forced,
+            "changes": [change.as_dict() for change in self.changes],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2)
+
+    def write(self, path: str) -> None:
+        """
+        Writes the manifest to `path` as JSON.
+        """
+        with open(path, "w") as f:
+            f.write(self.to_json())
+
+
+def diff_changes(repo: Repo, previous_head: Optional[str], new_head: str) -> List[FileChange]:
+    """
+    Lists the files that differ between two commits, with rename detection.
+    With no previous head, every file in `new_head` is reported as added.
+
+    Args:
+        repo (Repo): The repository holding both commits.
+        previous_head (Optional[str]): The older commit.
+        new_head (str): The newer commit.
+
+    Returns:
+        List[FileChange]: The changed paths, in git's order.
+    """
+    if previous_head is None:
+        output = repo.git.ls_tree("-r", "-z", "--name-only", new_head)
+        return [FileChange(ADDED, path) for path in output.split("\0") if path]
+
+    if previous_head == new_head:
+        return []
+
+    tokens = repo.git.diff("--name-status", "-z", "-M", previous_head, new_head).split("\0")
+    changes = []
+    i = 0
+    while i < len(tokens) and tokens[i]:
+        code = tokens[i][0]
+        status = _DIFF_STATUSES.get(code, MODIFIED)
+        if code in ("R", "C"):
+            old_path, path = tokens[i + 1], tokens[i + 2]
+            changes.append(FileChange(status, path, old_path if code == "R" else None))
+            i += 3
+        else:
+            changes.append(FileChange(status, tokens[i + 1]))
+            i += 2
+    return changes
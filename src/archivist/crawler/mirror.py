@@ -0,0 +1,256 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+mirror.py
+
+Local cache of bare mirrors, one per repository, so repeat crawls only fetch
+new objects and build working copies with hardlinked local clones.
+
+Typical usage example:
+
+    cache = MirrorCache("~/.cache/archivist/mirrors", max_bytes=50 * 2**30)
+    mirror_path = cache.fetch("https://github.com/org/repo.git")
+"""
+import hashlib
+import os
+import re
+import shutil
+import threading
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from git import Repo, GitCommandError
+
+from src.archivist.crawler.progress import CloneProgress
+from src.archivist.errors.errors import NO_EMPTY_PATH, INVALID_CACHE_LIMIT
+
+DEFAULT_MIRROR_CACHE_BYTES = 50 * 2 ** 30
+
+_SCP_URL = re.compile(r"^(?:[^@/]+@)?([^:/]+):(?!//)(.+)$")
+
+
+def normalize_url(repo_url: str) -> str:
+    """
+    Normalizes a repository URL so that spellings of the same repository share
+    one mirror. Credentials, the scheme, a trailing slash and `.git` are
+    dropped and the host is lowercased; `git@host:org/repo` becomes `host/org/repo`.
+
+    Args:
+        repo_url (str): The URL of the Git repository.
+
+    Returns:
+        str: The normalized URL.
+    """
+    url = repo_url.strip()
+    scp = _SCP_URL.match(url)
+    if scp and "://" not in url:
+        host, path = scp.group(1).lower(), scp.group(2)
+    else:
+        parsed = urlparse(url)
+        host = (parsed.hostname or "").lower()
+        if parsed.port:
+            host = f"{host}:{parsed.port}"
+        path = parsed.path
+
+    path = path.rstrip("/")
+    if path.endswith(".git"):
+        path = path[:-len(".git")]
+    return f"{host}/{path.lstrip('/')}" if host else path
+
+
+def mirror_name(repo_url: str) -> str:
+    """
+    Returns the directory name of the mirror for a repository URL: a readable
+    slug of the normalized URL plus a short hash to keep names unique.
+
+    Args:
+        repo_url (str): The URL of the Git repository.
+
+    Returns:
+        str: The mirror directory name.
+    """
+    normalized = normalize_url(repo_url)
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", normalized).strip("_")[-64:]
+    digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+    return f"{slug}-{digest}.git"
+
+
+def directory_size(path: str) -> int:
+    """
+    Returns the total size of the regular files under `path`.
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            full_path = os.path.join(root, name)
+            if not os.path.islink(full_path):
+                total += os.path.getsize(full_path)
+    return total
+
+
+class MirrorCache:
+    """
+    Directory of bare `git clone --mirror` repositories keyed by normalized URL.
+    Mirrors are evicted least recently used first once the cache grows past
+    `max_bytes` or `max_mirrors`.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = DEFAULT_MIRROR_CACHE_BYTES,
+                 max_mirrors: Optional[int] = None):
+        """
+        Initialize the MirrorCache object.
+
+        Args:
+            cache_dir (str): The directory holding the mirrors. Created if missing.
+            max_bytes (Optional[int]): Evict mirrors once the cache is larger than this.
+            max_mirrors (Optional[int]): Evict mirrors once there are more than this many.
+
+        Raises:
+            ValueError: If `cache_dir` is empty or a limit is not positive.
+        """
+        if not cache_dir or not cache_dir.strip():
+            raise ValueError(NO_EMPTY_PATH)
+        for limit in (max_bytes, max_mirrors):
+            if limit is not None and (not isinstance(limit, int) or limit < 1):
+                raise ValueError(INVALID_CACHE_LIMIT)
+
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.max_mirrors = max_mirrors
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def mirror_path(self, repo_url: str) -> str:
+        """
+        Returns the path of the mirror for `repo_url`, whether or not it exists yet.
+        """
+        return os.path.join(self.cache_dir, mirror_name(repo_url))
+
+    def has_mirror(self, repo_url: str) -> bool:
+        return os.path.isdir(self.mirror_path(repo_url))
+
+    def fetch(self, repo_url: str, progress: Optional[CloneProgress] = None) -> str:
+        """
+        Brings the mirror for `repo_url` up to date, creating it on first use.
+        An existing mirror only receives the objects it is missing.
+
+        Args:
+            repo_url (str): The URL of the Git repository.
+            progress (Optional[CloneProgress]): Receives git's transfer progress.
+
+        Returns:
+            str: The path to the bare mirror.
+
+        Raises:
+            GitCommandError: If the clone or fetch fails.
+        """
+        path = self.mirror_path(repo_url)
+        with self._lock_for(path):
+            try:
+                if os.path.isdir(path):
+                    Repo(path).remotes.origin.fetch(prune=True, progress=progress)
+                else:
+                    mirror = Repo.clone_from(repo_url, path, mirror=True, progress=progress)
+                    with mirror.config_writer() as config:
+                        # Keep every fetch as a pack so transfer sizes stay measurable.
+                        config.set_value("fetch", "unpackLimit", "1")
+            except GitCommandError as e:
+                raise GitCommandError(f"Git mirror fetch failed: {str(e)}")
+            os.utime(path)
+
+        self.evict(keep=path)
+        return path
+
+    def clone(self, repo_url: str, output_path: str, progress: Optional[CloneProgress] = None,
+              **clone_options) -> Repo:
+        """
+        Fetches the mirror for `repo_url` and clones a working copy from it.
+        The local clone hardlinks the mirror's objects, so it costs no network
+        transfer and little disk. The working copy's origin points at `repo_url`.
+
+        Args:
+            repo_url (str): The URL of the Git repository.
+            output_path (str): The directory where the working copy will be created.
+            progress (Optional[CloneProgress]): Receives git's transfer progress for the fetch.
+            **clone_options: Extra git clone options, e.g. `branch` or `single_branch`.
+                Transfer options such as `depth` and `filter` do not apply to local
+                clones and are dropped.
+
+        Returns:
+            Repo: The cloned working copy.
+
+        Raises:
+            GitCommandError: If the fetch or clone fails.
+        """
+        mirror_path = self.fetch(repo_url, progress=progress)
+        local_options = {key: value for key, value in clone_options.items() if key not in ("depth", "filter")}
+        with self._lock_for(mirror_path):
+            os.utime(mirror_path)
+            try:
+                repo = Repo.clone_from(mirror_path, output_path, local=True, **local_options)
+            except GitCommandError as e:
+                raise GitCommandError(f"Git clone operation failed: {str(e)}")
+        repo.remotes.origin.set_url(repo_url)
+        return repo
+
+    def mirrors(self) -> List[Tuple[str, float, int]]:
+        """
+        Lists the mirrors in the cache, least recently used first.
+
+        Returns:
+            List[Tuple[str, float, int]]: (path, last used time, size in bytes) per mirror.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".git") and os.path.isdir(path):
+                entries.append((path, os.path.getmtime(path), directory_size(path)))
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def size(self) -> int:
+        return sum(entry[2] for entry in self.mirrors())
+
+    def evict(self, keep: Optional[str] = None) -> List[str]:
+        """
+        Removes least recently used mirrors until the cache is within its limits.
+
+        Args:
+            keep (Optional[str]): A mirror path that must not be evicted, e.g. the one in use.
+
+        Returns:
+            List[str]: The paths of the evicted mirrors.
+        """
+        entries = self.mirrors()
+        total = sum(entry[2] for entry in entries)
+        count = len(entries)
+        evicted = []
+        for path, _, size in entries:
+            over_bytes = self.max_bytes is not None and total > self.max_bytes
+            over_count = self.max_mirrors is not None and count > self.max_mirrors
+            if not over_bytes and not over_count:
+                break
+            if path == keep:
+                continue
+            with self._lock_for(path):
+                shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            count -= 1
+            evicted.append(path)
+        return evicted
+
+    def _lock_for(self, path: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
@@ -0,0 +1,149 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+progress.py
+
+Transfer accounting for clone and fetch operations.
+"""
+import os
+import re
+
+from git import RemoteProgress
+
+_REMOTE_TOTAL = re.compile(r"^(?:remote: )?Total (\d+)")
+
+
+class CloneStats:
+    """
+    Summary of what a clone or fetch pulled over the wire.
+    """
+
+    def __init__(self, objects_received: int = 0, bytes_received: int = 0, elapsed: float = 0.0):
+        """
+        Initialize the CloneStats object.
+
+        Args:
+            objects_received (int): Number of objects received from the remote.
+            bytes_received (int): Size in bytes of the packfiles received from the remote.
+            elapsed (float): Wall-clock duration of the operation in seconds.
+        """
+        self.objects_received = objects_received
+        self.bytes_received = bytes_received
+        self.elapsed = elapsed
+
+    def as_dict(self) -> dict:
+        """
+        Returns the stats as a plain dictionary, suitable for JSON output.
+
+        Returns:
+            dict: The stats keyed by field name.
+        """
+        return {
+            "objects_received": self.objects_received,
+            "bytes_received": self.bytes_received,
+            "elapsed": round(self.elapsed, 3),
+        }
+
+    def __str__(self) -> str:
+        return (f"{self.objects_received} objects, {self.bytes_received} bytes "
+                f"received in {self.elapsed:.2f}s")
+
+
+class CloneProgress(RemoteProgress):
+    """
+    RemoteProgress handler that counts the objects received by every fetch git
+    performs during a clone, including lazy fetches made by partial clones at checkout.
+
+    The remote's "Total N" line is preferred because git only reports a
+    "Receiving objects" stage when it keeps the pack, not when it unpacks small
+    fetches into loose objects.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._objects_sent = 0
+        self._objects_indexed = 0
+        self._saw_total = False
+
+    @property
+    def objects_received(self) -> int:
+        return self._objects_sent if self._saw_total else self._objects_indexed
+
+    def update(self, op_code: int, cur_count, max_count=None, message: str = "") -> None:
+        """
+        Called by GitPython for every progress line git emits.
+
+        Args:
+            op_code (int): Stage and begin/end flags for the progress line.
+            cur_count: Current item count for the stage.
+            max_count: Total item count for the stage, if known.
+            message (str): Trailing message, e.g. the transfer size and rate.
+
+        Returns:
+            None
+        """
+        if op_code & self.RECEIVING and op_code & self.END:
+            self._objects_indexed += int(cur_count or 0)
+
+    def line_dropped(self, line: str) -> None:
+        """
+        Called by GitPython for lines that are not stage progress.
+
+        Args:
+            line (str): The raw line from git's stderr.
+
+        Returns:
+            None
+        """
+        match = _REMOTE_TOTAL.match(line.strip())
+        if match:
+            self._objects_sent += int(match.group(1))
+            self._saw_total = True
+
+    def stats(self, repo_path: str, elapsed: float) -> CloneStats:
+        """
+        Builds the stats for a finished clone.
+
+        Args:
+            repo_path (str): The path to the cloned repository.
+            elapsed (float): Wall-clock duration of the clone in seconds.
+
+        Returns:
+            CloneStats: The transfer summary.
+        """
+        return CloneStats(objects_received=self.objects_received,
+                          bytes_received=pack_bytes(repo_path),
+                          elapsed=elapsed)
+
+
+def pack_bytes(repo_path: str) -> int:
+    """
+    Sums the size of the packfiles in a repository. Git stores received packs
+    as-is, so for a fresh clone this is the number of bytes transferred.
+
+    Args:
+        repo_path (str): The path to a working copy or a bare repository.
+
+    Returns:
+        int: The total size of all packfiles, or 0 if there are none.
+    """
+    pack_dir = os.path.join(repo_path, ".git", "objects", "pack")
+    if not os.path.isdir(pack_dir):
+        pack_dir = os.path.join(repo_path, "objects", "pack")
+    if not os.path.isdir(pack_dir):
+        return 0
+
+    return sum(os.path.getsize(os.path.join(pack_dir, name))
+               for name in os.listdir(pack_dir) if name.endswith(".pack"))
@@ -0,0 +1,184 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+retry.py
+
+Retries git network operations that fail for transient reasons, with
+exponential backoff and full jitter so that many crawls failing together do
+not retry in lockstep.
+
+Typical usage example:
+
+    policy = RetryPolicy(retries=3)
+    repo = policy.run(lambda: Repo.clone_from(url, path))
+"""
+import itertools
+import random
+import signal
+import time
+from http.client import IncompleteRead
+from typing import Callable, Optional, TypeVar
+from urllib.error import HTTPError, URLError
+
+from git import GitCommandError
+
+from src.archivist.errors.errors import INVALID_RETRIES, INVALID_RETRY_DELAY
+
+T = TypeVar("T")
+
+DEFAULT_RETRIES = 3
+
+# Checked first: these never succeed on a retry.
+PERMANENT_GIT_ERRORS = (
+    "repository not found",
+    "does not appear to be a git repository",
+    "authentication failed",
+    "could not read username",
+    "permission denied",
+    "not found in upstream",
+    "remote branch",
+    "already exists and is not an empty directory",
+    "returned error: 401",
+    "returned error: 403",
+    "returned error: 404",
+)
+
+TRANSIENT_GIT_ERRORS = (
+    "could not resolve host",
+    "temporary failure in name resolution",
+    "couldn't connect to server",
+    "failed to connect",
+    "connection refused",
+    "connection reset",
+    "connection timed out",
+    "operation timed out",
+    "the remote end hung up unexpectedly",
+    "early eof",
+    "unexpected disconnect",
+    "rpc failed",
+    "transfer closed",
+    "index-pack failed",
+    "broken pipe",
+    "gnutls",
+    "ssl_read",
+    "ssl_error",
+    "returned error: 429",
+    "returned error: 5",
+)
+
+_KILLED = (-signal.SIGKILL, -signal.SIGTERM, 128 + signal.SIGKILL, 128 + signal.SIGTERM)
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Classifies a failure as transient (worth retrying) or permanent. Git
+    errors are classified by their stderr; a git process killed by a signal
+    is transient, and unrecognized git errors are permanent. HTTP errors are
+    transient for 429 and 5xx responses and for dropped connections.
+
+    Args:
+        error (BaseException): The failure.
+
+    Returns:
+        bool: True if the operation may succeed when retried.
+    """
+    if isinstance(error, GitCommandError):
+        message = str(error).lower()
+        if any(marker in message for marker in PERMANENT_GIT_ERRORS):
+            return False
+        if any(marker in message for marker in TRANSIENT_GIT_ERRORS):
+            return True
+        return error.status in _KILLED
+    if isinstance(error, HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (ConnectionError, TimeoutError, URLError, IncompleteRead))
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: the wait before retry `n` is drawn
+    uniformly from [0, min(max_delay, base_delay * multiplier ** (n - 1))].
+    """
+
+    def __init__(self, retries: int = DEFAULT_RETRIES, base_delay: float = 1.0, max_delay: float = 60.0,
+                 multiplier: float = 2.0, rng: Optional[random.Random] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Initialize the RetryPolicy object.
+
+        Args:
+            retries (int): The number of retries after the first attempt.
+            base_delay (float): The backoff cap, in seconds, for the first retry.
+            max_delay (float): The largest backoff cap, in seconds.
+            multiplier (float): The growth of the backoff cap per retry.
+            rng (Optional[random.Random]): The source of jitter.
+            sleep (Callable[[float], None]): Waits the given number of seconds.
+
+        Raises:
+            ValueError: If `retries` is negative or a delay setting is invalid.
+        """
+        if not isinstance(retries, int) or isinstance(retries, bool) or retries < 0:
+            raise ValueError(INVALID_RETRIES)
+        if base_delay < 0 or max_delay < 0 or multiplier < 1:
+            raise ValueError(INVALID_RETRY_DELAY)
+
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.rng = rng or random.Random()
+        self.sleep = sleep
+
+    def delay(self, retry: int) -> float:
+        """
+        Draws the wait before a retry.
+
+        Args:
+            retry (int): The 1-based retry number.
+
+        Returns:
+            float: The number of seconds to wait.
+        """
+        cap = min(self.max_delay, self.base_delay * self.multiplier ** (retry - 1))
+        return self.rng.uniform(0, cap)
+
+    def run(self, operation: Callable[[], T],
+            on_retry: Optional[Callable[[int, BaseException, float], None]] = None,
+            transient: Callable[[BaseException], bool] = is_transient) -> T:
+        """
+        Calls `operation` until it succeeds, fails permanently, or runs out of retries.
+
+        Args:
+            operation (Callable[[], T]): The operation to attempt.
+            on_retry (Optional[Callable[[int, BaseException, float], None]]): Called with the
+                retry number, the transient failure and the wait before each retry.
+            transient (Callable[[BaseException], bool]): Classifies a failure as worth retrying.
+
+        Returns:
+            T: The result of the first successful attempt.
+
+        Raises:
+            Exception: The failure of the last attempt, or the first permanent failure.
+        """
+        for retry in itertools.count(1):
+            try:
+                return operation()
+            except Exception as e:
+                if retry > self.retries or not transient(e):
+                    raise
+                delay = self.delay(retry)
+                if on_retry is not None:
+                    on_retry(retry, e, delay)
+                self.sleep(delay)
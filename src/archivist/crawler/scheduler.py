@@ -0,0 +1,333 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+scheduler.py
+
+Runs many crawls through a bounded worker pool.
+
+Typical usage example:
+
+    with CrawlScheduler(max_concurrent=2) as scheduler:
+        summary = scheduler.run([CrawlJob(url, path) for url, path in repos])
+"""
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from src.archivist.crawler.crawler import Crawler
+from src.archivist.errors.errors import INVALID_CONCURRENCY, SCHEDULER_SHUT_DOWN
+
+MAX_CONCURRENT_CRAWLS = 2
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+JOB_STATUSES = (PENDING, RUNNING, SUCCEEDED, FAILED, CANCELLED)
+
+
+class CrawlJob:
+    """
+    A single repository to crawl, and the state of its crawl.
+    """
+
+    def __init__(self, repo_url: str, output_path: str, **crawler_options):
+        """
+        Initialize the CrawlJob object.
+
+        Args:
+            repo_url (str): The URL of the Git repository to clone.
+            output_path (str): The directory where the repository will be cloned.
+            **crawler_options: Extra keyword arguments for `Crawler`, e.g. `branch` or `depth`.
+        """
+        self.repo_url = repo_url
+        self.output_path = output_path
+        self.crawler_options = crawler_options
+        self.job_id: Optional[int] = None
+        self.status = PENDING
+        self.result: Optional[str] = None
+        self.error: Optional[str] = None
+        self.clone_stats = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED, CANCELLED)
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def as_dict(self) -> dict:
+        """
+        Returns the job state as a plain dictionary, suitable for JSON output.
+
+        Returns:
+            dict: The job state keyed by field name.
+        """
+        return {
+            "job_id": self.job_id,
+            "repo_url": self.repo_url,
+            "output_path": self.output_path,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "elapsed": self.elapsed,
+            "clone_stats": self.clone_stats.as_dict() if self.clone_stats else None,
+        }
+
+
+class CrawlSummary:
+    """
+    Aggregated results of a set of crawl jobs.
+    """
+
+    def __init__(self, jobs: List[CrawlJob]):
+        self.jobs = jobs
+
+    def by_status(self, status: str) -> List[CrawlJob]:
+        return [job for job in self.jobs if job.status == status]
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        return {status: len(self.by_status(status)) for status in JOB_STATUSES}
+
+    @property
+    def succeeded(self) -> List[CrawlJob]:
+        return self.by_status(SUCCEEDED)
+
+    @property
+    def failed(self) -> List[CrawlJob]:
+        return self.by_status(FAILED)
+
+    @property
+    def cancelled(self) -> List[CrawlJob]:
+        return self.by_status(CANCELLED)
+
+    def as_dict(self) -> dict:
+        return {
+            "counts": self.counts,
+            "objects_received": sum(job.clone_stats.objects_received for job in self.jobs if job.clone_stats),
+            "bytes_received": sum(job.clone_stats.bytes_received for job in self.jobs if job.clone_stats),
+            "jobs": [job.as_dict() for job in self.jobs],
+        }
+
+    def __str__(self) -> str:
+        return ", ".join(f"{count} {status}" for status, count in self.counts.items() if count)
+
+
+class CrawlScheduler:
+    """
+    Runs crawl jobs on a thread pool with at most `max_concurrent` crawls in
+    flight. Clones spend nearly all their time waiting on the network and disk,
+    so threads are enough to overlap them.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_CRAWLS,
+                 crawler_factory: Callable[..., Crawler] = Crawler):
+        """
+        Initialize the CrawlScheduler object.
+
+        Args:
+            max_concurrent (int): The maximum number of crawls to run at once.
+            crawler_factory (Callable[..., Crawler]): Builds the crawler for a job from its
+                URL, output path and options.
+
+        Raises:
+            ValueError: If `max_concurrent` is not a positive integer.
+        """
+        if not isinstance(max_concurrent, int) or max_concurrent < 1:
+            raise ValueError(INVALID_CONCURRENCY)
+
+        self.max_concurrent = max_concurrent
+        self.crawler_factory = crawler_factory
+        self.jobs: List[CrawlJob] = []
+        self._futures: Dict[int, Future] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="crawl")
+        self._shut_down = False
+
+    def __enter__(self) -> "CrawlScheduler":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.shutdown(cancel_pending=exc_type is not None)
+
+    def submit(self, job: CrawlJob) -> CrawlJob:
+        """
+        Queues a job for crawling.
+
+        Args:
+            job (CrawlJob): The job to run.
+
+        Returns:
+            CrawlJob: The same job, with its `job_id` assigned.
+
+        Raises:
+            RuntimeError: If the scheduler has been shut down.
+        """
+        with self._lock:
+            if self._shut_down:
+                raise RuntimeError(SCHEDULER_SHUT_DOWN)
+            job.job_id = next(self._ids)
+            self.jobs.append(job)
+            self._futures[job.job_id] = self._executor.submit(self._run, job)
+        return job
+
+    def run(self, jobs: Iterable[CrawlJob]) -> CrawlSummary:
+        """
+        Submits every job and waits for all of them to finish.
+
+        Args:
+            jobs (Iterable[CrawlJob]): The jobs to run.
+
+        Returns:
+            CrawlSummary: The results of the submitted jobs.
+        """
+        submitted = [self.submit(job) for job in jobs]
+        wait([self._futures[job.job_id] for job in submitted])
+        return CrawlSummary(submitted)
+
+    def imap(self, jobs: Iterable[CrawlJob], max_pending: Optional[int] = None) -> Iterator[CrawlJob]:
+        """
+        Streams jobs through the pool and yields each one as it finishes, in
+        completion order. At most `max_pending` jobs are submitted but unfinished
+        at any time, so `jobs` is consumed lazily and may be arbitrarily long.
+        Finished jobs are not retained by the scheduler.
+
+        Args:
+            jobs (Iterable[CrawlJob]): The jobs to run.
+            max_pending (Optional[int]): The submission window. Defaults to twice `max_concurrent`.
+
+        Yields:
+            CrawlJob: Each job once it has finished.
+        """
+        max_pending = max_pending or 2 * self.max_concurrent
+        in_flight: Dict[Future, CrawlJob] = {}
+        jobs = iter(jobs)
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_pending:
+                job = next(jobs, None)
+                if job is None:
+                    exhausted = True
+                    break
+                self.submit(job)
+                in_flight[self._futures[job.job_id]] = job
+            if not in_flight:
+                break
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                self._forget(job)
+                yield job
+
+    def cancel(self, job: CrawlJob) -> bool:
+        """
+        Cancels a job. Pending jobs never start. A running clone cannot be
+        interrupted safely, so it is allowed to finish and then marked cancelled.
+
+        Args:
+            job (CrawlJob): The job to cancel.
+
+        Returns:
+            bool: True if the job will not report a result, False if it had already finished.
+        """
+        with self._lock:
+            if job.done:
+                return False
+            job.cancel_requested = True
+            if job.status == PENDING:
+                job.status = CANCELLED
+                self._futures[job.job_id].cancel()
+        return True
+
+    def cancel_all(self) -> int:
+        """
+        Cancels every unfinished job.
+
+        Returns:
+            int: The number of jobs cancelled.
+        """
+        return sum(self.cancel(job) for job in list(self.jobs))
+
+    def wait(self, timeout: Optional[float] = None) -> CrawlSummary:
+        """
+        Waits for every submitted job to finish.
+
+        Args:
+            timeout (Optional[float]): Maximum number of seconds to wait.
+
+        Returns:
+            CrawlSummary: The results of all jobs submitted so far.
+        """
+        wait(list(self._futures.values()), timeout=timeout)
+        return self.summary()
+
+    def summary(self) -> CrawlSummary:
+        with self._lock:
+            return CrawlSummary(list(self.jobs))
+
+    def shutdown(self, cancel_pending: bool = False) -> None:
+        """
+        Stops accepting jobs and waits for running ones to finish.
+
+        Args:
+            cancel_pending (bool): Cancel queued jobs instead of running them.
+
+        Returns:
+            None
+        """
+        if cancel_pending:
+            self.cancel_all()
+        with self._lock:
+            self._shut_down = True
+        self._executor.shutdown(wait=True)
+
+    def _forget(self, job: CrawlJob) -> None:
+        with self._lock:
+            self.jobs.remove(job)
+            self._futures.pop(job.job_id, None)
+
+    def _run(self, job: CrawlJob) -> None:
+        with self._lock:
+            if job.cancel_requested:
+                return
+            job.status = RUNNING
+            job.started_at = time.monotonic()
+
+        status, result, error, crawler = FAILED, None, None, None
+        try:
+            crawler = self.crawler_factory(job.repo_url, job.output_path, **job.crawler_options)
+            result = crawler.execute()
+            status = SUCCEEDED
+        except Exception as e:
+            error = str(e)
+
+        with self._lock:
+            job.finished_at = time.monotonic()
+            job.result = result
+            job.error = error
+            job.clone_stats = getattr(crawler, "clone_stats", None)
+            job.status = CANCELLED if job.cancel_requested else status
@@ -0,0 +1,165 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+blob_index.py
+
+SQLite index of file contents by git blob SHA: every (repo, path, commit)
+where a blob occurs, and whether the blob has been processed. Several
+crawler processes can share one index file.
+
+Typical usage example:
+
+    with BlobIndex("blobs.sqlite") as index:
+        new = index.claim_many([Occurrence(sha, url, path, commit)])
+"""
+import sqlite3
+import time
+from typing import Iterable, List, NamedTuple, Optional
+
+from src.archivist.errors.errors import INVALID_CLAIM_TIMEOUT
+
+DEFAULT_CLAIM_TIMEOUT = 3600.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    claimed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS occurrences (
+    sha TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    path TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    PRIMARY KEY (repo, revision, path)
+);
+CREATE INDEX IF NOT EXISTS occurrences_sha ON occurrences (sha);
+"""
+
+
+class Occurrence(NamedTuple):
+    """
+    One place a blob appears: a path in a repository at a commit.
+    """
+    blob_sha: str
+    repo: str
+    path: str
+    commit: str
+    size: int = 0
+
+
+class BlobIndex:
+    """
+    Records blob occurrences and hands out each blob for processing once.
+    A blob is claimed by the first caller to see it and stays claimed until
+    `mark_done`; a claim not completed within `claim_timeout` seconds, e.g.
+    because its process died, can be claimed again.
+    """
+
+    def __init__(self, db_path: str, claim_timeout: float = DEFAULT_CLAIM_TIMEOUT):
+        """
+        Initialize the BlobIndex object.
+
+        Args:
+            db_path (str): The SQLite database file. Created if missing.
+            claim_timeout (float): Seconds after which an unfinished claim expires.
+
+        Raises:
+            ValueError: If `claim_timeout` is not positive.
+        """
+        if claim_timeout <= 0:
+            raise ValueError(INVALID_CLAIM_TIMEOUT)
+        self.db_path = db_path
+        self.claim_timeout = claim_timeout
+        self._db = sqlite3.connect(db_path, timeout=60)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def __enter__(self) -> "BlobIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def claim_many(self, occurrences: Iterable[Occurrence]) -> List[bool]:
+        """
+        Records occurrences and claims the blobs nobody has processed or is
+        processing, in one transaction.
+
+        Args:
+            occurrences (Iterable[Occurrence]): The occurrences to record.
+
+        Returns:
+            List[bool]: Per occurrence, True if the caller should process the blob.
+            Only the first occurrence of a blob in the call can be True.
+        """
+        now = time.time()
+        claimed = []
+        with self._db:
+            for occurrence in occurrences:
+                self._db.execute("INSERT OR REPLACE INTO occurrences (sha, repo, path, revision) VALUES (?, ?, ?, ?)",
+                                 (occurrence.blob_sha, occurrence.repo, occurrence.path, occurrence.commit))
+                cursor = self._db.execute("INSERT OR IGNORE INTO blobs (sha, size, claimed_at) VALUES (?, ?, ?)",
+                                          (occurrence.blob_sha, occurrence.size, now))
+                if cursor.rowcount == 0:
+                    cursor = self._db.execute("UPDATE blobs SET claimed_at = ? WHERE sha = ? AND done = 0 "
+                                              "AND claimed_at < ?",
+                                              (now, occurrence.blob_sha, now - self.claim_timeout))
+                claimed.append(cursor.rowcount == 1)
+        return claimed
+
+    def mark_done(self, shas: Iterable[str]) -> None:
+        """
+        Marks blobs as processed, so they are never claimed again.
+
+        Args:
+            shas (Iterable[str]): The blob SHAs.
+
+        Returns:
+            None
+        """
+        with self._db:
+            self._db.executemany("UPDATE blobs SET done = 1 WHERE sha = ?", ((sha,) for sha in shas))
+
+    def is_done(self, sha: str) -> bool:
+        row = self._db.execute("SELECT done FROM blobs WHERE sha = ?", (sha,)).fetchone()
+        return bool(row and row[0])
+
+    def occurrences(self, sha: str) -> List[Occurrence]:
+        """
+        Lists every recorded occurrence of a blob.
+
+        Args:
+            sha (str): The blob SHA.
+
+        Returns:
+            List[Occurrence]: The occurrences, ordered by repository, commit and path.
+        """
+        rows = self._db.execute("SELECT o.sha, o.repo, o.path, o.revision, b.size FROM occurrences o "
+                                "JOIN blobs b ON b.sha = o.sha WHERE o.sha = ? ORDER BY o.repo, o.revision, o.path",
+                                (sha,))
+        return [Occurrence(*row) for row in rows]
+
+    def blob_count(self, done: Optional[bool] = None) -> int:
+        if done is None:
+            return self._db.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+        return self._db.execute("SELECT COUNT(*) FROM blobs WHERE done = ?", (int(done),)).fetchone()[0]
+
+    def occurrence_count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM occurrences").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
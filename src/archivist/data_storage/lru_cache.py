@@ -0,0 +1,228 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+lru_cache.py
+
+Base of the on-disk caches that keep their values in one SQLite table and
+evict them least recently used first once the table is larger than
+`max_bytes`, and once they have not been used for `max_age` seconds. The
+running total size is kept by triggers in the same transaction as each
+write, so any number of processes can share one cache file and never
+disagree about it. Lookups only read: the recency of the entries they find
+is written with the next insert, or on close, so a read-heavy workload
+does not take the database's write lock on every lookup.
+
+Typical usage example:
+
+    class PageCache(LRUCache):
+        table = "pages"
+        key_columns = (("url", "TEXT"),)
+"""
+import sqlite3
+import time
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+from src.archivist.errors.errors import INVALID_CACHE_LIMIT
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    {key_definitions},
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY ({keys})
+);
+CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals (id, bytes) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS {table}_added AFTER INSERT ON {table}
+BEGIN
+    UPDATE totals SET bytes = bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS {table}_removed AFTER DELETE ON {table}
+BEGIN
+    UPDATE totals SET bytes = bytes - OLD.size WHERE id = 0;
+END;
+"""
+
+_EVICTION_BATCH = 256
+# SQLite allows at most 999 parameters per statement in older builds.
+_MAX_PARAMETERS = 900
+# Recency updates held in memory before they are written on their own.
+_PENDING_TOUCHES = 4096
+
+
+class LRUCache:
+    """
+    A size- and age-bounded LRU cache of blobs. Subclasses name the table
+    and its key columns, and encode and decode their values; each row also
+    holds the value's size in bytes and when it was last used. `hits` and
+    `misses` count the lookups made through this object.
+    """
+
+    table = "entries"
+    key_columns: Tuple[Tuple[str, str], ...] = ()
+
+    def __init__(self, db_path: str, max_bytes: Optional[int], max_age: Optional[float] = None):
+        """
+        Initialize the LRUCache object.
+
+        Args:
+            db_path (str): The SQLite database file. Created if missing.
+            max_bytes (Optional[int]): Evict entries once their values take more than this.
+            max_age (Optional[float]): Evict entries not used for this many seconds.
+
+        Raises:
+            ValueError: If `max_bytes` is not a positive integer or `max_age` is not positive.
+        """
+        if max_bytes is not None and (not isinstance(max_bytes, int) or max_bytes < 1):
+            raise ValueError(INVALID_CACHE_LIMIT)
+        if max_age is not None and max_age <= 0:
+            raise ValueError(INVALID_CACHE_LIMIT)
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._keys = ", ".join(name for name, _ in self.key_columns)
+        self._key_match = " AND ".join(f"{name} = ?" for name, _ in self.key_columns)
+        self._touched: Dict[tuple, float] = {}
+        self._db = sqlite3.connect(db_path, timeout=60)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA.format(
+            table=self.table, keys=self._keys,
+            key_definitions=",\n    ".join(f"{name} {kind} NOT NULL" for name, kind in self.key_columns)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._db.execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def flush(self) -> None:
+        """Writes the pending recency updates, e.g. before a long-lived connection goes idle."""
+        if self._touched:
+            with self._db:
+                self._flush_touches()
+
+    def close(self) -> None:
+        self.flush()
+        self._db.close()
+
+    def _select(self, keys: Sequence[tuple]) -> Dict[tuple, bytes]:
+        """
+        Looks up entries with one indexed query per batch of keys.
+
+        Args:
+            keys (Sequence[tuple]): The value of each key column of each entry. Should not repeat.
+
+        Returns:
+            Dict[tuple, bytes]: The encoded value of each entry found, by key.
+        """
+        width = len(self.key_columns)
+        names = [name for name, _ in self.key_columns]
+        step = _MAX_PARAMETERS // width
+        row = f"({', '.join('?' * width)})"
+        found = {}
+        for start in range(0, len(keys), step):
+            batch = keys[start:start + step]
+            # CROSS JOIN keeps the key list as the outer loop, so each key is one primary key search.
+            query = (f"WITH wanted ({self._keys}) AS (VALUES {', '.join([row] * len(batch))}) "
+                     f"SELECT {', '.join(f'wanted.{name}' for name in names)}, {self.table}.value "
+                     f"FROM wanted CROSS JOIN {self.table} ON "
+                     + " AND ".join(f"{self.table}.{name} = wanted.{name}" for name in names))
+            for result in self._db.execute(query, [part for key in batch for part in key]):
+                found[tuple(result[:width])] = result[width]
+        return found
+
+    def _touch(self, keys: Iterable[tuple]) -> None:
+        """
+        Marks entries as recently used. The update is held in memory and
+        written with the next insert, on flush or close, or once enough are
+        pending.
+
+        Args:
+            keys (Iterable[tuple]): The value of each key column of each entry.
+
+        Returns:
+            None
+        """
+        now = time.time()
+        self._touched.update((key, now) for key in keys)
+        if len(self._touched) >= _PENDING_TOUCHES:
+            with self._db:
+                self._flush_touches()
+
+    def _flush_touches(self) -> None:
+        self._db.executemany(f"UPDATE {self.table} SET last_used = ? WHERE {self._key_match}",
+                             ((used, *key) for key, used in self._touched.items()))
+        self._touched.clear()
+
+    def _insert(self, rows: Iterable[Tuple[tuple, bytes]]) -> None:
+        """
+        Stores values in one transaction, then evicts expired and least
+        recently used entries. A value already stored, e.g. by another
+        process, is kept.
+
+        Args:
+            rows (Iterable[Tuple[tuple, bytes]]): The key and encoded value of each entry.
+
+        Returns:
+            None
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        now = time.time()
+        placeholders = ", ".join("?" * (len(self.key_columns) + 3))
+        with self._db:
+            self._db.executemany(f"INSERT OR IGNORE INTO {self.table} ({self._keys}, value, size, last_used) "
+                                 f"VALUES ({placeholders})",
+                                 ((*key, value, self._size(key, value), now) for key, value in rows))
+            self._flush_touches()
+            self._evict(now)
+
+    def _size(self, key: tuple, value: bytes) -> int:
+        """The bytes an entry counts against `max_bytes`. Defaults to the size of its value."""
+        return len(value)
+
+    def _evict(self, now: float) -> None:
+        if self.max_age is not None:
+            self._db.execute(f"DELETE FROM {self.table} WHERE last_used < ?", (now - self.max_age,))
+        if self.max_bytes is None:
+            return
+        excess = self.total_bytes - self.max_bytes
+        while excess > 0:
+            rows = self._db.execute(f"SELECT rowid, size FROM {self.table} ORDER BY last_used LIMIT ?",
+                                    (_EVICTION_BATCH,)).fetchall()
+            if not rows:
+                break
+            evicted = []
+            for rowid, size in rows:
+                if excess <= 0:
+                    break
+                evicted.append((rowid,))
+                excess -= size
+            self._db.executemany(f"DELETE FROM {self.table} WHERE rowid = ?", evicted)
@@ -0,0 +1,109 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+parse_cache.py
+
+SQLite cache of parse results keyed by parser and git blob SHA, so a file
+whose contents have not changed is never parsed twice, across runs and
+across the worker processes of one run.
+
+Typical usage example:
+
+    with ParseCache("parses.sqlite") as cache:
+        cached = cache.get_many("python:1", shas)
+"""
+import json
+import sqlite3
+from typing import Any, Dict, Iterable, Tuple
+
+# SQLite allows at most 999 parameters per statement in older builds, one of them the parser key.
+_MAX_SHAS = 900
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS parses (
+    parser TEXT NOT NULL,
+    sha TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (parser, sha)
+);
+"""
+
+
+class ParseCache:
+    """
+    Stores one JSON-serializable parse result per (parser, blob SHA). The
+    parser key should change whenever the parser's output does, so stale
+    results are never read back.
+    """
+
+    def __init__(self, db_path: str = ":memory:"):
+        """
+        Initialize the ParseCache object.
+
+        Args:
+            db_path (str): The SQLite database file, created if missing. Defaults to a
+                cache held in memory for the life of the object.
+        """
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, timeout=60)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def __enter__(self) -> "ParseCache":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def get_many(self, parser: str, shas: Iterable[str]) -> Dict[str, Any]:
+        """
+        Looks up cached results with one indexed query per batch of SHAs.
+
+        Args:
+            parser (str): The parser key.
+            shas (Iterable[str]): The blob SHAs.
+
+        Returns:
+            Dict[str, Any]: The cached result of each SHA found; missing SHAs are left out.
+        """
+        shas = list(set(shas))
+        found = {}
+        for start in range(0, len(shas), _MAX_SHAS):
+            batch = shas[start:start + _MAX_SHAS]
+            query = f"SELECT sha, result FROM parses WHERE parser = ? AND sha IN ({', '.join('?' * len(batch))})"
+            for sha, result in self._db.execute(query, (parser, *batch)):
+                found[sha] = json.loads(result)
+        return found
+
+    def put_many(self, parser: str, results: Iterable[Tuple[str, Any]]) -> None:
+        """
+        Stores results in one transaction, replacing any cached for the same SHA.
+
+        Args:
+            parser (str): The parser key.
+            results (Iterable[Tuple[str, Any]]): The blob SHA and JSON-serializable result of each parse.
+
+        Returns:
+            None
+        """
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO parses (parser, sha, result) VALUES (?, ?, ?)",
+                                 ((parser, sha, json.dumps(result)) for sha, result in results))
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM parses").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
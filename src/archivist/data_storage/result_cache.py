@@ -0,0 +1,105 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+result_cache.py
+
+On-disk cache of preprocessing results keyed by (blob SHA, configuration
+hash, code version), so re-indexing a repository only preprocesses the
+files that changed. Values are JSON, stored zlib-compressed in SQLite;
+entries are evicted least recently used first once the cache is larger
+than `max_bytes`. Any number of processes can share one cache file.
+
+Typical usage example:
+
+    with ResultCache("results.sqlite", max_bytes=1 << 30) as cache:
+        found = cache.get_many([(sha, config)])
+"""
+import json
+import zlib
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from src.archivist import __version__
+from src.archivist.data_storage.lru_cache import LRUCache
+
+DEFAULT_RESULT_CACHE_BYTES = 1 << 30
+
+
+class ResultCache(LRUCache):
+    """
+    A size-bounded LRU cache of JSON values. Entries written by another code
+    version or for another configuration are never read, so a version bump
+    or a configuration change misses only the entries it affects; the stale
+    ones age out through eviction.
+    """
+
+    table = "entries"
+    key_columns = (("sha", "TEXT"), ("config", "TEXT"), ("version", "TEXT"))
+
+    def __init__(self, db_path: str, max_bytes: Optional[int] = DEFAULT_RESULT_CACHE_BYTES,
+                 version: str = __version__):
+        """
+        Initialize the ResultCache object.
+
+        Args:
+            db_path (str): The SQLite database file. Created if missing.
+            max_bytes (Optional[int]): Evict entries once their compressed values take more than this.
+            version (str): The code version entries are read and written for.
+
+        Raises:
+            ValueError: If `max_bytes` is not a positive integer.
+        """
+        super().__init__(db_path, max_bytes)
+        self.version = version
+
+    def __enter__(self) -> "ResultCache":
+        return self
+
+    def get(self, sha: str, config: str) -> Optional[Any]:
+        return self.get_many([(sha, config)]).get((sha, config))
+
+    def get_many(self, keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Any]:
+        """
+        Looks up values and marks the ones found as recently used.
+
+        Args:
+            keys (Iterable[Tuple[str, str]]): The blob SHA and configuration hash of each value.
+
+        Returns:
+            Dict[Tuple[str, str], Any]: The values found, by key.
+        """
+        wanted = [(sha, config, self.version) for sha, config in dict.fromkeys(keys)]
+        rows = self._select(wanted)
+        self.hits += len(rows)
+        self.misses += len(wanted) - len(rows)
+        self._touch(rows)
+        found = {(sha, config): json.loads(zlib.decompress(value)) for (sha, config, _), value in rows.items()}
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, str, Any]]) -> None:
+        """
+        Stores values in one transaction, then evicts the least recently used
+        entries if the cache is over its size limit. A value already stored,
+        e.g. by another process, is kept.
+
+        Args:
+            items (Iterable[Tuple[str, str, Any]]): The blob SHA, configuration hash and
+                JSON-serializable value of each entry.
+
+        Returns:
+            None
+        """
+        self._insert(((sha, config, self.version),
+                      zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8")))
+                     for sha, config, value in items)
@@ -0,0 +1,124 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+backends.py
+
+The interface every embedding model is run through, and a hashing backend
+that needs no model. Backends for local transformer models and for remote
+APIs live in `transformer.py` and `remote.py`, so their dependencies are
+only imported when they are used.
+
+Typical usage example:
+
+    backend = HashingBackend(dimension=256)
+    vectors = backend.embed(["def main():", "SELECT 1"])
+"""
+from typing import List, Sequence
+
+import numpy as np
+
+from src.archivist.errors.errors import INVALID_DIMENSION
+from src.archivist.preprocessor.minhash import shingles
+
+DEFAULT_HASHING_DIMENSION = 256
+
+_SIGN_BIT = np.uint64(31)
+
+
+class EmbeddingBackend:
+    """
+    Turns batches of texts into vectors. Subclass it to run another model
+    behind `EmbeddingEngine`. `name`, `revision` and `dimension` identify
+    the vectors a backend produces: change `revision` whenever the same
+    text would get a different vector, so stored vectors are not mixed up.
+    Texts longer than `max_tokens` are truncated by the backend.
+    """
+    name = "backend"
+    revision = "1"
+    dimension = 0
+    max_tokens = 512
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.revision}:{self.dimension}"
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        """
+        Counts the tokens the backend would see for each text, after
+        truncation, to size batches. The default estimates four bytes of
+        UTF-8 per token; backends with a tokenizer should count exactly.
+
+        Args:
+            texts (Sequence[str]): The texts.
+
+        Returns:
+            List[int]: The token count of each text, at least 1.
+        """
+        return [min(max(len(text.encode("utf-8")) // 4, 1), self.max_tokens) for text in texts]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embeds a batch of texts.
+
+        Args:
+            texts (Sequence[str]): The texts.
+
+        Returns:
+            np.ndarray: A float32 array of shape (len(texts), dimension).
+        """
+        raise NotImplementedError
+
+
+class HashingBackend(EmbeddingBackend):
+    """
+    A deterministic stand-in for a model: each byte shingle of a text, as
+    hashed by `minhash.shingles`, adds +1 or -1 to one dimension picked by
+    its hash, and the vector is scaled to unit length. Texts sharing many
+    shingles get similar vectors, which is enough to test batching, storage
+    and search offline with no model download.
+    """
+    name = "hashing"
+    revision = "1"
+    max_tokens = 1 << 20
+
+    def __init__(self, dimension: int = DEFAULT_HASHING_DIMENSION, seed: int = 0):
+        """
+        Initialize the HashingBackend object.
+
+        Args:
+            dimension (int): The length of each vector.
+            seed (int): Selects a different hash, and so different vectors.
+
+        Raises:
+            ValueError: If `dimension` is not a positive integer.
+        """
+        if not isinstance(dimension, int) or dimension < 1:
+            raise ValueError(INVALID_DIMENSION)
+        self.dimension = dimension
+        self.seed = seed
+        self.revision = f"1-{seed}"
+        self._mix = np.uint64((0x2545F4914F6CDD1D + 2 * seed) % (1 << 64))
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        per_text = [shingles(text) for text in texts]
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), [len(hashes) for hashes in per_text])
+        hashes = np.concatenate(per_text) if per_text else np.zeros(0, dtype=np.uint64)
+        hashes = (hashes * self._mix) >> np.uint64(32)
+        buckets = rows * self.dimension + (hashes % np.uint64(self.dimension)).astype(np.int64)
+        signs = 1.0 - 2.0 * ((hashes >> _SIGN_BIT) & np.uint64(1)).astype(np.float64)
+        vectors = np.bincount(buckets, signs, minlength=len(texts) * self.dimension)
+        vectors = vectors.reshape(len(texts), self.dimension)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
@@ -0,0 +1,137 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+cache.py
+
+On-disk cache of embeddings keyed by a hash of the chunk text and the
+identity of the model (name, revision and dimension), so re-crawling a
+repository only embeds the chunks that changed. Vectors are stored as raw
+float32 bytes in SQLite, with 16-byte keys; entries are evicted least
+recently used first once the cache is larger than `max_bytes`, and once
+they have not been used for `max_age` seconds. Any number of processes can
+share one cache file.
+
+Typical usage example:
+
+    with EmbeddingCache("embeddings.sqlite", backend) as cache:
+        hashes = [text_hash(chunk.text) for chunk in chunks]
+        found = cache.get_many(hashes)
+"""
+import hashlib
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.archivist.data_storage.lru_cache import LRUCache
+from src.archivist.embeddings.backends import EmbeddingBackend
+from src.archivist.errors.errors import EMBEDDING_DIMENSION_MISMATCH
+
+DEFAULT_EMBEDDING_CACHE_BYTES = 4 << 30
+
+
+def text_hash(text: str) -> bytes:
+    """
+    Hashes the text of a chunk for use as a cache key. The text is expected
+    to be normalized already, as the preprocessor leaves it.
+
+    Args:
+        text (str): The chunk text.
+
+    Returns:
+        bytes: A 16-byte BLAKE2b digest of the UTF-8 text.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache(LRUCache):
+    """
+    A size- and age-bounded LRU cache of the vectors of one model. Vectors of
+    other models, revisions or dimensions share the file but are never read,
+    so switching models misses only until the new model's vectors are in;
+    the old ones age out through eviction.
+    """
+
+    table = "vectors"
+    key_columns = (("hash", "BLOB"), ("model", "TEXT"), ("revision", "TEXT"), ("dimension", "INTEGER"))
+
+    def __init__(self, db_path: str, backend: EmbeddingBackend,
+                 max_bytes: Optional[int] = DEFAULT_EMBEDDING_CACHE_BYTES, max_age: Optional[float] = None):
+        """
+        Initialize the EmbeddingCache object.
+
+        Args:
+            db_path (str): The SQLite database file. Created if missing.
+            backend (EmbeddingBackend): The model whose vectors are read and written.
+            max_bytes (Optional[int]): Evict entries once their vectors take more than this.
+            max_age (Optional[float]): Evict entries not used for this many seconds.
+
+        Raises:
+            ValueError: If `max_bytes` is not a positive integer or `max_age` is not positive.
+        """
+        super().__init__(db_path, max_bytes, max_age)
+        self.model = backend.name
+        self.revision = backend.revision
+        self.dimension = backend.dimension
+
+    def __enter__(self) -> "EmbeddingCache":
+        return self
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        """
+        Looks up the vectors of a batch of chunks and marks the ones found
+        as recently used.
+
+        Args:
+            keys (Sequence[bytes]): The `text_hash` of each chunk. Repeated keys are looked up once.
+
+        Returns:
+            Dict[bytes, np.ndarray]: The float32 vectors found, by key.
+        """
+        wanted = [(key, self.model, self.revision, self.dimension) for key in dict.fromkeys(keys)]
+        rows = self._select(wanted)
+        self.hits += len(rows)
+        self.misses += len(wanted) - len(rows)
+        self._touch(rows)
+        found = {key[0]: np.frombuffer(value, dtype=np.float32) for key, value in rows.items()}
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, np.ndarray]]) -> None:
+        """
+        Stores vectors in one transaction, then evicts expired and least
+        recently used entries. A vector already stored, e.g. by another
+        process, is kept.
+
+        Args:
+            items (Iterable[Tuple[bytes, np.ndarray]]): The `text_hash` and vector of each chunk.
+
+        Returns:
+            None
+
+        Raises:
+            ValueError: If a vector does not have the model's dimension.
+        """
+        rows = []
+        for key, vector in items:
+            vector = np.asarray(vector, dtype=np.float32)
+            if vector.shape != (self.dimension,):
+                raise ValueError(EMBEDDING_DIMENSION_MISMATCH)
+            rows.append(((key, self.model, self.revision, self.dimension), vector.tobytes()))
+        self._insert(rows)
+
+    def _size(self, key: tuple, value: bytes) -> int:
+        return len(key[0]) + len(value)
@@ -0,0 +1,500 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+engine.py
+
+Embeds chunks in batches sized by token count. Chunks are gathered into a
+sort window, sorted by length so that texts padded to the same length are
+about as long, and cut into batches whose padded size stays under a token
+budget. Inference runs on a background thread while the next window is
+counted and sorted, and vectors come back in input order.
+
+On CPU-only machines one model process either oversubscribes the cores with
+its thread pools or leaves them idle. An `EmbeddingWorkerPool` instead runs
+several replicas of the model in worker processes with a fixed number of
+threads each, fed from one shared queue of batches.
+
+Typical usage example:
+
+    with EmbeddingEngine(HashingBackend(), max_batch_tokens=16384) as engine:
+        for chunk, vector in engine.embed_chunks(chunks):
+            store(chunk, vector)
+        print(engine.stats.as_dict())
+
+    factory = functools.partial(TransformerBackend, "sentence-transformers/all-MiniLM-L6-v2")
+    with EmbeddingWorkerPool(factory, workers=8, threads=4) as pool:
+        engine = EmbeddingEngine(factory(), pool=pool, max_in_flight=4)
+        vectors = engine.embed(texts)
+        print(pool.as_dict())
+"""
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, InvalidStateError, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+from src.archivist.embeddings.backends import EmbeddingBackend
+from src.archivist.embeddings.cache import EmbeddingCache, text_hash
+from src.archivist.errors.errors import INVALID_EMBEDDING_BATCH, EMBEDDING_CACHE_MISMATCH, INVALID_WORKERS
+
+T = TypeVar("T")
+
+DEFAULT_MAX_BATCH_TOKENS = 16384
+DEFAULT_MAX_BATCH_SIZE = 128
+DEFAULT_SORT_WINDOW = 2048
+DEFAULT_MAX_IN_FLIGHT = 2
+
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS",
+                    "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+_worker_backend: Optional[EmbeddingBackend] = None
+
+
+class EmbeddingStats:
+    """
+    Counters for the embedding done by one engine. `padded_tokens` counts
+    every text as long as the longest in its batch, which is what a model
+    computes on; `elapsed` is the time spent in the backend. Texts served
+    from the cache, or repeating a text of the same sort window, are not
+    embedded again.
+    """
+
+    def __init__(self, texts: int = 0, batches: int = 0, tokens: int = 0, padded_tokens: int = 0,
+                 elapsed: float = 0.0, cache_hits: int = 0, cache_misses: int = 0):
+        """
+        Initialize the EmbeddingStats object.
+
+        Args:
+            texts (int): Number of texts embedded.
+            batches (int): Number of batches run through the backend.
+            tokens (int): Number of tokens embedded.
+            padded_tokens (int): Number of tokens including padding.
+            elapsed (float): Seconds spent in the backend.
+            cache_hits (int): Number of texts whose vector was found in the cache.
+            cache_misses (int): Number of texts looked up in the cache and not found.
+        """
+        self.texts = texts
+        self.batches = batches
+        self.tokens = tokens
+        self.padded_tokens = padded_tokens
+        self.elapsed = elapsed
+        self.cache_hits = cache_hits
+        self.cache_misses = cache_misses
+
+    def add(self, texts: int, tokens: int, padded_tokens: int, elapsed: float) -> None:
+        self.texts += texts
+        self.batches += 1
+        self.tokens += tokens
+        self.padded_tokens += padded_tokens
+        self.elapsed += elapsed
+
+    def as_dict(self) -> dict:
+        """
+        Returns the stats as a plain dictionary, suitable for JSON output.
+
+        Returns:
+            dict: The stats keyed by field name, with throughput and the share of
+                computed tokens that were not padding.
+        """
+        return {
+            "texts": self.texts,
+            "batches": self.batches,
+            "tokens": self.tokens,
+            "padded_tokens": self.padded_tokens,
+            "elapsed": round(self.elapsed, 3),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "texts_per_second": round(self.texts / self.elapsed, 1) if self.elapsed else 0.0,
+            "padding_efficiency": round(self.tokens / self.padded_tokens, 3) if self.padded_tokens else 1.0,
+        }
+
+
+class _Batch:
+    # A batch of one window: positions in the window, submitted to the backend.
+
+    def __init__(self, indices: List[int], tokens: int, padded_tokens: int, future: Future):
+        self.indices = indices
+        self.tokens = tokens
+        self.padded_tokens = padded_tokens
+        self.future = future
+
+
+class _Window:
+    # A sort window: its items, the vectors found in the cache, the batches
+    # submitted for the rest, and the items repeating an earlier one.
+
+    def __init__(self, items: list, dimension: int):
+        self.items = items
+        self.vectors = np.zeros((len(items), dimension), dtype=np.float32)
+        self.hashes: Optional[List[bytes]] = None
+        self.batches: List[_Batch] = []
+        self.repeats: List[Tuple[int, int]] = []
+
+
+class EmbeddingEngine:
+    """
+    Runs an `EmbeddingBackend` over a stream of texts with dynamic batching.
+    The batches of at most `max_in_flight` sort windows are submitted and not
+    yet collected, so a slow backend holds back reading rather than letting
+    batches pile up. With a cache, vectors already computed for the same
+    text and model are reused without running the model, and new vectors
+    are stored as each window is collected.
+    """
+
+    def __init__(self, backend: EmbeddingBackend, max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, sort_window: int = DEFAULT_SORT_WINDOW,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, cache: Optional[EmbeddingCache] = None,
+                 pool: Optional["EmbeddingWorkerPool"] = None):
+        """
+        Initialize the EmbeddingEngine object.
+
+        Args:
+            backend (EmbeddingBackend): The model to run.
+            max_batch_tokens (int): The most tokens in a batch, counting padding. A text
+                longer than this gets a batch of its own.
+            max_batch_size (int): The most texts in a batch.
+            sort_window (int): The number of texts sorted by length together. Larger
+                windows waste less padding but hold more texts in memory.
+            max_in_flight (int): The most sort windows submitted to the backend and not yet collected.
+            cache (Optional[EmbeddingCache]): Reuses and stores vectors. Must be opened for `backend`.
+            pool (Optional[EmbeddingWorkerPool]): Runs the batches on the pool's replicas of the model
+                instead of a background thread. `backend` must be the same model; it is then only
+                used to count tokens and to identify the model. The engine does not close the pool.
+
+        Raises:
+            ValueError: If a limit is not a positive integer, or the cache is for another model.
+        """
+        for limit in (max_batch_tokens, max_batch_size, sort_window, max_in_flight):
+            if not isinstance(limit, int) or limit < 1:
+                raise ValueError(INVALID_EMBEDDING_BATCH)
+        self.backend = backend
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.sort_window = sort_window
+        if cache is not None and (cache.model, cache.revision, cache.dimension) != \
+                (backend.name, backend.revision, backend.dimension):
+            raise ValueError(EMBEDDING_CACHE_MISMATCH)
+        self.max_in_flight = max_in_flight
+        self.cache = cache
+        self.pool = pool
+        self.stats = EmbeddingStats()
+        self._executor: Optional[Executor] = None
+
+    def __enter__(self) -> "EmbeddingEngine":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def dimension(self) -> int:
+        return self.backend.dimension
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Embeds texts.
+
+        Args:
+            texts (Sequence[str]): The texts.
+
+        Returns:
+            np.ndarray: A float32 array of shape (len(texts), dimension), in input order.
+        """
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, (_, vector) in enumerate(self.embed_chunks(_Text(text) for text in texts)):
+            vectors[i] = vector
+        return vectors
+
+    def embed_chunks(self, chunks: Iterable[T]) -> Iterator[Tuple[T, np.ndarray]]:
+        """
+        Embeds chunks. The token count a token chunker recorded on a chunk is
+        used instead of counting again.
+
+        Args:
+            chunks (Iterable[T]): `Chunk`s, or anything with `text` and `token_count`
+                attributes, consumed lazily.
+
+        Yields:
+            Tuple[T, np.ndarray]: Each chunk and its vector, in input order.
+        """
+        if self._executor is None and self.pool is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        in_flight: Deque[_Window] = deque()
+        try:
+            for items in _windows(chunks, self.sort_window):
+                if len(in_flight) == self.max_in_flight:
+                    yield from self._collect(in_flight.popleft())
+                in_flight.append(self._submit_window(items))
+            while in_flight:
+                yield from self._collect(in_flight.popleft())
+        finally:
+            for window in in_flight:
+                for batch in window.batches:
+                    batch.future.cancel()
+
+    def plan(self, lengths: Sequence[int]) -> List[List[int]]:
+        """
+        Cuts texts into batches, longest first, so that no batch exceeds
+        `max_batch_size` texts or `max_batch_tokens` tokens once every text
+        is padded to the longest in its batch.
+
+        Args:
+            lengths (Sequence[int]): The token count of each text.
+
+        Returns:
+            List[List[int]]: The positions of the texts in each batch.
+        """
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        for i in sorted(range(len(lengths)), key=lengths.__getitem__, reverse=True):
+            if batch and (len(batch) == self.max_batch_size
+                          or (len(batch) + 1) * lengths[batch[0]] > self.max_batch_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _submit_window(self, items: List[T]) -> _Window:
+        window = _Window(items, self.dimension)
+        texts = [item.text for item in items]
+        todo = list(range(len(items)))
+        if self.cache is not None:
+            window.hashes = [text_hash(text) for text in texts]
+            found = self.cache.get_many(window.hashes)
+            first: Dict[bytes, int] = {}
+            todo = []
+            for i, key in enumerate(window.hashes):
+                if key in found:
+                    window.vectors[i] = found[key]
+                elif key in first:
+                    window.repeats.append((i, first[key]))
+                else:
+                    first[key] = i
+                    todo.append(i)
+            self.stats.cache_misses += len(todo) + len(window.repeats)
+            self.stats.cache_hits += len(items) - len(todo) - len(window.repeats)
+        lengths = self._lengths([items[i] for i in todo], [texts[i] for i in todo])
+        for positions in self.plan(lengths):
+            indices = [todo[i] for i in positions]
+            tokens, padded_tokens = sum(lengths[i] for i in positions), len(positions) * lengths[positions[0]]
+            future = self._submit([texts[i] for i in indices], tokens, padded_tokens)
+            window.batches.append(_Batch(indices, tokens, padded_tokens, future))
+        return window
+
+    def _submit(self, texts: List[str], tokens: int, padded_tokens: int) -> Future:
+        if self.pool is not None:
+            return self.pool.submit(texts, tokens, padded_tokens)
+        return self._executor.submit(_timed_embed, self.backend, texts)
+
+    def _lengths(self, window: List[T], texts: List[str]) -> List[int]:
+        lengths = [getattr(chunk, "token_count", None) for chunk in window]
+        missing = [i for i, length in enumerate(lengths) if length is None]
+        for i, length in zip(missing, self.backend.count_tokens([texts[i] for i in missing])):
+            lengths[i] = length
+        return [min(max(length, 1), self.backend.max_tokens) for length in lengths]
+
+    def _collect(self, window: _Window) -> Iterator[Tuple[T, np.ndarray]]:
+        for batch in window.batches:
+            batch_vectors, elapsed = batch.future.result()
+            window.vectors[batch.indices] = batch_vectors
+            self.stats.add(len(batch.indices), batch.tokens, batch.padded_tokens, elapsed)
+        for i, first in window.repeats:
+            window.vectors[i] = window.vectors[first]
+        if self.cache is not None and window.batches:
+            self.cache.put_many((window.hashes[i], window.vectors[i])
+                                for batch in window.batches for i in batch.indices)
+        return zip(window.items, window.vectors)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+class _Text(NamedTuple):
+    text: str
+    token_count: Optional[int] = None
+
+
+def _windows(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    window: List[T] = []
+    for item in items:
+        window.append(item)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def _timed_embed(backend: EmbeddingBackend, texts: List[str]) -> Tuple[np.ndarray, float]:
+    started = time.perf_counter()
+    vectors = np.asarray(backend.embed(texts), dtype=np.float32)
+    return vectors, time.perf_counter() - started
+
+
+def limit_threads(threads: int) -> None:
+    """
+    Caps the native thread pools of this process at `threads` threads: the
+    BLAS and OpenMP pools already loaded, those of libraries loaded later
+    (through their environment variables), and torch's intra-op pool if
+    torch has been imported. Torch's inter-op pool gets a single thread.
+
+    Args:
+        threads (int): The most threads per pool.
+    """
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    threadpool_limits(limits=threads)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # It can only be set before the first inter-op parallel work.
+            pass
+
+
+class EmbeddingWorkerPool:
+    """
+    Replicas of one model in `workers` processes, each limited to `threads`
+    threads, pulling batches from one shared queue so that an idle worker
+    always takes the next batch. Set `workers * threads` to the number of
+    cores: e.g. 8 workers of 4 threads on a 32-core machine. Fewer, wider
+    workers hold fewer copies of the model; more, narrower ones lose less to
+    synchronization inside each forward pass.
+
+    Workers are spawned rather than forked, so they do not inherit thread
+    pools the parent has started, which are unusable after a fork. Each
+    builds its replica with `backend_factory` when it starts. Throughput is
+    recorded per worker in `worker_stats`, keyed by process ID.
+    """
+
+    def __init__(self, backend_factory: Callable[[], EmbeddingBackend], workers: Optional[int] = None,
+                 threads: int = 1):
+        """
+        Initialize the EmbeddingWorkerPool object. Worker processes are started
+        as batches arrive.
+
+        Args:
+            backend_factory (Callable[[], EmbeddingBackend]): Builds the model in each worker. Must
+                be picklable, e.g. a backend class or a `functools.partial` of one.
+            workers (Optional[int]): The number of worker processes. Defaults to the CPU count
+                divided by `threads`.
+            threads (int): The number of threads each worker's model runs on.
+
+        Raises:
+            ValueError: If `workers` or `threads` is not a positive integer.
+        """
+        if not isinstance(threads, int) or threads < 1:
+            raise ValueError(INVALID_WORKERS)
+        workers = workers if workers is not None else max((os.cpu_count() or 1) // threads, 1)
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError(INVALID_WORKERS)
+        self.workers = workers
+        self.threads = threads
+        self.worker_stats: Dict[int, EmbeddingStats] = {}
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_start_worker, initargs=(backend_factory, threads))
+
+    def __enter__(self) -> "EmbeddingWorkerPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def submit(self, texts: List[str], tokens: int = 0, padded_tokens: int = 0) -> Future:
+        """
+        Queues a batch for the next free worker.
+
+        Args:
+            texts (List[str]): The batch.
+            tokens (int): The token count of the batch, for the worker's stats.
+            padded_tokens (int): The token count including padding, for the worker's stats.
+
+        Returns:
+            Future: Resolves to the float32 vectors of the batch and the seconds the worker's
+                model took. Cancelling it cancels the batch if no worker has taken it yet.
+        """
+        result: Future = Future()
+        queued = self._executor.submit(_embed_in_worker, texts)
+        result.add_done_callback(lambda future: queued.cancel() if future.cancelled() else None)
+
+        def done(future: Future) -> None:
+            if future.cancelled():
+                result.cancel()
+                return
+            try:
+                vectors, elapsed, worker = future.result()
+            except BaseException as e:
+                _resolve(result, e)
+                return
+            with self._lock:
+                self.worker_stats.setdefault(worker, EmbeddingStats()).add(len(texts), tokens, padded_tokens,
+                                                                           elapsed)
+            _resolve(result, (vectors, elapsed))
+
+        queued.add_done_callback(done)
+        return result
+
+    def as_dict(self) -> dict:
+        """
+        Returns the pool's settings and each worker's stats, suitable for JSON output.
+
+        Returns:
+            dict: The number of workers and threads, and the stats of each worker that has
+                embedded a batch, keyed by process ID.
+        """
+        with self._lock:
+            workers = {str(pid): stats.as_dict() for pid, stats in sorted(self.worker_stats.items())}
+        return {"workers": self.workers, "threads": self.threads, "worker_stats": workers}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _start_worker(backend_factory: Callable[[], EmbeddingBackend], threads: int) -> None:
+    global _worker_backend
+    # Limit once before the model is built, so libraries it loads start with
+    # small pools, and again after, for pools they configure when imported.
+    limit_threads(threads)
+    _worker_backend = backend_factory()
+    limit_threads(threads)
+
+
+def _embed_in_worker(texts: List[str]) -> Tuple[np.ndarray, float, int]:
+    vectors, elapsed = _timed_embed(_worker_backend, texts)
+    return vectors, elapsed, os.getpid()
+
+
+def _resolve(future: Future, outcome) -> None:
+    try:
+        if isinstance(outcome, BaseException):
+            future.set_exception(outcome)
+        else:
+            future.set_result(outcome)
+    except InvalidStateError:
+        # Cancelled by the caller while a worker was embedding it.
+        pass
@@ -0,0 +1,134 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+faiss_index.py
+
+A `VectorIndex` backed by faiss (`faiss-cpu`), for stores large enough to
+need its multithreaded, SIMD search. Any faiss index factory string works,
+e.g. "IVF4096,Flat", "IVF4096,PQ64" or "HNSW32". Rows are added in store
+order, so faiss's sequential ids are the store-wide row numbers.
+
+The index is written to one file per update (`index.faiss.<rows>`) and the
+manifest is switched to it atomically. The file it replaces is kept until
+the next update, so a reader that read the manifest just before the switch
+can still open the file it names. Opening with `mmap=True` maps the
+inverted lists of IVF indexes instead of reading them; HNSW graphs are
+always read into memory.
+
+Typical usage example:
+
+    index = FaissIndex.build(store, factory="HNSW32", ef_search=128)
+    scores, rows = index.search(queries, k=10)
+"""
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from src.archivist.embeddings.index import VectorIndex, DEFAULT_PROBES
+from src.archivist.embeddings.store import EmbeddingStore, Segment
+from src.archivist.errors.errors import INVALID_INDEX_PARAMETERS
+
+DEFAULT_FACTORY = "IVF1024,Flat"
+DEFAULT_EF_SEARCH = 64
+
+_BLOCK_ROWS = 65536
+
+
+class FaissIndex(VectorIndex):
+    """
+    A faiss index with inner product as its metric. `probes` sets `nprobe`
+    for IVF indexes and `ef_search` sets `efSearch` for HNSW graphs; both may
+    be changed between searches.
+    """
+    kind = "faiss"
+
+    def __init__(self, store: EmbeddingStore, factory: str = DEFAULT_FACTORY, probes: int = DEFAULT_PROBES,
+                 ef_search: int = DEFAULT_EF_SEARCH):
+        """
+        Initialize the FaissIndex object.
+
+        Args:
+            store (EmbeddingStore): The store to index.
+            factory (str): The faiss index factory string.
+            probes (int): The number of inverted lists searched per query.
+            ef_search (int): The size of the HNSW candidate list per query.
+
+        Raises:
+            ValueError: If `probes` or `ef_search` is not a positive integer.
+        """
+        if any(not isinstance(value, int) or value < 1 for value in (probes, ef_search)):
+            raise ValueError(INVALID_INDEX_PARAMETERS)
+        super().__init__(store)
+        self.factory = factory
+        self.probes = probes
+        self.ef_search = ef_search
+        self.index: Optional[faiss.Index] = None
+        self._file: Optional[str] = None
+        self._previous: Optional[str] = None
+        self._mapped = False
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return {"factory": self.factory, "probes": self.probes, "ef_search": self.ef_search}
+
+    def _train(self, vectors: np.ndarray, seed: int) -> None:
+        self.index = faiss.index_factory(self.store.dimension, self.factory, faiss.METRIC_INNER_PRODUCT)
+        if not self.index.is_trained:
+            self.index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def _add(self, segment: Segment, start: int) -> None:
+        if self._mapped:
+            # Mapped inverted lists are read-only; adding needs the index in memory.
+            self.index = faiss.read_index(os.path.join(self.store.path, self._file))
+            self._mapped = False
+        for first in range(0, segment.rows, _BLOCK_ROWS):
+            self.index.add(np.ascontiguousarray(segment.vectors[first:first + _BLOCK_ROWS], dtype=np.float32))
+
+    def _save(self) -> None:
+        replaced, stale = self._file, self._previous
+        self._file = f"index.{self.kind}.{self.index.ntotal}"
+        if replaced != self._file:
+            self._previous = replaced
+        path = os.path.join(self.store.path, self._file)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        faiss.write_index(self.index, temporary)
+        os.replace(temporary, path)
+        self._write_manifest(file=self._file, previous=self._previous)
+        # Readers of the manifest before this one may still be opening `replaced`; only the file
+        # before it is unreferenced now.
+        if stale not in (None, self._previous, self._file):
+            try:
+                os.remove(os.path.join(self.store.path, stale))
+            except FileNotFoundError:
+                pass
+
+    def _load(self, manifest: dict, mmap: bool) -> None:
+        self._file = manifest["file"]
+        self._previous = manifest.get("previous")
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        self.index = faiss.read_index(os.path.join(self.store.path, self._file), flags)
+        self._mapped = mmap
+
+    def _search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        parameters = faiss.ParameterSpace()
+        if "HNSW" in self.factory:
+            parameters.set_index_parameter(self.index, "efSearch", self.ef_search)
+        if "IVF" in self.factory:
+            parameters.set_index_parameter(self.index, "nprobe", self.probes)
+        scores, rows = self.index.search(queries, k)
+        scores[rows < 0] = -np.inf
+        return scores, rows.astype(np.int64)
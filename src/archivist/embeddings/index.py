@@ -0,0 +1,397 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+index.py
+
+Approximate nearest-neighbor indexes over an embedding store. An index
+covers a prefix of the store's segments and `update` adds the segments
+committed since, without retraining or rebuilding what is already indexed.
+Indexes live in the store directory next to the segments, described by an
+`index.<kind>.json` manifest listing the segments they cover.
+
+`IVFIndex` partitions the vectors among k-means centroids (an inverted file)
+and scores a query only against the lists of its nearest centroids. It
+needs nothing but NumPy, keeps one small list file per segment and scores
+against the store's own memory-mapped vectors. `FaissIndex`, in
+`embeddings.faiss_index`, builds any faiss index, IVF or HNSW, for larger
+stores.
+
+Scores are inner products, i.e. cosine similarity for the unit vectors the
+backends produce. Row numbers are store-wide, as in `EmbeddingStore.ids`.
+
+Typical usage example:
+
+    index = IVFIndex.build(store, lists=4096, probes=32)
+    scores, rows = index.search(queries, k=10)
+    ...
+    index = VectorIndex.open(store, "ivf")
+    index.update()
+"""
+import importlib
+import json
+import math
+import os
+import re
+import uuid
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+
+from src.archivist.embeddings.quantization import DEFAULT_KMEANS_ITERATIONS, DEFAULT_TRAIN_ROWS, kmeans, nearest
+from src.archivist.embeddings.search import check_k
+from src.archivist.embeddings.store import EmbeddingStore, Segment
+from src.archivist.errors.errors import INVALID_INDEX_PARAMETERS, INDEX_NOT_BUILT, INDEX_STORE_MISMATCH, \
+    EMBEDDING_DIMENSION_MISMATCH, EMPTY_INDEX_STORE
+
+DEFAULT_PROBES = 16
+
+_BLOCK_ROWS = 16384
+
+INDEXES: Dict[str, Type["VectorIndex"]] = {}
+
+
+class VectorIndex:
+    """
+    An index over the first `len(segments)` segments of a store. Subclasses
+    set `kind`, which names their files, register themselves in `INDEXES` so
+    saved indexes can be opened, and implement training, adding a segment,
+    saving, loading and searching.
+
+    One process updates an index at a time; readers open it independently
+    and see the segments listed in its manifest when they opened it.
+    """
+    kind = "index"
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        INDEXES[cls.kind] = cls
+
+    def __init__(self, store: EmbeddingStore):
+        self.store = store
+        self.segments: List[str] = []
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        """
+        The constructor arguments, saved in the manifest.
+        """
+        raise NotImplementedError
+
+    @property
+    def rows(self) -> int:
+        """
+        The number of indexed rows, which are rows 0 to `rows` of the store.
+        """
+        return sum(segment.rows for segment in self.store.segments[:len(self.segments)])
+
+    @classmethod
+    def build(cls, store: EmbeddingStore, train_rows: int = DEFAULT_TRAIN_ROWS, seed: int = 0,
+              **params) -> "VectorIndex":
+        """
+        Trains an index on a random sample of the store, indexes every
+        segment and saves it, replacing an earlier index of the same kind.
+
+        Args:
+            store (EmbeddingStore): The store to index.
+            train_rows (int): The most rows to train on.
+            seed (int): Seeds the sample and the training.
+            **params: The arguments of the index class.
+
+        Returns:
+            VectorIndex: The index.
+
+        Raises:
+            ValueError: If the store is empty, since there is nothing to train on, or `train_rows`
+                is not a positive integer.
+        """
+        if not isinstance(train_rows, int) or train_rows < 1:
+            raise ValueError(INVALID_INDEX_PARAMETERS)
+        index = cls(store, **params)
+        store.refresh()
+        if not len(store):
+            raise ValueError(EMPTY_INDEX_STORE)
+        rows = np.random.default_rng(seed).choice(len(store), min(train_rows, len(store)), replace=False)
+        index._train(store.vectors(np.sort(rows)), seed)
+        index.update()
+        return index
+
+    @classmethod
+    def open(cls, store: EmbeddingStore, kind: str, mmap: bool = True) -> "VectorIndex":
+        """
+        Opens an index saved by `build` or `update`.
+
+        Args:
+            store (EmbeddingStore): The indexed store.
+            kind (str): The index kind, e.g. "ivf" or "faiss".
+            mmap (bool): Memory-map the index data where the backend supports it, instead of
+                reading it into memory.
+
+        Returns:
+            VectorIndex: The index.
+
+        Raises:
+            ValueError: If the store has no index of this kind, or the index covers segments the
+                store does not have.
+            ImportError: If the backend's library is not installed.
+        """
+        if kind not in INDEXES:
+            # Backends with their own dependency, e.g. "faiss", register when imported.
+            importlib.import_module(f"src.archivist.embeddings.{kind}_index")
+        try:
+            with open(_manifest_path(store, kind)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(INDEX_NOT_BUILT)
+        if len(manifest["segments"]) > len(store.segments):
+            # Another process added segments and indexed them since this store object was opened.
+            store.refresh()
+        index = INDEXES[kind](store, **manifest["params"])
+        index.segments = manifest["segments"]
+        index._check_segments()
+        index._load(manifest, mmap)
+        return index
+
+    def update(self) -> int:
+        """
+        Adds the segments committed to the store since the index was built
+        or last updated, and saves the index if any were added.
+
+        Returns:
+            int: The number of segments added.
+
+        Raises:
+            ValueError: If the index covers segments the store does not have.
+        """
+        self.store.refresh()
+        self._check_segments()
+        start = self.rows
+        added = self.store.segments[len(self.segments):]
+        for segment in added:
+            self._add(segment, start)
+            self.segments.append(segment.name)
+            start += segment.rows
+        if added:
+            self._save()
+        return len(added)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds approximately the indexed rows with the highest inner product
+        with each query, for a batch of queries at once.
+
+        Args:
+            queries (np.ndarray): An array of shape (queries, dimension).
+            k (int): The number of results per query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The scores and store-wide row numbers, each of shape
+                (queries, k), best first. Queries with fewer than `k` results are padded with a
+                score of -inf and a row of -1.
+
+        Raises:
+            ValueError: If the queries do not have the store's dimension, or `k` is not a
+                positive integer.
+        """
+        check_k(k)
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.store.dimension:
+            raise ValueError(EMBEDDING_DIMENSION_MISMATCH)
+        return self._search(np.ascontiguousarray(queries), k)
+
+    def _check_segments(self) -> None:
+        names = [segment.name for segment in self.store.segments[:len(self.segments)]]
+        if names != self.segments:
+            raise ValueError(INDEX_STORE_MISMATCH)
+
+    def _write_manifest(self, **fields) -> None:
+        manifest = {"kind": self.kind, "params": self.params, "segments": self.segments, **fields}
+        path = _manifest_path(self.store, self.kind)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def _train(self, vectors: np.ndarray, seed: int) -> None:
+        raise NotImplementedError
+
+    def _add(self, segment: Segment, start: int) -> None:
+        raise NotImplementedError
+
+    def _save(self) -> None:
+        raise NotImplementedError
+
+    def _load(self, manifest: dict, mmap: bool) -> None:
+        raise NotImplementedError
+
+    def _search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+
+class IVFIndex(VectorIndex):
+    """
+    An inverted file: k-means centroids (`index.ivf.<build>.npy`) and, per
+    segment, the segment's rows grouped by nearest centroid
+    (`segment-000000.ivf.<build>`). A query is scored exactly against the
+    rows listed under its `probes` nearest centroids, read from the store's
+    vectors. A batch of queries reads each probed list once, for all the
+    queries that probe it.
+
+    Every build writes its files under a new build id, recorded in the
+    manifest; updates add to the files of the current build. The files of
+    the build it replaced are kept until the next build, so a reader opened
+    before a rebuild still pairs its centroids with its own lists.
+    """
+    kind = "ivf"
+
+    def __init__(self, store: EmbeddingStore, lists: Optional[int] = None, probes: int = DEFAULT_PROBES,
+                 iterations: int = DEFAULT_KMEANS_ITERATIONS):
+        """
+        Initialize the IVFIndex object.
+
+        Args:
+            store (EmbeddingStore): The store to index.
+            lists (Optional[int]): The number of centroids. Defaults to four times the square root
+                of the number of rows when the index is built.
+            probes (int): The number of lists searched per query; more is slower but finds more of
+                the true neighbors. May be changed between searches.
+            iterations (int): The number of k-means iterations.
+
+        Raises:
+            ValueError: If `lists`, `probes` or `iterations` is not a positive integer.
+        """
+        if any(not isinstance(value, int) or value < 1 for value in (lists or 1, probes, iterations)):
+            raise ValueError(INVALID_INDEX_PARAMETERS)
+        super().__init__(store)
+        self.lists = lists
+        self.probes = probes
+        self.iterations = iterations
+        self.centroids: Optional[np.ndarray] = None
+        self.build_id: Optional[str] = None
+        self._previous: Optional[str] = None
+        self._inverted: Dict[str, np.ndarray] = {}
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return {"lists": self.lists, "probes": self.probes, "iterations": self.iterations}
+
+    def _train(self, vectors: np.ndarray, seed: int) -> None:
+        self.lists = min(self.lists or max(1, int(4 * math.sqrt(len(self.store)))), len(vectors))
+        self.centroids = kmeans(vectors, self.lists, self.iterations, np.random.default_rng(seed))
+        try:
+            with open(_manifest_path(self.store, self.kind)) as f:
+                self._previous = json.load(f).get("build")
+        except FileNotFoundError:
+            self._previous = None
+        self.build_id = uuid.uuid4().hex[:12]
+
+    def _add(self, segment: Segment, start: int) -> None:
+        assigned = np.zeros(segment.rows, dtype=np.int64)
+        for first in range(0, segment.rows, _BLOCK_ROWS):
+            block = np.asarray(segment.vectors[first:first + _BLOCK_ROWS], dtype=np.float32)
+            assigned[first:first + len(block)] = nearest(block, self.centroids)
+        # One int32 array: the offset of each list in the rows that follow, then the
+        # segment's rows ordered by list and, within a list, by row.
+        order = np.argsort(assigned, kind="stable")
+        offsets = np.searchsorted(assigned[order], np.arange(self.lists + 1))
+        path = self._lists_path(segment)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        np.concatenate([offsets, order]).astype("<i4").tofile(temporary)
+        os.replace(temporary, path)
+
+    def _save(self) -> None:
+        path = self._centroids_path()
+        if not os.path.exists(path):
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                np.save(f, self.centroids)
+            os.replace(temporary, path)
+        self._write_manifest(build=self.build_id, previous=self._previous)
+        # Readers of the replaced manifest may still open the previous build's files; older ones
+        # are unreferenced.
+        pattern = re.compile(rf"(?:index|segment-\d+)\.{self.kind}\.([0-9a-f]{{12}})(?:\.npy)?")
+        for name in os.listdir(self.store.path):
+            match = pattern.fullmatch(name)
+            if match and match.group(1) not in (self.build_id, self._previous):
+                try:
+                    os.remove(os.path.join(self.store.path, name))
+                except FileNotFoundError:
+                    pass
+
+    def _load(self, manifest: dict, mmap: bool) -> None:
+        self.build_id = manifest["build"]
+        self._previous = manifest.get("previous")
+        self.centroids = np.load(self._centroids_path())
+
+    def _centroids_path(self) -> str:
+        return os.path.join(self.store.path, f"index.{self.kind}.{self.build_id}.npy")
+
+    def _lists_path(self, segment: Segment) -> str:
+        return f"{segment.path}.{self.kind}.{self.build_id}"
+
+    def _search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        probes = min(self.probes, self.lists)
+        distances = (self.centroids ** 2).sum(axis=1) - 2 * queries @ self.centroids.T
+        probed = np.argpartition(distances, probes - 1, axis=1)[:, :probes].reshape(-1)
+        # Group (list, query) pairs by list, so each list is read once per batch.
+        order = np.argsort(probed, kind="stable")
+        asking = order // probes
+        lists, firsts = np.unique(probed[order], return_index=True)
+        groups = list(zip(lists, np.split(asking, firsts[1:])))
+
+        scores: List[List[np.ndarray]] = [[] for _ in range(len(queries))]
+        rows: List[List[np.ndarray]] = [[] for _ in range(len(queries))]
+        start = 0
+        for segment in self.store.segments[:len(self.segments)]:
+            inverted = self._inverted_lists(segment)
+            for list_number, group in groups:
+                first, last = inverted[list_number], inverted[list_number + 1]
+                if first == last:
+                    continue
+                members = inverted[self.lists + 1 + first:self.lists + 1 + last]
+                block = np.asarray(segment.vectors[members], dtype=np.float32)
+                block_scores = queries[group] @ block.T
+                for query, query_scores in zip(group, block_scores):
+                    scores[query].append(query_scores)
+                    rows[query].append(members + start)
+            start += segment.rows
+        return _select(scores, rows, k)
+
+    def _inverted_lists(self, segment: Segment) -> np.ndarray:
+        if segment.name not in self._inverted:
+            self._inverted[segment.name] = np.memmap(self._lists_path(segment), dtype="<i4", mode="r")
+        return self._inverted[segment.name]
+
+
+def _select(scores: List[List[np.ndarray]], rows: List[List[np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    best_scores = np.full((len(scores), k), -np.inf, dtype=np.float32)
+    best_rows = np.full((len(scores), k), -1, dtype=np.int64)
+    for query, (query_scores, query_rows) in enumerate(zip(scores, rows)):
+        if not query_scores:
+            continue
+        candidate_scores = np.concatenate(query_scores)
+        candidate_rows = np.concatenate(query_rows).astype(np.int64)
+        if len(candidate_scores) > k:
+            keep = np.argpartition(-candidate_scores, k - 1)[:k]
+            candidate_scores, candidate_rows = candidate_scores[keep], candidate_rows[keep]
+        order = np.argsort(-candidate_scores, kind="stable")
+        best_scores[query, :len(order)] = candidate_scores[order]
+        best_rows[query, :len(order)] = candidate_rows[order]
+    return best_scores, best_rows
+
+
+def _manifest_path(store: EmbeddingStore, kind: str) -> str:
+    return os.path.join(store.path, f"index.{kind}.json")
@@ -0,0 +1,476 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+quantization.py
+
+Compressed copies of an embedding store for memory-bound query nodes.
+`ScalarQuantizer` stores each dimension as one byte scaled between that
+dimension's bounds (4x smaller than float32); `ProductQuantizer` splits
+vectors into subspaces and stores, per subspace, the byte index of the
+nearest of 256 centroids learned by k-means (16x smaller with one subspace
+per four dimensions, 32x with one per eight).
+
+Search is asymmetric: queries stay float32 and are scored against the
+codes directly, without decompressing the store. Optionally the best
+candidates are rescored against the float vectors to win back recall.
+Scores are inner products, i.e. cosine similarity for the unit vectors the
+backends produce.
+
+Typical usage example:
+
+    compressed = QuantizedStore.train(store, ProductQuantizer(subspaces=96))
+    scores, rows = compressed.search(queries, k=10, rerank=100)
+"""
+import os
+from typing import Any, Dict, Iterator, Optional, Tuple, Type
+
+import numpy as np
+
+from src.archivist.embeddings.search import TopK, check_k
+from src.archivist.embeddings.store import EmbeddingStore
+from src.archivist.errors.errors import INVALID_SUBSPACES, QUANTIZER_NOT_TRAINED, EMBEDDING_DIMENSION_MISMATCH
+
+DEFAULT_TRAIN_ROWS = 65536
+DEFAULT_KMEANS_ITERATIONS = 10
+CENTROIDS = 256
+
+_BLOCK_ROWS = 16384
+
+QUANTIZERS: Dict[str, Type["Quantizer"]] = {}
+
+
+class Quantizer:
+    """
+    Encodes vectors as bytes and scores float queries against the codes.
+    Subclasses set `kind`, which names their code files, and register
+    themselves in `QUANTIZERS` so saved quantizers can be loaded.
+    """
+    kind = "quantizer"
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        QUANTIZERS[cls.kind] = cls
+
+    @property
+    def code_size(self) -> int:
+        """
+        The number of bytes per encoded vector.
+        """
+        raise NotImplementedError
+
+    def fit(self, vectors: np.ndarray) -> "Quantizer":
+        """
+        Learns the encoding from a sample of vectors.
+
+        Args:
+            vectors (np.ndarray): An array of shape (rows, dimension).
+
+        Returns:
+            Quantizer: This quantizer.
+        """
+        raise NotImplementedError
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Compresses vectors.
+
+        Args:
+            vectors (np.ndarray): An array of shape (rows, dimension).
+
+        Returns:
+            np.ndarray: A uint8 array of shape (rows, code_size).
+        """
+        raise NotImplementedError
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Approximately reconstructs vectors from their codes.
+
+        Args:
+            codes (np.ndarray): A uint8 array of shape (rows, code_size).
+
+        Returns:
+            np.ndarray: A float32 array of shape (rows, dimension).
+        """
+        raise NotImplementedError
+
+    def prepare(self, queries: np.ndarray) -> Any:
+        """
+        Precomputes whatever `scores` needs from a batch of queries.
+        """
+        raise NotImplementedError
+
+    def scores(self, prepared: Any, codes: np.ndarray) -> np.ndarray:
+        """
+        Scores prepared queries against a block of codes.
+
+        Args:
+            prepared (Any): The result of `prepare`.
+            codes (np.ndarray): A uint8 array of shape (rows, code_size).
+
+        Returns:
+            np.ndarray: The approximate inner products, of shape (queries, rows).
+        """
+        raise NotImplementedError
+
+    def state(self) -> Dict[str, np.ndarray]:
+        raise NotImplementedError
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "Quantizer":
+        raise NotImplementedError
+
+    def save(self, path: str) -> None:
+        """
+        Writes the trained quantizer to an `.npz` file.
+        """
+        with open(path, "wb") as f:
+            np.savez(f, kind=np.array(self.kind), **self.state())
+
+
+def load_quantizer(path: str) -> Quantizer:
+    """
+    Reads a quantizer written by `Quantizer.save`.
+
+    Args:
+        path (str): The `.npz` file.
+
+    Returns:
+        Quantizer: The trained quantizer.
+    """
+    with np.load(path) as data:
+        state = {name: data[name] for name in data.files}
+    return QUANTIZERS[str(state.pop("kind"))].from_state(state)
+
+
+class ScalarQuantizer(Quantizer):
+    """
+    Maps each dimension linearly from [low, high] onto 0..255, where the
+    bounds are that dimension's `clip` and `1 - clip` quantiles in the
+    training sample; values outside are clamped. Clipping a few outliers
+    spends the 256 levels on where most values are.
+    """
+    kind = "sq8"
+
+    def __init__(self, clip: float = 0.0):
+        self.clip = clip
+        self.low: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def code_size(self) -> int:
+        return len(self._trained(self.low))
+
+    def fit(self, vectors: np.ndarray) -> "ScalarQuantizer":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        low = np.quantile(vectors, self.clip, axis=0)
+        high = np.quantile(vectors, 1 - self.clip, axis=0)
+        self.low = low.astype(np.float32)
+        self.scale = np.where(high > low, (high - low) / 255, 1).astype(np.float32)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        levels = (np.asarray(vectors, dtype=np.float32) - self._trained(self.low)) / self.scale
+        return np.clip(np.rint(levels), 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self._trained(self.low) + codes.astype(np.float32) * self.scale
+
+    def prepare(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # q . (low + scale * code) = q . low + (q * scale) . code
+        queries = np.asarray(queries, dtype=np.float32)
+        return queries @ self._trained(self.low), queries * self.scale
+
+    def scores(self, prepared: Tuple[np.ndarray, np.ndarray], codes: np.ndarray) -> np.ndarray:
+        offsets, scaled = prepared
+        return offsets[:, None] + scaled @ codes.T.astype(np.float32)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"clip": np.array(self.clip), "low": self._trained(self.low), "scale": self.scale}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "ScalarQuantizer":
+        quantizer = cls(float(state["clip"]))
+        quantizer.low, quantizer.scale = state["low"], state["scale"]
+        return quantizer
+
+    @staticmethod
+    def _trained(value: Optional[np.ndarray]) -> np.ndarray:
+        if value is None:
+            raise ValueError(QUANTIZER_NOT_TRAINED)
+        return value
+
+
+class ProductQuantizer(Quantizer):
+    """
+    Splits vectors into `subspaces` equal slices and replaces each slice by
+    the nearest of up to 256 centroids, learned per subspace with k-means.
+    A query is scored by looking up, per subspace, the inner product of its
+    slice with the code's centroid, from a table computed once per query.
+    """
+    kind = "pq"
+
+    def __init__(self, subspaces: int, iterations: int = DEFAULT_KMEANS_ITERATIONS, seed: int = 0):
+        """
+        Initialize the ProductQuantizer object.
+
+        Args:
+            subspaces (int): The number of slices, and of bytes per code. Must divide the dimension.
+            iterations (int): The number of k-means iterations per subspace.
+            seed (int): Seeds the choice of initial centroids.
+
+        Raises:
+            ValueError: If `subspaces` is not a positive integer.
+        """
+        if not isinstance(subspaces, int) or subspaces < 1:
+            raise ValueError(INVALID_SUBSPACES)
+        self.subspaces = subspaces
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+
+    @property
+    def code_size(self) -> int:
+        return self.subspaces
+
+    def fit(self, vectors: np.ndarray) -> "ProductQuantizer":
+        """
+        Learns the centroids of each subspace.
+
+        Args:
+            vectors (np.ndarray): An array of shape (rows, dimension).
+
+        Returns:
+            ProductQuantizer: This quantizer.
+
+        Raises:
+            ValueError: If `subspaces` does not divide the dimension.
+        """
+        slices = self._slices(np.asarray(vectors, dtype=np.float32))
+        rng = np.random.default_rng(self.seed)
+        centroids = min(CENTROIDS, slices.shape[0])
+        self.centroids = np.stack([kmeans(slices[:, j], centroids, self.iterations, rng)
+                                   for j in range(self.subspaces)])
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        slices = self._slices(np.asarray(vectors, dtype=np.float32))
+        codes = np.zeros((slices.shape[0], self.subspaces), dtype=np.uint8)
+        for j in range(self.subspaces):
+            codes[:, j] = nearest(slices[:, j], self._trained()[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        centroids = self._trained()
+        return np.concatenate([centroids[j][codes[:, j]] for j in range(self.subspaces)], axis=1)
+
+    def prepare(self, queries: np.ndarray) -> np.ndarray:
+        # Lookup tables of shape (subspaces, centroids, queries), so that the
+        # entries of one code for every query are contiguous.
+        slices = self._slices(np.asarray(queries, dtype=np.float32))
+        return np.ascontiguousarray(np.einsum("qmd,mkd->mkq", slices, self._trained()))
+
+    def scores(self, prepared: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        scores = np.zeros((codes.shape[0], prepared.shape[2]), dtype=np.float32)
+        for j in range(self.subspaces):
+            scores += prepared[j][codes[:, j]]
+        return scores.T
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"subspaces": np.array(self.subspaces), "iterations": np.array(self.iterations),
+                "seed": np.array(self.seed), "centroids": self._trained()}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray]) -> "ProductQuantizer":
+        quantizer = cls(int(state["subspaces"]), int(state["iterations"]), int(state["seed"]))
+        quantizer.centroids = state["centroids"]
+        return quantizer
+
+    def _slices(self, vectors: np.ndarray) -> np.ndarray:
+        if vectors.ndim != 2 or vectors.shape[1] % self.subspaces:
+            raise ValueError(INVALID_SUBSPACES)
+        return vectors.reshape(vectors.shape[0], self.subspaces, -1)
+
+    def _trained(self) -> np.ndarray:
+        if self.centroids is None:
+            raise ValueError(QUANTIZER_NOT_TRAINED)
+        return self.centroids
+
+
+def nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Finds the index of the centroid nearest to each vector by L2 distance.
+    """
+    # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, and ||x||^2 does not change the argmin.
+    norms = (centroids ** 2).sum(axis=1)
+    assigned = np.zeros(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _BLOCK_ROWS):
+        block = vectors[start:start + _BLOCK_ROWS]
+        assigned[start:start + len(block)] = np.argmin(norms - 2 * block @ centroids.T, axis=1)
+    return assigned
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Learns `k` centroids of a float32 sample with Lloyd's algorithm, starting
+    from `k` sampled vectors.
+    """
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assigned = nearest(vectors, centroids)
+        counts = np.bincount(assigned, minlength=k)
+        sums = np.stack([np.bincount(assigned, vectors[:, i], minlength=k) for i in range(vectors.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # An empty cluster restarts at a random vector rather than staying unused.
+        centroids[~filled] = vectors[rng.choice(len(vectors), int((~filled).sum()))]
+    return centroids.astype(np.float32)
+
+
+class QuantizedStore:
+    """
+    The codes of every segment of an `EmbeddingStore`, one file per segment
+    next to its vectors (e.g. `segment-000000.pq`), and the quantizer they
+    were encoded with (`quantizer.pq.npz`). Codes are memory-mapped like the
+    vectors. Segments appended to the store later are encoded by `update`
+    with the same quantizer, without retraining.
+    """
+
+    def __init__(self, store: EmbeddingStore, quantizer: Quantizer):
+        self.store = store
+        self.quantizer = quantizer
+        self._codes: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def train(cls, store: EmbeddingStore, quantizer: Quantizer, train_rows: int = DEFAULT_TRAIN_ROWS,
+              seed: int = 0) -> "QuantizedStore":
+        """
+        Trains a quantizer on a random sample of the store, saves it, and
+        encodes every segment. Codes of an earlier quantizer of the same
+        kind are replaced.
+
+        Args:
+            store (EmbeddingStore): The store to compress.
+            quantizer (Quantizer): An untrained quantizer.
+            train_rows (int): The most rows to train on.
+            seed (int): Seeds the sample.
+
+        Returns:
+            QuantizedStore: The compressed store.
+        """
+        rows = np.random.default_rng(seed).choice(len(store), min(train_rows, len(store)), replace=False)
+        quantizer.fit(store.vectors(np.sort(rows)))
+        for segment in store.segments:
+            path = f"{segment.path}.{quantizer.kind}"
+            if os.path.exists(path):
+                os.remove(path)
+        quantizer.save(os.path.join(store.path, f"quantizer.{quantizer.kind}.npz"))
+        compressed = cls(store, quantizer)
+        compressed.update()
+        return compressed
+
+    @classmethod
+    def open(cls, store: EmbeddingStore, kind: str) -> "QuantizedStore":
+        """
+        Opens the codes of a store compressed by `train`.
+
+        Args:
+            store (EmbeddingStore): The store.
+            kind (str): The quantizer kind, e.g. "sq8" or "pq".
+
+        Returns:
+            QuantizedStore: The compressed store.
+        """
+        return cls(store, load_quantizer(os.path.join(store.path, f"quantizer.{kind}.npz")))
+
+    def update(self) -> int:
+        """
+        Encodes the segments of the store that have no codes yet.
+
+        Returns:
+            int: The number of segments encoded.
+        """
+        self.store.refresh()
+        encoded = 0
+        for segment in self.store.segments:
+            path = f"{segment.path}.{self.quantizer.kind}"
+            if os.path.exists(path):
+                continue
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                for start in range(0, segment.rows, _BLOCK_ROWS):
+                    f.write(self.quantizer.encode(segment.vectors[start:start + _BLOCK_ROWS]).tobytes())
+            os.replace(temporary, path)
+            encoded += 1
+        return encoded
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.store) * self.quantizer.code_size
+
+    def iter_codes(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Iterates over the segments' codes without copying them.
+
+        Yields:
+            Tuple[int, np.ndarray]: The store-wide row number of each segment's first row, and
+                its memory-mapped uint8 codes of shape (rows, code_size).
+        """
+        start = 0
+        for segment in self.store.segments:
+            if segment.name not in self._codes:
+                self._codes[segment.name] = np.memmap(f"{segment.path}.{self.quantizer.kind}", dtype=np.uint8,
+                                                      mode="r", shape=(segment.rows, self.quantizer.code_size))
+            yield start, self._codes[segment.name]
+            start += segment.rows
+
+    def search(self, queries: np.ndarray, k: int, rerank: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the rows with the highest inner product with each query.
+
+        Args:
+            queries (np.ndarray): An array of shape (queries, dimension).
+            k (int): The number of results per query.
+            rerank (int): Rescore this many of the best candidates, if more than `k`, against
+                the float vectors of the store and keep the best `k` of them.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The scores and store-wide row numbers, each of shape
+                (queries, k), best first. Scores are approximate unless reranked.
+
+        Raises:
+            ValueError: If the queries do not have the store's dimension, or `k` is not a
+                positive integer.
+        """
+        check_k(k)
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[1] != self.store.dimension:
+            raise ValueError(EMBEDDING_DIMENSION_MISMATCH)
+        prepared = self.quantizer.prepare(queries)
+        best = TopK(len(queries), max(k, rerank))
+        for start, codes in self.iter_codes():
+            for offset in range(0, len(codes), _BLOCK_ROWS):
+                best.push(self.quantizer.scores(prepared, codes[offset:offset + _BLOCK_ROWS]), start + offset)
+        scores, rows = best.result()
+        if rerank <= k:
+            return scores[:, :k], rows[:, :k]
+        exact = np.einsum("qd,qcd->qc", queries, self.store.vectors(np.maximum(rows, 0)))
+        exact[rows < 0] = -np.inf
+        return _best(exact, rows, k)
+
+
+def _best(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(rows, order, axis=1)
@@ -0,0 +1,95 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+remote.py
+
+Embeds texts through the OpenAI embeddings API. Texts are sent as token IDs
+already truncated to the model's input limit, and rate limits and dropped
+connections are retried with backoff.
+
+Typical usage example:
+
+    backend = OpenAIBackend(api_key=os.environ["OPENAI_API_KEY"])
+    vectors = EmbeddingEngine(backend, max_batch_tokens=100000).embed(texts)
+"""
+from typing import List, Optional, Sequence
+
+import numpy as np
+import openai
+import tiktoken
+
+from src.archivist.crawler.retry import RetryPolicy
+from src.archivist.embeddings.backends import EmbeddingBackend
+
+DEFAULT_OPENAI_MODEL = "text-embedding-ada-002"
+DEFAULT_OPENAI_DIMENSION = 1536
+DEFAULT_OPENAI_MAX_TOKENS = 8191
+
+TRANSIENT_API_ERRORS = (openai.error.RateLimitError, openai.error.APIConnectionError, openai.error.Timeout,
+                        openai.error.ServiceUnavailableError, openai.error.TryAgain)
+
+
+def is_transient_api_error(error: BaseException) -> bool:
+    """
+    Classifies an API failure as worth retrying: rate limits, timeouts,
+    dropped connections and 5xx responses.
+    """
+    if isinstance(error, openai.error.APIError) and (error.http_status or 0) >= 500:
+        return True
+    return isinstance(error, TRANSIENT_API_ERRORS)
+
+
+class OpenAIBackend(EmbeddingBackend):
+    """
+    A model served by the OpenAI embeddings API. The API has no model
+    revisions, so `revision` is "api"; use a new model name when the model
+    changes.
+    """
+    revision = "api"
+
+    def __init__(self, model_name: str = DEFAULT_OPENAI_MODEL, dimension: int = DEFAULT_OPENAI_DIMENSION,
+                 api_key: Optional[str] = None, encoding: str = "cl100k_base",
+                 max_tokens: int = DEFAULT_OPENAI_MAX_TOKENS, retry_policy: Optional[RetryPolicy] = None):
+        """
+        Initialize the OpenAIBackend object.
+
+        Args:
+            model_name (str): The embedding model.
+            dimension (int): The length of the model's vectors.
+            api_key (Optional[str]): The API key. Defaults to `openai.api_key`, which reads
+                the OPENAI_API_KEY environment variable.
+            encoding (str): The tiktoken encoding of the model.
+            max_tokens (int): The model's input limit; longer texts are truncated.
+            retry_policy (Optional[RetryPolicy]): How to retry transient failures.
+        """
+        self.name = model_name
+        self.dimension = dimension
+        self.api_key = api_key
+        self.encoding = tiktoken.get_encoding(encoding)
+        self.max_tokens = max_tokens
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        return [min(len(tokens), self.max_tokens) for tokens in self.encoding.encode_ordinary_batch(list(texts))]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        # The API rejects empty inputs, so an empty text is sent as a space.
+        space = self.encoding.encode_ordinary(" ")
+        inputs = [tokens[:self.max_tokens] or space for tokens in self.encoding.encode_ordinary_batch(list(texts))]
+        response = self.retry_policy.run(
+            lambda: openai.Embedding.create(model=self.name, input=inputs, api_key=self.api_key),
+            transient=is_transient_api_error)
+        data = sorted(response["data"], key=lambda item: item["index"])
+        return np.array([item["embedding"] for item in data], dtype=np.float32).reshape(len(texts), self.dimension)
@@ -0,0 +1,162 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+search.py
+
+Top-k selection over scores computed block by block. Each block is reduced
+to its best `k` columns with `argpartition`, which is linear in the block
+size, and merged with the best found so far, so a search holds only one
+block of scores at a time whatever the size of the store.
+
+`exact_search` scores every row of a store this way. For stores of up to a
+few hundred thousand vectors it is fast enough to need no index, and for
+any store it is the ground truth that approximate indexes are measured
+against.
+
+Typical usage example:
+
+    scores, rows = exact_search(store, queries, k=10)
+"""
+from typing import Tuple
+
+import numpy as np
+
+from src.archivist.embeddings.store import EmbeddingStore
+from src.archivist.errors.errors import INVALID_BLOCK_SIZE, EMBEDDING_DIMENSION_MISMATCH, INVALID_TOP_K
+
+DEFAULT_BLOCK_BYTES = 64 << 20
+DEFAULT_QUERY_BATCH = 1024
+
+
+class TopK:
+    """
+    The `k` highest scores per query seen so far, and the rows they belong
+    to. Queries with fewer than `k` rows pushed have the remaining slots
+    filled with a score of -inf and a row of -1.
+    """
+
+    def __init__(self, queries: int, k: int):
+        """
+        Initialize the TopK object.
+
+        Args:
+            queries (int): The number of queries.
+            k (int): The number of results kept per query.
+
+        Raises:
+            ValueError: If `k` is not a positive integer.
+        """
+        check_k(k)
+        self.k = k
+        self.scores = np.full((queries, 0), -np.inf, dtype=np.float32)
+        self.rows = np.full((queries, 0), -1, dtype=np.int64)
+
+    def push(self, scores: np.ndarray, first_row: int) -> None:
+        """
+        Merges the scores of a block of consecutive rows.
+
+        Args:
+            scores (np.ndarray): An array of shape (queries, block rows).
+            first_row (int): The row number of the block's first column.
+        """
+        if scores.shape[1] > self.k:
+            columns = np.argpartition(-scores, self.k - 1, axis=1)[:, :self.k]
+            scores = np.take_along_axis(scores, columns, axis=1)
+        else:
+            columns = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        self.scores = np.concatenate([self.scores, scores.astype(np.float32, copy=False)], axis=1)
+        self.rows = np.concatenate([self.rows, columns + first_row], axis=1)
+        if self.scores.shape[1] > self.k:
+            keep = np.argpartition(-self.scores, self.k - 1, axis=1)[:, :self.k]
+            self.scores = np.take_along_axis(self.scores, keep, axis=1)
+            self.rows = np.take_along_axis(self.rows, keep, axis=1)
+
+    def result(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the best scores, highest first.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The scores and row numbers, each of shape (queries, k).
+        """
+        order = np.argsort(-self.scores, axis=1, kind="stable")
+        scores = np.take_along_axis(self.scores, order, axis=1)
+        rows = np.take_along_axis(self.rows, order, axis=1)
+        missing = self.k - scores.shape[1]
+        if missing > 0:
+            scores = np.pad(scores, ((0, 0), (0, missing)), constant_values=-np.inf)
+            rows = np.pad(rows, ((0, 0), (0, missing)), constant_values=-1)
+        return scores, rows
+
+
+def check_k(k: int) -> None:
+    """
+    Checks the number of results per query of a search.
+
+    Raises:
+        ValueError: If `k` is not a positive integer.
+    """
+    if not isinstance(k, (int, np.integer)) or isinstance(k, bool) or k < 1:
+        raise ValueError(INVALID_TOP_K)
+
+
+def exact_search(store: EmbeddingStore, queries: np.ndarray, k: int, block_bytes: int = DEFAULT_BLOCK_BYTES,
+                 query_batch: int = DEFAULT_QUERY_BATCH) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the rows with the highest inner product with each query by
+    scoring every row of the store, one block of rows at a time.
+
+    Blocks are sized so that a block of vectors converted to float32 and the
+    scores of a batch of queries against it, with the temporaries of their
+    top-k selection, take about `block_bytes`. That is the peak memory of a
+    search beyond its inputs and results; the store's vectors are read
+    through their memory maps. Larger batches of queries read the store once
+    per `query_batch` queries.
+
+    Args:
+        store (EmbeddingStore): The store to search.
+        queries (np.ndarray): An array of shape (queries, dimension).
+        k (int): The number of results per query.
+        block_bytes (int): The memory to use per block.
+        query_batch (int): The most queries scored against a block at once.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The scores and store-wide row numbers, each of shape
+            (queries, k), best first. Queries of a store with fewer than `k` rows are padded
+            with a score of -inf and a row of -1.
+
+    Raises:
+        ValueError: If the queries do not have the store's dimension, or `k`, `block_bytes` or
+            `query_batch` is not a positive integer.
+    """
+    check_k(k)
+    queries = np.asarray(queries, dtype=np.float32)
+    if queries.ndim != 2 or queries.shape[1] != store.dimension:
+        raise ValueError(EMBEDDING_DIMENSION_MISMATCH)
+    if any(not isinstance(value, int) or value < 1 for value in (block_bytes, query_batch)):
+        raise ValueError(INVALID_BLOCK_SIZE)
+    scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    rows = np.full((len(queries), k), -1, dtype=np.int64)
+    for first in range(0, len(queries), query_batch):
+        batch = queries[first:first + query_batch]
+        # Per row: its float32 vector, and per query its score plus the negated
+        # copy and int64 index that argpartition works on.
+        block_rows = max(1, block_bytes // (4 * store.dimension + 16 * len(batch)))
+        best = TopK(len(batch), k)
+        for start, vectors in store.iter_vectors():
+            for offset in range(0, len(vectors), block_rows):
+                block = np.asarray(vectors[offset:offset + block_rows], dtype=np.float32)
+                best.push(batch @ block.T, start + offset)
+        scores[first:first + len(batch)], rows[first:first + len(batch)] = best.result()
+    return scores, rows
@@ -0,0 +1,407 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+store.py
+
+The on-disk format of an embedding store, the directory `--embeddings_path`
+points at. Vectors are kept in append-only segments, each a contiguous
+little-endian float32 or float16 matrix with no header, next to a sidecar
+of chunk IDs: the UTF-8 IDs back to back, and an int64 array of where each
+one starts. `store.json` records the model, dimension, format version and
+the committed segments.
+
+Segments are opened with `numpy.memmap`, so opening a store of any size
+reads only its manifest, and processes reading the same store share pages
+through the OS page cache instead of each loading a copy.
+
+    embeddings/
+        store.json
+        segment-000000.vectors    rows x dimension values
+        segment-000000.ids        chunk IDs, concatenated
+        segment-000000.offsets    int64, rows + 1 offsets into the IDs
+
+Typical usage example:
+
+    store = EmbeddingStore.create(config.embeddings_path, backend.name, backend.revision, backend.dimension)
+    with store.writer() as writer:
+        for chunk, vector in engine.embed_chunks(chunks):
+            writer.add(chunk_key(document, chunk.index), vector)
+"""
+import json
+import os
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no flock; the store locks a byte of its lock file with msvcrt instead.
+    fcntl = None
+    import msvcrt
+
+from src.archivist import __version__
+from src.archivist.errors.errors import EMBEDDING_DIMENSION_MISMATCH, EMBEDDING_STORE_MISMATCH, \
+    NOT_AN_EMBEDDING_STORE, UNSUPPORTED_STORE_DTYPE
+
+STORE_FORMAT = 1
+MANIFEST = "store.json"
+STORE_DTYPES = ("float32", "float16")
+
+_LOCK = ".lock"
+_WRITE_ROWS = 4096
+
+
+class StoreHeader(NamedTuple):
+    """
+    What the vectors of a store are: the model that produced them and how
+    they are laid out.
+    """
+    model: str
+    revision: str
+    dimension: int
+    dtype: str = "float32"
+
+
+class Segment:
+    """
+    One committed segment. `vectors` is a read-only memory map of shape
+    (rows, dimension); it is opened on first use.
+    """
+
+    def __init__(self, store_path: str, name: str, rows: int, dimension: int, dtype: str):
+        self.path = os.path.join(store_path, name)
+        self.name = name
+        self.rows = rows
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self._vectors: Optional[np.ndarray] = None
+        self._offsets: Optional[np.ndarray] = None
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            self._vectors = _memmap(self.path + ".vectors", self.dtype, (self.rows, self.dimension))
+        return self._vectors
+
+    def ids(self, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        """
+        Reads the chunk IDs of rows `start` to `stop` (exclusive).
+
+        Args:
+            start (int): The first row.
+            stop (Optional[int]): The row after the last one. Defaults to the end of the segment.
+
+        Returns:
+            List[str]: The IDs, in row order.
+        """
+        if self._offsets is None:
+            self._offsets = _memmap(self.path + ".offsets", np.dtype("<i8"), (self.rows + 1,))
+        stop = self.rows if stop is None else stop
+        offsets = self._offsets[start:stop + 1].tolist()
+        with open(self.path + ".ids", "rb") as f:
+            f.seek(offsets[0])
+            data = f.read(offsets[-1] - offsets[0])
+        base = offsets[0]
+        return [data[a - base:b - base].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+
+
+class EmbeddingStore:
+    """
+    A directory of append-only vector segments. Writers add whole segments
+    and commit them by rewriting the manifest atomically under a lock, so
+    readers never see a partial segment and concurrent writers do not lose
+    each other's segments. Call `refresh` to pick up segments committed
+    since the store was opened.
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens an existing store. Only the manifest is read.
+
+        Args:
+            path (str): The store directory.
+
+        Raises:
+            ValueError: If the directory is not an embedding store, or was written in a newer format.
+        """
+        self.path = path
+        self.header: Optional[StoreHeader] = None
+        self.segments: List[Segment] = []
+        self.refresh()
+
+    @classmethod
+    def create(cls, path: str, model: str, revision: str, dimension: int, dtype: str = "float32") -> "EmbeddingStore":
+        """
+        Opens a store, creating it if it does not exist.
+
+        Args:
+            path (str): The store directory.
+            model (str): The name of the model the vectors come from.
+            revision (str): The revision of the model.
+            dimension (int): The length of each vector.
+            dtype (str): "float32", or "float16" to halve the size of the vectors.
+
+        Returns:
+            EmbeddingStore: The store.
+
+        Raises:
+            ValueError: If `dtype` is not supported, or the store exists with a different header.
+        """
+        if dtype not in STORE_DTYPES:
+            raise ValueError(UNSUPPORTED_STORE_DTYPE)
+        header = StoreHeader(model, revision, dimension, dtype)
+        os.makedirs(path, exist_ok=True)
+        with _locked(path):
+            if not os.path.exists(os.path.join(path, MANIFEST)):
+                _write_manifest(path, header, [])
+        store = cls(path)
+        if store.header != header:
+            raise ValueError(EMBEDDING_STORE_MISMATCH)
+        return store
+
+    @property
+    def dimension(self) -> int:
+        return self.header.dimension
+
+    def __len__(self) -> int:
+        return sum(segment.rows for segment in self.segments)
+
+    def refresh(self) -> None:
+        """
+        Rereads the manifest. Segments already opened keep their memory maps.
+        """
+        try:
+            with open(os.path.join(self.path, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            raise ValueError(NOT_AN_EMBEDDING_STORE)
+        if manifest.get("format") != STORE_FORMAT:
+            raise ValueError(NOT_AN_EMBEDDING_STORE)
+        self.header = StoreHeader(manifest["model"], manifest["revision"], manifest["dimension"], manifest["dtype"])
+        opened = {segment.name: segment for segment in self.segments}
+        self.segments = [opened.get(entry["name"]) or Segment(self.path, entry["name"], entry["rows"],
+                                                              self.dimension, self.header.dtype)
+                         for entry in manifest["segments"]]
+
+    def iter_vectors(self) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Iterates over the segments' vectors without copying them.
+
+        Yields:
+            Tuple[int, np.ndarray]: The store-wide row number of each segment's first row, and
+                its memory-mapped matrix.
+        """
+        start = 0
+        for segment in self.segments:
+            yield start, segment.vectors
+            start += segment.rows
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Gathers vectors by store-wide row number, e.g. to rescore search results.
+
+        Args:
+            rows (np.ndarray): An integer array of row numbers, of any shape.
+
+        Returns:
+            np.ndarray: The float32 vectors, of shape rows.shape + (dimension,).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        flat = rows.reshape(-1)
+        gathered = np.zeros((len(flat), self.dimension), dtype=np.float32)
+        for start, vectors in self.iter_vectors():
+            inside = (flat >= start) & (flat < start + len(vectors))
+            gathered[inside] = vectors[flat[inside] - start]
+        return gathered.reshape(rows.shape + (self.dimension,))
+
+    def ids(self, rows: Sequence[int]) -> List[str]:
+        """
+        Looks up the chunk IDs of store-wide row numbers, e.g. search results.
+
+        Args:
+            rows (Sequence[int]): The row numbers.
+
+        Returns:
+            List[str]: The ID of each row, in the same order.
+        """
+        starts = np.cumsum([0] + [segment.rows for segment in self.segments])
+        ids = []
+        for row in rows:
+            i = int(np.searchsorted(starts, row, side="right")) - 1
+            ids.append(self.segments[i].ids(row - starts[i], row - starts[i] + 1)[0])
+        return ids
+
+    def append(self, ids: Sequence[str], vectors: np.ndarray) -> Segment:
+        """
+        Writes one segment and commits it.
+
+        Args:
+            ids (Sequence[str]): The chunk ID of each vector.
+            vectors (np.ndarray): An array of shape (len(ids), dimension).
+
+        Returns:
+            Segment: The committed segment.
+        """
+        with self.writer() as writer:
+            writer.add_many(ids, vectors)
+        return self.segments[-1]
+
+    @contextmanager
+    def writer(self) -> Iterator["SegmentWriter"]:
+        """
+        Writes vectors into a new segment, committed when the block exits
+        without an exception and discarded otherwise. An empty segment is
+        not committed.
+
+        Yields:
+            SegmentWriter: The writer.
+        """
+        writer = SegmentWriter(self)
+        try:
+            yield writer
+        except BaseException:
+            writer.discard()
+            raise
+        writer.commit()
+
+
+class SegmentWriter:
+    """
+    Streams vectors and IDs to temporary files that become a segment on
+    `commit`. Vectors are converted to the store's type and buffered in
+    blocks of rows.
+    """
+
+    def __init__(self, store: EmbeddingStore):
+        self.store = store
+        self.rows = 0
+        self._prefix = os.path.join(store.path, f".tmp-{os.getpid()}-{id(self)}")
+        self._vectors = open(self._prefix + ".vectors", "wb")
+        self._ids = open(self._prefix + ".ids", "wb")
+        self._offsets = [0]
+        self._pending_ids: List[str] = []
+        self._pending: List[np.ndarray] = []
+
+    def add(self, chunk_id: str, vector: np.ndarray) -> None:
+        self.add_many([chunk_id], np.asarray(vector).reshape(1, -1))
+
+    def add_many(self, ids: Sequence[str], vectors: np.ndarray) -> None:
+        """
+        Adds vectors to the segment.
+
+        Args:
+            ids (Sequence[str]): The chunk ID of each vector.
+            vectors (np.ndarray): An array of shape (len(ids), dimension).
+
+        Raises:
+            ValueError: If the vectors do not have the store's dimension.
+        """
+        vectors = np.asarray(vectors)
+        if vectors.ndim != 2 or vectors.shape != (len(ids), self.store.dimension):
+            raise ValueError(EMBEDDING_DIMENSION_MISMATCH)
+        self._pending.append(vectors.astype(np.dtype(self.store.header.dtype).newbyteorder("<")))
+        self._pending_ids.extend(ids)
+        self.rows += len(ids)
+        if len(self._pending_ids) >= _WRITE_ROWS:
+            self._flush()
+
+    def commit(self) -> None:
+        self._flush()
+        for f in (self._vectors, self._ids):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        if not self.rows:
+            self._remove()
+            return
+        np.array(self._offsets, dtype="<i8").tofile(self._prefix + ".offsets")
+        with _locked(self.store.path):
+            self.store.refresh()
+            segments = [{"name": segment.name, "rows": segment.rows} for segment in self.store.segments]
+            name = f"segment-{len(segments):06d}"
+            for suffix in (".vectors", ".ids", ".offsets"):
+                os.replace(self._prefix + suffix, os.path.join(self.store.path, name + suffix))
+            _write_manifest(self.store.path, self.store.header, segments + [{"name": name, "rows": self.rows}])
+            self.store.refresh()
+
+    def discard(self) -> None:
+        self._vectors.close()
+        self._ids.close()
+        self._remove()
+
+    def _flush(self) -> None:
+        if not self._pending_ids:
+            return
+        self._vectors.write(np.concatenate(self._pending).tobytes())
+        for chunk_id in self._pending_ids:
+            data = chunk_id.encode("utf-8")
+            self._ids.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+        self._pending, self._pending_ids = [], []
+
+    def _remove(self) -> None:
+        for suffix in (".vectors", ".ids", ".offsets"):
+            if os.path.exists(self._prefix + suffix):
+                os.remove(self._prefix + suffix)
+
+
+def _memmap(path: str, dtype: np.dtype, shape: Tuple[int, ...]) -> np.ndarray:
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+@contextmanager
+def _locked(path: str) -> Iterator[None]:
+    with open(os.path.join(path, _LOCK), "a") as lock:
+        _lock(lock)
+        try:
+            yield
+        finally:
+            _unlock(lock)
+
+
+def _lock(lock) -> None:
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return
+    lock.seek(0)
+    while True:
+        try:
+            # LK_LOCK gives up after ten attempts a second apart; keep waiting like flock does.
+            msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock(lock) -> None:
+    if fcntl is not None:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        return
+    lock.seek(0)
+    msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _write_manifest(path: str, header: StoreHeader, segments: List[dict]) -> None:
+    manifest = {"format": STORE_FORMAT, "archivist_version": __version__, **header._asdict(), "segments": segments}
+    temporary = os.path.join(path, f".{MANIFEST}.{os.getpid()}")
+    with open(temporary, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, os.path.join(path, MANIFEST))
@@ -0,0 +1,80 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+transformer.py
+
+Runs a Hugging Face transformer encoder locally with PyTorch, mean-pooling
+the last hidden state over the tokens that are not padding.
+
+Typical usage example:
+
+    backend = TransformerBackend("sentence-transformers/all-MiniLM-L6-v2")
+    vectors = EmbeddingEngine(backend).embed(texts)
+"""
+from typing import List, Optional, Sequence
+
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+from src.archivist.embeddings.backends import EmbeddingBackend
+
+DEFAULT_TRANSFORMER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class TransformerBackend(EmbeddingBackend):
+    """
+    A transformer encoder run with PyTorch, by default on the CPU. Pin
+    `revision` to a commit of the model repository so that `key` changes
+    only when the weights do.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_TRANSFORMER_MODEL, revision: str = "main", device: str = "cpu",
+                 max_tokens: Optional[int] = None, normalize: bool = True):
+        """
+        Initialize the TransformerBackend object. Downloads the model unless it
+        is in the Hugging Face cache.
+
+        Args:
+            model_name (str): The model repository, or a local directory.
+            revision (str): The branch, tag or commit of the model.
+            device (str): The torch device to run on, e.g. "cpu" or "cuda".
+            max_tokens (Optional[int]): Truncate texts to this many tokens. Defaults to
+                the longest input the model accepts.
+            normalize (bool): Scale vectors to unit length.
+        """
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision)
+        self.model = AutoModel.from_pretrained(model_name, revision=revision).to(device).eval()
+        self.name = model_name
+        self.revision = revision
+        self.device = device
+        self.dimension = self.model.config.hidden_size
+        self.max_tokens = min(max_tokens or self.tokenizer.model_max_length, self.tokenizer.model_max_length)
+        self.normalize = normalize
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        encoded = self.tokenizer(list(texts), truncation=True, max_length=self.max_tokens)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        batch = self.tokenizer(list(texts), padding=True, truncation=True, max_length=self.max_tokens,
+                               return_tensors="pt").to(self.device)
+        with torch.inference_mode():
+            hidden = self.model(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            vectors = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            if self.normalize:
+                vectors = torch.nn.functional.normalize(vectors, dim=1)
+        return vectors.float().cpu().numpy()
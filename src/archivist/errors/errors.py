@@ -22,3 +22,52 @@ UNSUPPORTED_URL = "Unsupported URL."
 NO_EMPTY_PATH = "Path cannot be empty."
 UNSUPPORTED_PATH = "Unsupported path."
 NON_EXISTENT_PATH = "Path does not exist."
+UNSUPPORTED_CLONE_FILTER = "Unsupported clone filter."
+INVALID_DEPTH = "Depth must be a positive integer."
+INVALID_CONCURRENCY = "Concurrency limit must be a positive integer."
+SCHEDULER_SHUT_DOWN = "Scheduler has been shut down."
+INVALID_CACHE_LIMIT = "Cache limits must be positive integers."
+MISSING_OBJECT = "Object does not exist:"
+GIT_PROCESS_FAILED = "Git process failed."
+NOT_CLONED = "Repository has not been cloned."
+UNSUPPORTED_ASYNC_OPTION = "Mirror caches, incremental updates and archives are not supported by AsyncCrawler."
+INVALID_BATCH_LINE = "Batch line must be a JSON object."
+INVALID_BATCH_FIELD = "Batch job url, output_path and branch must be strings."
+UNSUPPORTED_BATCH_OPTION = "Unsupported batch job option:"
+INVALID_BATCH_OPTION = "Batch job option has the wrong type:"
+NO_EMPTY_PATTERN = "Path patterns cannot be empty."
+INVALID_MAX_FILE_SIZE = "Maximum file size must be a positive integer."
+CONFLICTING_CLONE_FILTER = "A clone filter cannot be combined with a maximum file size."
+INVALID_RETRIES = "Retries must be a non-negative integer."
+INVALID_RETRY_DELAY = "Retry delays must be non-negative and the multiplier at least 1."
+NO_REMOTE_HEAD = "Remote has no default branch."
+UNSUPPORTED_ARCHIVE_URL = "Archive downloads need a GitHub repository URL or a direct archive URL."
+UNSUPPORTED_ARCHIVE_OPTION = "Archive downloads do not support mirror caches, incremental updates or clone modes."
+INCREMENTAL_NEEDS_CHECKOUT = "Incremental updates need a checkout."
+UNSAFE_ARCHIVE_PATH = "Archive entry escapes the output path:"
+INVALID_WORKERS = "Worker and queue limits must be positive integers."
+INVALID_BATCH_BYTES = "Batch size in bytes must be a positive integer."
+INVALID_CHUNK_LINES = "Lines per chunk must be a positive integer."
+INVALID_CLAIM_TIMEOUT = "Claim timeout must be a positive number of seconds."
+INVALID_MAX_TOKENS = "Tokens per chunk must be a positive integer."
+INVALID_OVERLAP_TOKENS = "Overlap tokens must be a non-negative integer less than the tokens per chunk."
+INVALID_MINHASH_BANDS = "MinHash bands must be a positive divisor of the signature length."
+INVALID_SIMILARITY_THRESHOLD = "Similarity threshold must be greater than 0 and at most 1."
+INVALID_MAX_SIGNATURES = "The maximum number of indexed signatures must be a positive integer."
+INVALID_WINDOW_BYTES = "Window size in bytes must be a positive integer."
+INVALID_STREAM_MEMORY = "Streaming thresholds and memory limits must be positive integers."
+INVALID_DIMENSION = "Embedding dimension must be a positive integer."
+INVALID_EMBEDDING_BATCH = "Embedding batch limits must be positive integers."
+EMBEDDING_DIMENSION_MISMATCH = "Vectors do not have the dimension of the model."
+EMBEDDING_CACHE_MISMATCH = "Embedding cache was opened for a different model."
+NOT_AN_EMBEDDING_STORE = "Path is not an embedding store."
+EMBEDDING_STORE_MISMATCH = "Embedding store was created for a different model, dimension or type."
+UNSUPPORTED_STORE_DTYPE = "Embedding stores hold float32 or float16 vectors."
+INVALID_SUBSPACES = "Product quantizer subspaces must be a positive divisor of the dimension."
+QUANTIZER_NOT_TRAINED = "Quantizer has not been trained."
+INVALID_INDEX_PARAMETERS = "Index lists, probes, training rows and search depth must be positive integers."
+INDEX_NOT_BUILT = "Embedding store has no index of this kind."
+EMPTY_INDEX_STORE = "Cannot build an index over an empty embedding store."
+INDEX_STORE_MISMATCH = "Index does not match the segments of its embedding store."
+INVALID_BLOCK_SIZE = "Search block size and query batch must be positive integers."
+INVALID_TOP_K = "The number of results per query must be a positive integer."
@@ -0,0 +1,243 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+chunker.py
+
+Splits normalized text into overlapping chunks bounded by a model's token
+count. Each file is tokenized once, many files per `encode_ordinary_batch`
+call, and chunk boundaries are found from the byte length of each token, so
+no window is ever tokenized again.
+
+Typical usage example:
+
+    chunker = TokenChunker("cl100k_base", max_tokens=512, overlap_tokens=64)
+    for chunks in chunker.chunk_many([(path, text) for path, text in files]):
+        embed(chunks)
+"""
+import bisect
+import itertools
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import tiktoken
+
+from src.archivist.errors.errors import INVALID_MAX_TOKENS, INVALID_OVERLAP_TOKENS
+
+DEFAULT_ENCODING = "cl100k_base"
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_OVERLAP_TOKENS = 64
+
+
+class Chunk(NamedTuple):
+    """
+    A span of a normalized file. Lines are 1-based and inclusive; bytes are
+    offsets into the UTF-8 encoding of the normalized text, end exclusive.
+    `token_count` is only set by the token chunkers, `symbol` by the syntax
+    chunker for a chunk holding a single definition, and `duplicate_of` by
+    the near-duplicate filter.
+    """
+    path: str
+    index: int
+    text: str
+    start_line: int
+    end_line: int
+    start_byte: int
+    end_byte: int
+    token_count: Optional[int] = None
+    symbol: Optional[str] = None
+    duplicate_of: Optional[str] = None
+
+
+def chunk_lines(path: str, text: str, lines_per_chunk: int) -> List[Chunk]:
+    """
+    Splits text into chunks of `lines_per_chunk` lines.
+
+    Args:
+        path (str): The path recorded on each chunk.
+        text (str): The normalized text.
+        lines_per_chunk (int): The number of lines per chunk.
+
+    Returns:
+        List[Chunk]: The chunks, in order. Empty text has no chunks.
+    """
+    chunks = []
+    lines = split_lines(text)
+    offset = 0
+    for start in range(0, len(lines), lines_per_chunk):
+        window = lines[start:start + lines_per_chunk]
+        chunk_text = "".join(window)
+        size = len(chunk_text.encode("utf-8"))
+        chunks.append(Chunk(path, len(chunks), chunk_text, start + 1, start + len(window), offset, offset + size))
+        offset += size
+    return chunks
+
+
+def split_lines(text: str) -> List[str]:
+    """
+    Splits text after every LF, keeping the line endings. Unlike
+    `str.splitlines`, other Unicode line breaks do not end a line, so line
+    numbers match what git and editors show.
+    """
+    lines = [line + "\n" for line in text.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+def line_starts(data: bytes) -> List[int]:
+    """
+    Finds the byte offset at which each line starts.
+
+    Args:
+        data (bytes): UTF-8 text.
+
+    Returns:
+        List[int]: The offsets, starting with 0 for the first line.
+    """
+    starts = [0]
+    offset = data.find(b"\n")
+    while offset != -1:
+        starts.append(offset + 1)
+        offset = data.find(b"\n", offset + 1)
+    return starts
+
+
+class TokenChunker:
+    """
+    Chunks text into windows of at most `max_tokens` tokens, each starting
+    `overlap_tokens` tokens before the previous one ended. Windows end after
+    a line break when one falls in the second half of the window, and start
+    after one when it falls in the overlap, so chunks of code keep whole
+    lines. A window never splits a UTF-8 character.
+    """
+
+    def __init__(self, encoding: Union[str, tiktoken.Encoding] = DEFAULT_ENCODING,
+                 max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS):
+        """
+        Initialize the TokenChunker object.
+
+        Args:
+            encoding (Union[str, tiktoken.Encoding]): The tokenizer, or the name of a tiktoken encoding.
+            max_tokens (int): The most tokens in a chunk.
+            overlap_tokens (int): The number of tokens repeated from the end of the previous chunk.
+
+        Raises:
+            ValueError: If `max_tokens` is not a positive integer, or `overlap_tokens` is
+                negative or not less than `max_tokens`.
+        """
+        if not isinstance(max_tokens, int) or max_tokens < 1:
+            raise ValueError(INVALID_MAX_TOKENS)
+        if not isinstance(overlap_tokens, int) or not 0 <= overlap_tokens < max_tokens:
+            raise ValueError(INVALID_OVERLAP_TOKENS)
+        self.encoding = tiktoken.get_encoding(encoding) if isinstance(encoding, str) else encoding
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def chunk(self, path: str, text: str) -> List[Chunk]:
+        """
+        Chunks one text.
+
+        Args:
+            path (str): The path recorded on each chunk.
+            text (str): The normalized text.
+
+        Returns:
+            List[Chunk]: The chunks, in order. Empty text has no chunks.
+        """
+        return self.chunk_many([(path, text)])[0]
+
+    def chunk_many(self, documents: Sequence[Tuple[str, str]]) -> List[List[Chunk]]:
+        """
+        Chunks many texts with a single batched tokenizer call. Special token
+        text such as `<|endoftext|>` is tokenized as ordinary text.
+
+        Args:
+            documents (Sequence[Tuple[str, str]]): The path and normalized text of each file.
+
+        Returns:
+            List[List[Chunk]]: The chunks of each text, in input order.
+        """
+        offsets = self.token_offsets([text for _, text in documents])
+        return [self.windows(path, text.encode("utf-8"), file_offsets)
+                for (path, text), file_offsets in zip(documents, offsets)]
+
+    def token_offsets(self, texts: Sequence[str]) -> List[List[int]]:
+        """
+        Tokenizes texts in one batched call.
+
+        Args:
+            texts (Sequence[str]): The texts.
+
+        Returns:
+            List[List[int]]: Per text, the byte offset at which each token starts in its
+                UTF-8 encoding, followed by the length of the encoding.
+        """
+        return [[0, *itertools.accumulate(len(token) for token in self.encoding.decode_tokens_bytes(tokens))]
+                for tokens in self.encoding.encode_ordinary_batch(list(texts))]
+
+    def windows(self, path: str, data: bytes, offsets: List[int], first: int = 0, last: Optional[int] = None,
+                starts: Optional[List[int]] = None) -> List[Chunk]:
+        """
+        Cuts tokens `first` to `last` (exclusive) of a tokenized text into windows.
+
+        Args:
+            path (str): The path recorded on each chunk.
+            data (bytes): The UTF-8 text.
+            offsets (List[int]): The token offsets from `token_offsets`.
+            first (int): The first token to chunk.
+            last (Optional[int]): The token after the last one to chunk. Defaults to the end of the text.
+            starts (Optional[List[int]]): The `line_starts` of `data`, if already known.
+
+        Returns:
+            List[Chunk]: The chunks, numbered from 0.
+        """
+        starts = starts if starts is not None else line_starts(data)
+        last = len(offsets) - 1 if last is None else last
+        chunks: List[Chunk] = []
+        start = first
+        while start < last:
+            end = min(start + self.max_tokens, last)
+            if end < last:
+                end = self._window_end(data, offsets, start, end)
+            start_byte, end_byte = offsets[start], offsets[end]
+            chunks.append(Chunk(path, len(chunks), data[start_byte:end_byte].decode("utf-8"),
+                                bisect.bisect_right(starts, start_byte), bisect.bisect_right(starts, end_byte - 1),
+                                start_byte, end_byte, end - start))
+            if end == last:
+                break
+            start = self._window_start(data, offsets, start, end)
+        return chunks
+
+    def _window_end(self, data: bytes, ends: List[int], start: int, end: int) -> int:
+        for i in range(end, start + max(self.max_tokens // 2, 1), -1):
+            if data[ends[i] - 1] == 0x0A:
+                return i
+        while end > start + 1 and not _is_char_boundary(data, ends[end]):
+            end -= 1
+        while not _is_char_boundary(data, ends[end]):
+            # A single character longer than the window; the budget gives way.
+            end += 1
+        return end
+
+    def _window_start(self, data: bytes, ends: List[int], start: int, end: int) -> int:
+        overlap_start = max(end - self.overlap_tokens, start + 1)
+        for i in range(overlap_start, end):
+            if data[ends[i] - 1] == 0x0A:
+                return i
+        while overlap_start < end and not _is_char_boundary(data, ends[overlap_start]):
+            overlap_start += 1
+        return overlap_start
+
+
+def _is_char_boundary(data: bytes, offset: int) -> bool:
+    return offset >= len(data) or data[offset] & 0xC0 != 0x80
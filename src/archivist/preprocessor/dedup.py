@@ -0,0 +1,121 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+dedup.py
+
+Content-addressed deduplication between the crawler and the preprocessor.
+Files are identified by git blob SHA, so the same contents in forks, vendored
+copies or later commits are processed once, while every place they occur is
+still recorded in the blob index.
+
+Typical usage example:
+
+    with BlobIndex("blobs.sqlite") as index:
+        dedup = Deduplicator(index, repo_url, head_commit(path))
+        for document in preprocessor.run(dedup.filter(iter_files(path))):
+            embed(document)
+            index.mark_done([document.blob_sha])
+"""
+from typing import Iterable, Iterator, List, Union
+
+from git import Repo
+
+from src.archivist.crawler.blobs import BlobRecord, blob_sha
+from src.archivist.data_storage.blob_index import BlobIndex, Occurrence
+from src.archivist.preprocessor.walker import FileRecord, file_contents
+
+Record = Union[FileRecord, BlobRecord]
+
+CLAIM_BATCH_SIZE = 512
+
+
+def file_blob_sha(record: FileRecord) -> str:
+    """
+    Hashes a file on disk into its git blob SHA, as `git hash-object` would
+    for a file without clean filters.
+
+    Args:
+        record (FileRecord): The file.
+
+    Returns:
+        str: The hex blob SHA.
+    """
+    with file_contents(record) as data:
+        return blob_sha(data)
+
+
+def head_commit(repo_path: str) -> str:
+    return Repo(repo_path).head.commit.hexsha
+
+
+class Deduplicator:
+    """
+    Passes through only the files whose blob has not been processed (or
+    claimed) before, in any repository, and records every occurrence.
+    `BlobRecord`s from `Crawler.blobs()` carry their SHA already; files from
+    the walker are hashed.
+    """
+
+    def __init__(self, index: BlobIndex, repo: str, commit: str, batch_size: int = CLAIM_BATCH_SIZE):
+        """
+        Initialize the Deduplicator object.
+
+        Args:
+            index (BlobIndex): The shared blob index.
+            repo (str): The repository the files come from, e.g. its URL.
+            commit (str): The commit the files come from.
+            batch_size (int): The number of occurrences recorded per transaction.
+        """
+        self.index = index
+        self.repo = repo
+        self.commit = commit
+        self.batch_size = batch_size
+        self.seen = 0
+        self.unique = 0
+
+    @property
+    def duplicates(self) -> int:
+        return self.seen - self.unique
+
+    def filter(self, records: Iterable[Record]) -> Iterator[Record]:
+        """
+        Records every file's occurrence and yields the files to process, with
+        `blob_sha` set, in input order.
+
+        Args:
+            records (Iterable[Record]): The files of one commit.
+
+        Yields:
+            Record: The files whose contents are new.
+        """
+        batch: List[Record] = []
+        for record in records:
+            if record.blob_sha is None:
+                record = record._replace(blob_sha=file_blob_sha(record))
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                yield from self._claim(batch)
+                batch = []
+        if batch:
+            yield from self._claim(batch)
+
+    def _claim(self, batch: List[Record]) -> Iterator[Record]:
+        claimed = self.index.claim_many(Occurrence(record.blob_sha, self.repo, record.path, self.commit, record.size)
+                                        for record in batch)
+        self.seen += len(batch)
+        for record, is_new in zip(batch, claimed):
+            if is_new:
+                self.unique += 1
+                yield record
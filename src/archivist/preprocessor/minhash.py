@@ -0,0 +1,311 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+minhash.py
+
+Near-duplicate detection for chunks. Each chunk's text is cut into
+overlapping byte shingles, hashed with NumPy, and summarized as a MinHash
+signature; LSH banding finds the earlier chunks likely to be similar, and
+their signatures confirm it. Generated code, license headers and lightly
+edited forks can then be skipped or linked to one canonical chunk before
+they are embedded.
+
+Typical usage example:
+
+    near_duplicates = NearDuplicateFilter(threshold=0.8)
+    for document in near_duplicates.filter(preprocessor.run(iter_files(path))):
+        embed(document.chunks)
+"""
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from src.archivist.errors.errors import INVALID_MINHASH_BANDS, INVALID_SIMILARITY_THRESHOLD, INVALID_MAX_SIGNATURES
+from src.archivist.preprocessor.pipeline import Document
+
+DEFAULT_NUM_PERM = 128
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+# About 1 GB of index with the default signature length and bands.
+DEFAULT_MAX_SIGNATURES = 1 << 18
+SHINGLE_BYTES = 8
+BLOCK_SHINGLES = 1 << 12
+
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def shingles(text: str) -> np.ndarray:
+    """
+    Cuts text into overlapping shingles of `SHINGLE_BYTES` bytes, after
+    collapsing runs of whitespace, and hashes each to 32 bits.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        np.ndarray: The uint64 shingle hashes, one per byte offset. Text shorter
+            than a shingle is one shingle.
+    """
+    data = np.frombuffer(_WHITESPACE.sub(" ", text).strip().encode("utf-8"), dtype=np.uint8)
+    if len(data) < SHINGLE_BYTES:
+        data = np.concatenate([data, np.zeros(SHINGLE_BYTES - len(data), dtype=np.uint8)])
+    count = len(data) - SHINGLE_BYTES + 1
+    values = np.zeros(count, dtype=np.uint64)
+    for i in range(SHINGLE_BYTES):
+        values |= data[i:i + count].astype(np.uint64) << np.uint64(8 * i)
+    return (values * _GOLDEN) >> np.uint64(32)
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures with `num_perm` multiply-shift hash functions
+    `(a * x + b) >> 32` over 64-bit integers, which need no modulo. Shingles of many texts are hashed in one
+    array operation, in blocks of at most `BLOCK_SHINGLES` shingles to bound
+    memory.
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = 1):
+        """
+        Initialize the MinHasher object.
+
+        Args:
+            num_perm (int): The signature length.
+            seed (int): Seeds the hash functions; signatures are only comparable for equal seeds.
+        """
+        generator = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = generator.integers(0, 1 << 63, size=(num_perm, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._b = generator.integers(0, 1 << 63, size=(num_perm, 1), dtype=np.uint64)
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Computes the signature of each text.
+
+        Args:
+            texts (Sequence[str]): The texts.
+
+        Returns:
+            np.ndarray: A uint32 array of shape (len(texts), num_perm).
+        """
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        group: List[np.ndarray] = []
+        group_start = 0
+        for i, text in enumerate(texts):
+            text_shingles = shingles(text)
+            if group and sum(len(s) for s in group) + len(text_shingles) > BLOCK_SHINGLES:
+                result[group_start:i] = self._group_signatures(group)
+                group, group_start = [], i
+            group.append(text_shingles)
+        if group:
+            result[group_start:len(texts)] = self._group_signatures(group)
+        return result
+
+    def _group_signatures(self, group: List[np.ndarray]) -> np.ndarray:
+        if len(group) == 1:
+            signature = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+            for start in range(0, len(group[0]), BLOCK_SHINGLES):
+                np.minimum(signature, self._permute(group[0][start:start + BLOCK_SHINGLES]).min(axis=1), out=signature)
+            return signature[np.newaxis, :]
+        starts = np.cumsum([0] + [len(s) for s in group[:-1]])
+        return np.minimum.reduceat(self._permute(np.concatenate(group)), starts, axis=1).T
+
+    def _permute(self, values: np.ndarray) -> np.ndarray:
+        hashes = self._a * values
+        hashes += self._b
+        hashes >>= np.uint64(32)
+        return hashes
+
+
+class LSHIndex:
+    """
+    Banded locality-sensitive hashing over MinHash signatures: signatures are
+    cut into `bands` bands of equal width, and two signatures are candidates
+    if any band matches exactly.
+
+    Every signature is held in memory: its `4 * num_perm` bytes, its key,
+    and one bucket entry per band, which is about 4 KB with 128 positions
+    in 16 bands. Once `max_size` signatures are indexed, each insert drops
+    the oldest one.
+    """
+
+    def __init__(self, bands: int, num_perm: int, max_size: Optional[int] = None):
+        """
+        Initialize the LSHIndex object.
+
+        Args:
+            bands (int): The number of bands.
+            num_perm (int): The signature length, a multiple of `bands`.
+            max_size (Optional[int]): The most signatures held at once. Unbounded if None.
+
+        Raises:
+            ValueError: If `bands` is not a positive divisor of `num_perm`, or `max_size`
+                is not a positive integer.
+        """
+        if not isinstance(bands, int) or bands < 1 or num_perm % bands:
+            raise ValueError(INVALID_MINHASH_BANDS)
+        if max_size is not None and (not isinstance(max_size, int) or max_size < 1):
+            raise ValueError(INVALID_MAX_SIGNATURES)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_size = max_size
+        # Both are keyed by insertion position, so they iterate oldest first.
+        self.keys: Dict[int, str] = {}
+        self.signatures: Dict[int, np.ndarray] = {}
+        self._next = 0
+        self._tables: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def candidates(self, signature: np.ndarray) -> List[int]:
+        """
+        Finds the indexed signatures sharing a band with `signature`.
+
+        Returns:
+            List[int]: Their positions, the keys of `keys` and `signatures`, in insertion order.
+        """
+        found = set()
+        for band, table in zip(self._band_keys(signature), self._tables):
+            found.update(table.get(band, ()))
+        return sorted(found)
+
+    def insert(self, key: str, signature: np.ndarray) -> None:
+        if self.max_size is not None and len(self.keys) >= self.max_size:
+            self._remove_oldest()
+        position = self._next
+        self._next += 1
+        self.keys[position] = key
+        # A copy, so a row of a batch of signatures does not keep the whole batch alive.
+        self.signatures[position] = signature.copy()
+        for band, table in zip(self._band_keys(signature), self._tables):
+            table.setdefault(band, []).append(position)
+
+    def _remove_oldest(self) -> None:
+        position = next(iter(self.keys))
+        del self.keys[position]
+        signature = self.signatures.pop(position)
+        for band, table in zip(self._band_keys(signature), self._tables):
+            # Buckets are in insertion order, so the oldest position comes first.
+            bucket = table[band]
+            del bucket[0]
+            if not bucket:
+                del table[band]
+
+    def _band_keys(self, signature: np.ndarray) -> Iterator[bytes]:
+        for band in range(self.bands):
+            yield signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+
+class NearDuplicateFilter:
+    """
+    Finds chunks whose estimated Jaccard similarity to an earlier chunk is at
+    least `threshold`. The first chunk of each near-duplicate group is its
+    canonical chunk, identified by `chunk_key`. LSH only proposes candidates;
+    a chunk is a duplicate once its signature agrees with a candidate's on
+    at least `threshold` of its positions.
+
+    With the defaults, 16 bands of 8 rows, a pair with similarity 0.9 is
+    proposed with probability above 0.999, one with similarity 0.8 about
+    0.95, and one with similarity 0.5 about 0.06.
+
+    Canonical signatures cost about 4 KB each with the defaults, see
+    `LSHIndex`. At most `max_signatures` are kept; past that the oldest are
+    forgotten, and a later copy of a forgotten chunk becomes canonical again.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = DEFAULT_NUM_PERM,
+                 bands: int = DEFAULT_BANDS, seed: int = 1, max_signatures: Optional[int] = DEFAULT_MAX_SIGNATURES):
+        """
+        Initialize the NearDuplicateFilter object.
+
+        Args:
+            threshold (float): The estimated Jaccard similarity at which chunks are near-duplicates.
+            num_perm (int): The signature length.
+            bands (int): The number of LSH bands; must divide `num_perm`.
+            seed (int): Seeds the MinHash functions.
+            max_signatures (Optional[int]): The most canonical signatures kept. Unbounded if None.
+
+        Raises:
+            ValueError: If `threshold` is not in (0, 1], `bands` does not divide `num_perm`,
+                or `max_signatures` is not a positive integer.
+        """
+        if not 0 < threshold <= 1:
+            raise ValueError(INVALID_SIMILARITY_THRESHOLD)
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, seed)
+        self.index = LSHIndex(bands, num_perm, max_signatures)
+        self.chunks_seen = 0
+        self.duplicates = 0
+
+    def find(self, key: str, signature: np.ndarray) -> Optional[str]:
+        """
+        Checks one chunk against every canonical chunk seen so far, and makes
+        it canonical if it matches none.
+
+        Args:
+            key (str): The chunk key.
+            signature (np.ndarray): The chunk's MinHash signature.
+
+        Returns:
+            Optional[str]: The key of the most similar canonical chunk, or None if the chunk is new.
+        """
+        self.chunks_seen += 1
+        candidates = self.index.candidates(signature)
+        if candidates:
+            similarity = (np.stack([self.index.signatures[i] for i in candidates]) == signature).mean(axis=1)
+            best = int(similarity.argmax())
+            if similarity[best] >= self.threshold:
+                self.duplicates += 1
+                return self.index.keys[candidates[best]]
+        self.index.insert(key, signature)
+        return None
+
+    def filter(self, documents: Iterable[Document], drop: bool = True) -> Iterator[Document]:
+        """
+        Passes documents through, dropping near-duplicate chunks, or with
+        `drop=False`, keeping them with `duplicate_of` set to the canonical
+        chunk's key.
+
+        Args:
+            documents (Iterable[Document]): Preprocessed documents, e.g. from `Preprocessor.run`.
+            drop (bool): Drop near-duplicate chunks instead of linking them.
+
+        Yields:
+            Document: Each document, in input order.
+        """
+        for document in documents:
+            if not document.chunks:
+                yield document
+                continue
+            signatures = self.hasher.signatures([chunk.text for chunk in document.chunks])
+            chunks = []
+            for chunk, signature in zip(document.chunks, signatures):
+                canonical = self.find(chunk_key(document, chunk.index), signature)
+                if canonical is None:
+                    chunks.append(chunk)
+                elif not drop:
+                    chunks.append(chunk._replace(duplicate_of=canonical))
+            yield document._replace(chunks=chunks)
+
+
+def chunk_key(document: Document, index: int) -> str:
+    """
+    Identifies a chunk by its file's blob SHA, or path if the SHA is unknown,
+    and its index.
+    """
+    return f"{document.blob_sha or document.path}:{index}"
@@ -0,0 +1,526 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+pipeline.py
+
+Turns the files found by the walker into normalized text chunks. Files are
+grouped into batches of roughly equal byte size and fanned out to a process
+pool; results come back in input order with a bounded number of batches in
+flight, so a slow consumer holds back the walk instead of queueing the repo.
+
+Typical usage example:
+
+    with Preprocessor(workers=8) as preprocessor:
+        for document in preprocessor.run(iter_files(path)):
+            embed(document.chunks)
+"""
+import functools
+import hashlib
+import json
+import mmap
+import os
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Deque, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import tiktoken
+
+from src.archivist.errors.errors import INVALID_BATCH_BYTES, INVALID_WORKERS, INVALID_CHUNK_LINES, \
+    INVALID_MAX_TOKENS, INVALID_OVERLAP_TOKENS, INVALID_STREAM_MEMORY
+from src.archivist.crawler.blobs import blob_sha
+from src.archivist.data_storage.parse_cache import ParseCache
+from src.archivist.data_storage.result_cache import ResultCache, DEFAULT_RESULT_CACHE_BYTES
+from src.archivist.preprocessor.chunker import Chunk, TokenChunker, chunk_lines, DEFAULT_ENCODING, \
+    DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS
+from src.archivist.preprocessor.streaming import TextStream
+from src.archivist.preprocessor.syntax import PARSERS, SyntaxChunker
+from src.archivist.preprocessor.walker import FileRecord, file_contents
+
+DEFAULT_BATCH_BYTES = 4 << 20
+DEFAULT_STREAM_THRESHOLD = 64 << 20
+DEFAULT_STREAM_MEMORY = 32 << 20
+DEFAULT_CHUNK_LINES = 200
+
+
+class Document(NamedTuple):
+    """
+    The preprocessing result for one file. Binary files and files that could
+    not be read have no chunks; `error` says why for the latter. `blob_sha`
+    is set for every file that was read.
+
+    A streamed file comes as several documents numbered by `part`, each with
+    the next run of chunks; only the last one has the `blob_sha`, which is
+    known once the whole file has been read. `part` is None for other files.
+    """
+    path: str
+    size: int
+    encoding: Optional[str]
+    chunks: List[Chunk]
+    error: Optional[str] = None
+    blob_sha: Optional[str] = None
+    part: Optional[int] = None
+
+
+class PreprocessOptions:
+    """
+    How files are decoded, normalized and chunked. Sent to every worker, so
+    it must stay picklable; pass `encoding` by name when using a process pool.
+    Files are chunked by line count unless `max_tokens` or `syntax_aware` is set.
+    Files larger than `stream_threshold` are streamed instead of read whole.
+    """
+
+    def __init__(self, normalize_newlines: bool = True, strip_trailing_whitespace: bool = True,
+                 chunk_lines: int = DEFAULT_CHUNK_LINES, max_tokens: Optional[int] = None,
+                 overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                 encoding: Union[str, tiktoken.Encoding] = DEFAULT_ENCODING, syntax_aware: bool = False,
+                 parse_cache_path: Optional[str] = None, cache_path: Optional[str] = None,
+                 cache_max_bytes: Optional[int] = DEFAULT_RESULT_CACHE_BYTES,
+                 stream_threshold: int = DEFAULT_STREAM_THRESHOLD, stream_memory: int = DEFAULT_STREAM_MEMORY):
+        """
+        Initialize the PreprocessOptions object.
+
+        Args:
+            normalize_newlines (bool): Convert CRLF and CR line endings to LF.
+            strip_trailing_whitespace (bool): Strip whitespace from the end of every line.
+            chunk_lines (int): The number of lines per chunk.
+            max_tokens (Optional[int]): Chunk by token count instead, with at most this many tokens per chunk.
+            overlap_tokens (int): The number of tokens repeated from the end of the previous chunk.
+            encoding (Union[str, tiktoken.Encoding]): The tokenizer, or the name of a tiktoken encoding.
+            syntax_aware (bool): Chunk source code along its definitions, within the token
+                budget, which defaults to `DEFAULT_MAX_TOKENS`.
+            parse_cache_path (Optional[str]): The SQLite file that caches parse results across
+                runs and workers. Defaults to a cache in memory per worker.
+            cache_path (Optional[str]): The SQLite file that caches preprocessing results by
+                blob SHA, configuration and code version. No results are cached by default.
+            cache_max_bytes (Optional[int]): Evict cached results once they take more than this.
+            stream_threshold (int): Stream files larger than this many bytes.
+            stream_memory (int): The approximate memory ceiling, in bytes, for streaming one file.
+
+        Raises:
+            ValueError: If `chunk_lines` or `max_tokens` is not a positive integer,
+                `overlap_tokens` is negative or not less than `max_tokens`, or
+                `stream_threshold` or `stream_memory` is not a positive integer.
+        """
+        if not isinstance(chunk_lines, int) or chunk_lines < 1:
+            raise ValueError(INVALID_CHUNK_LINES)
+        for limit in (stream_threshold, stream_memory):
+            if not isinstance(limit, int) or limit < 1:
+                raise ValueError(INVALID_STREAM_MEMORY)
+        if syntax_aware and max_tokens is None:
+            max_tokens = DEFAULT_MAX_TOKENS
+        if max_tokens is not None:
+            if not isinstance(max_tokens, int) or max_tokens < 1:
+                raise ValueError(INVALID_MAX_TOKENS)
+            if not isinstance(overlap_tokens, int) or not 0 <= overlap_tokens < max_tokens:
+                raise ValueError(INVALID_OVERLAP_TOKENS)
+        self.normalize_newlines = normalize_newlines
+        self.strip_trailing_whitespace = strip_trailing_whitespace
+        self.chunk_lines = chunk_lines
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.encoding = encoding
+        self.syntax_aware = syntax_aware
+        self.parse_cache_path = parse_cache_path
+        self.cache_path = cache_path
+        self.cache_max_bytes = cache_max_bytes
+        self.stream_threshold = stream_threshold
+        self.stream_memory = stream_memory
+
+    def streams(self, record: FileRecord) -> bool:
+        return not record.binary and record.size > self.stream_threshold
+
+    def config_hash(self, path: str) -> str:
+        """
+        Hashes the settings that shape the result for a file, to key the result
+        cache. With syntax-aware chunking, the parser the file's extension
+        selects, and its version, are part of the hash.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            str: The hex SHA-256 of the settings.
+        """
+        encoding = self.encoding if isinstance(self.encoding, str) else self.encoding.name
+        settings = [self.normalize_newlines, self.strip_trailing_whitespace, self.chunk_lines, self.max_tokens,
+                    self.overlap_tokens, encoding, self.syntax_aware]
+        if self.syntax_aware:
+            parser = PARSERS.get(os.path.splitext(path)[1].lower())
+            settings.append(parser.key if parser is not None else None)
+        return hashlib.sha256(json.dumps(settings).encode("utf-8")).hexdigest()
+
+
+def decode(data: Union[bytes, mmap.mmap, memoryview]) -> Tuple[str, str]:
+    """
+    Decodes file contents as UTF-8, dropping a byte order mark, and falls
+    back to Latin-1, which accepts any bytes. Memory-mapped contents are
+    decoded in place, without first copying them into a bytes object.
+
+    Args:
+        data (Union[bytes, mmap.mmap, memoryview]): The file contents.
+
+    Returns:
+        Tuple[str, str]: The text and the encoding used.
+    """
+    try:
+        return str(data, "utf-8-sig"), "utf-8"
+    except UnicodeDecodeError:
+        return str(data, "latin-1"), "latin-1"
+
+
+def normalize(text: str, options: PreprocessOptions) -> str:
+    """
+    Applies the newline and whitespace normalization selected in `options`.
+    """
+    if options.normalize_newlines:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if options.strip_trailing_whitespace:
+        text = "\n".join(line.rstrip() for line in text.split("\n"))
+    return text
+
+
+def read_text(record: FileRecord, options: PreprocessOptions) -> Tuple[Document, Optional[str]]:
+    """
+    Reads, decodes and normalizes one file.
+
+    Args:
+        record (FileRecord): The file to read.
+        options (PreprocessOptions): How to normalize it.
+
+    Returns:
+        Tuple[Document, Optional[str]]: The document, not yet chunked, and its normalized
+            text. The text is None for binary files and files that could not be read.
+    """
+    if record.binary:
+        return Document(record.path, record.size, None, [], blob_sha=record.blob_sha), None
+    try:
+        with file_contents(record) as data:
+            sha = record.blob_sha or blob_sha(data)
+            text, encoding = decode(data)
+    except OSError as e:
+        return Document(record.path, record.size, None, [], str(e), record.blob_sha), None
+    return Document(record.path, record.size, encoding, [], blob_sha=sha), normalize(text, options)
+
+
+def chunk_texts(documents: Sequence[Tuple[str, str, Optional[str]]], options: PreprocessOptions) -> List[List[Chunk]]:
+    """
+    Chunks normalized texts by line count, by syntax if `options.syntax_aware` is
+    set, or else by token count if `options.max_tokens` is set. Token and
+    syntax chunking tokenize the texts in one batch.
+
+    Args:
+        documents (Sequence[Tuple[str, str, Optional[str]]]): The path, normalized text and
+            blob SHA of each file.
+        options (PreprocessOptions): How to chunk them.
+
+    Returns:
+        List[List[Chunk]]: The chunks of each text, in input order.
+    """
+    if options.syntax_aware:
+        return syntax_chunker(options.encoding, options.max_tokens, options.overlap_tokens,
+                              options.parse_cache_path).chunk_many(documents)
+    if options.max_tokens is None:
+        return [chunk_lines(path, text, options.chunk_lines) for path, text, _ in documents]
+    return token_chunker(options.encoding, options.max_tokens,
+                         options.overlap_tokens).chunk_many([(path, text) for path, text, _ in documents])
+
+
+@functools.lru_cache(maxsize=8)
+def token_chunker(encoding: Union[str, tiktoken.Encoding], max_tokens: int, overlap_tokens: int) -> TokenChunker:
+    """
+    Returns a chunker shared by every batch a worker process handles, so the
+    encoding is loaded once per process.
+    """
+    return TokenChunker(encoding, max_tokens, overlap_tokens)
+
+
+@functools.lru_cache(maxsize=8)
+def syntax_chunker(encoding: Union[str, tiktoken.Encoding], max_tokens: int, overlap_tokens: int,
+                   parse_cache_path: Optional[str]) -> SyntaxChunker:
+    """
+    Returns a syntax chunker shared by every batch a worker process handles,
+    so its parse cache lives as long as the process.
+    """
+    return SyntaxChunker(token_chunker(encoding, max_tokens, overlap_tokens),
+                         ParseCache(parse_cache_path or ":memory:"))
+
+
+def preprocess_file(record: FileRecord, options: PreprocessOptions) -> Document:
+    """
+    Reads, decodes, normalizes and chunks one file.
+
+    Args:
+        record (FileRecord): The file to preprocess.
+        options (PreprocessOptions): How to preprocess it.
+
+    Returns:
+        Document: The chunks of the file, or an error if it could not be read.
+    """
+    return preprocess_batch([record], options)[0]
+
+
+def preprocess_batch(batch: List[FileRecord], options: PreprocessOptions) -> List[Document]:
+    """
+    Preprocesses a batch of files. Runs in the worker processes. With a
+    result cache, files whose blob SHA is already known are looked up before
+    they are read, the others once they have been read and hashed. The
+    cache's recency updates are written before the batch returns, as the
+    worker's connection is never closed.
+    """
+    if options.cache_path is None:
+        return _chunk_loaded([read_text(record, options) for record in batch], options)
+
+    cache = result_cache(options.cache_path, options.cache_max_bytes)
+    configs = [options.config_hash(record.path) for record in batch]
+    known = cache.get_many((record.blob_sha, config) for record, config in zip(batch, configs)
+                           if record.blob_sha is not None and not record.binary)
+    loaded = [(cached_document(record.path, record.size, record.blob_sha, known[(record.blob_sha, config)]), None)
+              if (record.blob_sha, config) in known else read_text(record, options)
+              for record, config in zip(batch, configs)]
+    hashed = cache.get_many((document.blob_sha, config) for record, (document, text), config
+                            in zip(batch, loaded, configs) if text is not None and record.blob_sha is None)
+    loaded = [(cached_document(document.path, document.size, document.blob_sha, hashed[(document.blob_sha, config)]),
+               None) if text is not None and (document.blob_sha, config) in hashed else (document, text)
+              for (document, text), config in zip(loaded, configs)]
+
+    documents = _chunk_loaded(loaded, options)
+    cache.put_many((document.blob_sha, config, cached_value(document, text))
+                   for document, (_, text), config in zip(documents, loaded, configs) if text is not None)
+    cache.flush()
+    return documents
+
+
+def _chunk_loaded(loaded: List[Tuple[Document, Optional[str]]], options: PreprocessOptions) -> List[Document]:
+    chunks = iter(chunk_texts([(document.path, text, document.blob_sha) for document, text in loaded
+                               if text is not None], options))
+    return [document if text is None else document._replace(chunks=next(chunks)) for document, text in loaded]
+
+
+@functools.lru_cache(maxsize=8)
+def result_cache(cache_path: str, max_bytes: Optional[int]) -> ResultCache:
+    """
+    Returns the result cache connection of a worker process.
+    """
+    return ResultCache(cache_path, max_bytes)
+
+
+def cached_value(document: Document, text: str) -> dict:
+    """
+    Converts a preprocessed file to the value stored in the result cache: the
+    normalized text and the boundaries of its chunks.
+    """
+    return {"encoding": document.encoding, "text": text,
+            "chunks": [[chunk.start_line, chunk.end_line, chunk.start_byte, chunk.end_byte, chunk.token_count,
+                        chunk.symbol] for chunk in document.chunks]}
+
+
+def cached_document(path: str, size: int, sha: str, value: dict) -> Document:
+    """
+    Rebuilds a preprocessed file from its value in the result cache.
+    """
+    data = value["text"].encode("utf-8")
+    chunks = [Chunk(path, index, data[start_byte:end_byte].decode("utf-8"), start_line, end_line, start_byte,
+                    end_byte, token_count, symbol)
+              for index, (start_line, end_line, start_byte, end_byte, token_count, symbol)
+              in enumerate(value["chunks"])]
+    return Document(path, size, value["encoding"], chunks, blob_sha=sha)
+
+
+def stream_documents(record: FileRecord, options: PreprocessOptions) -> Iterator[Document]:
+    """
+    Preprocesses a large file as it streams, in bounded memory. The text is
+    read and normalized in windows of `options.stream_memory / 32` bytes, each
+    window is chunked by line or token count as it arrives, and a document
+    part is emitted whenever its chunks reach `options.stream_memory / 16`
+    bytes. The margin covers the copies made while normalizing a window, the
+    wider in-memory form of non-ASCII text, and the part the caller still
+    holds while the next one is built. Chunks end at window boundaries and
+    syntax-aware chunking is not applied. Invalid UTF-8 is replaced rather
+    than decoding the file as Latin-1.
+
+    Args:
+        record (FileRecord): The file to preprocess.
+        options (PreprocessOptions): How to preprocess it.
+
+    Yields:
+        Document: The parts of the file, in order. A read error ends the file with
+            a part that has the error.
+    """
+    stream = TextStream(record.full_path, max(options.stream_memory // 32, 1), options.normalize_newlines,
+                        options.strip_trailing_whitespace)
+    part_limit = max(options.stream_memory // 16, 1)
+    chunks: List[Chunk] = []
+    part_bytes = part = index = 0
+    try:
+        for segment in stream:
+            for chunk in _chunk_segment(record.path, segment.text, options):
+                chunks.append(chunk._replace(index=index, start_line=chunk.start_line + segment.start_line - 1,
+                                             end_line=chunk.end_line + segment.start_line - 1,
+                                             start_byte=chunk.start_byte + segment.start_byte,
+                                             end_byte=chunk.end_byte + segment.start_byte))
+                index += 1
+                part_bytes += chunk.end_byte - chunk.start_byte
+            if part_bytes >= part_limit:
+                yield Document(record.path, record.size, "utf-8", chunks, blob_sha=record.blob_sha, part=part)
+                chunks, part_bytes, part = [], 0, part + 1
+    except OSError as e:
+        yield Document(record.path, record.size, None, chunks, str(e), record.blob_sha, part)
+        return
+    yield Document(record.path, record.size, "utf-8", chunks, blob_sha=record.blob_sha or stream.blob_sha, part=part)
+
+
+def _chunk_segment(path: str, text: str, options: PreprocessOptions) -> List[Chunk]:
+    if options.max_tokens is None:
+        return chunk_lines(path, text, options.chunk_lines)
+    return token_chunker(options.encoding, options.max_tokens, options.overlap_tokens).chunk(path, text)
+
+
+def _split_streamed(batch: List[FileRecord], options: PreprocessOptions) -> Iterator[Union[List[FileRecord],
+                                                                                          FileRecord]]:
+    # Splits the files to stream out of a batch, keeping the order.
+    rest: List[FileRecord] = []
+    for record in batch:
+        if options.streams(record):
+            if rest:
+                yield rest
+                rest = []
+            yield record
+        else:
+            rest.append(record)
+    if rest:
+        yield rest
+
+
+def iter_batches(records: Iterable[FileRecord], batch_bytes: int = DEFAULT_BATCH_BYTES) -> Iterator[List[FileRecord]]:
+    """
+    Groups files into batches of about `batch_bytes` bytes, so that a batch
+    of many small files costs about as much as one of a few large ones. A
+    file larger than `batch_bytes` gets a batch of its own. Binary files,
+    which are not read, count as empty.
+
+    Args:
+        records (Iterable[FileRecord]): The files, consumed lazily.
+        batch_bytes (int): The target number of bytes per batch.
+
+    Yields:
+        List[FileRecord]: Consecutive files, in input order.
+    """
+    batch: List[FileRecord] = []
+    batch_size = 0
+    for record in records:
+        size = 0 if record.binary else record.size
+        if batch and batch_size + size > batch_bytes:
+            yield batch
+            batch, batch_size = [], 0
+        batch.append(record)
+        batch_size += size
+    if batch:
+        yield batch
+
+
+class Preprocessor:
+    """
+    Preprocesses files on a process pool. At most `max_in_flight` batches are
+    submitted and not yet consumed; results are yielded in input order, so a
+    slow batch holds back later ones rather than reordering them. With one
+    worker, files are preprocessed in the calling process.
+    """
+
+    def __init__(self, workers: Optional[int] = None, batch_bytes: int = DEFAULT_BATCH_BYTES,
+                 max_in_flight: Optional[int] = None, options: Optional[PreprocessOptions] = None):
+        """
+        Initialize the Preprocessor object.
+
+        Args:
+            workers (Optional[int]): The number of worker processes. Defaults to the CPU count.
+            batch_bytes (int): The target number of bytes per batch.
+            max_in_flight (Optional[int]): The maximum number of batches submitted but not
+                yet consumed. Defaults to twice `workers`.
+            options (Optional[PreprocessOptions]): How to preprocess files.
+
+        Raises:
+            ValueError: If `workers`, `batch_bytes` or `max_in_flight` is not a positive integer.
+        """
+        workers = workers if workers is not None else os.cpu_count() or 1
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError(INVALID_WORKERS)
+        if not isinstance(batch_bytes, int) or batch_bytes < 1:
+            raise ValueError(INVALID_BATCH_BYTES)
+        max_in_flight = max_in_flight if max_in_flight is not None else 2 * workers
+        if not isinstance(max_in_flight, int) or max_in_flight < 1:
+            raise ValueError(INVALID_WORKERS)
+
+        self.workers = workers
+        self.batch_bytes = batch_bytes
+        self.max_in_flight = max_in_flight
+        self.options = options or PreprocessOptions()
+        self.peak_in_flight = 0
+        self._executor: Optional[Executor] = None
+
+    def __enter__(self) -> "Preprocessor":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def run(self, records: Iterable[FileRecord]) -> Iterator[Document]:
+        """
+        Preprocesses files, yielding one document per file in input order.
+
+        Args:
+            records (Iterable[FileRecord]): The files, consumed lazily, e.g. from `iter_files`.
+
+        Yields:
+            Document: The result for each file.
+        """
+        batches = (part for batch in iter_batches(records, self.batch_bytes)
+                   for part in _split_streamed(batch, self.options))
+        if self.workers == 1:
+            for batch in batches:
+                yield from self._results(batch)
+            return
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        in_flight: Deque[Union[Future, FileRecord]] = deque()
+        try:
+            for batch in batches:
+                if len(in_flight) == self.max_in_flight:
+                    yield from self._results(in_flight.popleft())
+                if isinstance(batch, FileRecord):
+                    in_flight.append(batch)
+                else:
+                    in_flight.append(self._executor.submit(preprocess_batch, batch, self.options))
+                self.peak_in_flight = max(self.peak_in_flight, len(in_flight))
+            while in_flight:
+                yield from self._results(in_flight.popleft())
+        finally:
+            for item in in_flight:
+                if isinstance(item, Future):
+                    item.cancel()
+
+    def _results(self, item: Union[Future, List[FileRecord], FileRecord]) -> Iterator[Document]:
+        # Streamed files are read in this process, while the workers carry
+        # on with the batches after them.
+        if isinstance(item, FileRecord):
+            return stream_documents(item, self.options)
+        if isinstance(item, Future):
+            return iter(item.result())
+        return iter(preprocess_batch(item, self.options))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,202 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+rules.py
+
+Per-directory `.gitignore` and `.gitattributes` rules. Rules are kept as a
+stack that follows the walk, so only the rule files of the directories
+between the root and the current one are ever loaded.
+"""
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from pathspec.patterns import GitWildMatchPattern
+
+AttributeValue = Union[bool, str]
+
+# Attribute macros built into git.
+ATTRIBUTE_MACROS = {"binary": {"diff": False, "merge": False, "text": False}}
+
+
+class RuleFile(NamedTuple):
+    """
+    The rules of one `.gitignore` or `.gitattributes` file. `base` is the
+    directory it applies to, relative to the repository root ("" for the root).
+    """
+    base: str
+    rules: List[Tuple[GitWildMatchPattern, object]]
+
+
+def _relative(base: str, path: str) -> Optional[str]:
+    if not base:
+        return path
+    prefix = base + "/"
+    return path[len(prefix):] if path.startswith(prefix) else None
+
+
+def _read_lines(path: str) -> List[str]:
+    try:
+        with open(path, encoding="utf-8", errors="surrogateescape") as f:
+            return f.read().splitlines()
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return []
+
+
+def parse_ignore_lines(lines: List[str]) -> List[Tuple[GitWildMatchPattern, bool]]:
+    """
+    Compiles gitignore lines.
+
+    Args:
+        lines (List[str]): The lines of a `.gitignore` file.
+
+    Returns:
+        List[Tuple[GitWildMatchPattern, bool]]: Each pattern, and True if it ignores
+        (False if it re-includes with `!`).
+    """
+    rules = []
+    for line in lines:
+        pattern = GitWildMatchPattern(line)
+        if pattern.include is not None:
+            rules.append((pattern, pattern.include))
+    return rules
+
+
+def parse_attribute_lines(lines: List[str]) -> List[Tuple[GitWildMatchPattern, Dict[str, AttributeValue]]]:
+    """
+    Compiles gitattributes lines. `attr` sets an attribute to True, `-attr`
+    to False and `attr=value` to the string value; `!attr` is ignored.
+
+    Args:
+        lines (List[str]): The lines of a `.gitattributes` file.
+
+    Returns:
+        List[Tuple[GitWildMatchPattern, Dict[str, AttributeValue]]]: Each pattern and the
+        attributes it sets.
+    """
+    rules = []
+    for line in lines:
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        attributes: Dict[str, AttributeValue] = {}
+        for field in fields[1:]:
+            if field.startswith("-"):
+                attributes[field[1:]] = False
+            elif field.startswith("!"):
+                continue
+            elif "=" in field:
+                name, value = field.split("=", 1)
+                attributes[name] = value
+            else:
+                attributes.update(ATTRIBUTE_MACROS.get(field, {}))
+                attributes[field] = True
+        pattern = GitWildMatchPattern(fields[0])
+        if pattern.include is not None and attributes:
+            rules.append((pattern, attributes))
+    return rules
+
+
+class RuleStack:
+    """
+    The `.gitignore` and `.gitattributes` rules in effect for the directory
+    being walked. Call `push` on entering a directory and `pop` on leaving it.
+    """
+
+    def __init__(self, root: str, extra_ignores: Optional[List[str]] = None):
+        """
+        Initialize the RuleStack object.
+
+        Args:
+            root (str): The repository root.
+            extra_ignores (Optional[List[str]]): Root-level ignore lines applied before
+                `.git/info/exclude` and the `.gitignore` files.
+        """
+        self.root = root
+        exclude = _read_lines(os.path.join(root, ".git", "info", "exclude"))
+        self.ignores: List[RuleFile] = [RuleFile("", parse_ignore_lines(list(extra_ignores or []) + exclude))]
+        self.attributes: List[RuleFile] = [RuleFile("", parse_attribute_lines(
+            _read_lines(os.path.join(root, ".git", "info", "attributes"))))]
+        self._pushed: List[Tuple[bool, bool]] = []
+
+    def push(self, directory: str) -> None:
+        """
+        Loads the rule files of a directory.
+
+        Args:
+            directory (str): The directory, relative to the root ("" for the root).
+
+        Returns:
+            None
+        """
+        full_path = os.path.join(self.root, directory)
+        ignores = parse_ignore_lines(_read_lines(os.path.join(full_path, ".gitignore")))
+        attributes = parse_attribute_lines(_read_lines(os.path.join(full_path, ".gitattributes")))
+        if ignores:
+            self.ignores.append(RuleFile(directory, ignores))
+        if attributes:
+            self.attributes.append(RuleFile(directory, attributes))
+        self._pushed.append((bool(ignores), bool(attributes)))
+
+    def pop(self) -> None:
+        ignores, attributes = self._pushed.pop()
+        if ignores:
+            self.ignores.pop()
+        if attributes:
+            self.attributes.pop()
+
+    def is_ignored(self, path: str, is_dir: bool = False) -> bool:
+        """
+        Checks whether a path is ignored. As in git, the last matching rule
+        wins and rules in deeper directories come later.
+
+        Args:
+            path (str): The path relative to the root, with `/` separators.
+            is_dir (bool): Whether the path is a directory.
+
+        Returns:
+            bool: True if the path is ignored.
+        """
+        ignored = False
+        for rule_file in self.ignores:
+            relative = _relative(rule_file.base, path)
+            if relative is None:
+                continue
+            if is_dir:
+                relative += "/"
+            for pattern, ignore in rule_file.rules:
+                if pattern.match_file(relative) is not None:
+                    ignored = ignore
+        return ignored
+
+    def attributes_for(self, path: str) -> Dict[str, AttributeValue]:
+        """
+        Resolves the attributes of a file.
+
+        Args:
+            path (str): The path relative to the root, with `/` separators.
+
+        Returns:
+            Dict[str, AttributeValue]: The attributes set on the file.
+        """
+        resolved: Dict[str, AttributeValue] = {}
+        # Repository-wide info/attributes has the highest precedence in git.
+        for rule_file in self.attributes[1:] + self.attributes[:1]:
+            relative = _relative(rule_file.base, path)
+            if relative is None:
+                continue
+            for pattern, attributes in rule_file.rules:
+                if pattern.match_file(relative) is not None:
+                    resolved.update(attributes)
+        return resolved
@@ -0,0 +1,149 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+streaming.py
+
+Reads very large text files, such as SQL dumps, logs and generated sources,
+in fixed windows with bounded memory. Bytes are decoded incrementally as
+UTF-8, replacing invalid sequences instead of failing the file, and the
+text is normalized as it streams, so the preprocessor can chunk it segment
+by segment without ever holding the whole file.
+
+Typical usage example:
+
+    stream = TextStream(path, window_bytes=1 << 20)
+    for segment in stream:
+        chunk(segment.text, segment.start_line, segment.start_byte)
+    print(stream.blob_sha)
+"""
+import codecs
+import hashlib
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+from src.archivist.errors.errors import INVALID_WINDOW_BYTES
+
+DEFAULT_WINDOW_BYTES = 1 << 20
+# Trailing whitespace shorter than this is always stripped, even with tiny windows.
+_MIN_HELD_WHITESPACE = 1 << 12
+
+
+class TextSegment(NamedTuple):
+    """
+    A run of normalized text. `start_line` is the 1-based line the segment
+    starts on and `start_byte` its offset in the UTF-8 encoding of the whole
+    normalized file. Segments end after a line break unless a single line
+    is longer than the window, in which case the line is cut. Trailing
+    whitespace is then stripped from at most the last window of the line,
+    or its last 4096 characters if the window is smaller.
+    """
+    text: str
+    start_line: int
+    start_byte: int
+
+
+class TextStream:
+    """
+    Iterates over a file as normalized text segments. The file is read with
+    buffered reads into one reused window; it is not memory-mapped, because
+    mapped pages count towards the resident set until the kernel reclaims
+    them. At most about two windows of text are held at once.
+
+    After iteration, `blob_sha` is the git blob SHA of the file, and
+    `replaced` is True if the text contains U+FFFD, which is what invalid
+    UTF-8 is replaced with.
+    """
+
+    def __init__(self, path: str, window_bytes: int = DEFAULT_WINDOW_BYTES, normalize_newlines: bool = True,
+                 strip_trailing_whitespace: bool = True):
+        """
+        Initialize the TextStream object.
+
+        Args:
+            path (str): The file to read.
+            window_bytes (int): The number of bytes read at a time.
+            normalize_newlines (bool): Convert CRLF and CR line endings to LF.
+            strip_trailing_whitespace (bool): Strip whitespace from the end of every line.
+
+        Raises:
+            ValueError: If `window_bytes` is not a positive integer.
+        """
+        if not isinstance(window_bytes, int) or window_bytes < 1:
+            raise ValueError(INVALID_WINDOW_BYTES)
+        self.path = path
+        self.window_bytes = window_bytes
+        self.normalize_newlines = normalize_newlines
+        self.strip_trailing_whitespace = strip_trailing_whitespace
+        self.blob_sha: Optional[str] = None
+        self.replaced = False
+        self.bytes_read = 0
+
+    def __iter__(self) -> Iterator[TextSegment]:
+        decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        window = bytearray(self.window_bytes)
+        view = memoryview(window)
+        pending = ""
+        line, offset = 1, 0
+        with open(self.path, "rb", buffering=0) as f:
+            digest = hashlib.sha1(b"blob %d\0" % _file_size(f))
+            while True:
+                count = f.readinto(window)
+                self.bytes_read += count
+                digest.update(view[:count])
+                text = decoder.decode(view[:count], final=not count)
+                self.replaced = self.replaced or "\ufffd" in text
+                ready, pending = self._split(pending + text, final=not count)
+                if ready:
+                    yield TextSegment(ready, line, offset)
+                    line += ready.count("\n")
+                    offset += len(ready.encode("utf-8"))
+                if not count:
+                    break
+        self.blob_sha = digest.hexdigest()
+
+    def _split(self, text: str, final: bool) -> Tuple[str, str]:
+        # Returns the text ready to emit and the text held back until more
+        # arrives: a trailing CR that may start a CRLF, and an unfinished line.
+        held = ""
+        if self.normalize_newlines and "\r" in text:
+            if text.endswith("\r") and not final:
+                text, held = text[:-1], "\r"
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if final:
+            return self._strip(text), ""
+        cut = text.rfind("\n") + 1
+        if cut == 0:
+            if len(text) < self.window_bytes:
+                return "", text + held
+            # A line longer than the window is emitted in pieces. Whitespace
+            # at the end of a piece is held back in case the line ends there.
+            piece = text.rstrip() if self.strip_trailing_whitespace else text
+            limit = max(self.window_bytes, _MIN_HELD_WHITESPACE)
+            if len(text) - len(piece) > limit:
+                # A whitespace run longer than the window cannot be held back
+                # in bounded memory; only its last window can still be stripped.
+                piece = text[:-limit]
+            return piece, text[len(piece):] + held
+        return self._strip(text[:cut]), text[cut:] + held
+
+    def _strip(self, text: str) -> str:
+        if not self.strip_trailing_whitespace:
+            return text
+        return "\n".join(line.rstrip() for line in text.split("\n"))
+
+
+def _file_size(f) -> int:
+    position = f.seek(0, 2)
+    f.seek(0)
+    return position
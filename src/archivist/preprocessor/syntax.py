@@ -0,0 +1,303 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+syntax.py
+
+Chunks source files along their definitions, so a chunk holds whole
+functions and classes rather than an arbitrary window. Python is parsed
+with `ast`; other languages plug in a `Parser`. Files without a parser, or
+that fail to parse, fall back to token windows. Parse results are cached by
+blob SHA, so re-indexing never parses an unchanged file again.
+
+Typical usage example:
+
+    chunker = SyntaxChunker(TokenChunker(max_tokens=512), ParseCache("parses.sqlite"))
+    chunks = chunker.chunk("src/app.py", text, blob_sha)
+"""
+import ast
+import bisect
+import os
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from src.archivist.crawler.blobs import blob_sha
+from src.archivist.data_storage.parse_cache import ParseCache
+from src.archivist.preprocessor.chunker import Chunk, TokenChunker, line_starts
+
+
+class Definition(NamedTuple):
+    """
+    A function or class and the 1-based, inclusive lines it spans, including
+    decorators. `symbol` is qualified by the enclosing classes, e.g.
+    `Crawler.clone_repo`.
+    """
+    symbol: str
+    kind: str
+    start_line: int
+    end_line: int
+    children: Tuple["Definition", ...] = ()
+
+    @classmethod
+    def from_json(cls, value: list) -> "Definition":
+        symbol, kind, start_line, end_line, children = value
+        return cls(symbol, kind, start_line, end_line, tuple(cls.from_json(child) for child in children))
+
+
+class Parser:
+    """
+    Finds the definitions in source files of one language. Subclass it and
+    call `register_parser` to chunk another language along its definitions.
+    Bump `version` whenever the output of `parse` changes, so results cached
+    by the old version are not reused.
+    """
+    name = "parser"
+    version = 1
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.version}"
+
+    def parse(self, text: str) -> List[Definition]:
+        """
+        Finds the top-level definitions of a file, with nested ones as children.
+
+        Args:
+            text (str): The source code.
+
+        Returns:
+            List[Definition]: The definitions, in source order, not overlapping.
+
+        Raises:
+            SyntaxError: If the text cannot be parsed.
+        """
+        raise NotImplementedError
+
+
+class PythonParser(Parser):
+    """
+    Parses Python with `ast`. Methods and nested classes are children of
+    their class; functions nested in functions are not split out.
+    """
+    name = "python"
+    version = 1
+
+    def parse(self, text: str) -> List[Definition]:
+        try:
+            tree = ast.parse(text)
+        except (ValueError, RecursionError) as e:
+            raise SyntaxError(str(e)) from e
+        return _python_definitions(tree.body, "")
+
+
+def _python_definitions(body: List[ast.stmt], prefix: str) -> List[Definition]:
+    definitions = []
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            kind, children = "function", ()
+        elif isinstance(node, ast.ClassDef):
+            kind, children = "class", tuple(_python_definitions(node.body, f"{prefix}{node.name}."))
+        else:
+            continue
+        start_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        definitions.append(Definition(prefix + node.name, kind, start_line, node.end_lineno, children))
+    return definitions
+
+
+PARSERS: Dict[str, Parser] = {}
+
+
+def register_parser(parser: Parser, *extensions: str) -> None:
+    """
+    Registers a parser for files with the given extensions, e.g. ".py".
+    Replaces any parser already registered for them.
+    """
+    for extension in extensions:
+        PARSERS[extension.lower()] = parser
+
+
+register_parser(PythonParser(), ".py", ".pyi")
+
+
+class _Unit(NamedTuple):
+    start_line: int
+    end_line: int
+    definition: Optional[Definition]
+
+
+def _units(definitions: Sequence[Definition], first_line: int, last_line: int) -> List[_Unit]:
+    # Covers the lines with the definitions and the code between them.
+    units = []
+    line = first_line
+    for definition in definitions:
+        if definition.start_line > line:
+            units.append(_Unit(line, definition.start_line - 1, None))
+        start_line = max(definition.start_line, line)
+        if definition.end_line >= start_line:
+            units.append(_Unit(start_line, definition.end_line, definition))
+            line = definition.end_line + 1
+    if line <= last_line:
+        units.append(_Unit(line, last_line, None))
+    return units
+
+
+class SyntaxChunker:
+    """
+    Chunks files along their definitions. Consecutive definitions, and the
+    code between them, are packed into one chunk while they fit in the token
+    budget of `fallback`. A class too large for one chunk is split into its
+    methods; any other definition too large for one chunk is cut into token
+    windows. A chunk holding exactly one definition records its symbol.
+
+    `token_count` counts the tokens that start in a chunk, so a token
+    spanning a line break is counted once, in the earlier chunk.
+    """
+
+    def __init__(self, fallback: Optional[TokenChunker] = None, cache: Optional[ParseCache] = None,
+                 parsers: Optional[Dict[str, Parser]] = None):
+        """
+        Initialize the SyntaxChunker object.
+
+        Args:
+            fallback (Optional[TokenChunker]): Sets the token budget and chunks files
+                that have no parser or do not parse.
+            cache (Optional[ParseCache]): Where parse results are kept. Defaults to a cache in memory.
+            parsers (Optional[Dict[str, Parser]]): Parsers by file extension. Defaults to `PARSERS`.
+        """
+        self.fallback = fallback or TokenChunker()
+        self.cache = cache if cache is not None else ParseCache()
+        self.parsers = parsers if parsers is not None else PARSERS
+        self.parses = 0
+
+    def parser_for(self, path: str) -> Optional[Parser]:
+        return self.parsers.get(os.path.splitext(path)[1].lower())
+
+    def chunk(self, path: str, text: str, sha: Optional[str] = None) -> List[Chunk]:
+        """
+        Chunks one file.
+
+        Args:
+            path (str): The path of the file, which selects the parser.
+            text (str): The normalized text.
+            sha (Optional[str]): The blob SHA of the file, which keys the parse cache.
+
+        Returns:
+            List[Chunk]: The chunks, in order. Empty text has no chunks.
+        """
+        return self.chunk_many([(path, text, sha)])[0]
+
+    def chunk_many(self, documents: Sequence[Tuple[str, str, Optional[str]]]) -> List[List[Chunk]]:
+        """
+        Chunks many files with one batched tokenizer call and one cache lookup per parser.
+
+        Args:
+            documents (Sequence[Tuple[str, str, Optional[str]]]): The path, normalized text and
+                blob SHA of each file. Without a SHA, the cache is keyed by the SHA of the text.
+
+        Returns:
+            List[List[Chunk]]: The chunks of each file, in input order.
+        """
+        definitions = self.definitions(documents)
+        offsets = self.fallback.token_offsets([text for _, text, _ in documents])
+        results = []
+        for (path, text, _), file_definitions, file_offsets in zip(documents, definitions, offsets):
+            data = text.encode("utf-8")
+            if file_definitions is None:
+                results.append(self.fallback.windows(path, data, file_offsets))
+                continue
+            chunks: List[Chunk] = []
+            starts = line_starts(data)
+            last_line = bisect.bisect_right(starts, len(data) - 1) if data else 0
+            self._pack(path, data, file_offsets, starts, _units(file_definitions, 1, last_line), chunks)
+            results.append([chunk._replace(index=index) for index, chunk in enumerate(chunks)])
+        return results
+
+    def definitions(self, documents: Sequence[Tuple[str, str, Optional[str]]]) -> List[Optional[List[Definition]]]:
+        """
+        Parses each file that has a parser, reusing cached results.
+
+        Args:
+            documents (Sequence[Tuple[str, str, Optional[str]]]): The path, normalized text and
+                blob SHA of each file.
+
+        Returns:
+            List[Optional[List[Definition]]]: The definitions of each file, or None if it has
+                no parser or failed to parse.
+        """
+        results: List[Optional[List[Definition]]] = [None] * len(documents)
+        by_parser: Dict[str, List[Tuple[int, str]]] = {}
+        for i, (path, text, sha) in enumerate(documents):
+            parser = self.parser_for(path)
+            if parser is not None:
+                by_parser.setdefault(parser.key, []).append((i, sha or blob_sha(text.encode("utf-8"))))
+
+        for key, files in by_parser.items():
+            cached = self.cache.get_many(key, [sha for _, sha in files])
+            parsed = {}
+            for i, sha in files:
+                if sha not in cached and sha not in parsed:
+                    parsed[sha] = self._parse(documents[i][0], documents[i][1])
+                value = cached[sha] if sha in cached else parsed[sha]
+                results[i] = None if value is None else [Definition.from_json(item) for item in value]
+            if parsed:
+                self.cache.put_many(key, parsed.items())
+        return results
+
+    def _parse(self, path: str, text: str) -> Optional[list]:
+        self.parses += 1
+        try:
+            return [list(definition) for definition in self.parser_for(path).parse(text)]
+        except SyntaxError:
+            return None
+
+    def _pack(self, path: str, data: bytes, offsets: List[int], starts: List[int], units: List[_Unit],
+              chunks: List[Chunk]) -> None:
+        def line_byte(line: int) -> int:
+            return starts[line - 1] if line <= len(starts) else len(data)
+
+        def token_at(byte: int) -> int:
+            return bisect.bisect_left(offsets, byte, 0, len(offsets) - 1)
+
+        group: List[_Unit] = []
+
+        def flush() -> None:
+            if not group:
+                return
+            start_byte, end_byte = line_byte(group[0].start_line), line_byte(group[-1].end_line + 1)
+            text = data[start_byte:end_byte].decode("utf-8")
+            symbols = [unit.definition.symbol for unit in group if unit.definition is not None]
+            if text.strip():
+                chunks.append(Chunk(path, 0, text, group[0].start_line, group[-1].end_line, start_byte, end_byte,
+                                    token_at(end_byte) - token_at(start_byte),
+                                    symbols[0] if len(symbols) == 1 else None))
+            group.clear()
+
+        max_tokens = self.fallback.max_tokens
+        for unit in units:
+            start_byte = line_byte(group[0].start_line if group else unit.start_line)
+            end_byte = line_byte(unit.end_line + 1)
+            if token_at(end_byte) - token_at(start_byte) <= max_tokens:
+                group.append(unit)
+                continue
+            flush()
+            start_byte = line_byte(unit.start_line)
+            if token_at(end_byte) - token_at(start_byte) <= max_tokens:
+                group.append(unit)
+            elif unit.definition is not None and unit.definition.children:
+                self._pack(path, data, offsets, starts,
+                           _units(unit.definition.children, unit.start_line, unit.end_line), chunks)
+            else:
+                symbol = unit.definition.symbol if unit.definition is not None else None
+                windows = self.fallback.windows(path, data, offsets, token_at(start_byte), token_at(end_byte), starts)
+                chunks.extend(window._replace(symbol=symbol) for window in windows)
+        flush()
@@ -0,0 +1,163 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+walker.py
+
+Walks a cloned repository lazily, one directory at a time, yielding a small
+record per file. Ignored files are never opened and file contents are only
+read on request, so memory use depends on the depth of the tree rather than
+its size.
+
+Typical usage example:
+
+    for record in iter_files(crawler.execute()):
+        if not record.binary:
+            with file_contents(record) as data:
+                index(record.path, data)
+"""
+import mmap
+import os
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Union
+
+from src.archivist.crawler.filters import PathFilter
+from src.archivist.preprocessor.rules import RuleStack
+
+BINARY_SNIFF_BYTES = 8000
+MMAP_THRESHOLD = 1 << 20
+
+# Files git hosts mark as not worth indexing.
+GENERATED_ATTRIBUTES = ("linguist-generated", "linguist-vendored")
+
+
+class FileRecord(NamedTuple):
+    """
+    One file found by `iter_files`. `path` is relative to the repository root
+    with `/` separators; `binary` comes from `.gitattributes` when set there,
+    otherwise from the first bytes of the file. `blob_sha` is only set once
+    the file has been hashed, e.g. by deduplication.
+    """
+    path: str
+    full_path: str
+    size: int
+    binary: bool
+    blob_sha: Optional[str] = None
+
+
+def is_binary(full_path: str, sniff_bytes: int = BINARY_SNIFF_BYTES) -> bool:
+    """
+    Guesses whether a file is binary the way git does: by looking for a NUL
+    byte in its first `sniff_bytes` bytes.
+
+    Args:
+        full_path (str): The path of the file.
+        sniff_bytes (int): The number of leading bytes to check.
+
+    Returns:
+        bool: True if the file looks binary.
+    """
+    with open(full_path, "rb") as f:
+        return b"\0" in f.read(sniff_bytes)
+
+
+@contextmanager
+def file_contents(record: FileRecord, mmap_threshold: int = MMAP_THRESHOLD) -> Iterator[Union[bytes, mmap.mmap]]:
+    """
+    Opens a file's contents. Files of at least `mmap_threshold` bytes are
+    memory-mapped read-only instead of copied onto the heap; the mapping is
+    closed when the context exits, so do not keep references to it.
+
+    Args:
+        record (FileRecord): The file to read.
+        mmap_threshold (int): The size from which files are memory-mapped.
+
+    Yields:
+        Union[bytes, mmap.mmap]: The contents, as bytes or a bytes-like mapping.
+    """
+    with open(record.full_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < mmap_threshold or size == 0:
+            yield f.read()
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+def iter_files(root: str, path_filter: Optional[PathFilter] = None, skip_generated: bool = True,
+               extra_ignores: Optional[List[str]] = None) -> Iterator[FileRecord]:
+    """
+    Walks a working copy depth-first in sorted order, honoring `.gitignore`
+    files at every level, `.git/info/exclude` and `.gitattributes`. The `.git`
+    directory, symlinks and ignored directories are never entered. Only the
+    listing of the directories on the current path is held in memory.
+
+    Args:
+        root (str): The root of the working copy, e.g. the path returned by `Crawler.execute()`.
+        path_filter (Optional[PathFilter]): Skip files the filter rejects.
+        skip_generated (bool): Skip files marked `linguist-generated` or `linguist-vendored`.
+        extra_ignores (Optional[List[str]]): Extra gitignore lines applied at the root.
+
+    Yields:
+        FileRecord: The path, size and binary flag of each file.
+    """
+    rules = RuleStack(root, extra_ignores)
+    rules.push("")
+    stack = [("", _sorted_entries(root))]
+    while stack:
+        directory, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            rules.pop()
+            continue
+
+        path = f"{directory}/{entry.name}" if directory else entry.name
+        if entry.is_symlink():
+            continue
+        if entry.is_dir():
+            if entry.name == ".git" or rules.is_ignored(path, is_dir=True):
+                continue
+            rules.push(path)
+            stack.append((path, _sorted_entries(entry.path)))
+            continue
+        if not entry.is_file() or rules.is_ignored(path):
+            continue
+
+        size = entry.stat().st_size
+        if path_filter is not None and not path_filter.matches(path, size):
+            continue
+        attributes = rules.attributes_for(path)
+        if skip_generated and any(attributes.get(name) is True for name in GENERATED_ATTRIBUTES):
+            continue
+        binary = _binary_attribute(attributes)
+        yield FileRecord(path, entry.path, size, is_binary(entry.path) if binary is None else binary)
+
+
+def _sorted_entries(path: str) -> Iterator[os.DirEntry]:
+    with os.scandir(path) as entries:
+        return iter(sorted(entries, key=lambda entry: entry.name))
+
+
+def _binary_attribute(attributes: dict) -> Optional[bool]:
+    # `binary` expands to `-text`; `text=auto` leaves detection to the contents.
+    text = attributes.get("text")
+    if text is True:
+        return False
+    if text is False:
+        return True
+    return None
@@ -0,0 +1,170 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_batch.py
+"""
+import json
+import os
+import tempfile
+import unittest
+
+from src.archivist.cli.batch import parse_job_line, iter_batch_jobs, run_batch, INVALID
+from src.archivist.crawler.mirror import MirrorCache
+from src.archivist.errors.errors import UNSUPPORTED_URL, INVALID_DEPTH, INVALID_BATCH_LINE, INVALID_BATCH_OPTION, \
+    INVALID_CONCURRENCY, INVALID_BATCH_FIELD, CONFLICTING_CLONE_FILTER, UNSUPPORTED_ARCHIVE_OPTION, NO_EMPTY_PATTERN, \
+    INCREMENTAL_NEEDS_CHECKOUT
+
+
+class RecordingCrawler:
+    """
+    Stands in for Crawler and records the options each job was built with.
+    """
+    built = []
+
+    def __init__(self, repo_url, output_path, **options):
+        self.repo_url = repo_url
+        self.output_path = output_path
+        self.clone_stats = None
+        RecordingCrawler.built.append((repo_url, output_path, options))
+
+    def execute(self):
+        if self.repo_url.endswith("broken"):
+            raise Exception("Cloning operation failed: not found")
+        return self.output_path
+
+
+class TestParseJobLine(unittest.TestCase):
+
+    def test_valid_line(self):
+        job = parse_job_line(json.dumps({"url": "https://github.com/org/repo", "output_path": "repos/repo",
+                                         "branch": "dev", "options": {"depth": 1}}), 3)
+        self.assertEqual((job.line_number, job.repo_url, job.output_path), (3, "https://github.com/org/repo",
+                                                                             "repos/repo"))
+        self.assertEqual(job.crawler_options, {"branch": "dev", "depth": 1})
+
+    def test_invalid_json(self):
+        with self.assertRaisesRegex(ValueError, INVALID_BATCH_LINE):
+            parse_job_line("{not json", 1)
+
+    def test_cli_validation_applies(self):
+        with self.assertRaisesRegex(ValueError, UNSUPPORTED_URL):
+            parse_job_line(json.dumps({"url": "https://example.com/repo", "output_path": "out"}), 1)
+        with self.assertRaisesRegex(ValueError, INVALID_DEPTH):
+            parse_job_line(json.dumps({"url": "https://github.com/org/repo", "output_path": "out",
+                                       "options": {"depth": -1}}), 1)
+
+    def test_unknown_option(self):
+        with self.assertRaises(ValueError):
+            parse_job_line(json.dumps({"url": "https://github.com/org/repo", "output_path": "out",
+                                       "options": {"upload_pack": "evil"}}), 1)
+
+    def test_option_types(self):
+        valid = {"depth": 2, "single_branch": True, "clone_filter": "blob:none", "incremental": False,
+                 "checkout": False, "include": ["*.py"], "exclude": [], "max_file_size": None, "retries": 0,
+                 "archive": False}
+        job = parse_job_line(json.dumps({"url": "https://github.com/org/repo", "output_path": "out",
+                                         "options": valid}), 1)
+        self.assertEqual(job.crawler_options, {"branch": None, **valid})
+
+        malformed = {"depth": True, "single_branch": "yes", "clone_filter": 1, "incremental": 1, "checkout": "false",
+                     "include": "*.py", "exclude": ["docs/", 3], "max_file_size": 1.5, "retries": False,
+                     "archive": []}
+        for name, value in malformed.items():
+            with self.subTest(name), self.assertRaisesRegex(ValueError, f"{INVALID_BATCH_OPTION} {name}"):
+                parse_job_line(json.dumps({"url": "https://github.com/org/repo", "output_path": "out",
+                                           "options": {name: value}}), 1)
+
+    def test_field_types(self):
+        for fields in ({"url": 5, "output_path": "out"}, {"url": "https://github.com/org/repo", "output_path": 5},
+                       {"url": "https://github.com/org/repo", "output_path": "out", "branch": 7}):
+            with self.subTest(fields), self.assertRaisesRegex(ValueError, INVALID_BATCH_FIELD):
+                parse_job_line(json.dumps(fields), 1)
+
+    def test_option_combinations(self):
+        for options, error in (({"clone_filter": "blob:none", "max_file_size": 10}, CONFLICTING_CLONE_FILTER),
+                               ({"archive": True, "incremental": True}, UNSUPPORTED_ARCHIVE_OPTION),
+                               ({"archive": True, "depth": 1}, UNSUPPORTED_ARCHIVE_OPTION),
+                               ({"incremental": True, "checkout": False}, INCREMENTAL_NEEDS_CHECKOUT),
+                               ({"include": [" "]}, NO_EMPTY_PATTERN)):
+            with self.subTest(options), self.assertRaisesRegex(ValueError, error):
+                parse_job_line(json.dumps({"url": "https://github.com/org/repo", "output_path": "out",
+                                           "options": options}), 1)
+
+
+class TestRunBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.batch_path = os.path.join(self.tmp.name, "jobs.jsonl")
+        self.results_path = os.path.join(self.tmp.name, "results.jsonl")
+        RecordingCrawler.built = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_batch(self, lines):
+        with open(self.batch_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def test_iter_batch_jobs_is_lazy(self):
+        self.write_batch([json.dumps({"url": "https://github.com/org/a", "output_path": "a"}), "oops"])
+        invalid = []
+        jobs = iter_batch_jobs(self.batch_path, on_invalid=invalid.append)
+        self.assertEqual(next(jobs).repo_url, "https://github.com/org/a")
+        self.assertEqual(invalid, [])
+        self.assertEqual(list(jobs), [])
+        self.assertEqual(invalid[0]["line"], 2)
+
+    def test_run_batch_writes_a_result_per_line(self):
+        lines = [json.dumps({"url": f"https://github.com/org/repo{i}", "output_path": f"out/{i}"}) for i in range(20)]
+        lines += ["", "not json", json.dumps({"url": "https://github.com/org/broken", "output_path": "out/b"}),
+                  json.dumps({"url": "https://github.com/org/a", "output_path": "out/a",
+                              "options": {"include": "*.py"}}),
+                  json.dumps({"url": "https://github.com/org/a", "output_path": 5}),
+                  json.dumps({"url": "https://github.com/org/a", "output_path": "out/a",
+                              "options": {"archive": True, "incremental": True}})]
+        self.write_batch(lines)
+
+        counts = run_batch(self.batch_path, self.results_path, max_concurrent=3, crawler_factory=RecordingCrawler)
+
+        self.assertEqual(counts, {"succeeded": 20, "failed": 1, INVALID: 4})
+        with open(self.results_path) as f:
+            results = [json.loads(line) for line in f]
+        self.assertEqual(len(results), 25)
+        self.assertEqual(sorted(result["line"] for result in results), list(range(1, 21)) + [22, 23, 24, 25, 26])
+        self.assertEqual([result["error"] for result in results if result["line"] == 24],
+                         [f"{INVALID_BATCH_OPTION} include"])
+        self.assertEqual({result["status"] for result in results if result["line"] == 23}, {"failed"})
+
+    def test_run_batch_shares_mirror_cache(self):
+        self.write_batch([json.dumps({"url": f"https://github.com/org/repo{i}", "output_path": f"out/{i}"})
+                          for i in range(2)])
+        cache = MirrorCache(os.path.join(self.tmp.name, "cache"))
+        run_batch(self.batch_path, self.results_path, mirror_cache=cache, crawler_factory=RecordingCrawler)
+        self.assertTrue(all(options["mirror_cache"] is cache for _, _, options in RecordingCrawler.built))
+
+    def test_invalid_max_concurrent_keeps_results(self):
+        self.write_batch([json.dumps({"url": "https://github.com/org/a", "output_path": "a"})])
+        with open(self.results_path, "w") as f:
+            f.write("previous\n")
+        with self.assertRaisesRegex(ValueError, INVALID_CONCURRENCY):
+            run_batch(self.batch_path, self.results_path, max_concurrent=0, crawler_factory=RecordingCrawler)
+        with open(self.results_path) as f:
+            self.assertEqual(f.read(), "previous\n")
+        self.assertEqual(RecordingCrawler.built, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,10 +19,12 @@ import unittest
 from unittest import mock
 from src.archivist.cli.cli import handle_config, handle_github_url, handle_output_path, \
     handle_branch, handle_verbose, handle_quiet, handle_token, handle_config_file, \
-    handle_embeddings_path
+    handle_embeddings_path, handle_depth, handle_clone_filter, handle_mirror_cache, handle_manifest_path, \
+    handle_max_file_size, handle_retries
 from src.archivist.__main__ import Config
 from src.archivist.errors.errors import UNSUPPORTED_CONFIG, NO_CONFIG, UNSUPPORTED_URL, NO_EMPTY_PATH, \
-    UNSUPPORTED_PATH, UNSUPPORTED_CONFIG_PATH
+    UNSUPPORTED_PATH, UNSUPPORTED_CONFIG_PATH, INVALID_DEPTH, UNSUPPORTED_CLONE_FILTER, \
+    INVALID_MAX_FILE_SIZE, INVALID_RETRIES
 
 
 class TestHandleConfig(unittest.TestCase):
@@ -223,6 +225,95 @@ class TestHandleEmbeddingsPath(unittest.TestCase):
             handle_embeddings_path(config)
 
 
+class TestHandleDepth(unittest.TestCase):
+
+    def test_no_depth(self):
+        config = Config(depth=None, github_url="test", output_path="test", branch="master", verbose=True,
+                        quiet=True, token="test", config_file="test", embeddings_path="test")
+        self.assertIsNone(handle_depth(config))
+
+    def test_valid_depth(self):
+        config = Config(depth=1, github_url="test", output_path="test", branch="master", verbose=True,
+                        quiet=True, token="test", config_file="test", embeddings_path="test")
+        self.assertIsNone(handle_depth(config))
+
+    def test_invalid_depth(self):
+        config = Config(depth=0, github_url="test", output_path="test", branch="master", verbose=True,
+                        quiet=True, token="test", config_file="test", embeddings_path="test")
+        with self.assertRaisesRegex(ValueError, INVALID_DEPTH):
+            handle_depth(config)
+
+
+class TestHandleCloneFilter(unittest.TestCase):
+
+    def test_valid_clone_filter(self):
+        config = Config(clone_filter="tree:0", github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        self.assertIsNone(handle_clone_filter(config))
+
+    def test_invalid_clone_filter(self):
+        config = Config(clone_filter="sparse:oid=abc", github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        with self.assertRaisesRegex(ValueError, UNSUPPORTED_CLONE_FILTER):
+            handle_clone_filter(config)
+
+
+class TestHandleMirrorCache(unittest.TestCase):
+
+    def test_no_mirror_cache(self):
+        config = Config(mirror_cache=None, github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        self.assertIsNone(handle_mirror_cache(config))
+
+    def test_invalid_mirror_cache(self):
+        config = Config(mirror_cache="cache<>|:", github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        with self.assertRaisesRegex(ValueError, UNSUPPORTED_PATH):
+            handle_mirror_cache(config)
+
+
+class TestHandleManifestPath(unittest.TestCase):
+
+    def test_valid_manifest_path(self):
+        config = Config(manifest_path="./manifest.json", github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        self.assertIsNone(handle_manifest_path(config))
+
+    def test_empty_manifest_path(self):
+        config = Config(manifest_path=" ", github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        with self.assertRaisesRegex(ValueError, NO_EMPTY_PATH):
+            handle_manifest_path(config)
+
+
+class TestHandleMaxFileSize(unittest.TestCase):
+
+    def test_valid_max_file_size(self):
+        config = Config(max_file_size=1024, github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        self.assertIsNone(handle_max_file_size(config))
+
+    def test_invalid_max_file_size(self):
+        config = Config(max_file_size=0, github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        with self.assertRaisesRegex(ValueError, INVALID_MAX_FILE_SIZE):
+            handle_max_file_size(config)
+
+
+class TestHandleRetries(unittest.TestCase):
+
+    def test_zero_retries(self):
+        config = Config(retries=0, github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        self.assertIsNone(handle_retries(config))
+
+    def test_negative_retries(self):
+        config = Config(retries=-1, github_url="test", output_path="test", branch="master",
+                        verbose=True, quiet=True, token="test", config_file="test", embeddings_path="test")
+        with self.assertRaisesRegex(ValueError, INVALID_RETRIES):
+            handle_retries(config)
+
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -0,0 +1,86 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+fixtures.py
+
+Local git repositories for crawler tests. Sources are bare repositories served
+over file:// so that clones go through the pack protocol like a remote would.
+"""
+import os
+import subprocess
+
+from git import Actor, Repo
+
+AUTHOR = Actor("Archivist Tests", "tests@example.com")
+
+
+def make_source_repo(root: str, commits: int = 3, file_size: int = 4096) -> str:
+    """
+    Creates a bare repository with `commits` commits, each adding one file of
+    `file_size` bytes, and returns its file:// URL.
+    """
+    work_path = os.path.join(root, "source")
+    Repo.init(work_path, initial_branch="main")
+    for i in range(commits):
+        commit_files(work_path, {f"file_{i}.txt": os.urandom(file_size // 2).hex()}, f"Commit {i}")
+
+    bare_path = os.path.join(root, "source.git")
+    Repo(work_path).clone(bare_path, bare=True)
+    with Repo(bare_path).config_writer() as config:
+        config.set_value("uploadpack", "allowFilter", "true")
+        config.set_value("uploadpack", "allowAnySHA1InWant", "true")
+    return "file://" + bare_path
+
+
+def commit_files(work_path: str, files: dict, message: str, removed: tuple = ()) -> str:
+    """
+    Writes `files` (path to text), removes `removed`, and commits in `work_path`.
+    Returns the new commit SHA.
+    """
+    repo = Repo(work_path)
+    for path, text in files.items():
+        full_path = os.path.join(work_path, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as f:
+            f.write(text)
+        repo.index.add([path])
+    if removed:
+        repo.index.remove(list(removed), working_tree=True)
+    return repo.index.commit(message, author=AUTHOR, committer=AUTHOR).hexsha
+
+
+def push_source(root: str) -> None:
+    """
+    Pushes new commits from the source working copy to the bare repository.
+    """
+    Repo(os.path.join(root, "source")).git.push(os.path.join(root, "source.git"), "main")
+
+
+def interrupt_clone(url: str, output_path: str, *options: str, marker: bytes = b"Receiving objects") -> int:
+    """
+    Starts `git clone` and kills it as soon as `marker` appears in its progress
+    output, leaving a partial clone behind. Returns the exit status of git.
+    """
+    process = subprocess.Popen(["git", "clone", "--progress", *options, url, output_path],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    output = b""
+    while marker not in output:
+        chunk = process.stderr.read1(256)
+        if not chunk:
+            break
+        output += chunk
+    process.kill()
+    process.stderr.close()
+    return process.wait()
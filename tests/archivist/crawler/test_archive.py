@@ -0,0 +1,235 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_archive.py
+"""
+import io
+import os
+import stat
+import subprocess
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from src.archivist.crawler.archive import ArchiveReader, archive_url
+from src.archivist.crawler.crawler import Crawler
+from src.archivist.errors.errors import UNSUPPORTED_ARCHIVE_URL, UNSAFE_ARCHIVE_PATH, UNSUPPORTED_ARCHIVE_OPTION
+
+COMMIT = "0123456789abcdef0123456789abcdef01234567"
+FILES = {"README.md": b"# Repo\n", "src/app.py": b"print('hi')\n", "bin/run.sh": b"#!/bin/sh\n",
+         "data/blob.bin": os.urandom(1 << 20)}
+
+
+def make_tarball(files: dict, prefix: str = "repo-0123456/", symlink: bool = True) -> bytes:
+    """
+    Builds a gzipped tarball laid out like a GitHub archive, in `files` order.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz", format=tarfile.PAX_FORMAT,
+                      pax_headers={"comment": COMMIT}) as tar:
+        for path, data in files.items():
+            info = tarfile.TarInfo(prefix + path)
+            info.size = len(data)
+            info.mode = 0o755 if path.endswith(".sh") else 0o644
+            tar.addfile(info, io.BytesIO(data))
+        if symlink:
+            info = tarfile.TarInfo(prefix + "link.py")
+            info.type = tarfile.SYMTYPE
+            info.linkname = "src/app.py"
+            tar.addfile(info)
+    return buffer.getvalue()
+
+
+def make_zip(files: dict, prefix: str = "repo-0123456/") -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.comment = COMMIT.encode("ascii")
+        for path, data in files.items():
+            info = zipfile.ZipInfo(prefix + path)
+            info.external_attr = (stat.S_IFREG | (0o755 if path.endswith(".sh") else 0o644)) << 16
+            archive.writestr(info, data)
+        link = zipfile.ZipInfo(prefix + "link.py")
+        link.external_attr = (stat.S_IFLNK | 0o777) << 16
+        archive.writestr(link, "src/app.py")
+    return buffer.getvalue()
+
+
+class ArchiveServer:
+    """
+    Serves archives from memory on a local port. Paths in `failures` answer
+    with that many 503s first; `gate`, if set, pauses each response halfway
+    until it is released.
+    """
+
+    def __init__(self):
+        self.archives = {}
+        self.failures = {}
+        self.gate = None
+        self.completed = threading.Event()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if server.failures.get(self.path):
+                    server.failures[self.path] -= 1
+                    self.send_error(503)
+                    return
+                if self.path not in server.archives:
+                    self.send_error(404)
+                    return
+                data, content_type = server.archives[self.path]
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                half = len(data) // 2
+                self.wfile.write(data[:half])
+                self.wfile.flush()
+                if server.gate is not None:
+                    server.gate.wait(10)
+                self.wfile.write(data[half:])
+                server.completed.set()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def add(self, path: str, data: bytes, content_type: str = "application/gzip") -> str:
+        self.archives[path] = (data, content_type)
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestArchiveUrl(unittest.TestCase):
+
+    def test_github_url(self):
+        self.assertEqual(archive_url("https://github.com/org/repo.git", "main"),
+                         "https://github.com/org/repo/archive/main.tar.gz")
+        self.assertEqual(archive_url("https://github.com/org/repo"), "https://github.com/org/repo/archive/HEAD.tar.gz")
+
+    def test_direct_archive_url(self):
+        url = "https://example.com/snapshots/repo.tar.gz"
+        self.assertEqual(archive_url(url, "main"), url)
+
+    def test_unsupported_url(self):
+        with self.assertRaisesRegex(ValueError, UNSUPPORTED_ARCHIVE_URL):
+            archive_url("https://example.com/org/repo")
+
+
+class TestArchiveReader(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ArchiveServer()
+        self.tarball = make_tarball(FILES)
+
+    def tearDown(self):
+        if self.server.gate is not None:
+            self.server.gate.set()
+        self.server.close()
+
+    def test_streams_tarball(self):
+        reader = ArchiveReader(self.server.add("/repo.tar.gz", self.tarball))
+        records = {record.path: record for record in reader}
+        self.assertEqual(sorted(records), sorted(FILES))
+        for path, data in FILES.items():
+            self.assertEqual(records[path].data, data)
+        expected_sha = subprocess.run(["git", "hash-object", "--stdin"], input=FILES["src/app.py"],
+                                      capture_output=True, check=True).stdout.decode().strip()
+        self.assertEqual(records["src/app.py"].blob_sha, expected_sha)
+        self.assertEqual(reader.commit, COMMIT)
+        self.assertEqual(reader.files_read, len(FILES))
+        self.assertEqual(reader.bytes_received, len(self.tarball))
+
+    def test_entries_arrive_before_download_completes(self):
+        self.server.gate = threading.Event()
+        reader = ArchiveReader(self.server.add("/repo.tar.gz", self.tarball))
+        first = next(iter(reader))
+        self.assertEqual(first.path, "README.md")
+        self.assertFalse(self.server.completed.is_set())
+        self.assertLess(reader.bytes_received, len(self.tarball))
+
+    def test_reads_zip(self):
+        reader = ArchiveReader(self.server.add("/repo.zip", make_zip(FILES), "application/zip"))
+        self.assertEqual(sorted(record.path for record in reader), sorted(FILES))
+        self.assertEqual(reader.commit, COMMIT)
+
+    def test_extract_keeps_executable_bit(self):
+        with tempfile.TemporaryDirectory() as output_path:
+            written = ArchiveReader(self.server.add("/repo.tar.gz", self.tarball)).extract(output_path)
+            self.assertEqual(written, len(FILES))
+            self.assertTrue(os.access(os.path.join(output_path, "bin/run.sh"), os.X_OK))
+            self.assertFalse(os.access(os.path.join(output_path, "README.md"), os.X_OK))
+            self.assertFalse(os.path.exists(os.path.join(output_path, "link.py")))
+
+    def test_rejects_unsafe_paths(self):
+        reader = ArchiveReader(self.server.add("/evil.tar.gz", make_tarball({"../evil.txt": b"x"}, prefix="")),
+                               strip_components=0)
+        with self.assertRaisesRegex(ValueError, UNSAFE_ARCHIVE_PATH):
+            list(reader)
+
+
+@patch.object(Crawler, 'validate_repo_url', return_value=True)
+class TestArchiveCrawl(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.server = ArchiveServer()
+        self.url = self.server.add("/repo.tar.gz", make_tarball(FILES))
+        self.output_path = os.path.join(self.tmp.name, "repo")
+
+    def tearDown(self):
+        self.server.close()
+        self.tmp.cleanup()
+
+    def test_archive_crawl_extracts_files(self, _):
+        crawler = Crawler(self.url, self.output_path, archive=True, exclude=["data/"])
+        self.assertEqual(crawler.execute(), self.output_path)
+        with open(os.path.join(self.output_path, "src/app.py"), "rb") as f:
+            self.assertEqual(f.read(), FILES["src/app.py"])
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, "data")))
+        self.assertEqual(crawler.clone_stats.objects_received, 3)
+
+    def test_archive_crawl_without_checkout_streams_blobs(self, _):
+        crawler = Crawler(self.url, self.output_path, archive=True, checkout=False)
+        crawler.execute()
+        self.assertEqual(os.listdir(self.output_path), [])
+        self.assertEqual(sorted(record.path for record in crawler.blobs(max_size=1000)),
+                         ["README.md", "bin/run.sh", "src/app.py"])
+
+    def test_archive_crawl_retries_server_errors(self, _):
+        self.server.failures["/repo.tar.gz"] = 1
+        crawler = Crawler(self.url, self.output_path, archive=True)
+        crawler.retry_policy.sleep = lambda delay: None
+        crawler.execute()
+        self.assertEqual(crawler.attempts, 2)
+        self.assertTrue(os.path.isfile(os.path.join(self.output_path, "README.md")))
+
+    def test_archive_rejects_git_options(self, _):
+        with self.assertRaisesRegex(ValueError, UNSUPPORTED_ARCHIVE_OPTION):
+            Crawler(self.url, self.output_path, archive=True, depth=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
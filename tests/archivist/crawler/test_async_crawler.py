@@ -0,0 +1,148 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_async_crawler.py
+"""
+import asyncio
+import os
+import stat
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from git import Repo
+from git.exc import GitCommandError
+
+from src.archivist.crawler.async_crawler import AsyncCrawler, crawl_all, git_options
+from src.archivist.crawler.mirror import MirrorCache
+from src.archivist.crawler.scheduler import CrawlJob, CrawlScheduler, SUCCEEDED
+from tests.archivist.crawler.fixtures import make_source_repo
+
+
+def slow_git(root: str) -> str:
+    """
+    Writes a stand-in git executable that starts a clone into its last
+    argument, prints a progress line and hangs.
+    """
+    path = os.path.join(root, "slow-git")
+    with open(path, "w") as f:
+        f.write(f"#!{sys.executable}\n"
+                "import os, sys, time\n"
+                "os.makedirs(os.path.join(sys.argv[-1], '.git', 'objects', 'pack'))\n"
+                "open(os.path.join(sys.argv[-1], '.git', 'objects', 'pack', 'tmp_pack_1'), 'w').close()\n"
+                "sys.stderr.write('Receiving objects:  10% (1/10)\\r')\n"
+                "sys.stderr.flush()\n"
+                "time.sleep(30)\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+class TestGitOptions(unittest.TestCase):
+
+    def test_git_options(self):
+        self.assertEqual(git_options({"branch": "main", "depth": 1, "single_branch": True, "bare": False}),
+                         ["--branch=main", "--depth=1", "--single-branch"])
+
+
+class TestAsyncCrawler(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = make_source_repo(self.tmp.name, commits=3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_rejects_sync_only_options(self):
+        with self.assertRaises(ValueError):
+            AsyncCrawler(self.url, "/output/path", mirror_cache=MirrorCache(os.path.join(self.tmp.name, "c")))
+
+    async def test_clone_streams_progress(self):
+        lines = []
+        crawler = AsyncCrawler(self.url, os.path.join(self.tmp.name, "clone"), depth=1, on_progress=lines.append)
+        path = await crawler.aclone_repo()
+        self.assertEqual(len(list(Repo(path).iter_commits())), 1)
+        self.assertTrue(any(line.startswith("Receiving objects") for line in lines))
+        self.assertEqual(crawler.clone_stats.objects_received, 5)
+
+    async def test_clone_failure(self):
+        crawler = AsyncCrawler("file:///no/such/repo.git", os.path.join(self.tmp.name, "clone"))
+        with self.assertRaises(GitCommandError):
+            await crawler.aclone_repo()
+
+    @patch.object(AsyncCrawler, 'validate_repo_url', return_value=True)
+    async def test_crawl_all(self, _):
+        crawlers = [AsyncCrawler(self.url, os.path.join(self.tmp.name, f"clone{i}")) for i in range(3)]
+        crawlers.append(AsyncCrawler("file:///no/such/repo.git", os.path.join(self.tmp.name, "missing")))
+        results = await crawl_all(crawlers, max_concurrent=2)
+        self.assertEqual(results[:3], [crawler.output_path for crawler in crawlers[:3]])
+        self.assertIsInstance(results[3], Exception)
+
+    async def test_timeout_kills_git(self):
+        crawler = AsyncCrawler(self.url, os.path.join(self.tmp.name, "clone"), timeout=0.5)
+        crawler.git_executable = slow_git(self.tmp.name)
+        started = asyncio.get_running_loop().time()
+        with self.assertRaises(asyncio.TimeoutError):
+            await crawler.aclone_repo()
+        self.assertLess(asyncio.get_running_loop().time() - started, 10)
+        self.assertTrue(crawler.last_progress.startswith("Receiving objects"))
+
+    @patch.object(AsyncCrawler, 'validate_repo_url', return_value=True)
+    async def test_rerun_after_timeout(self, _):
+        output_path = os.path.join(self.tmp.name, "clone")
+        crawler = AsyncCrawler(self.url, output_path, timeout=0.5)
+        crawler.git_executable = slow_git(self.tmp.name)
+        with self.assertRaisesRegex(Exception, "timed out"):
+            await crawler.aexecute()
+        self.assertEqual(os.listdir(output_path), [])
+
+        self.assertEqual(await AsyncCrawler(self.url, output_path).aexecute(), output_path)
+        self.assertEqual(len(list(Repo(output_path).iter_commits())), 3)
+
+    async def test_cancel_keeps_existing_contents(self):
+        output_path = os.path.join(self.tmp.name, "clone")
+        os.makedirs(output_path)
+        with open(os.path.join(output_path, "keep.txt"), "w") as f:
+            f.write("not ours")
+        crawler = AsyncCrawler(self.url, output_path, timeout=0.5)
+        crawler.git_executable = slow_git(self.tmp.name)
+        with self.assertRaises(asyncio.TimeoutError):
+            await crawler.aclone_repo()
+        self.assertIn("keep.txt", os.listdir(output_path))
+
+    async def test_cancel_kills_git(self):
+        crawler = AsyncCrawler(self.url, os.path.join(self.tmp.name, "clone"))
+        crawler.git_executable = slow_git(self.tmp.name)
+        task = asyncio.create_task(crawler.aclone_repo())
+        while crawler.last_progress is None:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertEqual(os.listdir(crawler.output_path), [])
+
+    @patch.object(AsyncCrawler, 'validate_repo_url', return_value=True)
+    def test_works_as_a_sync_crawler(self, _):
+        job = CrawlJob(self.url, os.path.join(self.tmp.name, "clone"))
+        with CrawlScheduler(crawler_factory=AsyncCrawler) as scheduler:
+            summary = scheduler.run([job])
+        self.assertEqual(summary.counts[SUCCEEDED], 1)
+        self.assertEqual(job.result, job.output_path)
+        self.assertEqual(len(list(Repo(job.output_path).iter_commits())), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_blobs.py
+"""
+import os
+import tempfile
+import unittest
+
+from git import Repo
+
+from src.archivist.crawler.blobs import CatFileBatch, iter_blobs, iter_tree
+from src.archivist.crawler.crawler import Crawler
+from src.archivist.crawler.mirror import MirrorCache
+from tests.archivist.crawler.fixtures import make_source_repo, commit_files, push_source
+
+
+class TestIterBlobs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = make_source_repo(self.tmp.name, commits=2)
+        self.source = os.path.join(self.tmp.name, "source")
+        commit_files(self.source, {"src/app.py": "print('hi')\n", "big.bin": "x" * 10000}, "More files")
+        os.symlink("src/app.py", os.path.join(self.source, "link.py"))
+        repo = Repo(self.source)
+        repo.index.add(["link.py"])
+        repo.index.commit("Link")
+        push_source(self.tmp.name)
+        self.bare = os.path.join(self.tmp.name, "source.git")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_iter_tree_skips_symlinks(self):
+        paths = [entry.path for entry in iter_tree(self.bare, "main")]
+        self.assertEqual(sorted(paths), ["big.bin", "file_0.txt", "file_1.txt", "src/app.py"])
+
+    def test_iter_blobs_matches_working_tree(self):
+        records = {record.path: record for record in iter_blobs(self.bare, "main")}
+        with open(os.path.join(self.source, "src/app.py"), "rb") as f:
+            self.assertEqual(records["src/app.py"].data, f.read())
+        for record in records.values():
+            self.assertEqual(record.size, len(record.data))
+        self.assertEqual(records["big.bin"].blob_sha, Repo(self.source).head.commit.tree["big.bin"].hexsha)
+
+    def test_iter_blobs_max_size(self):
+        paths = [record.path for record in iter_blobs(self.bare, "main", max_size=1000)]
+        self.assertNotIn("big.bin", paths)
+        self.assertIn("src/app.py", paths)
+
+    def test_iter_tree_unknown_revision(self):
+        with self.assertRaises(RuntimeError):
+            list(iter_tree(self.bare, "no-such-branch"))
+
+    def test_cat_file_pipelines_many_objects(self):
+        shas = [entry.blob_sha for entry in iter_tree(self.bare)] * 50
+        with CatFileBatch(self.bare, pipeline_depth=16) as cat_file:
+            objects = list(cat_file.read_many(shas))
+        self.assertEqual([sha for sha, _, _ in objects], shas)
+        self.assertTrue(all(object_type == "blob" for _, object_type, _ in objects))
+
+    def test_cat_file_missing_object(self):
+        with CatFileBatch(self.bare) as cat_file:
+            with self.assertRaises(KeyError):
+                cat_file.read("0" * 40)
+
+    def test_early_exit_closes_cleanly(self):
+        records = iter_blobs(self.bare, "main")
+        next(records)
+        records.close()
+
+
+class TestCheckoutFreeCrawl(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = make_source_repo(self.tmp.name, commits=3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_bare_clone_streams_blobs(self):
+        crawler = Crawler(self.url, os.path.join(self.tmp.name, "repo.git"), checkout=False)
+        path = crawler.clone_repo()
+        self.assertTrue(Repo(path).bare)
+        self.assertEqual(sorted(record.path for record in crawler.blobs()),
+                         ["file_0.txt", "file_1.txt", "file_2.txt"])
+
+    def test_mirror_is_read_in_place(self):
+        cache = MirrorCache(os.path.join(self.tmp.name, "cache"))
+        crawler = Crawler(self.url, os.path.join(self.tmp.name, "unused"), checkout=False, mirror_cache=cache)
+        self.assertEqual(crawler.clone_repo(), cache.mirror_path(self.url))
+        self.assertEqual(len(list(crawler.blobs("main"))), 3)
+
+    def test_blobless_bare_clone_fetches_on_demand(self):
+        crawler = Crawler(self.url, os.path.join(self.tmp.name, "partial.git"), checkout=False,
+                          clone_filter="blob:none")
+        crawler.clone_repo()
+        self.assertTrue(all(record.size == len(record.data) for record in crawler.blobs()))
+
+    def test_blobs_before_clone(self):
+        with self.assertRaises(ValueError):
+            Crawler(self.url, "/output/path").blobs()
+
+
+if __name__ == '__main__':
+    unittest.main()
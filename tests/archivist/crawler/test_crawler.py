@@ -16,9 +16,13 @@ limitations under the License.
 test_crawler.py
 """
 from unittest.mock import patch, Mock
+import os
+import tempfile
 import unittest
 from src.archivist.crawler.crawler import Crawler
+from git import Repo
 from git.exc import GitCommandError
+from tests.archivist.crawler.fixtures import make_source_repo, commit_files, push_source
 
 
 class TestValidateRepoUrl(unittest.TestCase):
@@ -86,6 +90,69 @@ class TestCloneRepo(unittest.TestCase):
             crawler.clone_repo()
 
 
+class TestCloneModes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = make_source_repo(self.tmp.name, commits=3, file_size=8192)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def clone(self, name, **kwargs):
+        crawler = Crawler(self.url, os.path.join(self.tmp.name, name), **kwargs)
+        crawler.clone_repo()
+        return crawler
+
+    def test_invalid_depth(self):
+        with self.assertRaises(ValueError):
+            Crawler(self.url, "/output/path", depth=0)
+
+    def test_invalid_clone_filter(self):
+        with self.assertRaises(ValueError):
+            Crawler(self.url, "/output/path", clone_filter="blob:limit=1k")
+
+    def test_clone_options(self):
+        crawler = Crawler(self.url, "/output/path", branch="main", depth=1, single_branch=True,
+                          clone_filter="blob:none")
+        self.assertEqual(crawler.clone_options(),
+                         {"branch": "main", "depth": 1, "single_branch": True, "filter": "blob:none"})
+
+    def test_full_clone_stats(self):
+        crawler = self.clone("full")
+        self.assertEqual(crawler.clone_stats.objects_received, 9)
+        self.assertGreater(crawler.clone_stats.bytes_received, 0)
+
+    def test_shallow_clone_transfers_less(self):
+        full = self.clone("full")
+        shallow = self.clone("shallow", depth=1)
+        self.assertEqual(len(list(Repo(shallow.output_path).iter_commits())), 1)
+        self.assertLess(shallow.clone_stats.objects_received, full.clone_stats.objects_received)
+        self.assertLess(shallow.clone_stats.bytes_received, full.clone_stats.bytes_received)
+
+    def test_single_branch_honors_branch(self):
+        Repo(os.path.join(self.tmp.name, "source.git")).git.branch("other", "main~1")
+        crawler = self.clone("single", branch="other", single_branch=True)
+        repo = Repo(crawler.output_path)
+        self.assertEqual(repo.active_branch.name, "other")
+        self.assertEqual([ref.remote_head for ref in repo.remotes.origin.refs], ["other"])
+
+    def test_blobless_clone_fetches_blobs_for_head_only(self):
+        for i in range(3):
+            commit_files(os.path.join(self.tmp.name, "source"), {"file_0.txt": os.urandom(4096).hex()},
+                         f"Rewrite {i}")
+        push_source(self.tmp.name)
+        full = self.clone("full")
+        blobless = self.clone("blobless", clone_filter="blob:none")
+        self.assertTrue(os.path.exists(os.path.join(blobless.output_path, "file_2.txt")))
+        self.assertLess(blobless.clone_stats.bytes_received, full.clone_stats.bytes_received)
+
+    def test_treeless_clone(self):
+        crawler = self.clone("treeless", clone_filter="tree:0")
+        self.assertTrue(os.path.exists(os.path.join(crawler.output_path, "file_0.txt")))
+        self.assertGreater(crawler.clone_stats.objects_received, 0)
+
+
 class TestExecute(unittest.TestCase):
 
     @patch.object(Crawler, 'validate_repo_url')
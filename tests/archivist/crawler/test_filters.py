@@ -0,0 +1,164 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_filters.py
+"""
+import asyncio
+import os
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.archivist.crawler.async_crawler import AsyncCrawler
+from src.archivist.crawler.crawler import Crawler
+from src.archivist.crawler.filters import PathFilter, escape_pattern
+from src.archivist.errors.errors import CONFLICTING_CLONE_FILTER, INVALID_MAX_FILE_SIZE, NO_EMPTY_PATTERN
+from tests.archivist.crawler.fixtures import make_source_repo, commit_files, push_source
+
+
+class TestPathFilter(unittest.TestCase):
+
+    def test_inactive_by_default(self):
+        path_filter = PathFilter()
+        self.assertFalse(path_filter.active)
+        self.assertTrue(path_filter.matches("any/path.py", 10 ** 9))
+
+    def test_include_and_exclude(self):
+        path_filter = PathFilter(include=["*.py", "docs/"], exclude=["vendor/"])
+        self.assertTrue(path_filter.matches("src/app.py"))
+        self.assertTrue(path_filter.matches("docs/index.md"))
+        self.assertFalse(path_filter.matches("README.md"))
+        self.assertFalse(path_filter.matches("vendor/lib.py"))
+
+    def test_max_file_size(self):
+        path_filter = PathFilter(max_file_size=100)
+        self.assertTrue(path_filter.matches("a.txt", 100))
+        self.assertFalse(path_filter.matches("a.txt", 101))
+        self.assertTrue(path_filter.matches("a.txt"))
+
+    def test_invalid_options(self):
+        with self.assertRaisesRegex(ValueError, NO_EMPTY_PATTERN):
+            PathFilter(include=[" "])
+        with self.assertRaisesRegex(ValueError, INVALID_MAX_FILE_SIZE):
+            PathFilter(max_file_size=0)
+
+    def test_sparse_patterns(self):
+        path_filter = PathFilter(exclude=["vendor/"])
+        self.assertEqual(path_filter.sparse_patterns(["big [1].bin"]), ["/*", "!vendor/", "!**/vendor/**",
+                                                                          "!/big \\[1\\].bin"])
+
+    def test_escape_pattern(self):
+        self.assertEqual(escape_pattern("a*b?.txt"), "/a\\*b\\?.txt")
+        self.assertEqual(escape_pattern("#notes "), "/\\#notes\\ ")
+
+
+@patch.object(Crawler, 'validate_repo_url', return_value=True)
+class TestFilteredClone(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = make_source_repo(self.tmp.name, commits=1)
+        self.source = os.path.join(self.tmp.name, "source")
+        self.big = os.urandom(50000).hex()
+        commit_files(self.source, {"src/app.py": "print('hi')\n", "vendor/lib.py": "x = 1\n",
+                                   "data/big.bin": self.big}, "More files")
+        push_source(self.tmp.name)
+        self.output_path = os.path.join(self.tmp.name, "clone")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def missing_blobs(self, repo_path):
+        objects = subprocess.run(["git", "rev-list", "--objects", "--all", "--missing=print"], cwd=repo_path,
+                                 capture_output=True, text=True, check=True).stdout.split()
+        return {line[1:] for line in objects if line.startswith("?")}
+
+    def blob_sha(self, path):
+        return subprocess.run(["git", "rev-parse", f"HEAD:{path}"], cwd=self.source, capture_output=True,
+                              text=True, check=True).stdout.strip()
+
+    def test_sparse_clone_never_fetches_excluded_blobs(self, _):
+        Crawler(self.url, self.output_path, exclude=["vendor/", "data/"]).execute()
+        self.assertTrue(os.path.isfile(os.path.join(self.output_path, "src/app.py")))
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, "vendor")))
+        self.assertEqual(self.missing_blobs(self.output_path),
+                         {self.blob_sha("vendor/lib.py"), self.blob_sha("data/big.bin")})
+
+    def test_oversized_files_are_never_fetched(self, _):
+        crawler = Crawler(self.url, self.output_path, exclude=["vendor/"], max_file_size=10000)
+        crawler.execute()
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, "vendor")))
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, "data/big.bin")))
+        self.assertEqual(self.missing_blobs(self.output_path), {self.blob_sha("data/big.bin")})
+        self.assertLess(crawler.clone_stats.bytes_received, len(self.big) // 2)
+
+    def test_clone_filter_conflicts_with_max_file_size(self, _):
+        with self.assertRaisesRegex(ValueError, CONFLICTING_CLONE_FILTER):
+            Crawler(self.url, self.output_path, clone_filter="blob:none", max_file_size=10000)
+
+    def test_include_only(self, _):
+        Crawler(self.url, self.output_path, include=["*.py"], exclude=["vendor/"]).execute()
+        files = sorted(os.path.relpath(os.path.join(root, name), self.output_path)
+                       for root, dirs, names in os.walk(self.output_path) if ".git" not in root for name in names)
+        self.assertEqual(files, ["src/app.py"])
+
+    def test_bare_clone_filters_blobs(self, _):
+        crawler = Crawler(self.url, self.output_path, checkout=False, exclude=["vendor/"], max_file_size=10000)
+        crawler.execute()
+        self.assertEqual([record.path for record in crawler.blobs()], ["file_0.txt", "src/app.py"])
+        self.assertIn(self.blob_sha("data/big.bin"), self.missing_blobs(self.output_path))
+
+    def test_async_sparse_clone(self, _):
+        crawler = AsyncCrawler(self.url, self.output_path, exclude=["vendor/"])
+        asyncio.run(crawler.aexecute())
+        self.assertTrue(os.path.isfile(os.path.join(self.output_path, "src/app.py")))
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, "vendor")))
+
+    def test_async_size_filter_runs_off_the_event_loop(self, _):
+        crawler = AsyncCrawler(self.url, self.output_path, max_file_size=10000)
+        sparse_patterns = crawler.sparse_patterns
+        threads = []
+
+        def recording_sparse_patterns(*args):
+            threads.append(threading.get_ident())
+            return sparse_patterns(*args)
+
+        crawler.sparse_patterns = recording_sparse_patterns
+        asyncio.run(crawler.aexecute())
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())
+        self.assertTrue(os.path.isfile(os.path.join(self.output_path, "src/app.py")))
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, "data/big.bin")))
+
+    def test_incremental_manifest_is_filtered(self, _):
+        crawler = Crawler(self.url, self.output_path, incremental=True, exclude=["vendor/"], max_file_size=10000)
+        crawler.execute()
+        self.assertEqual(sorted(crawler.manifest.added), ["file_0.txt", "src/app.py"])
+
+        commit_files(self.source, {"src/new.py": "y = 2\n", "vendor/new.py": "z = 3\n",
+                                   "data/huge.bin": self.big}, "Update")
+        push_source(self.tmp.name)
+        crawler = Crawler(self.url, self.output_path, incremental=True, exclude=["vendor/"], max_file_size=10000)
+        crawler.execute()
+        self.assertEqual(crawler.manifest.added, ["src/new.py"])
+        self.assertTrue(os.path.isfile(os.path.join(self.output_path, "src/new.py")))
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, "vendor")))
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, "data/huge.bin")))
+
+
+if __name__ == "__main__":
+    unittest.main()
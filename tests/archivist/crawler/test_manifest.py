@@ -0,0 +1,126 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_manifest.py
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from git import Repo
+
+from src.archivist.crawler.crawler import Crawler
+from src.archivist.crawler.manifest import FileChange, ADDED, MODIFIED, DELETED, RENAMED
+from src.archivist.crawler.mirror import MirrorCache
+from src.archivist.errors.errors import INCREMENTAL_NEEDS_CHECKOUT
+from tests.archivist.crawler.fixtures import make_source_repo, commit_files, push_source
+
+
+@patch.object(Crawler, 'validate_repo_url', return_value=True)
+class TestIncrementalCrawl(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = make_source_repo(self.tmp.name, commits=3)
+        self.source = os.path.join(self.tmp.name, "source")
+        self.output_path = os.path.join(self.tmp.name, "checkout")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def crawl(self, **kwargs):
+        crawler = Crawler(self.url, self.output_path, incremental=True, **kwargs)
+        crawler.execute()
+        return crawler.manifest
+
+    def test_first_crawl_lists_every_file_as_added(self, _):
+        manifest = self.crawl()
+        self.assertIsNone(manifest.previous_head)
+        self.assertEqual(sorted(manifest.added), ["file_0.txt", "file_1.txt", "file_2.txt"])
+
+    def test_incremental_needs_checkout(self, _):
+        with self.assertRaisesRegex(ValueError, INCREMENTAL_NEEDS_CHECKOUT):
+            Crawler(self.url, self.output_path, incremental=True, checkout=False)
+
+    def test_recrawl_without_changes(self, _):
+        first = self.crawl()
+        second = self.crawl()
+        self.assertTrue(second.unchanged)
+        self.assertEqual(second.previous_head, first.new_head)
+        self.assertEqual(second.changes, [])
+
+    def test_recrawl_reports_changes(self, _):
+        first = self.crawl()
+        os.rename(os.path.join(self.source, "file_1.txt"), os.path.join(self.source, "moved.txt"))
+        repo = Repo(self.source)
+        repo.index.remove(["file_1.txt"])
+        repo.index.add(["moved.txt"])
+        commit_files(self.source, {"file_0.txt": "changed", "docs/new.md": "# New"}, "Change files",
+                     removed=("file_2.txt",))
+        push_source(self.tmp.name)
+
+        manifest = self.crawl()
+        self.assertEqual(manifest.previous_head, first.new_head)
+        self.assertEqual(manifest.new_head, repo.head.commit.hexsha)
+        self.assertEqual(Repo(self.output_path).head.commit.hexsha, manifest.new_head)
+        self.assertFalse(manifest.forced)
+        self.assertEqual(manifest.added, ["docs/new.md"])
+        self.assertEqual(manifest.modified, ["file_0.txt"])
+        self.assertEqual(manifest.deleted, ["file_2.txt"])
+        self.assertEqual(manifest.renamed, [FileChange(RENAMED, "moved.txt", "file_1.txt")])
+        self.assertEqual(json.loads(manifest.to_json())["changes"][0]["status"], ADDED)
+
+    def test_recrawl_after_force_push(self, _):
+        self.crawl()
+        repo = Repo(self.source)
+        repo.git.reset("--hard", "HEAD~1")
+        commit_files(self.source, {"file_2.txt": "rewritten"}, "Rewrite")
+        repo.git.push("--force", os.path.join(self.tmp.name, "source.git"), "main")
+
+        manifest = self.crawl()
+        self.assertTrue(manifest.forced)
+        self.assertEqual(manifest.new_head, repo.head.commit.hexsha)
+        self.assertEqual([(c.status, c.path) for c in manifest.changes], [(MODIFIED, "file_2.txt")])
+
+    def test_recrawl_through_mirror_cache(self, _):
+        cache = MirrorCache(os.path.join(self.tmp.name, "cache"))
+        self.crawl(mirror_cache=cache)
+        commit_files(self.source, {"file_0.txt": "changed"}, "Change")
+        push_source(self.tmp.name)
+        crawler = Crawler(self.url, self.output_path, incremental=True, mirror_cache=cache)
+        crawler.execute()
+        self.assertEqual(crawler.manifest.modified, ["file_0.txt"])
+        self.assertEqual(crawler.clone_stats.objects_received, 3)
+
+    def test_recrawl_reports_transfer(self, _):
+        self.crawl()
+        commit_files(self.source, {"file_0.txt": "changed"}, "Change")
+        push_source(self.tmp.name)
+        crawler = Crawler(self.url, self.output_path, incremental=True)
+        crawler.execute()
+        self.assertEqual(crawler.clone_stats.objects_received, 3)
+        self.assertGreater(crawler.clone_stats.bytes_received, 0)
+
+    def test_manifest_deleted(self, _):
+        self.crawl()
+        commit_files(self.source, {}, "Remove", removed=("file_0.txt",))
+        push_source(self.tmp.name)
+        self.assertEqual(self.crawl().paths(DELETED), ["file_0.txt"])
+
+
+if __name__ == '__main__':
+    unittest.main()
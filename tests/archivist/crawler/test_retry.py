@@ -0,0 +1,197 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_retry.py
+"""
+import glob
+import os
+import random
+import signal
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from git import Repo
+from git.exc import GitCommandError
+
+from src.archivist.crawler.crawler import Crawler
+from src.archivist.crawler.retry import RetryPolicy, is_transient
+from src.archivist.errors.errors import INVALID_RETRIES, INVALID_RETRY_DELAY
+from tests.archivist.crawler.fixtures import make_source_repo, interrupt_clone
+
+HUNG_UP = GitCommandError(["git", "clone"], 128, "fatal: the remote end hung up unexpectedly")
+NOT_FOUND = GitCommandError(["git", "clone"], 128, "remote: Repository not found.")
+
+
+class TestIsTransient(unittest.TestCase):
+
+    def test_network_errors_are_transient(self):
+        self.assertTrue(is_transient(HUNG_UP))
+        self.assertTrue(is_transient(GitCommandError(["git"], 128, "error: RPC failed; curl 56")))
+        self.assertTrue(is_transient(GitCommandError(["git"], 128, "The requested URL returned error: 503")))
+        self.assertTrue(is_transient(ConnectionResetError()))
+
+    def test_killed_git_is_transient(self):
+        self.assertTrue(is_transient(GitCommandError(["git"], -signal.SIGKILL, "")))
+
+    def test_permanent_errors(self):
+        self.assertFalse(is_transient(NOT_FOUND))
+        self.assertFalse(is_transient(GitCommandError(["git"], 128, "fatal: Authentication failed")))
+        self.assertFalse(is_transient(GitCommandError(["git"], 128, "fatal: something unexpected")))
+        self.assertFalse(is_transient(ValueError("bad option")))
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+        self.policy = RetryPolicy(retries=3, base_delay=1.0, max_delay=3.0, rng=random.Random(0),
+                                  sleep=self.sleeps.append)
+
+    def test_delay_is_jittered_and_capped(self):
+        for retry, cap in [(1, 1.0), (2, 2.0), (3, 3.0), (10, 3.0)]:
+            delays = [self.policy.delay(retry) for _ in range(100)]
+            self.assertTrue(all(0 <= delay <= cap for delay in delays))
+            self.assertGreater(len(set(delays)), 1)
+
+    def test_retries_transient_failures(self):
+        outcomes = [HUNG_UP, HUNG_UP, "done"]
+
+        def operation():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        retries = []
+        self.assertEqual(self.policy.run(operation, on_retry=lambda *args: retries.append(args)), "done")
+        self.assertEqual([retry for retry, _, _ in retries], [1, 2])
+        self.assertEqual(self.sleeps, [delay for _, _, delay in retries])
+
+    def test_permanent_failure_is_not_retried(self):
+        calls = []
+
+        def operation():
+            calls.append(1)
+            raise NOT_FOUND
+
+        with self.assertRaises(GitCommandError):
+            self.policy.run(operation)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_gives_up_after_retries(self):
+        calls = []
+
+        def operation():
+            calls.append(1)
+            raise HUNG_UP
+
+        with self.assertRaises(GitCommandError):
+            self.policy.run(operation)
+        self.assertEqual(len(calls), 4)
+
+    def test_custom_classification(self):
+        outcomes = [LookupError("busy"), "done"]
+
+        def operation():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(self.policy.run(operation, transient=lambda e: isinstance(e, LookupError)), "done")
+        self.assertEqual(len(self.sleeps), 1)
+
+    def test_invalid_settings(self):
+        with self.assertRaisesRegex(ValueError, INVALID_RETRIES):
+            RetryPolicy(retries=-1)
+        with self.assertRaisesRegex(ValueError, INVALID_RETRY_DELAY):
+            RetryPolicy(multiplier=0.5)
+
+
+@patch.object(Crawler, 'validate_repo_url', return_value=True)
+class TestResumeClone(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = make_source_repo(self.tmp.name, commits=4, file_size=2 ** 20)
+        self.head = Repo(os.path.join(self.tmp.name, "source")).head.commit.hexsha
+        self.output_path = os.path.join(self.tmp.name, "clone")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def crawler(self, **kwargs):
+        crawler = Crawler(self.url, self.output_path, **kwargs)
+        crawler.retry_policy.sleep = lambda delay: None
+        return crawler
+
+    def test_resumes_clone_killed_mid_transfer(self, _):
+        self.assertEqual(interrupt_clone(self.url, self.output_path), -signal.SIGKILL)
+        crawler = self.crawler()
+        self.assertTrue(crawler.is_partial_clone())
+        self.assertFalse(crawler.has_checkout())
+
+        crawler.execute()
+        repo = Repo(self.output_path)
+        self.assertEqual(repo.head.commit.hexsha, self.head)
+        self.assertEqual(repo.active_branch.name, "main")
+        self.assertEqual(repo.active_branch.tracking_branch().name, "origin/main")
+        self.assertFalse(repo.is_dirty(untracked_files=True))
+        self.assertTrue(os.path.isfile(os.path.join(self.output_path, "file_3.txt")))
+        self.assertEqual(glob.glob(os.path.join(self.output_path, ".git", "objects", "pack", "tmp_*")), [])
+
+    def test_resumes_bare_clone(self, _):
+        self.assertEqual(interrupt_clone(self.url, self.output_path, "--bare"), -signal.SIGKILL)
+        crawler = self.crawler(checkout=False)
+        self.assertTrue(crawler.is_partial_clone())
+
+        crawler.execute()
+        self.assertEqual(Repo(self.output_path).head.commit.hexsha, self.head)
+        self.assertEqual(len(list(crawler.blobs())), 4)
+
+    def test_incremental_crawl_resumes_partial_clone(self, _):
+        interrupt_clone(self.url, self.output_path)
+        crawler = self.crawler(incremental=True)
+        crawler.execute()
+        self.assertEqual(len(crawler.manifest.added), 4)
+
+    def test_retries_transient_clone_failure(self, _):
+        clone_from = Repo.clone_from
+        calls = []
+
+        def flaky_clone(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise HUNG_UP
+            return clone_from(*args, **kwargs)
+
+        crawler = self.crawler()
+        with patch("git.Repo.clone_from", side_effect=flaky_clone):
+            crawler.execute()
+        self.assertEqual(crawler.attempts, 2)
+        self.assertEqual(Repo(self.output_path).head.commit.hexsha, self.head)
+
+    def test_permanent_failure_is_not_retried(self, _):
+        crawler = self.crawler()
+        with patch("git.Repo.clone_from", side_effect=NOT_FOUND):
+            with self.assertRaises(Exception):
+                crawler.execute()
+        self.assertEqual(crawler.attempts, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
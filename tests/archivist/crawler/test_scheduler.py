@@ -0,0 +1,131 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_scheduler.py
+"""
+import threading
+import time
+import unittest
+
+from src.archivist.crawler.scheduler import CrawlScheduler, CrawlJob, MAX_CONCURRENT_CRAWLS, SUCCEEDED, \
+    FAILED, CANCELLED, PENDING
+
+
+class FakeCrawler:
+    """
+    Stands in for Crawler and records how many crawls overlap.
+    """
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    release = None
+
+    def __init__(self, repo_url, output_path, **options):
+        self.repo_url = repo_url
+        self.output_path = output_path
+        self.clone_stats = None
+
+    def execute(self):
+        with FakeCrawler.lock:
+            FakeCrawler.active += 1
+            FakeCrawler.peak = max(FakeCrawler.peak, FakeCrawler.active)
+        try:
+            if FakeCrawler.release is not None:
+                FakeCrawler.release.wait(5)
+            else:
+                time.sleep(0.02)
+            if "fail" in self.repo_url:
+                raise Exception("Cloning operation failed: boom")
+            return self.output_path
+        finally:
+            with FakeCrawler.lock:
+                FakeCrawler.active -= 1
+
+
+class TestCrawlScheduler(unittest.TestCase):
+
+    def setUp(self):
+        FakeCrawler.active = 0
+        FakeCrawler.peak = 0
+        FakeCrawler.release = None
+
+    def test_default_concurrency(self):
+        with CrawlScheduler(crawler_factory=FakeCrawler) as scheduler:
+            self.assertEqual(scheduler.max_concurrent, MAX_CONCURRENT_CRAWLS)
+
+    def test_invalid_concurrency(self):
+        with self.assertRaises(ValueError):
+            CrawlScheduler(max_concurrent=0)
+
+    def test_run_respects_concurrency_limit(self):
+        jobs = [CrawlJob(f"https://github.com/org/repo{i}", f"/out/{i}") for i in range(8)]
+        with CrawlScheduler(max_concurrent=3, crawler_factory=FakeCrawler) as scheduler:
+            summary = scheduler.run(jobs)
+        self.assertEqual(summary.counts[SUCCEEDED], 8)
+        self.assertEqual(FakeCrawler.peak, 3)
+        self.assertEqual([job.result for job in jobs], [f"/out/{i}" for i in range(8)])
+        self.assertEqual(len({job.job_id for job in jobs}), 8)
+
+    def test_failures_are_aggregated(self):
+        jobs = [CrawlJob("https://github.com/org/ok", "/out/ok"),
+                CrawlJob("https://github.com/org/fail", "/out/fail")]
+        with CrawlScheduler(crawler_factory=FakeCrawler) as scheduler:
+            summary = scheduler.run(jobs)
+        self.assertEqual([job.repo_url for job in summary.failed], ["https://github.com/org/fail"])
+        self.assertIn("boom", summary.failed[0].error)
+        self.assertEqual(summary.as_dict()["counts"][FAILED], 1)
+        self.assertEqual(str(summary), "1 succeeded, 1 failed")
+
+    def test_cancel_pending_and_running_jobs(self):
+        FakeCrawler.release = threading.Event()
+        scheduler = CrawlScheduler(max_concurrent=1, crawler_factory=FakeCrawler)
+        running = scheduler.submit(CrawlJob("https://github.com/org/a", "/out/a"))
+        pending = scheduler.submit(CrawlJob("https://github.com/org/b", "/out/b"))
+        while FakeCrawler.active == 0:
+            time.sleep(0.001)
+        self.assertEqual(pending.status, PENDING)
+        self.assertTrue(scheduler.cancel(pending))
+        self.assertTrue(scheduler.cancel(running))
+        FakeCrawler.release.set()
+        summary = scheduler.wait()
+        scheduler.shutdown()
+        self.assertEqual(summary.counts[CANCELLED], 2)
+        self.assertFalse(scheduler.cancel(running))
+
+    def test_imap_consumes_jobs_lazily(self):
+        consumed = []
+
+        def jobs():
+            for i in range(10):
+                consumed.append(i)
+                yield CrawlJob(f"https://github.com/org/repo{i}", f"/out/{i}")
+
+        with CrawlScheduler(max_concurrent=2, crawler_factory=FakeCrawler) as scheduler:
+            finished = scheduler.imap(jobs(), max_pending=3)
+            next(finished)
+            self.assertLessEqual(len(consumed), 4)
+            rest = list(finished)
+            self.assertEqual(len(rest), 9)
+            self.assertEqual(scheduler.jobs, [])
+
+    def test_submit_after_shutdown(self):
+        scheduler = CrawlScheduler(crawler_factory=FakeCrawler)
+        scheduler.shutdown()
+        with self.assertRaises(RuntimeError):
+            scheduler.submit(CrawlJob("https://github.com/org/a", "/out/a"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_blob_index.py
+"""
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from src.archivist.data_storage.blob_index import BlobIndex, Occurrence
+from src.archivist.errors.errors import INVALID_CLAIM_TIMEOUT
+
+
+def claim_all(db_path: str, repo: str) -> int:
+    with BlobIndex(db_path) as index:
+        claimed = index.claim_many(Occurrence(f"{i:040x}", repo, f"file_{i}", "c1") for i in range(200))
+        return sum(claimed)
+
+
+class TestBlobIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "blobs.sqlite")
+        self.index = BlobIndex(self.db_path)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def test_first_occurrence_claims(self):
+        claimed = self.index.claim_many([Occurrence("a" * 40, "repo1", "x.py", "c1", 10),
+                                         Occurrence("a" * 40, "repo1", "vendor/x.py", "c1", 10),
+                                         Occurrence("b" * 40, "repo1", "y.py", "c1", 20)])
+        self.assertEqual(claimed, [True, False, True])
+        self.assertEqual(self.index.claim_many([Occurrence("a" * 40, "repo2", "x.py", "c9", 10)]), [False])
+        self.assertEqual([(o.repo, o.path) for o in self.index.occurrences("a" * 40)],
+                         [("repo1", "vendor/x.py"), ("repo1", "x.py"), ("repo2", "x.py")])
+        self.assertEqual(self.index.occurrence_count(), 4)
+
+    def test_expired_claims_are_reclaimed(self):
+        self.index.claim_many([Occurrence("a" * 40, "repo1", "x.py", "c1")])
+        self.index.mark_done(["a" * 40])
+        self.index.claim_many([Occurrence("b" * 40, "repo1", "y.py", "c1")])
+        with BlobIndex(self.db_path, claim_timeout=1e-9) as other:
+            self.assertEqual(other.claim_many([Occurrence("a" * 40, "repo2", "x.py", "c2"),
+                                               Occurrence("b" * 40, "repo2", "y.py", "c2")]), [False, True])
+        self.assertTrue(self.index.is_done("a" * 40))
+        self.assertEqual(self.index.blob_count(done=False), 1)
+
+    def test_concurrent_processes_claim_each_blob_once(self):
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            counts = list(pool.map(claim_all, [self.db_path] * 4, [f"repo{i}" for i in range(4)]))
+        self.assertEqual(sum(counts), 200)
+        self.assertEqual(self.index.occurrence_count(), 800)
+
+    def test_invalid_claim_timeout(self):
+        with self.assertRaisesRegex(ValueError, INVALID_CLAIM_TIMEOUT):
+            BlobIndex(self.db_path, claim_timeout=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_lru_cache.py
+"""
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from src.archivist.data_storage.lru_cache import LRUCache
+from src.archivist.errors.errors import INVALID_CACHE_LIMIT
+
+
+class PageCache(LRUCache):
+    table = "pages"
+    key_columns = (("url", "TEXT"), ("revision", "INTEGER"))
+
+    def get(self, url: str, revision: int):
+        found = self._select([(url, revision)])
+        self._touch(found)
+        return found.get((url, revision))
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "pages.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_subclass_names_table_and_keys(self):
+        with PageCache(self.db_path, max_bytes=None) as cache:
+            cache._insert([(("a", 1), b"x" * 10), (("a", 2), b"y" * 20)])
+            cache._insert([(("a", 1), b"z" * 30)])
+            self.assertEqual(cache.get("a", 1), b"x" * 10)
+            self.assertEqual((len(cache), cache.total_bytes), (2, 30))
+        with sqlite3.connect(self.db_path) as db:
+            self.assertEqual(db.execute("SELECT SUM(size) FROM pages").fetchone()[0],
+                             db.execute("SELECT bytes FROM totals").fetchone()[0])
+
+    def test_evicts_by_size_and_age(self):
+        with PageCache(self.db_path, max_bytes=30) as cache:
+            for revision in range(3):
+                cache._insert([(("a", revision), b"x" * 10)])
+                time.sleep(0.01)
+            cache.get("a", 0)
+            cache._insert([(("a", 3), b"x" * 10)])
+            self.assertEqual([revision for revision in range(4) if cache.get("a", revision)], [0, 2, 3])
+        with PageCache(self.db_path, max_bytes=None, max_age=0.05) as cache:
+            time.sleep(0.1)
+            cache._insert([(("b", 0), b"x")])
+            self.assertEqual(len(cache), 1)
+
+    def test_select_batches_keys(self):
+        keys = [("page", revision) for revision in range(1000)]
+        with PageCache(self.db_path, max_bytes=None) as cache:
+            cache._insert((key, str(key[1]).encode()) for key in keys[::2])
+            found = cache._select(keys)
+        self.assertEqual(sorted(found), keys[::2])
+        self.assertEqual(found[("page", 10)], b"10")
+
+    def test_reads_defer_recency_updates(self):
+        def last_used():
+            with sqlite3.connect(self.db_path) as db:
+                return db.execute("SELECT last_used FROM pages WHERE url = 'a'").fetchone()[0]
+
+        with PageCache(self.db_path, max_bytes=None) as cache:
+            cache._insert([(("a", 0), b"x")])
+            written = last_used()
+            time.sleep(0.01)
+            cache.get("a", 0)
+            self.assertEqual(last_used(), written)
+            self.assertFalse(cache._db.in_transaction)
+        self.assertGreater(last_used(), written)
+
+    def test_invalid_limits(self):
+        for limits in ({"max_bytes": 0}, {"max_bytes": 1.5}, {"max_bytes": None, "max_age": 0}):
+            with self.assertRaisesRegex(ValueError, INVALID_CACHE_LIMIT):
+                PageCache(self.db_path, **limits)
+
+
+if __name__ == "__main__":
+    unittest.main()
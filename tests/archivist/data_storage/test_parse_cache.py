@@ -0,0 +1,47 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_parse_cache.py
+"""
+import os
+import tempfile
+import unittest
+
+from src.archivist.data_storage.parse_cache import ParseCache
+
+
+class TestParseCache(unittest.TestCase):
+
+    def test_round_trip_and_persistence(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "parses.sqlite")
+            with ParseCache(path) as cache:
+                cache.put_many("python:1", [("a" * 40, [["f", "function", 1, 2, []]]), ("b" * 40, None)])
+            with ParseCache(path) as cache:
+                self.assertEqual(cache.get_many("python:1", ["a" * 40, "b" * 40, "c" * 40]),
+                                 {"a" * 40: [["f", "function", 1, 2, []]], "b" * 40: None})
+                self.assertEqual(cache.get_many("python:2", ["a" * 40]), {})
+                self.assertEqual(len(cache), 2)
+
+    def test_lookup_batches(self):
+        shas = [f"{i:040x}" for i in range(2000)]
+        with ParseCache() as cache:
+            cache.put_many("python:1", [(sha, i) for i, sha in enumerate(shas[::2])])
+            found = cache.get_many("python:1", shas + shas[:10])
+        self.assertEqual(found, {sha: i for i, sha in enumerate(shas[::2])})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_result_cache.py
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+from src.archivist.data_storage.result_cache import ResultCache
+from src.archivist.errors.errors import INVALID_CACHE_LIMIT
+
+
+def fill(db_path: str, worker: int) -> None:
+    with ResultCache(db_path, max_bytes=20000) as cache:
+        for batch in range(10):
+            cache.put_many((f"{worker}-{batch}-{i}", "config", os.urandom(200).hex()) for i in range(10))
+            cache.get_many((f"{worker}-{batch}-{i}", "config") for i in range(10))
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "results.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_keys_include_config_and_version(self):
+        with ResultCache(self.db_path, version="1.0") as cache:
+            cache.put_many([("a" * 40, "config-1", {"chunks": [1, 2]})])
+            self.assertEqual(cache.get("a" * 40, "config-1"), {"chunks": [1, 2]})
+            self.assertIsNone(cache.get("a" * 40, "config-2"))
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+        with ResultCache(self.db_path, version="1.1") as cache:
+            self.assertIsNone(cache.get("a" * 40, "config-1"))
+            cache.put_many([("a" * 40, "config-1", {"chunks": []})])
+            self.assertEqual(len(cache), 2)
+        with ResultCache(self.db_path, version="1.0") as cache:
+            self.assertEqual(cache.get("a" * 40, "config-1"), {"chunks": [1, 2]})
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with ResultCache(self.db_path, max_bytes=None) as cache:
+            for sha in "abc":
+                cache.put_many([(sha, "c", os.urandom(1000).hex())])
+            entry_size = cache.total_bytes // 3
+            cache.get("a", "c")
+            cache.max_bytes = 3 * entry_size + entry_size // 2
+            cache.put_many([("d", "c", os.urandom(1000).hex())])
+            self.assertEqual(sorted(sha for sha in "abcd" if cache.get(sha, "c") is not None), ["a", "c", "d"])
+            self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+
+    def test_concurrent_writers_respect_size_limit(self):
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            list(pool.map(fill, [self.db_path] * 4, range(4)))
+        with ResultCache(self.db_path, max_bytes=20000) as cache:
+            self.assertLessEqual(cache.total_bytes, 20000)
+            self.assertGreater(len(cache), 0)
+        with sqlite3.connect(self.db_path) as db:
+            self.assertEqual(db.execute("SELECT SUM(size) FROM entries").fetchone()[0],
+                             db.execute("SELECT bytes FROM totals").fetchone()[0])
+
+    def test_invalid_limit(self):
+        with self.assertRaisesRegex(ValueError, INVALID_CACHE_LIMIT):
+            ResultCache(self.db_path, max_bytes=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+bench_engine.py
+
+Throughput benchmark, in chunks per second, of the embedding engine with the
+offline hashing backend, batching chunks in input order against sorting
+them by length first, and then on worker pools of each given shape
+(workers x threads per worker). Not collected by the test runner; run it
+directly:
+
+    python -m tests.archivist.embeddings.bench_engine [path] [--repeat N] [--dimension D] [--pools 8x4 ...]
+"""
+import argparse
+import functools
+import json
+import os
+import time
+from typing import List
+
+from src.archivist.embeddings.backends import HashingBackend
+from src.archivist.embeddings.engine import EmbeddingEngine, EmbeddingWorkerPool, DEFAULT_MAX_BATCH_SIZE, \
+    DEFAULT_SORT_WINDOW
+from src.archivist.preprocessor.chunker import Chunk
+from src.archivist.preprocessor.pipeline import Preprocessor, PreprocessOptions
+from src.archivist.preprocessor.walker import iter_files
+
+
+def load_chunks(root: str, repeat: int) -> List[Chunk]:
+    with Preprocessor(workers=1, options=PreprocessOptions(chunk_lines=40)) as preprocessor:
+        chunks = [chunk for document in preprocessor.run(iter_files(root)) for chunk in document.chunks]
+    return chunks * repeat
+
+
+def measure(name: str, chunks: List[Chunk], engine: EmbeddingEngine) -> None:
+    started = time.perf_counter()
+    with engine:
+        for _ in engine.embed_chunks(chunks):
+            pass
+    elapsed = time.perf_counter() - started
+    print(f"{name:<16} {len(chunks) / elapsed:>10.1f} chunks/s {json.dumps(engine.stats.as_dict())}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=os.path.join("src", "archivist"))
+    parser.add_argument("--repeat", type=int, default=20, help="Embed the corpus this many times per run.")
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--pools", nargs="*", default=[f"{os.cpu_count()}x1"],
+                        help="Worker pool shapes to measure, as WORKERSxTHREADS.")
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.path, args.repeat)
+    print(f"{len(chunks)} chunks, {sum(len(chunk.text) for chunk in chunks)} characters")
+    backend = HashingBackend(args.dimension)
+    measure("input order", chunks, EmbeddingEngine(backend, sort_window=DEFAULT_MAX_BATCH_SIZE))
+    measure("length sorted", chunks, EmbeddingEngine(backend, sort_window=DEFAULT_SORT_WINDOW))
+    factory = functools.partial(HashingBackend, args.dimension)
+    for shape in args.pools:
+        workers, threads = map(int, shape.split("x"))
+        with EmbeddingWorkerPool(factory, workers=workers, threads=threads) as pool:
+            # Start every worker before timing, so that spawning them is not measured.
+            for future in [pool.submit(["warm up"]) for _ in range(4 * workers)]:
+                future.result()
+            pool.worker_stats.clear()
+            measure(f"pool {shape}", chunks, EmbeddingEngine(backend, pool=pool, max_in_flight=4))
+            for pid, stats in pool.as_dict()["worker_stats"].items():
+                print(f"  worker {pid:<8} {stats['texts']:>8} chunks {stats['texts_per_second']:>10.1f} chunks/s busy")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+bench_index.py
+
+Build time, batch throughput, single-query latency and recall@k of the
+approximate indexes at several store sizes. The synthetic vectors are
+clustered in a low-dimensional subspace like model embeddings, generated
+and appended one segment at a time so that 10M rows never have to fit in
+memory; the ground truth is an exact blocked scan of the store. Backends
+whose library is not installed are skipped. Not collected by the test
+runner; run it directly:
+
+    python -m tests.archivist.embeddings.bench_index [--rows N ...] [--dimension D] [--backends B ...]
+"""
+import argparse
+import math
+import os
+import tempfile
+import time
+from typing import Callable, Dict
+
+import numpy as np
+
+from src.archivist.embeddings.index import IVFIndex, VectorIndex
+from src.archivist.embeddings.search import exact_search
+from src.archivist.embeddings.store import EmbeddingStore
+from tests.archivist.embeddings.fixtures import recall
+
+SEGMENT_ROWS = 500000
+LATENT_DIMENSION = 48
+CENTERS = 1000
+TRAIN_ROWS = 262144
+LATENCY_QUERIES = 100
+QUERY_SEED = 2 ** 32 - 1
+
+
+def embeddings(rows: int, dimension: int, seed: int) -> np.ndarray:
+    shared = np.random.default_rng(1000)
+    centers = shared.normal(size=(CENTERS, LATENT_DIMENSION))
+    projection = shared.normal(size=(LATENT_DIMENSION, dimension)) / np.sqrt(LATENT_DIMENSION)
+    rng = np.random.default_rng(seed)
+    latent = centers[rng.integers(0, CENTERS, rows)] + 1.2 * rng.normal(size=(rows, LATENT_DIMENSION))
+    vectors = latent @ projection + 0.02 * rng.normal(size=(rows, dimension))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def backends(rows: int) -> Dict[str, Callable[[EmbeddingStore], VectorIndex]]:
+    lists = int(4 * math.sqrt(rows))
+    builders = {"ivf": lambda store: IVFIndex.build(store, lists=lists, probes=32, train_rows=TRAIN_ROWS)}
+    try:
+        from src.archivist.embeddings.faiss_index import FaissIndex
+    except ImportError:
+        return builders
+    builders["faiss-ivf"] = lambda store: FaissIndex.build(store, factory=f"IVF{lists},Flat", probes=32,
+                                                           train_rows=TRAIN_ROWS)
+    builders["faiss-hnsw"] = lambda store: FaissIndex.build(store, factory="HNSW32", ef_search=128,
+                                                            train_rows=TRAIN_ROWS)
+    return builders
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000, 10000000])
+    parser.add_argument("--dimension", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backends", nargs="+", default=["ivf", "faiss-ivf", "faiss-hnsw"])
+    args = parser.parse_args()
+
+    queries = embeddings(args.queries, args.dimension, seed=QUERY_SEED)
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = EmbeddingStore.create(os.path.join(tmp, "embeddings"), "synthetic", "1", args.dimension)
+            for start in range(0, rows, SEGMENT_ROWS):
+                count = min(SEGMENT_ROWS, rows - start)
+                store.append([str(i) for i in range(start, start + count)],
+                             embeddings(count, args.dimension, seed=start))
+            started = time.perf_counter()
+            _, expected = exact_search(store, queries, args.k)
+            exact_qps = args.queries / (time.perf_counter() - started)
+            print(f"{rows} x {args.dimension} vectors, {args.queries} queries, recall@{args.k}")
+            print(f"  {'exact':<11} {'':>9} {exact_qps:>9.1f} q/s")
+
+            available = backends(rows)
+            for name in args.backends:
+                if name not in available:
+                    print(f"  {name:<11} skipped: not installed")
+                    continue
+                started = time.perf_counter()
+                index = available[name](store)
+                built = time.perf_counter() - started
+                started = time.perf_counter()
+                _, found = index.search(queries, args.k)
+                qps = args.queries / (time.perf_counter() - started)
+                latencies = []
+                for query in queries[:LATENCY_QUERIES]:
+                    started = time.perf_counter()
+                    index.search(query[None], args.k)
+                    latencies.append(time.perf_counter() - started)
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+                print(f"  {name:<11} {built:>8.1f}s {qps:>9.1f} q/s  p50 {p50:.2f} ms  p99 {p99:.2f} ms  "
+                      f"recall {recall(found, expected):.3f}")
+
+
+if __name__ == "__main__":
+    main()
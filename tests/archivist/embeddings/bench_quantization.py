@@ -0,0 +1,89 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+bench_quantization.py
+
+Recall@k, memory and query throughput of compressed search against exact
+float32 search. The synthetic vectors are clustered in a low-dimensional
+subspace, as model embeddings are, rather than isotropic noise, which no
+quantizer can compress. Not collected by the test runner; run it directly:
+
+    python -m tests.archivist.embeddings.bench_quantization [--rows N] [--dimension D] [--k K]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from src.archivist.embeddings.quantization import ProductQuantizer, QuantizedStore, ScalarQuantizer
+from src.archivist.embeddings.search import exact_search
+from src.archivist.embeddings.store import EmbeddingStore
+from tests.archivist.embeddings.fixtures import clustered, recall
+
+SEGMENT_ROWS = 100000
+LATENT_DIMENSION = 48
+
+
+def embeddings(rows: int, dimension: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(1000)
+    projection = rng.normal(size=(LATENT_DIMENSION, dimension)) / np.sqrt(LATENT_DIMENSION)
+    vectors = clustered(rows, LATENT_DIMENSION, seed) @ projection
+    vectors += 0.02 * np.random.default_rng(seed).normal(size=vectors.shape)
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=100)
+    args = parser.parse_args()
+
+    vectors = embeddings(args.rows, args.dimension, seed=0)
+    queries = embeddings(args.queries, args.dimension, seed=1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = EmbeddingStore.create(os.path.join(tmp, "embeddings"), "synthetic", "1", args.dimension)
+        for start in range(0, args.rows, SEGMENT_ROWS):
+            store.append([str(i) for i in range(start, min(start + SEGMENT_ROWS, args.rows))],
+                         vectors[start:start + SEGMENT_ROWS])
+        started = time.perf_counter()
+        _, expected = exact_search(store, queries, args.k)
+        exact_qps = args.queries / (time.perf_counter() - started)
+        print(f"{args.rows} x {args.dimension} vectors, {args.queries} queries, recall@{args.k}")
+        print(f"{'float32':<12} {'':>6} {vectors.nbytes / 2 ** 20:>9.1f} MiB {1.0:>6.3f} {exact_qps:>9.1f} q/s")
+        quantizers = [("sq8", ScalarQuantizer(clip=0.0005)),
+                      ("pq d/2", ProductQuantizer(args.dimension // 2)),
+                      ("pq d/4", ProductQuantizer(args.dimension // 4)),
+                      ("pq d/8", ProductQuantizer(args.dimension // 8))]
+        for name, quantizer in quantizers:
+            started = time.perf_counter()
+            compressed = QuantizedStore.train(store, quantizer)
+            trained = time.perf_counter() - started
+            for rerank in (0, args.rerank):
+                started = time.perf_counter()
+                _, rows = compressed.search(queries, args.k, rerank=rerank)
+                qps = args.queries / (time.perf_counter() - started)
+                ratio = vectors.nbytes / compressed.nbytes
+                print(f"{name:<12} {'+' + str(rerank) if rerank else '':>6} {compressed.nbytes / 2 ** 20:>9.1f} MiB "
+                      f"{recall(rows, expected):>6.3f} {qps:>9.1f} q/s  {ratio:.0f}x smaller, trained in {trained:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+fixtures.py
+
+Synthetic embeddings and recall scoring shared by the embedding tests and
+benchmarks.
+"""
+import numpy as np
+
+
+def clustered(rows: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """
+    Unit vectors scattered around 50 random centers, standing in for embeddings.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(50, dimension))
+    vectors = centers[rng.integers(0, 50, rows)] + 0.3 * rng.normal(size=(rows, dimension))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def recall(found: np.ndarray, expected: np.ndarray) -> float:
+    return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, expected)]))
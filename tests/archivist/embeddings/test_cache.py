@@ -0,0 +1,87 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_cache.py
+"""
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from src.archivist.embeddings.backends import HashingBackend
+from src.archivist.embeddings.cache import EmbeddingCache, text_hash
+from src.archivist.errors.errors import EMBEDDING_DIMENSION_MISMATCH, INVALID_CACHE_LIMIT
+
+
+class TestEmbeddingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "embeddings.sqlite")
+        self.backend = HashingBackend(8)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_keys_include_model_identity(self):
+        keys = [text_hash(f"chunk {i}") for i in range(3)]
+        vectors = self.backend.embed([f"chunk {i}" for i in range(3)])
+        with EmbeddingCache(self.db_path, self.backend) as cache:
+            cache.put_many(zip(keys[:2], vectors[:2]))
+            found = cache.get_many(keys + keys[:1])
+            self.assertEqual(set(found), set(keys[:2]))
+            np.testing.assert_array_equal(found[keys[1]], vectors[1])
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+        for other in (HashingBackend(8, seed=1), HashingBackend(16)):
+            with EmbeddingCache(self.db_path, other) as cache:
+                self.assertIsNone(cache.get(keys[0]))
+        with EmbeddingCache(self.db_path, self.backend) as cache:
+            np.testing.assert_array_equal(cache.get(keys[0]), vectors[0])
+            self.assertEqual(len(cache), 2)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with EmbeddingCache(self.db_path, self.backend, max_bytes=None) as cache:
+            for text in "abc":
+                cache.put_many([(text_hash(text), np.ones(8))])
+                time.sleep(0.01)
+            cache.get(text_hash("a"))
+            self.assertEqual(cache.total_bytes, 3 * (16 + 32))
+        with EmbeddingCache(self.db_path, self.backend, max_bytes=3 * 48) as cache:
+            cache.put_many([(text_hash("d"), np.ones(8))])
+            self.assertIsNone(cache.get(text_hash("b")))
+            self.assertIsNotNone(cache.get(text_hash("a")))
+            self.assertEqual(cache.total_bytes, 3 * 48)
+
+    def test_entries_expire(self):
+        with EmbeddingCache(self.db_path, self.backend, max_age=0.05) as cache:
+            cache.put_many([(text_hash("old"), np.ones(8))])
+            time.sleep(0.1)
+            cache.put_many([(text_hash("new"), np.ones(8))])
+            self.assertIsNone(cache.get(text_hash("old")))
+            self.assertIsNotNone(cache.get(text_hash("new")))
+
+    def test_invalid_values(self):
+        with EmbeddingCache(self.db_path, self.backend) as cache:
+            with self.assertRaisesRegex(ValueError, EMBEDDING_DIMENSION_MISMATCH):
+                cache.put_many([(text_hash("a"), np.ones(4))])
+        for limits in ({"max_bytes": 0}, {"max_age": 0}):
+            with self.assertRaisesRegex(ValueError, INVALID_CACHE_LIMIT):
+                EmbeddingCache(self.db_path, self.backend, **limits)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_engine.py
+"""
+import functools
+import os
+import tempfile
+import threading
+import unittest
+from typing import List, Sequence
+
+import numpy as np
+from threadpoolctl import threadpool_info
+
+from src.archivist.embeddings.backends import EmbeddingBackend, HashingBackend
+from src.archivist.embeddings.cache import EmbeddingCache
+from src.archivist.embeddings.engine import EmbeddingEngine, EmbeddingWorkerPool, THREAD_VARIABLES
+from src.archivist.errors.errors import INVALID_DIMENSION, INVALID_EMBEDDING_BATCH, EMBEDDING_CACHE_MISMATCH, \
+    INVALID_WORKERS
+from src.archivist.preprocessor.chunker import Chunk
+
+
+class RecordingBackend(EmbeddingBackend):
+    """
+    Embeds a text as its length in every dimension and records each batch.
+    """
+    name = "recording"
+    dimension = 4
+
+    def __init__(self):
+        self.batches: List[List[str]] = []
+        self.threads = set()
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        return [len(text) for text in texts]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        self.batches.append(list(texts))
+        self.threads.add(threading.get_ident())
+        return np.array([[len(text)] * self.dimension for text in texts], dtype=np.float32)
+
+
+class ThreadsBackend(EmbeddingBackend):
+    """
+    Embeds every text as the thread limits of the process it runs in: the
+    largest native thread pool threadpoolctl finds, if any, and each of the
+    thread environment variables.
+    """
+    name = "threads"
+    dimension = 1 + len(THREAD_VARIABLES)
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        return [1] * len(texts)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        limits = [max((pool["num_threads"] for pool in threadpool_info()), default=0)]
+        limits += [int(os.environ[variable]) for variable in THREAD_VARIABLES]
+        return np.array([limits] * len(texts), dtype=np.float32)
+
+
+class FailingBackend(RecordingBackend):
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        raise RuntimeError("model failed")
+
+
+class TestHashingBackend(unittest.TestCase):
+
+    def test_deterministic_unit_vectors(self):
+        texts = ["def main():\n    return 1\n", "def main():\n    return 2\n", "SELECT * FROM users;", ""]
+        vectors = HashingBackend(128).embed(texts)
+        self.assertEqual(vectors.shape, (4, 128))
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1, rtol=1e-6)
+        np.testing.assert_array_equal(vectors, HashingBackend(128).embed(texts))
+        np.testing.assert_array_equal(vectors[1:2], HashingBackend(128).embed(texts[1:2]))
+        similarities = vectors @ vectors.T
+        self.assertGreater(similarities[0, 1], 0.8)
+        self.assertLess(abs(similarities[0, 2]), 0.5)
+
+    def test_seed_and_key(self):
+        self.assertFalse(np.array_equal(HashingBackend(64, seed=1).embed(["text"]),
+                                        HashingBackend(64, seed=2).embed(["text"])))
+        self.assertNotEqual(HashingBackend(64, seed=1).key, HashingBackend(64, seed=2).key)
+        self.assertEqual(HashingBackend(64).embed([]).shape, (0, 64))
+        with self.assertRaisesRegex(ValueError, INVALID_DIMENSION):
+            HashingBackend(0)
+
+
+class TestEmbeddingEngine(unittest.TestCase):
+
+    def test_plan_bounds_padded_tokens(self):
+        engine = EmbeddingEngine(RecordingBackend(), max_batch_tokens=100, max_batch_size=4)
+        lengths = [5, 50, 10, 30, 10, 200, 20, 5, 5, 5, 5]
+        batches = engine.plan(lengths)
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(len(lengths))))
+        self.assertEqual(batches[0], [5])
+        for batch in batches:
+            self.assertLessEqual(len(batch), 4)
+            self.assertEqual(max(lengths[i] for i in batch), lengths[batch[0]])
+            if len(batch) > 1:
+                self.assertLessEqual(len(batch) * lengths[batch[0]], 100)
+
+    def test_results_in_input_order(self):
+        backend = RecordingBackend()
+        texts = ["x" * (i * 7 % 23 + 1) for i in range(100)]
+        with EmbeddingEngine(backend, max_batch_tokens=64, max_batch_size=8, sort_window=30) as engine:
+            vectors = engine.embed(texts)
+        np.testing.assert_array_equal(vectors[:, 0], [len(text) for text in texts])
+        for batch in backend.batches:
+            self.assertLessEqual(len(batch), 8)
+            self.assertTrue(len(batch) == 1 or len(batch) * max(map(len, batch)) <= 64)
+        self.assertNotIn(threading.get_ident(), backend.threads)
+        stats = engine.stats.as_dict()
+        self.assertEqual(stats["texts"], 100)
+        self.assertEqual(stats["batches"], len(backend.batches))
+        self.assertEqual(stats["tokens"], sum(map(len, texts)))
+        self.assertGreater(stats["padding_efficiency"], 0.8)
+
+    def test_sorting_reduces_padding(self):
+        texts = ["x" * (i * 37 % 200 + 1) for i in range(400)]
+        with EmbeddingEngine(RecordingBackend(), max_batch_tokens=4000, max_batch_size=16) as engine:
+            engine.embed(texts)
+        in_order = sum(len(batch) * max(map(len, batch)) for batch in (texts[i:i + 16] for i in range(0, 400, 16)))
+        self.assertLess(engine.stats.padded_tokens, 0.7 * in_order)
+
+    def test_embed_chunks_uses_recorded_token_counts(self):
+        backend = RecordingBackend()
+        chunks = [Chunk("a.py", i, "x" * (i + 1), 1, 1, 0, i + 1, token_count=1) for i in range(10)]
+        with EmbeddingEngine(backend, max_batch_tokens=5, max_batch_size=100) as engine:
+            results = list(engine.embed_chunks(iter(chunks)))
+        self.assertEqual([chunk for chunk, _ in results], chunks)
+        self.assertEqual([vector[0] for _, vector in results], list(range(1, 11)))
+        self.assertEqual([len(batch) for batch in backend.batches], [5, 5])
+
+    def test_matches_backend(self):
+        backend = HashingBackend(64)
+        texts = [f"line {i}\n" * (i % 13 + 1) for i in range(300)]
+        with EmbeddingEngine(backend, max_batch_tokens=200, sort_window=64) as engine:
+            np.testing.assert_allclose(engine.embed(texts), backend.embed(texts), rtol=1e-6)
+
+    def test_cache_hits_bypass_backend(self):
+        texts = [f"chunk {i % 30}" for i in range(50)]
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "embeddings.sqlite")
+            backend = RecordingBackend()
+            with EmbeddingCache(db_path, backend) as cache, \
+                    EmbeddingEngine(backend, cache=cache, sort_window=20, max_in_flight=1) as engine:
+                first = engine.embed(texts)
+            self.assertEqual(sum(map(len, backend.batches)), 30)
+            self.assertEqual((engine.stats.cache_hits, engine.stats.cache_misses), (20, 30))
+
+            backend = RecordingBackend()
+            with EmbeddingCache(db_path, backend) as cache, EmbeddingEngine(backend, cache=cache) as engine:
+                np.testing.assert_array_equal(engine.embed(texts + ["new"]), np.vstack([first, [[3] * 4]]))
+            self.assertEqual(backend.batches, [["new"]])
+            self.assertEqual(engine.stats.as_dict()["cache_hits"], 50)
+            self.assertEqual(engine.stats.as_dict()["cache_misses"], 1)
+
+            with EmbeddingCache(db_path, HashingBackend(4)) as cache:
+                with self.assertRaisesRegex(ValueError, EMBEDDING_CACHE_MISMATCH):
+                    EmbeddingEngine(RecordingBackend(), cache=cache)
+
+    def test_invalid_limits(self):
+        for limits in ({"max_batch_tokens": 0}, {"max_batch_size": 0}, {"sort_window": 0}, {"max_in_flight": 0}):
+            with self.assertRaisesRegex(ValueError, INVALID_EMBEDDING_BATCH):
+                EmbeddingEngine(RecordingBackend(), **limits)
+
+
+class TestEmbeddingWorkerPool(unittest.TestCase):
+
+    def test_matches_backend(self):
+        texts = [f"def f{i}():\n    return {i * 'x'}\n" for i in range(300)]
+        factory = functools.partial(HashingBackend, 64)
+        with EmbeddingWorkerPool(factory, workers=2) as pool:
+            with EmbeddingEngine(factory(), pool=pool, max_batch_size=16, sort_window=100) as engine:
+                vectors = engine.embed(texts)
+            self.assertIsNone(engine._executor)
+            np.testing.assert_allclose(vectors, HashingBackend(64).embed(texts), rtol=1e-6)
+            stats = pool.as_dict()
+        self.assertEqual((stats["workers"], stats["threads"]), (2, 1))
+        self.assertEqual(sum(worker["texts"] for worker in stats["worker_stats"].values()), 300)
+        self.assertEqual(sum(worker["batches"] for worker in stats["worker_stats"].values()), engine.stats.batches)
+        self.assertEqual(sum(worker["tokens"] for worker in stats["worker_stats"].values()), engine.stats.tokens)
+
+    def test_workers_are_limited_to_their_threads(self):
+        with EmbeddingWorkerPool(ThreadsBackend, workers=1, threads=2) as pool:
+            vectors, _ = pool.submit(["a", "b"]).result()
+        self.assertTrue(np.all(vectors[:, 0] <= 2))
+        np.testing.assert_array_equal(vectors[:, 1:], 2)
+
+    def test_worker_errors_reach_the_caller(self):
+        with EmbeddingWorkerPool(FailingBackend, workers=1) as pool:
+            with self.assertRaisesRegex(RuntimeError, "model failed"):
+                EmbeddingEngine(RecordingBackend(), pool=pool).embed(["a"])
+
+    def test_invalid_sizes(self):
+        for sizes in ({"workers": 0}, {"threads": 0}, {"workers": 1.5}):
+            with self.assertRaisesRegex(ValueError, INVALID_WORKERS):
+                EmbeddingWorkerPool(HashingBackend, **sizes)
+
+
+if __name__ == "__main__":
+    unittest.main()
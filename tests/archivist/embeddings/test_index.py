@@ -0,0 +1,195 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_index.py
+"""
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.archivist.embeddings.index import IVFIndex, VectorIndex
+from src.archivist.embeddings.search import exact_search
+from src.archivist.embeddings.store import EmbeddingStore
+from src.archivist.errors.errors import INVALID_INDEX_PARAMETERS, INDEX_NOT_BUILT, INDEX_STORE_MISMATCH, \
+    EMBEDDING_DIMENSION_MISMATCH, EMPTY_INDEX_STORE, INVALID_TOP_K
+from tests.archivist.embeddings.fixtures import clustered, recall
+
+try:
+    from src.archivist.embeddings.faiss_index import FaissIndex
+except ImportError:
+    FaissIndex = None
+
+
+class IndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.vectors = clustered(4000, 32)
+        self.queries = clustered(50, 32, seed=1)
+        self.store = EmbeddingStore.create(os.path.join(self.tmp.name, "embeddings"), "model", "1", 32)
+        self.store.append([str(i) for i in range(3000)], self.vectors[:3000])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def exact(self) -> np.ndarray:
+        return exact_search(self.store, self.queries, 10)[1]
+
+    def check_update(self, index: VectorIndex) -> None:
+        self.assertEqual(index.update(), 0)
+        self.store.append([str(i) for i in range(3000, 4000)], self.vectors[3000:])
+        self.assertEqual(index.update(), 1)
+        self.assertEqual(index.rows, 4000)
+        # Each vector of the new segment finds itself.
+        _, rows = index.search(self.vectors[3000:3100], 1)
+        self.assertGreaterEqual(np.mean(rows[:, 0] == np.arange(3000, 3100)), 0.95)
+
+
+class TestIVFIndex(IndexTestCase):
+
+    def test_search(self):
+        index = IVFIndex.build(self.store, lists=40, probes=8)
+        scores, rows = index.search(self.queries, 10)
+        self.assertEqual(rows.shape, (50, 10))
+        self.assertGreaterEqual(recall(rows, self.exact()), 0.9)
+        np.testing.assert_allclose(scores, np.einsum("qd,qkd->qk", self.queries, self.vectors[rows]), atol=1e-5)
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+    def test_probing_every_list_is_exact(self):
+        index = IVFIndex.build(self.store, lists=20, probes=20)
+        _, rows = index.search(self.queries, 10)
+        self.assertEqual(recall(rows, self.exact()), 1.0)
+
+    def test_default_lists(self):
+        self.assertEqual(IVFIndex.build(self.store).lists, int(4 * np.sqrt(3000)))
+
+    def test_update_adds_new_segments(self):
+        index = IVFIndex.build(self.store, lists=40, probes=8)
+        first = os.path.join(self.store.path, f"{self.store.segments[0].name}.ivf.{index.build_id}")
+        written = os.stat(first).st_mtime_ns
+        self.check_update(index)
+        self.assertEqual(os.stat(first).st_mtime_ns, written)
+        _, rows = index.search(self.queries, 10)
+        self.assertGreaterEqual(recall(rows, self.exact()), 0.9)
+
+    def test_open(self):
+        index = IVFIndex.build(self.store, lists=40, probes=8)
+        self.store.append([str(i) for i in range(3000, 4000)], self.vectors[3000:])
+        opened = VectorIndex.open(EmbeddingStore(self.store.path), "ivf")
+        self.assertIsInstance(opened, IVFIndex)
+        self.assertEqual((opened.lists, opened.probes), (40, 8))
+        self.assertEqual(opened.rows, 3000)
+        np.testing.assert_array_equal(opened.search(self.queries, 10)[1], index.search(self.queries, 10)[1])
+        self.assertEqual(opened.update(), 1)
+        self.assertEqual(VectorIndex.open(self.store, "ivf").rows, 4000)
+
+    def test_rebuild_keeps_open_readers_consistent(self):
+        first = IVFIndex.build(self.store, lists=40, probes=8)
+        reader = VectorIndex.open(self.store, "ivf")
+        second = IVFIndex.build(self.store, lists=10, probes=2, seed=1)
+        self.assertNotEqual(second.build_id, first.build_id)
+        np.testing.assert_array_equal(reader.search(self.queries, 10)[1], first.search(self.queries, 10)[1])
+        np.testing.assert_array_equal(VectorIndex.open(self.store, "ivf").search(self.queries, 10)[1],
+                                      second.search(self.queries, 10)[1])
+        third = IVFIndex.build(self.store, lists=10, probes=2, seed=2)
+        names = os.listdir(self.store.path)
+        self.assertFalse([name for name in names if first.build_id in name])
+        self.assertTrue([name for name in names if second.build_id in name])
+        self.assertTrue([name for name in names if third.build_id in name])
+
+    def test_short_results_are_padded(self):
+        store = EmbeddingStore.create(os.path.join(self.tmp.name, "small"), "model", "1", 32)
+        store.append(["a", "b", "c"], self.vectors[:3])
+        scores, rows = IVFIndex.build(store, lists=3, probes=3).search(self.queries[:2], 5)
+        self.assertTrue(np.all(rows[:, 3:] == -1))
+        self.assertTrue(np.all(scores[:, 3:] == -np.inf))
+        self.assertEqual(sorted(rows[0, :3]), [0, 1, 2])
+
+    def test_errors(self):
+        with self.assertRaisesRegex(ValueError, INDEX_NOT_BUILT):
+            VectorIndex.open(self.store, "ivf")
+        with self.assertRaisesRegex(ValueError, INVALID_INDEX_PARAMETERS):
+            IVFIndex(self.store, probes=0)
+        with self.assertRaisesRegex(ValueError, INVALID_INDEX_PARAMETERS):
+            IVFIndex.build(self.store, train_rows=0)
+        empty = EmbeddingStore.create(os.path.join(self.tmp.name, "empty"), "model", "1", 32)
+        with self.assertRaisesRegex(ValueError, EMPTY_INDEX_STORE):
+            IVFIndex.build(empty)
+        with self.assertRaisesRegex(ValueError, INDEX_NOT_BUILT):
+            VectorIndex.open(empty, "ivf")
+        index = IVFIndex.build(self.store, lists=10)
+        with self.assertRaisesRegex(ValueError, EMBEDDING_DIMENSION_MISMATCH):
+            index.search(np.zeros((1, 16)), 10)
+        with self.assertRaisesRegex(ValueError, INVALID_TOP_K):
+            index.search(self.queries, 0)
+        manifest_path = os.path.join(self.store.path, "index.ivf.json")
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        manifest["segments"] = ["segment-999999"]
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+        with self.assertRaisesRegex(ValueError, INDEX_STORE_MISMATCH):
+            VectorIndex.open(self.store, "ivf")
+
+
+@unittest.skipIf(FaissIndex is None, "faiss-cpu is not installed")
+class TestFaissIndex(IndexTestCase):
+
+    def test_ivf(self):
+        index = FaissIndex.build(self.store, factory="IVF40,Flat", probes=8)
+        _, rows = index.search(self.queries, 10)
+        self.assertGreaterEqual(recall(rows, self.exact()), 0.9)
+        self.check_update(index)
+
+    def test_hnsw(self):
+        index = FaissIndex.build(self.store, factory="HNSW32", ef_search=128)
+        _, rows = index.search(self.queries, 10)
+        self.assertGreaterEqual(recall(rows, self.exact()), 0.9)
+        self.check_update(index)
+
+    def test_open_mapped_then_update(self):
+        index = FaissIndex.build(self.store, factory="IVF40,Flat", probes=8)
+        opened = VectorIndex.open(EmbeddingStore(self.store.path), "faiss", mmap=True)
+        np.testing.assert_array_equal(opened.search(self.queries, 10)[1], index.search(self.queries, 10)[1])
+        opened.store.append([str(i) for i in range(3000, 4000)], self.vectors[3000:])
+        self.assertEqual(opened.update(), 1)
+        self.assertEqual(self.index_files(), ["index.faiss.3000", "index.faiss.4000"])
+        self.assertEqual(VectorIndex.open(self.store, "faiss").index.ntotal, 4000)
+
+    def test_replaced_file_is_kept_for_one_update(self):
+        index = FaissIndex.build(self.store, factory="IVF40,Flat", probes=8)
+        with open(os.path.join(self.store.path, "index.faiss.json")) as f:
+            manifest = json.load(f)
+        self.store.append([str(i) for i in range(3000, 3500)], self.vectors[3000:3500])
+        index.update()
+        # A reader that read the manifest before the update can still open the file it named.
+        stale = VectorIndex.open(self.store, "faiss")
+        stale._load(manifest, mmap=True)
+        self.assertEqual(stale.index.ntotal, 3000)
+        reopened = VectorIndex.open(EmbeddingStore(self.store.path), "faiss")
+        self.store.append([str(i) for i in range(3500, 4000)], self.vectors[3500:])
+        reopened.update()
+        self.assertEqual(self.index_files(), ["index.faiss.3500", "index.faiss.4000"])
+
+    def index_files(self):
+        return sorted(name for name in os.listdir(self.store.path)
+                      if name.startswith("index.faiss.") and not name.endswith(".json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_quantization.py
+"""
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from src.archivist.embeddings.quantization import ProductQuantizer, QuantizedStore, ScalarQuantizer, load_quantizer
+from src.archivist.embeddings.search import exact_search
+from src.archivist.embeddings.store import EmbeddingStore
+from src.archivist.errors.errors import INVALID_SUBSPACES, QUANTIZER_NOT_TRAINED, EMBEDDING_DIMENSION_MISMATCH
+from tests.archivist.embeddings.fixtures import clustered, recall
+
+
+class TestQuantizers(unittest.TestCase):
+
+    def setUp(self):
+        self.vectors = clustered(3000, 32)
+        self.queries = clustered(50, 32, seed=1)
+        self.exact = np.argsort(-(self.queries @ self.vectors.T), axis=1)[:, :10]
+
+    def test_scalar_round_trip(self):
+        quantizer = ScalarQuantizer().fit(self.vectors)
+        codes = quantizer.encode(self.vectors)
+        self.assertEqual(codes.shape, (3000, 32))
+        self.assertEqual(codes.dtype, np.uint8)
+        error = np.abs(quantizer.decode(codes) - self.vectors)
+        self.assertTrue(np.all(error <= quantizer.scale / 2 + 1e-6))
+
+    def test_asymmetric_scores_match_decoded_vectors(self):
+        for quantizer in (ScalarQuantizer(clip=0.001), ProductQuantizer(8, iterations=5)):
+            codes = quantizer.fit(self.vectors).encode(self.vectors)
+            scores = quantizer.scores(quantizer.prepare(self.queries), codes)
+            np.testing.assert_allclose(scores, self.queries @ quantizer.decode(codes).T, atol=1e-4)
+
+    def test_product_quantizer(self):
+        quantizer = ProductQuantizer(8, iterations=5).fit(self.vectors)
+        self.assertEqual(quantizer.centroids.shape, (8, 256, 4))
+        codes = quantizer.encode(self.vectors)
+        self.assertEqual(codes.shape, (3000, 8))
+        reconstructed = quantizer.decode(codes)
+        self.assertLess(np.mean((reconstructed - self.vectors) ** 2), np.mean(self.vectors ** 2) / 2)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for quantizer in (ScalarQuantizer(clip=0.01), ProductQuantizer(4, iterations=2)):
+                quantizer.fit(self.vectors)
+                path = os.path.join(tmp, f"{quantizer.kind}.npz")
+                quantizer.save(path)
+                loaded = load_quantizer(path)
+                self.assertIs(type(loaded), type(quantizer))
+                np.testing.assert_array_equal(loaded.encode(self.vectors), quantizer.encode(self.vectors))
+
+    def test_invalid_quantizers(self):
+        with self.assertRaisesRegex(ValueError, INVALID_SUBSPACES):
+            ProductQuantizer(0)
+        with self.assertRaisesRegex(ValueError, INVALID_SUBSPACES):
+            ProductQuantizer(5).fit(self.vectors)
+        for quantizer in (ScalarQuantizer(), ProductQuantizer(4)):
+            with self.assertRaisesRegex(ValueError, QUANTIZER_NOT_TRAINED):
+                quantizer.encode(self.vectors)
+
+
+class TestQuantizedStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = EmbeddingStore.create(os.path.join(self.tmp.name, "embeddings"), "hashing", "1-0", 32)
+        self.vectors = clustered(4000, 32)
+        self.store.append([str(i) for i in range(3000)], self.vectors[:3000])
+        self.queries = clustered(50, 32, seed=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def exact(self) -> np.ndarray:
+        return exact_search(self.store, self.queries, 10)[1]
+
+    def test_search_recall(self):
+        scalar = QuantizedStore.train(self.store, ScalarQuantizer())
+        _, rows = scalar.search(self.queries, 10)
+        self.assertGreater(recall(rows, self.exact()), 0.9)
+        self.assertEqual(scalar.nbytes * 4, self.store.vectors(np.arange(3000)).nbytes)
+
+        product = QuantizedStore.train(self.store, ProductQuantizer(8, iterations=5))
+        _, approximate = product.search(self.queries, 10)
+        scores, reranked = product.search(self.queries, 10, rerank=100)
+        self.assertGreater(recall(reranked, self.exact()), recall(approximate, self.exact()))
+        self.assertGreater(recall(reranked, self.exact()), 0.9)
+        np.testing.assert_allclose(scores, np.einsum("qd,qkd->qk", self.queries, self.vectors[reranked]), rtol=1e-5)
+
+    def test_new_segments_are_encoded_without_retraining(self):
+        compressed = QuantizedStore.train(self.store, ScalarQuantizer())
+        self.store.append([str(i) for i in range(3000, 4000)], self.vectors[3000:])
+        self.assertEqual(compressed.update(), 1)
+        self.assertEqual(compressed.update(), 0)
+        reopened = QuantizedStore.open(EmbeddingStore(self.store.path), "sq8")
+        np.testing.assert_array_equal(reopened.quantizer.low, compressed.quantizer.low)
+        scores, rows = reopened.search(self.vectors[3500:3501], 1)
+        self.assertEqual(rows[0, 0], 3500)
+        with self.assertRaisesRegex(ValueError, EMBEDDING_DIMENSION_MISMATCH):
+            reopened.search(np.zeros((1, 8)), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_search.py
+"""
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+import numpy as np
+
+from src.archivist.embeddings.search import TopK, exact_search
+from src.archivist.embeddings.store import EmbeddingStore
+from src.archivist.errors.errors import INVALID_BLOCK_SIZE, EMBEDDING_DIMENSION_MISMATCH, INVALID_TOP_K
+
+
+class TestTopK(unittest.TestCase):
+
+    def test_merges_blocks(self):
+        scores = np.random.default_rng(0).normal(size=(5, 1000)).astype(np.float32)
+        best = TopK(5, 7)
+        for start in range(0, 1000, 64):
+            best.push(scores[:, start:start + 64], start)
+        found_scores, rows = best.result()
+        expected = np.argsort(-scores, axis=1)[:, :7]
+        np.testing.assert_array_equal(rows, expected)
+        np.testing.assert_array_equal(found_scores, np.take_along_axis(scores, expected, axis=1))
+
+    def test_fewer_rows_than_k(self):
+        best = TopK(2, 4)
+        best.push(np.array([[1.0, 3.0], [2.0, 0.0]]), 10)
+        scores, rows = best.result()
+        np.testing.assert_array_equal(rows, [[11, 10, -1, -1], [10, 11, -1, -1]])
+        self.assertTrue(np.all(np.isneginf(scores[:, 2:])))
+
+
+class TestExactSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(5000, 32)).astype(np.float32)
+        self.queries = rng.normal(size=(20, 32)).astype(np.float32)
+        self.store = EmbeddingStore.create(os.path.join(self.tmp.name, "embeddings"), "model", "1", 32)
+        for start in range(0, 5000, 2000):
+            self.store.append([str(i) for i in range(start, min(start + 2000, 5000))],
+                              self.vectors[start:start + 2000])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_matches_full_sort(self):
+        all_scores = self.queries @ self.vectors.T
+        expected = np.argsort(-all_scores, axis=1)[:, :10]
+        for block_bytes, query_batch in [(64 << 20, 1024), (10000, 1024), (10000, 3), (1, 1)]:
+            scores, rows = exact_search(self.store, self.queries, 10, block_bytes=block_bytes,
+                                        query_batch=query_batch)
+            np.testing.assert_array_equal(rows, expected)
+            np.testing.assert_allclose(scores, np.take_along_axis(all_scores, expected, axis=1), rtol=1e-5)
+
+    def test_float16_store(self):
+        store = EmbeddingStore.create(os.path.join(self.tmp.name, "half"), "model", "1", 32, dtype="float16")
+        store.append([str(i) for i in range(5000)], self.vectors)
+        _, rows = exact_search(store, self.queries, 10, block_bytes=100000)
+        half = self.vectors.astype(np.float16).astype(np.float32)
+        np.testing.assert_array_equal(rows, np.argsort(-(self.queries @ half.T), axis=1)[:, :10])
+
+    def test_fewer_rows_than_k(self):
+        store = EmbeddingStore.create(os.path.join(self.tmp.name, "small"), "model", "1", 32)
+        store.append(["a", "b"], self.vectors[:2])
+        scores, rows = exact_search(store, self.queries, 4)
+        self.assertTrue(np.all(rows[:, 2:] == -1))
+        self.assertTrue(np.all(np.isneginf(scores[:, 2:])))
+
+    def test_peak_memory_follows_block_size(self):
+        store = EmbeddingStore.create(os.path.join(self.tmp.name, "large"), "model", "1", 256)
+        rng = np.random.default_rng(1)
+        for _ in range(4):
+            store.append(["x"] * 10000, rng.normal(size=(10000, 256)).astype(np.float32))
+        queries = rng.normal(size=(100, 256)).astype(np.float32)
+        tracemalloc.start()
+        try:
+            exact_search(store, queries, 10, block_bytes=1 << 20)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # The store's 40 MB of vectors are never read into memory at once.
+        self.assertLess(peak, 1.25 * (1 << 20))
+
+    def test_invalid_arguments(self):
+        with self.assertRaisesRegex(ValueError, EMBEDDING_DIMENSION_MISMATCH):
+            exact_search(self.store, np.zeros((1, 16)), 10)
+        with self.assertRaisesRegex(ValueError, INVALID_BLOCK_SIZE):
+            exact_search(self.store, self.queries, 10, block_bytes=0)
+        with self.assertRaisesRegex(ValueError, INVALID_BLOCK_SIZE):
+            exact_search(self.store, self.queries, 10, query_batch=0)
+        for k in (0, -1, 1.5, True):
+            with self.assertRaisesRegex(ValueError, INVALID_TOP_K):
+                exact_search(self.store, self.queries, k)
+        with self.assertRaisesRegex(ValueError, INVALID_TOP_K):
+            TopK(2, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_store.py
+"""
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import Mock, patch
+
+import numpy as np
+
+from src.archivist.embeddings import store as store_module
+from src.archivist.embeddings.store import EmbeddingStore, MANIFEST
+from src.archivist.errors.errors import EMBEDDING_DIMENSION_MISMATCH, EMBEDDING_STORE_MISMATCH, \
+    NOT_AN_EMBEDDING_STORE, UNSUPPORTED_STORE_DTYPE
+
+
+def append_segment(path: str, worker: int) -> None:
+    store = EmbeddingStore(path)
+    for segment in range(3):
+        store.append([f"{worker}:{segment}:{i}" for i in range(10)], np.full((10, 4), worker, dtype=np.float32))
+
+
+class TestEmbeddingStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "embeddings")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append_and_read(self):
+        store = EmbeddingStore.create(self.path, "hashing", "1-0", 4)
+        first = np.arange(12, dtype=np.float32).reshape(3, 4)
+        store.append(["a:0", "a:1", "é:2"], first)
+        with store.writer() as writer:
+            for i in range(5000):
+                writer.add(f"b:{i}", np.full(4, i, dtype=np.float64))
+        self.assertEqual(len(store), 5003)
+        self.assertEqual([segment.rows for segment in store.segments], [3, 5000])
+
+        reopened = EmbeddingStore(self.path)
+        self.assertEqual(reopened.header, store.header)
+        self.assertIsNone(reopened.segments[1]._vectors)
+        segments = list(reopened.iter_vectors())
+        self.assertEqual([start for start, _ in segments], [0, 3])
+        self.assertIsInstance(segments[1][1], np.memmap)
+        np.testing.assert_array_equal(segments[0][1], first)
+        np.testing.assert_array_equal(segments[1][1][4321], [4321] * 4)
+        self.assertEqual(reopened.segments[0].ids(), ["a:0", "a:1", "é:2"])
+        self.assertEqual(reopened.ids([2, 3, 5002]), ["é:2", "b:0", "b:4999"])
+        with self.assertRaises(ValueError):
+            segments[0][1][0, 0] = 1
+
+    def test_float16(self):
+        store = EmbeddingStore.create(self.path, "hashing", "1-0", 2, dtype="float16")
+        store.append(["a"], np.array([[0.5, -1.25]]))
+        vectors = EmbeddingStore(self.path).segments[0].vectors
+        self.assertEqual(vectors.dtype, np.dtype("<f2"))
+        self.assertEqual(os.path.getsize(os.path.join(self.path, "segment-000000.vectors")), 4)
+        np.testing.assert_array_equal(vectors, [[0.5, -1.25]])
+
+    def test_failed_or_empty_writes_are_not_committed(self):
+        store = EmbeddingStore.create(self.path, "hashing", "1-0", 2)
+        with self.assertRaises(RuntimeError):
+            with store.writer() as writer:
+                writer.add("a", np.zeros(2))
+                raise RuntimeError
+        with store.writer():
+            pass
+        self.assertEqual(len(EmbeddingStore(self.path)), 0)
+        self.assertEqual(sorted(os.listdir(self.path)), [".lock", MANIFEST])
+
+    def test_concurrent_writers(self):
+        EmbeddingStore.create(self.path, "hashing", "1-0", 4)
+        with ProcessPoolExecutor(max_workers=3) as executor:
+            list(executor.map(append_segment, [self.path] * 3, range(3)))
+        store = EmbeddingStore(self.path)
+        self.assertEqual(len(store.segments), 9)
+        for segment in store.segments:
+            worker = segment.ids(0, 1)[0].split(":")[0]
+            np.testing.assert_array_equal(segment.vectors, np.full((10, 4), int(worker)))
+
+    def test_locks_with_msvcrt_without_fcntl(self):
+        msvcrt = Mock(LK_LOCK=1, LK_UNLCK=0)
+        msvcrt.locking.side_effect = [OSError, None, None]
+        with patch.object(store_module, "fcntl", None), patch.object(store_module, "msvcrt", msvcrt, create=True):
+            store = EmbeddingStore.create(os.path.join(self.tmp.name, "windows"), "model", "1", 4)
+        self.assertTrue(os.path.exists(os.path.join(store.path, MANIFEST)))
+        self.assertEqual([call.args[1:] for call in msvcrt.locking.call_args_list], [(1, 1), (1, 1), (0, 1)])
+
+    def test_opens_large_store_without_reading_it(self):
+        store = EmbeddingStore.create(self.path, "hashing", "1-0", 256)
+        rows = (4 << 30) // (256 * 4)
+        with open(os.path.join(self.path, "segment-000000.vectors"), "wb") as f:
+            f.truncate(rows * 256 * 4)
+        with open(os.path.join(self.path, MANIFEST)) as f:
+            manifest = json.load(f)
+        manifest["segments"] = [{"name": "segment-000000", "rows": rows}]
+        with open(os.path.join(self.path, MANIFEST), "w") as f:
+            json.dump(manifest, f)
+        store.refresh()
+        self.assertEqual(len(store), rows)
+        np.testing.assert_array_equal(store.segments[0].vectors[-1], np.zeros(256))
+
+    def test_invalid_stores(self):
+        with self.assertRaisesRegex(ValueError, NOT_AN_EMBEDDING_STORE):
+            EmbeddingStore(self.path)
+        with self.assertRaisesRegex(ValueError, UNSUPPORTED_STORE_DTYPE):
+            EmbeddingStore.create(self.path, "hashing", "1-0", 4, dtype="int8")
+        store = EmbeddingStore.create(self.path, "hashing", "1-0", 4)
+        with self.assertRaisesRegex(ValueError, EMBEDDING_STORE_MISMATCH):
+            EmbeddingStore.create(self.path, "hashing", "1-0", 8)
+        with self.assertRaisesRegex(ValueError, EMBEDDING_DIMENSION_MISMATCH):
+            store.append(["a"], np.zeros((1, 8)))
+
+
+if __name__ == "__main__":
+    unittest.main()
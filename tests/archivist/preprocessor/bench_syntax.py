@@ -0,0 +1,81 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+bench_syntax.py
+
+Throughput benchmark, in files per second, of the syntax-aware chunker (with
+a cold and a warm parse cache) against the plain token window chunker. Not
+collected by the test runner; run it directly:
+
+    python -m tests.archivist.preprocessor.bench_syntax [path] [--repeat N] [--offline]
+
+`--offline` uses a byte-level test encoding instead of downloading cl100k_base.
+"""
+import argparse
+import os
+import time
+from typing import Callable, List, Tuple
+
+from src.archivist.crawler.blobs import blob_sha
+from src.archivist.preprocessor.chunker import TokenChunker
+from src.archivist.preprocessor.pipeline import PreprocessOptions, decode, normalize
+from src.archivist.preprocessor.syntax import SyntaxChunker
+from src.archivist.preprocessor.walker import file_contents, iter_files
+from tests.archivist.preprocessor.test_chunker import byte_level_encoding
+
+BATCH_FILES = 64
+
+
+def load_corpus(root: str, repeat: int) -> List[Tuple[str, str, str]]:
+    documents = []
+    options = PreprocessOptions()
+    for record in iter_files(root):
+        if record.binary:
+            continue
+        with file_contents(record) as data:
+            documents.append((record.path, normalize(decode(bytes(data))[0], options), blob_sha(data)))
+    return documents * repeat
+
+
+def measure(name: str, documents: List[Tuple[str, str, str]], chunk_batch: Callable[[list], list]) -> None:
+    started = time.perf_counter()
+    chunks = 0
+    for i in range(0, len(documents), BATCH_FILES):
+        chunks += sum(len(file_chunks) for file_chunks in chunk_batch(documents[i:i + BATCH_FILES]))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<24} {len(documents) / elapsed:>10.1f} files/s {chunks:>8} chunks")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default=os.path.join("src", "archivist"))
+    parser.add_argument("--repeat", type=int, default=20, help="Chunk the corpus this many times per run.")
+    parser.add_argument("--max_tokens", type=int, default=512)
+    parser.add_argument("--offline", action="store_true")
+    args = parser.parse_args()
+
+    encoding = byte_level_encoding() if args.offline else "cl100k_base"
+    windows = TokenChunker(encoding, max_tokens=args.max_tokens)
+    syntax = SyntaxChunker(windows)
+    documents = load_corpus(args.path, args.repeat)
+    print(f"{len(documents)} files, {sum(len(text) for _, text, _ in documents)} characters")
+
+    measure("token windows", documents, lambda batch: windows.chunk_many([(path, text) for path, text, _ in batch]))
+    measure("syntax, cold cache", documents[:len(documents) // args.repeat], syntax.chunk_many)
+    measure("syntax, warm cache", documents, syntax.chunk_many)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_chunker.py
+"""
+import os
+import tempfile
+import unittest
+
+import tiktoken
+
+from src.archivist.errors.errors import INVALID_MAX_TOKENS, INVALID_OVERLAP_TOKENS
+from src.archivist.preprocessor.chunker import TokenChunker, line_starts
+from src.archivist.preprocessor.pipeline import Preprocessor, PreprocessOptions
+from src.archivist.preprocessor.walker import iter_files
+
+CL100K_PATTERN = (r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|"""
+                  r"""\s*[\r\n]+|\s+(?!\S)|\s+""")
+
+
+def byte_level_encoding() -> tiktoken.Encoding:
+    """
+    A small tiktoken encoding built offline: every byte, plus a few merges
+    so that tokens span several bytes.
+    """
+    ranks = {bytes([i]): i for i in range(256)}
+    for word in (b"  ", b"    ", b"de", b"def", b"re", b"ret", b"retu", b"retur", b"return", b" r", b" re"):
+        ranks[word] = len(ranks)
+    return tiktoken.Encoding("test_bytes", pat_str=CL100K_PATTERN, mergeable_ranks=ranks,
+                             special_tokens={"<|endoftext|>": len(ranks)})
+
+
+CODE = "".join(f"def function_{i}(x):\n    return x + {i}\n\n" for i in range(60))
+
+
+class TestTokenChunker(unittest.TestCase):
+
+    def setUp(self):
+        self.encoding = byte_level_encoding()
+        self.chunker = TokenChunker(self.encoding, max_tokens=64, overlap_tokens=16)
+
+    def assert_spans(self, text, chunks):
+        data = text.encode("utf-8")
+        self.assertEqual(chunks[0].start_byte, 0)
+        self.assertEqual(chunks[-1].end_byte, len(data))
+        for chunk in chunks:
+            self.assertEqual(chunk.text, data[chunk.start_byte:chunk.end_byte].decode("utf-8"))
+            self.assertLessEqual(chunk.token_count, self.chunker.max_tokens)
+            self.assertEqual(chunk.start_line, data[:chunk.start_byte].count(b"\n") + 1)
+            self.assertEqual(chunk.end_line, data[:chunk.end_byte - 1].count(b"\n") + 1)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertLess(previous.start_byte, chunk.start_byte)
+            self.assertLessEqual(chunk.start_byte, previous.end_byte)
+
+    def test_chunks_cover_text_with_overlap(self):
+        chunks = self.chunker.chunk("a.py", CODE)
+        self.assert_spans(CODE, chunks)
+        self.assertEqual([chunk.index for chunk in chunks], list(range(len(chunks))))
+        self.assertTrue(any(chunk.start_byte < previous.end_byte for previous, chunk in zip(chunks, chunks[1:])))
+
+    def test_chunks_keep_whole_lines(self):
+        chunks = TokenChunker(self.encoding, max_tokens=64, overlap_tokens=24).chunk("a.py", CODE)
+        starts = set(line_starts(CODE.encode("utf-8")))
+        self.assertTrue(all(chunk.text.endswith("\n") for chunk in chunks))
+        self.assertTrue(all(chunk.start_byte in starts for chunk in chunks))
+
+    def test_long_lines_and_multibyte_characters(self):
+        text = "é" * 500 + "\n" + "x" * 200
+        self.chunker = TokenChunker(self.encoding, max_tokens=7, overlap_tokens=2)
+        chunks = self.chunker.chunk("a.txt", text)
+        self.assert_spans(text, chunks)
+        self.assertEqual(chunks[0].text, "ééé")
+
+    def test_chunk_many_matches_chunk(self):
+        documents = [("a.py", CODE), ("empty.py", ""), ("b.txt", "<|endoftext|> is plain text\n")]
+        self.assertEqual(self.chunker.chunk_many(documents),
+                         [self.chunker.chunk(path, text) for path, text in documents])
+        self.assertEqual(self.chunker.chunk("empty.py", ""), [])
+
+    def test_invalid_settings(self):
+        with self.assertRaisesRegex(ValueError, INVALID_MAX_TOKENS):
+            TokenChunker(self.encoding, max_tokens=0)
+        with self.assertRaisesRegex(ValueError, INVALID_OVERLAP_TOKENS):
+            TokenChunker(self.encoding, max_tokens=8, overlap_tokens=8)
+        with self.assertRaisesRegex(ValueError, INVALID_OVERLAP_TOKENS):
+            PreprocessOptions(max_tokens=8, overlap_tokens=-1)
+
+    def test_preprocessor_chunks_by_tokens(self):
+        with tempfile.TemporaryDirectory() as root:
+            for name in ("a.py", "b.py"):
+                with open(os.path.join(root, name), "w") as f:
+                    f.write(CODE)
+            options = PreprocessOptions(max_tokens=64, overlap_tokens=16, encoding=self.encoding)
+            with Preprocessor(workers=1, options=options) as preprocessor:
+                documents = list(preprocessor.run(iter_files(root)))
+        self.assertEqual([document.path for document in documents], ["a.py", "b.py"])
+        expected = self.chunker.chunk("a.py", CODE)
+        self.assertEqual(documents[0].chunks, expected)
+        self.assertEqual([chunk.text for chunk in documents[1].chunks], [chunk.text for chunk in expected])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_dedup.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from git import Repo
+
+from src.archivist.crawler.blobs import iter_blobs
+from src.archivist.data_storage.blob_index import BlobIndex
+from src.archivist.preprocessor.dedup import Deduplicator, file_blob_sha, head_commit
+from src.archivist.preprocessor.pipeline import Preprocessor
+from src.archivist.preprocessor.walker import iter_files
+from tests.archivist.crawler.fixtures import make_source_repo, commit_files
+
+
+class TestDeduplicator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        make_source_repo(self.tmp.name, commits=2)
+        self.source = os.path.join(self.tmp.name, "source")
+        commit_files(self.source, {"vendor/file_0.txt": open(os.path.join(self.source, "file_0.txt")).read()},
+                     "Vendor a copy")
+        self.fork = os.path.join(self.tmp.name, "fork")
+        shutil.copytree(self.source, self.fork)
+        commit_files(self.fork, {"fork_only.txt": "new in the fork\n"}, "Fork change")
+        self.index = BlobIndex(os.path.join(self.tmp.name, "blobs.sqlite"))
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def test_file_blob_sha_matches_git(self):
+        record = next(r for r in iter_files(self.source) if r.path == "file_1.txt")
+        self.assertEqual(file_blob_sha(record), Repo(self.source).head.commit.tree["file_1.txt"].hexsha)
+
+    def test_each_blob_is_processed_once_across_repos(self):
+        source = Deduplicator(self.index, "source", head_commit(self.source))
+        paths = [record.path for record in source.filter(iter_files(self.source))]
+        self.assertEqual(paths, ["file_0.txt", "file_1.txt"])
+        self.assertEqual(source.duplicates, 1)
+
+        fork = Deduplicator(self.index, "fork", head_commit(self.fork))
+        self.assertEqual([record.path for record in fork.filter(iter_files(self.fork))], ["fork_only.txt"])
+        sha = Repo(self.source).head.commit.tree["file_0.txt"].hexsha
+        self.assertEqual(sorted((o.repo, o.path) for o in self.index.occurrences(sha)),
+                         [("fork", "file_0.txt"), ("fork", "vendor/file_0.txt"),
+                          ("source", "file_0.txt"), ("source", "vendor/file_0.txt")])
+
+    def test_blob_records_and_preprocessing(self):
+        records = iter_blobs(self.source)
+        unique = list(Deduplicator(self.index, "source", head_commit(self.source)).filter(records))
+        self.assertEqual(len(unique), 2)
+
+        fork = Deduplicator(self.index, "fork", head_commit(self.fork))
+        with Preprocessor(workers=1) as preprocessor:
+            documents = list(preprocessor.run(fork.filter(iter_files(self.fork))))
+        self.assertEqual([document.path for document in documents], ["fork_only.txt"])
+        self.assertEqual(documents[0].blob_sha, Repo(self.fork).head.commit.tree["fork_only.txt"].hexsha)
+
+
+if __name__ == "__main__":
+    unittest.main()
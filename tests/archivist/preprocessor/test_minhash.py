@@ -0,0 +1,116 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_minhash.py
+"""
+import random
+import unittest
+
+import numpy as np
+
+from src.archivist.errors.errors import INVALID_MINHASH_BANDS, INVALID_SIMILARITY_THRESHOLD, INVALID_MAX_SIGNATURES
+from src.archivist.preprocessor.chunker import chunk_lines
+from src.archivist.preprocessor.minhash import MinHasher, NearDuplicateFilter, LSHIndex, shingles, chunk_key
+from src.archivist.preprocessor.pipeline import Document
+
+LICENSE = "".join(f"# Licensed under the Apache License, Version 2.0, clause {i} of the terms.\n" for i in range(12))
+
+
+def random_code(generator: random.Random, lines: int) -> str:
+    words = ["value", "index", "result", "items", "self", "return", "for", "in", "if", "None", "total", "count"]
+    return "".join(" ".join(generator.choice(words) for _ in range(8)) + "\n" for _ in range(lines))
+
+
+def document(path: str, text: str) -> Document:
+    return Document(path, len(text), "utf-8", chunk_lines(path, text, 12), blob_sha=path * 4)
+
+
+class TestMinHash(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = random.Random(7)
+        self.hasher = MinHasher()
+
+    def test_shingles(self):
+        self.assertEqual(len(shingles("tiny")), 1)
+        np.testing.assert_array_equal(shingles("a  b\n\tc d e f g"), shingles("a b c d e f g"))
+        self.assertEqual(len(shingles("0123456789")), 3)
+
+    def test_signatures_match_per_text_and_block_boundaries(self):
+        texts = [random_code(self.generator, lines) for lines in (1, 5, 300, 2, 80)]
+        batch = self.hasher.signatures(texts)
+        self.assertEqual(batch.shape, (5, 128))
+        self.assertEqual(batch.dtype, np.uint32)
+        for text, signature in zip(texts, batch):
+            expected = self.hasher._permute(shingles(text)).min(axis=1)
+            np.testing.assert_array_equal(signature, expected)
+            np.testing.assert_array_equal(self.hasher.signatures([text])[0], signature)
+
+    def test_signature_agreement_estimates_jaccard(self):
+        text = random_code(self.generator, 40)
+        lines = text.splitlines(keepends=True)
+        edited = "".join(lines[:30]) + random_code(self.generator, 10)
+        first, second = (set(shingles(t).tolist()) for t in (text, edited))
+        jaccard = len(first & second) / len(first | second)
+        signatures = MinHasher(num_perm=512).signatures([text, edited])
+        self.assertAlmostEqual((signatures[0] == signatures[1]).mean(), jaccard, delta=0.08)
+
+
+class TestNearDuplicateFilter(unittest.TestCase):
+
+    def setUp(self):
+        generator = random.Random(11)
+        self.first = document("a", LICENSE + random_code(generator, 12))
+        edited = LICENSE.replace("clause 3", "clause three")
+        self.second = document("b", edited + random_code(generator, 12))
+
+    def test_drops_near_duplicate_chunks(self):
+        near_duplicates = NearDuplicateFilter(threshold=0.8)
+        documents = list(near_duplicates.filter([self.first, self.second]))
+        self.assertEqual([len(d.chunks) for d in documents], [2, 1])
+        self.assertEqual(documents[1].chunks[0].start_line, 13)
+        self.assertEqual((near_duplicates.chunks_seen, near_duplicates.duplicates), (4, 1))
+
+    def test_links_near_duplicate_chunks(self):
+        documents = list(NearDuplicateFilter().filter([self.first, self.second], drop=False))
+        self.assertEqual([chunk.duplicate_of for chunk in documents[1].chunks], [chunk_key(self.first, 0), None])
+        self.assertEqual(chunk_key(self.first, 0), "aaaa:0")
+
+    def test_index_size_is_bounded(self):
+        signatures = np.random.default_rng(3).integers(0, 1 << 32, size=(10, 16), dtype=np.uint32)
+        signatures[5:, :4] = signatures[0, :4]
+        index = LSHIndex(4, 16, max_size=3)
+        for i, signature in enumerate(signatures):
+            index.insert(str(i), signature)
+        self.assertEqual(list(index.keys.values()), ["7", "8", "9"])
+        self.assertEqual(index.candidates(signatures[0]), [7, 8, 9])
+        self.assertEqual(index.candidates(signatures[6]), [7, 8, 9])
+        self.assertEqual(sum(len(bucket) for table in index._tables for bucket in table.values()), 3 * 4)
+
+        near_duplicates = NearDuplicateFilter(max_signatures=2)
+        documents = list(near_duplicates.filter([self.first, self.second, self.first]))
+        self.assertEqual([len(d.chunks) for d in documents], [2, 1, 2])
+
+    def test_invalid_settings(self):
+        with self.assertRaisesRegex(ValueError, INVALID_MINHASH_BANDS):
+            NearDuplicateFilter(num_perm=128, bands=12)
+        with self.assertRaisesRegex(ValueError, INVALID_SIMILARITY_THRESHOLD):
+            NearDuplicateFilter(threshold=0)
+        with self.assertRaisesRegex(ValueError, INVALID_MAX_SIGNATURES):
+            NearDuplicateFilter(max_signatures=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
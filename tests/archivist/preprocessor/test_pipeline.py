@@ -0,0 +1,153 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_pipeline.py
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from src.archivist.errors.errors import INVALID_WORKERS, INVALID_BATCH_BYTES
+from src.archivist.preprocessor.chunker import split_lines
+from src.archivist.preprocessor.pipeline import Preprocessor, PreprocessOptions, chunk_lines, decode, \
+    iter_batches, preprocess_file, read_text, result_cache
+from src.archivist.preprocessor.walker import FileRecord, iter_files
+
+
+def record(path: str, size: int, binary: bool = False) -> FileRecord:
+    return FileRecord(path, path, size, binary)
+
+
+class TestBatches(unittest.TestCase):
+
+    def test_batches_by_bytes(self):
+        records = [record("a", 60), record("b", 30), record("c", 20), record("d", 200), record("e", 10)]
+        batches = [[r.path for r in batch] for batch in iter_batches(records, batch_bytes=100)]
+        self.assertEqual(batches, [["a", "b"], ["c"], ["d"], ["e"]])
+
+    def test_binary_files_count_as_empty(self):
+        records = [record("a", 90), record("b", 10 ** 9, binary=True), record("c", 10)]
+        self.assertEqual(len(list(iter_batches(records, batch_bytes=100))), 1)
+
+
+class TestPreprocessFile(unittest.TestCase):
+
+    def test_decode(self):
+        self.assertEqual(decode("\ufeffhé".encode("utf-8")), ("hé", "utf-8"))
+        self.assertEqual(decode(b"caf\xe9"), ("café", "latin-1"))
+        self.assertEqual(decode(memoryview(b"caf\xe9")), ("café", "latin-1"))
+
+    def test_memory_mapped_files(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "big.txt")
+            for data, encoding in ((("\ufeff" + "hé\n" * (1 << 19)).encode("utf-8"), "utf-8"),
+                                   (b"caf\xe9\n" * (1 << 19), "latin-1")):
+                with open(path, "wb") as f:
+                    f.write(data)
+                document, text = read_text(FileRecord("big.txt", path, len(data), False), PreprocessOptions())
+                self.assertEqual((document.encoding, text), (encoding, decode(bytes(data))[0]))
+
+    def test_normalizes_and_chunks(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "a.py")
+            with open(path, "wb") as f:
+                f.write(b"one  \r\ntwo\rthree\n")
+            document = preprocess_file(FileRecord("a.py", path, 18, False), PreprocessOptions(chunk_lines=2))
+        self.assertEqual(document.encoding, "utf-8")
+        self.assertEqual([chunk.text for chunk in document.chunks], ["one\ntwo\n", "three\n"])
+        self.assertEqual([(chunk.start_line, chunk.end_line) for chunk in document.chunks], [(1, 2), (3, 3)])
+        self.assertEqual([(chunk.start_byte, chunk.end_byte) for chunk in document.chunks], [(0, 8), (8, 14)])
+
+    def test_binary_and_missing_files(self):
+        self.assertEqual(preprocess_file(record("x.png", 10, binary=True), PreprocessOptions()).chunks, [])
+        document = preprocess_file(record("/does/not/exist", 10), PreprocessOptions())
+        self.assertIsNotNone(document.error)
+
+    def test_split_lines(self):
+        self.assertEqual(split_lines("a\nb"), ["a\n", "b"])
+        self.assertEqual(split_lines("a b\n"), ["a b\n"])
+        self.assertEqual(chunk_lines("p", "", 10), [])
+
+
+class TestPreprocessor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for i in range(40):
+            path = os.path.join(self.tmp.name, f"dir_{i % 4}", f"file_{i:02}.txt")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write("".join(f"line {j} of file {i}\n" for j in range(i * 10)))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parallel_matches_serial_order(self):
+        with Preprocessor(workers=1) as serial:
+            expected = list(serial.run(iter_files(self.tmp.name)))
+        with Preprocessor(workers=3, batch_bytes=2048, max_in_flight=2) as parallel:
+            documents = list(parallel.run(iter_files(self.tmp.name)))
+            self.assertEqual(parallel.peak_in_flight, 2)
+        self.assertEqual(documents, expected)
+        self.assertEqual([document.path for document in documents], sorted(document.path for document in documents))
+
+    def test_early_exit(self):
+        with Preprocessor(workers=2, batch_bytes=1024) as preprocessor:
+            documents = preprocessor.run(iter_files(self.tmp.name))
+            self.assertEqual(next(documents).path, "dir_0/file_00.txt")
+            documents.close()
+
+    def test_result_cache(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_path = os.path.join(cache_dir.name, "results.sqlite")
+        options = PreprocessOptions(chunk_lines=50, cache_path=cache_path)
+        with Preprocessor(workers=1, options=options) as preprocessor:
+            expected = list(preprocessor.run(iter_files(self.tmp.name)))
+        cache = result_cache(cache_path, options.cache_max_bytes)
+        self.assertEqual((cache.hits, len(cache)), (0, 40))
+
+        with open(os.path.join(self.tmp.name, "dir_1", "file_05.txt"), "a") as f:
+            f.write("appended\n")
+        with Preprocessor(workers=3, batch_bytes=2048, options=options) as preprocessor:
+            documents = list(preprocessor.run(iter_files(self.tmp.name)))
+        self.assertEqual([document for document in documents if document.path != "dir_1/file_05.txt"],
+                         [document for document in expected if document.path != "dir_1/file_05.txt"])
+        self.assertEqual(len(cache), 41)
+
+        # An all-hit run only touches entries; the worker's connection stays open.
+        db = sqlite3.connect(cache_path)
+        self.addCleanup(db.close)
+        with db:
+            db.execute("UPDATE entries SET last_used = 0")
+        with Preprocessor(workers=1, options=options) as preprocessor:
+            list(preprocessor.run(iter_files(self.tmp.name)))
+        self.assertEqual(db.execute("SELECT COUNT(*) FROM entries WHERE last_used = 0").fetchone()[0], 1)
+
+        other = PreprocessOptions(chunk_lines=20, cache_path=cache_path)
+        with Preprocessor(workers=1, options=other) as preprocessor:
+            list(preprocessor.run(iter_files(self.tmp.name)))
+        self.assertEqual(len(cache), 81)
+
+    def test_invalid_settings(self):
+        with self.assertRaisesRegex(ValueError, INVALID_WORKERS):
+            Preprocessor(workers=0)
+        with self.assertRaisesRegex(ValueError, INVALID_BATCH_BYTES):
+            Preprocessor(batch_bytes=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_streaming.py
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from git import Repo
+
+from src.archivist.errors.errors import INVALID_STREAM_MEMORY, INVALID_WINDOW_BYTES
+from src.archivist.preprocessor.pipeline import Preprocessor, PreprocessOptions, decode, normalize
+from src.archivist.preprocessor.streaming import TextStream
+from src.archivist.preprocessor.walker import FileRecord, iter_files
+
+SAMPLE = ("﻿INSERT INTO t VALUES (1, 'café');   \r\n"
+          "INSERT INTO t VALUES (2, '日本語');\r"
+          "-- a comment with trailing tabs\t\t\n"
+          "INSERT INTO t VALUES (3, 'naïve');\n").encode("utf-8")
+
+LARGE_FILE_SCRIPT = """
+import json, resource, sys
+from src.archivist.preprocessor.pipeline import Preprocessor, PreprocessOptions
+from src.archivist.preprocessor.walker import FileRecord
+
+path, size, memory = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+options = PreprocessOptions(stream_threshold=1 << 20, stream_memory=memory)
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+chunks = parts = end_byte = 0
+with Preprocessor(workers=1, options=options) as preprocessor:
+    for document in preprocessor.run([FileRecord("dump.sql", path, size, False)]):
+        parts += 1
+        chunks += len(document.chunks)
+        end_byte = document.chunks[-1].end_byte if document.chunks else end_byte
+growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+print(json.dumps({"chunks": chunks, "parts": parts, "end_byte": end_byte, "rss_growth_kb": growth}))
+"""
+
+
+def write_dump(path: str, size: int) -> None:
+    block = b"".join(b"INSERT INTO events VALUES (%d, 'caf\xc3\xa9 \xe6\x97\xa5\xe6\x9c\xac', '%s');\r\n"
+                     % (i, b"x" * (i % 50)) for i in range(12000))
+    with open(path, "wb") as f:
+        written = 0
+        while written < size:
+            written += f.write(block[:size - written])
+
+
+class TestTextStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "dump.sql")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, data: bytes) -> None:
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+    def test_small_windows_match_whole_file(self):
+        data = SAMPLE * 20
+        self.write(data)
+        expected = normalize(decode(data)[0], PreprocessOptions())
+        for window_bytes in (1, 2, 3, 7, 64, 1 << 20):
+            stream = TextStream(self.path, window_bytes)
+            segments = list(stream)
+            self.assertEqual("".join(segment.text for segment in segments), expected)
+            for segment in segments:
+                before = expected.encode("utf-8")[:segment.start_byte].decode("utf-8")
+                self.assertEqual(segment.start_line, before.count("\n") + 1)
+            self.assertFalse(stream.replaced)
+            self.assertEqual(stream.bytes_read, len(data))
+
+    def test_blob_sha(self):
+        self.write(SAMPLE)
+        repo = Repo.init(self.tmp.name)
+        stream = TextStream(self.path, 5)
+        list(stream)
+        self.assertEqual(stream.blob_sha, repo.git.hash_object(self.path))
+
+    def test_invalid_utf8_is_replaced(self):
+        self.write(b"ok line\nbad \xff\xfe byte\ntruncated \xe6\x97")
+        stream = TextStream(self.path, 4)
+        self.assertEqual("".join(segment.text for segment in stream), "ok line\nbad �� byte\ntruncated �")
+        self.assertTrue(stream.replaced)
+
+    def test_long_lines_are_cut(self):
+        self.write(b"a" * 100 + b"\nb\n")
+        segments = list(TextStream(self.path, 16))
+        self.assertTrue(all(len(segment.text) <= 32 for segment in segments))
+        self.assertEqual("".join(segment.text for segment in segments), "a" * 100 + "\nb\n")
+        self.assertGreater(len(segments), 4)
+
+    def test_long_whitespace_runs_are_cut(self):
+        for line in (" " * 10000, "a" + "\t" * 10000):
+            self.write(line.encode() + b"\nb\n")
+            segments = list(TextStream(self.path, 1024))
+            self.assertTrue(all(len(segment.text) <= 8192 for segment in segments))
+            self.assertGreater(len(segments), 1)
+            text = "".join(segment.text for segment in segments)
+            self.assertTrue(line.startswith(text[:-3]))
+            self.assertLessEqual(len(text), len(line) + 3 - 4096)
+            self.assertTrue(text.endswith("\nb\n"))
+
+    def test_invalid_settings(self):
+        with self.assertRaisesRegex(ValueError, INVALID_WINDOW_BYTES):
+            TextStream(self.path, 0)
+        with self.assertRaisesRegex(ValueError, INVALID_STREAM_MEMORY):
+            PreprocessOptions(stream_memory=0)
+
+
+class TestStreamingPreprocessor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for name, size in (("a.txt", 100), ("big.sql", 300000), ("c.txt", 100)):
+            write_dump(os.path.join(self.tmp.name, name), size)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_large_files_stream_in_parts(self):
+        options = PreprocessOptions(chunk_lines=50, stream_threshold=10000, stream_memory=40000)
+        with Preprocessor(workers=2, options=options) as preprocessor:
+            documents = list(preprocessor.run(iter_files(self.tmp.name)))
+        self.assertEqual([document.path for document in documents if document.part is None], ["a.txt", "c.txt"])
+        parts = [document for document in documents if document.path == "big.sql"]
+        self.assertEqual([document.part for document in parts], list(range(len(parts))))
+        self.assertGreater(len(parts), 5)
+        self.assertEqual([document.blob_sha is not None for document in parts], [False] * (len(parts) - 1) + [True])
+
+        with open(os.path.join(self.tmp.name, "big.sql"), "rb") as f:
+            text = normalize(decode(f.read())[0], options).encode("utf-8")
+        chunks = [chunk for document in parts for chunk in document.chunks]
+        self.assertEqual([chunk.index for chunk in chunks], list(range(len(chunks))))
+        self.assertEqual(b"".join(chunk.text.encode("utf-8") for chunk in chunks), text)
+        for chunk in chunks:
+            self.assertEqual(chunk.text.encode("utf-8"), text[chunk.start_byte:chunk.end_byte])
+            self.assertEqual(chunk.start_line, text[:chunk.start_byte].count(b"\n") + 1)
+            self.assertLessEqual(chunk.end_line - chunk.start_line, 49)
+
+    def test_file_under_rss_limit(self):
+        self.assert_streams_under_rss_limit(256 << 20)
+
+    @unittest.skipUnless(os.environ.get("ARCHIVIST_LARGE_FILE_TESTS"), "set ARCHIVIST_LARGE_FILE_TESTS to run")
+    def test_multi_gb_file_under_rss_limit(self):
+        self.assert_streams_under_rss_limit(3 << 30)
+
+    def assert_streams_under_rss_limit(self, size: int, memory: int = 16 << 20, rss_limit: int = 24 << 20):
+        path = os.path.join(self.tmp.name, "huge.sql")
+        write_dump(path, size)
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        result = subprocess.run([sys.executable, "-c", LARGE_FILE_SCRIPT, path, str(size), str(memory)],
+                                cwd=root, capture_output=True, text=True, check=True)
+        stats = json.loads(result.stdout)
+        self.assertGreater(stats["parts"], 1)
+        self.assertGreater(stats["end_byte"], size * 0.9)
+        self.assertLess(stats["rss_growth_kb"] * 1024, rss_limit)
+
+
+if __name__ == "__main__":
+    unittest.main()
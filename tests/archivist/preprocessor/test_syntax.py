@@ -0,0 +1,154 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_syntax.py
+"""
+import os
+import tempfile
+import textwrap
+import unittest
+from typing import List
+
+from src.archivist.data_storage.parse_cache import ParseCache
+from src.archivist.preprocessor.chunker import TokenChunker
+from src.archivist.preprocessor.pipeline import Preprocessor, PreprocessOptions
+from src.archivist.preprocessor.syntax import Definition, Parser, PythonParser, SyntaxChunker
+from src.archivist.preprocessor.walker import iter_files
+from tests.archivist.preprocessor.test_chunker import byte_level_encoding
+
+SOURCE = textwrap.dedent('''\
+    import os
+
+
+    def small(x):
+        return x + 1
+
+
+    @decorator
+    async def fetch(url):
+        return url
+
+
+    class Store:
+        """A store."""
+
+        def get(self, key):
+            return self.items[key]
+
+        def put(self, key, value):
+            self.items[key] = value
+
+        class Meta:
+            ordering = "name"
+
+
+    MAIN = small(1)
+    ''')
+
+
+class SectionParser(Parser):
+    """
+    Treats each "## " heading and the lines after it as a definition.
+    """
+    name = "sections"
+
+    def parse(self, text: str) -> List[Definition]:
+        lines = text.split("\n")
+        headings = [i + 1 for i, line in enumerate(lines) if line.startswith("## ")]
+        ends = [start - 1 for start in headings[1:]] + [len(lines)]
+        return [Definition(lines[start - 1][3:], "section", start, end) for start, end in zip(headings, ends)]
+
+
+class TestSyntaxChunker(unittest.TestCase):
+
+    def setUp(self):
+        self.encoding = byte_level_encoding()
+        self.fallback = TokenChunker(self.encoding, max_tokens=60, overlap_tokens=10)
+        self.chunker = SyntaxChunker(self.fallback)
+
+    def test_python_definitions(self):
+        definitions = PythonParser().parse(SOURCE)
+        self.assertEqual([(d.symbol, d.kind, d.start_line, d.end_line) for d in definitions],
+                         [("small", "function", 4, 5), ("fetch", "function", 8, 10), ("Store", "class", 13, 23)])
+        self.assertEqual([child.symbol for child in definitions[2].children],
+                         ["Store.get", "Store.put", "Store.Meta"])
+        with self.assertRaises(SyntaxError):
+            PythonParser().parse("def broken(:\n")
+
+    def test_chunks_follow_definitions(self):
+        chunks = self.chunker.chunk("store.py", SOURCE)
+        self.assertEqual([(chunk.symbol, chunk.start_line, chunk.end_line) for chunk in chunks],
+                         [("small", 1, 7), ("fetch", 8, 12), (None, 13, 15), ("Store.get", 16, 18),
+                          ("Store.put", 19, 21), ("Store.Meta", 22, 23), (None, 24, 26)])
+        data = SOURCE.encode("utf-8")
+        for index, chunk in enumerate(chunks):
+            self.assertEqual(chunk.index, index)
+            self.assertEqual(chunk.text, data[chunk.start_byte:chunk.end_byte].decode("utf-8"))
+            self.assertLessEqual(chunk.token_count, 60)
+
+    def test_small_files_pack_into_one_chunk(self):
+        chunks = SyntaxChunker(TokenChunker(self.encoding, max_tokens=1000)).chunk("store.py", SOURCE)
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0].text, SOURCE)
+
+    def test_oversized_definition_is_windowed(self):
+        source = "def long():\n" + "".join(f"    value_{i} = {i}\n" for i in range(40))
+        chunks = self.chunker.chunk("long.py", source)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(chunk.symbol == "long" for chunk in chunks))
+        self.assertTrue(all(chunk.token_count <= 60 for chunk in chunks))
+
+    def test_fallback_to_token_windows(self):
+        broken = "def broken(:\n" + SOURCE
+        self.assertEqual(self.chunker.chunk("broken.py", broken), self.fallback.chunk("broken.py", broken))
+        self.assertEqual(self.chunker.chunk("notes.txt", SOURCE), self.fallback.chunk("notes.txt", SOURCE))
+
+    def test_pluggable_parser(self):
+        chunker = SyntaxChunker(self.fallback, parsers={".md": SectionParser()})
+        text = "# Title\n## Install\npip install\n## Usage\narchivist --help\n"
+        chunks = SyntaxChunker(TokenChunker(self.encoding, max_tokens=30, overlap_tokens=4), parsers={".md": SectionParser()}).chunk(
+            "README.md", text)
+        self.assertEqual([(chunk.symbol, chunk.text) for chunk in chunks],
+                         [(None, "# Title\n"), ("Install", "## Install\npip install\n"),
+                          ("Usage", "## Usage\narchivist --help\n")])
+        self.assertEqual(chunker.chunk("store.py", SOURCE), self.fallback.chunk("store.py", SOURCE))
+
+    def test_parse_cache_by_blob_sha(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache_path = os.path.join(root, "parses.sqlite")
+            with ParseCache(cache_path) as cache:
+                chunker = SyntaxChunker(self.fallback, cache)
+                documents = [("a.py", SOURCE, "a" * 40), ("b.py", SOURCE, "a" * 40), ("bad.py", "def (", None)]
+                first = chunker.chunk_many(documents)
+                self.assertEqual(chunker.parses, 2)
+                self.assertEqual(len(cache), 2)
+
+            with ParseCache(cache_path) as cache:
+                chunker = SyntaxChunker(self.fallback, cache)
+                self.assertEqual(chunker.chunk_many(documents), first)
+                self.assertEqual(chunker.parses, 0)
+
+    def test_preprocessor_chunks_by_syntax(self):
+        with tempfile.TemporaryDirectory() as root:
+            with open(os.path.join(root, "store.py"), "w") as f:
+                f.write(SOURCE)
+            options = PreprocessOptions(max_tokens=60, overlap_tokens=10, encoding=self.encoding, syntax_aware=True)
+            with Preprocessor(workers=1, options=options) as preprocessor:
+                documents = list(preprocessor.run(iter_files(root)))
+        self.assertEqual(documents[0].chunks, self.chunker.chunk("store.py", SOURCE))
+
+
+if __name__ == "__main__":
+    unittest.main()
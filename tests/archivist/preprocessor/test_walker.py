@@ -0,0 +1,108 @@
+"""
+Copyright © 2023 Brad Edwards
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+test_walker.py
+"""
+import mmap
+import os
+import tempfile
+import unittest
+
+from src.archivist.crawler.filters import PathFilter
+from src.archivist.preprocessor.walker import iter_files, file_contents, is_binary
+
+
+def write(root: str, path: str, data) -> None:
+    full_path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+
+
+class TestIterFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        write(self.root, ".git/HEAD", "ref: refs/heads/main\n")
+        write(self.root, ".git/info/exclude", "secret.txt\n")
+        write(self.root, ".gitignore", "*.log\nbuild/\n!keep.log\n")
+        write(self.root, ".gitattributes", "*.dat binary\nforce.txt text\ngen/** linguist-generated\n")
+        write(self.root, "src/app.py", "print('hi')\n")
+        write(self.root, "src/.gitignore", "local.py\n!debug.log\n")
+        write(self.root, "src/local.py", "x = 1\n")
+        write(self.root, "src/debug.log", "kept by a deeper rule\n")
+        write(self.root, "app.log", "ignored\n")
+        write(self.root, "keep.log", "re-included\n")
+        write(self.root, "build/out.py", "ignored\n")
+        write(self.root, "secret.txt", "ignored\n")
+        write(self.root, "image.png", b"\x89PNG\r\n\x1a\n\0\0\0")
+        write(self.root, "table.dat", "looks like text\n")
+        write(self.root, "force.txt", b"has a \0 but is text\n")
+        write(self.root, "gen/api.py", "generated\n")
+        os.symlink("src/app.py", os.path.join(self.root, "link.py"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_honors_gitignore_and_exclude(self):
+        paths = [record.path for record in iter_files(self.root)]
+        self.assertEqual(paths, [".gitattributes", ".gitignore", "force.txt", "image.png", "keep.log",
+                                 "src/.gitignore", "src/app.py", "src/debug.log", "table.dat"])
+
+    def test_binary_detection(self):
+        records = {record.path: record for record in iter_files(self.root)}
+        self.assertTrue(records["image.png"].binary)
+        self.assertFalse(records["src/app.py"].binary)
+        self.assertTrue(records["table.dat"].binary)
+        self.assertFalse(records["force.txt"].binary)
+
+    def test_generated_files(self):
+        paths = [record.path for record in iter_files(self.root, skip_generated=False)]
+        self.assertIn("gen/api.py", paths)
+
+    def test_path_filter(self):
+        paths = [record.path for record in iter_files(self.root, path_filter=PathFilter(include=["*.py"]))]
+        self.assertEqual(paths, ["src/app.py"])
+
+    def test_is_lazy(self):
+        files = iter_files(self.root)
+        first = next(files)
+        self.assertEqual(first.path, ".gitattributes")
+        self.assertEqual(first.size, os.path.getsize(os.path.join(self.root, ".gitattributes")))
+
+    def test_is_binary(self):
+        self.assertTrue(is_binary(os.path.join(self.root, "image.png")))
+        self.assertFalse(is_binary(os.path.join(self.root, "src/app.py")))
+
+
+class TestFileContents(unittest.TestCase):
+
+    def test_small_and_large_files(self):
+        with tempfile.TemporaryDirectory() as root:
+            write(root, "small.txt", "small\n")
+            write(root, "large.txt", "x" * 4096)
+            records = {record.path: record for record in iter_files(root)}
+            with file_contents(records["small.txt"], mmap_threshold=1024) as data:
+                self.assertEqual(data, b"small\n")
+            with file_contents(records["large.txt"], mmap_threshold=1024) as data:
+                self.assertIsInstance(data, mmap.mmap)
+                self.assertEqual(data[:4], b"xxxx")
+                self.assertEqual(len(data), 4096)
+            self.assertTrue(data.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
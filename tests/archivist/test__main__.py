@@ -18,6 +18,27 @@ test__main__.py
 import unittest
 from unittest.mock import patch, Mock
 from src.archivist.__main__ import main, Config
+from src.archivist.errors.errors import INVALID_CONCURRENCY
+
+
+def set_crawl_args(mock_args):
+    """Give the crawl options real values, as argparse would when they are omitted."""
+    mock_args.branch = None
+    mock_args.depth = None
+    mock_args.single_branch = False
+    mock_args.clone_filter = None
+    mock_args.mirror_cache = None
+    mock_args.incremental = False
+    mock_args.manifest_path = None
+    mock_args.no_checkout = False
+    mock_args.batch = None
+    mock_args.results = None
+    mock_args.max_concurrent = 4
+    mock_args.include = None
+    mock_args.exclude = None
+    mock_args.max_file_size = None
+    mock_args.retries = None
+    mock_args.archive = False
 
 class TestArchivist(unittest.TestCase):
 
@@ -33,13 +54,15 @@ class TestArchivist(unittest.TestCase):
 
         mock_exit.assert_called_once_with(0)
 
+    @patch('src.archivist.__main__.Crawler')
     @patch('src.archivist.__main__.DEBUG', new_callable=Mock)
     @patch('src.archivist.__main__.argparse.ArgumentParser.parse_args')
     @patch('src.archivist.__main__.subprocess.run')
     @patch('src.archivist.__main__.sys.exit')
-    def test_update_flag(self, mock_exit, mock_run, mock_parse_args, mock_debug):
+    def test_update_flag(self, mock_exit, mock_run, mock_parse_args, mock_debug, mock_crawler):
         mock_debug.return_value = False
         mock_args = Mock()
+        set_crawl_args(mock_args)
         mock_args.update = True
         mock_args.version = False
         mock_parse_args.return_value = mock_args
@@ -49,13 +72,15 @@ class TestArchivist(unittest.TestCase):
         mock_run.assert_called_once()
         mock_exit.assert_called_once_with(0)
 
+    @patch('src.archivist.__main__.Crawler')
     @patch('src.archivist.__main__.DEBUG', new_callable=Mock)
     @patch('argparse.ArgumentParser.parse_args')
     @patch('subprocess.run')
     @patch('sys.exit')
-    def test_version_flag(self, mock_exit, mock_run, mock_parse_args, mock_debug):
+    def test_version_flag(self, mock_exit, mock_run, mock_parse_args, mock_debug, mock_crawler):
         mock_debug.return_value = False
         mock_args = Mock()
+        set_crawl_args(mock_args)
         mock_args.github_url = "some_url"
         mock_args.output_path = "some_path"
         mock_args.version = False
@@ -71,6 +96,37 @@ class TestArchivist(unittest.TestCase):
         self.assertEqual(config.github_url, "some_url")
         self.assertEqual(config.output_path, "some_path")
 
+    @patch('src.archivist.__main__.MirrorCache')
+    @patch('src.archivist.__main__.Crawler')
+    @patch('argparse.ArgumentParser.parse_args')
+    def test_mirror_cache_validated_before_opening(self, mock_parse_args, mock_crawler, mock_mirror_cache):
+        mock_args = Mock()
+        set_crawl_args(mock_args)
+        mock_args.version = False
+        mock_args.update = False
+        mock_args.mirror_cache = "   "
+        mock_parse_args.return_value = mock_args
+
+        with self.assertRaises(ValueError):
+            main()
+        mock_mirror_cache.assert_not_called()
+        mock_crawler.assert_not_called()
+
+    @patch('src.archivist.cli.batch.run_batch')
+    @patch('argparse.ArgumentParser.parse_args')
+    def test_batch_validates_max_concurrent(self, mock_parse_args, mock_run_batch):
+        mock_args = Mock()
+        set_crawl_args(mock_args)
+        mock_args.version = False
+        mock_args.update = False
+        mock_args.batch = "jobs.jsonl"
+        mock_args.max_concurrent = 0
+        mock_parse_args.return_value = mock_args
+
+        with self.assertRaisesRegex(ValueError, INVALID_CONCURRENCY):
+            main()
+        mock_run_batch.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()